@@ -0,0 +1,60 @@
+#!/usr/bin/python
+#
+# Measures how fast files are split into content-defined chunks, in a single
+# process, as each worker of the process pool does it.
+#
+# Run from the root of the package, on the commits to be compared:
+#     python benchmarks/chunking.py [--mib N]
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import argparse
+import os
+import os.path
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import paradux.chunkstore
+
+
+def measure(mib):
+    """
+    Split a file of this size into chunks. The content is random, with a
+    run of zeros and a repeated pattern, so all ways of cutting occur.
+
+    mib: the size of the file in MiB
+    return: tuple of (seconds to split, number of chunks)
+    """
+    rnd  = random.Random(1)
+    size = mib * 1024 * 1024
+    data = bytearray(rnd.randbytes(size))
+    data[size // 4 : size // 4 + size // 8]   = bytes(size // 8)
+    data[size // 2 : size // 2 + 1024 * 1024] = b'paradux-' * ( 1024 * 1024 // 8 )
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        fileName = os.path.join(tmpDir, 'data')
+        with open(fileName, 'wb') as fd:
+            fd.write(data)
+
+        start           = time.perf_counter()
+        lengths, unused = paradux.chunkstore.chunkLengthsOfFile(fileName)
+        duration        = time.perf_counter() - start
+
+        assert sum(lengths) == size
+        return ( duration, len(lengths) )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure splitting a file into content-defined chunks.')
+    parser.add_argument('--mib', type=int, default=64, help='Size of the file in MiB.')
+    args = parser.parse_args()
+
+    duration, chunks = measure(args.mib)
+    print('{0:d} MiB: {1:d} chunks in {2:.1f}s, {3:.1f} MiB/s'.format(
+            args.mib, chunks, duration, args.mib / duration))
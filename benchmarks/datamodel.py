@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+# Measures how long it takes to load a large datasets configuration, and how
+# much memory the loaded data model retains.
+#
+# Only the data model is used, so the script runs unchanged on older commits.
+# Run from the root of the package, on the commits to be compared:
+#     python benchmarks/datamodel.py [--datasets N] [--destinations M]
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import argparse
+import gc
+import json
+import os
+import os.path
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import paradux.data.dataset
+import paradux.utils
+
+
+def datasetsJson(datasetCount, destinationCount):
+    """
+    Create the JSON content of a datasets file with many datasets, each with
+    many destinations, as found on a large installation.
+
+    datasetCount: the number of datasets
+    destinationCount: the number of destinations per dataset
+    return: JSON content
+    """
+    datasets = []
+    for i in range(datasetCount):
+        destinations = []
+        for k in range(destinationCount):
+            destinations.append({
+                'name'        : 'Destination ' + str(k),
+                'url'         : 's3://bucket-{0:d}/dataset-{1:d}'.format(k % 10, i),
+                'credentials' : {
+                    'aws-access-key' : 'AKIA0000000000000000',
+                    'aws-secret-key' : 'secret' + str(k % 10)
+                },
+                'frequency'   : '1d'
+            })
+        datasets.append({
+            'name'         : 'dataset-' + str(i),
+            'description'  : 'Dataset number ' + str(i),
+            'source'       : {
+                'url' : 'scp://host-{0:d}.example.com/~user/data'.format(i % 20)
+            },
+            'destinations' : destinations
+        })
+    return { 'datasets' : datasets }
+
+
+def measure(datasetCount, destinationCount):
+    """
+    Load a datasets configuration of this size.
+
+    datasetCount: the number of datasets
+    destinationCount: the number of destinations per dataset
+    return: tuple (seconds to load, bytes retained by the loaded datasets)
+    """
+    with tempfile.TemporaryDirectory() as tmpDir:
+        masterFile = os.path.join(tmpDir, 'datasets.json')
+        with open(masterFile, 'w') as fd:
+            json.dump(datasetsJson(datasetCount, destinationCount), fd)
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            start    = time.perf_counter()
+            j        = paradux.utils.readJsonFromFile(masterFile)
+            datasets = [ paradux.data.dataset.parseDatasetJson(datasetJ) for datasetJ in j['datasets'] ]
+            del j
+            duration = time.perf_counter() - start
+
+            gc.collect()
+            retained = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+        assert len(datasets) == datasetCount
+        return ( duration, retained )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure loading a large datasets configuration.')
+    parser.add_argument('--datasets',     type=int, default=1000, help='Number of datasets.')
+    parser.add_argument('--destinations', type=int, default=100,  help='Number of destinations per dataset.')
+    args = parser.parse_args()
+
+    duration, retained = measure(args.datasets, args.destinations)
+    print('{0:d} datasets x {1:d} destinations: load {2:.1f}s, retained {3:.1f} MiB'.format(
+            args.datasets, args.destinations, duration, retained / 1024 / 1024))
@@ -24,6 +24,8 @@ def run():
     parser.add_argument('--directory',     action='store',       default=paradux.settings.DEFAULT_DIRECTORY, help='Directory containing the paradux data.' )
     parser.add_argument('-v', '--verbose', action='count',       default=0,  help='Display extra output. May be repeated for even more output.')
     parser.add_argument('--debug',         action='store_const', const=True, help='Suspend execution at certain points for debugging' )
+    parser.add_argument('--bwlimit',       action='store',       help='Limit the bandwidth of all transfers together, in bytes per second, such as 500k or 2M.' )
+    parser.add_argument('--connections-per-host', action='store', type=int, help='Maximum number of transfers to the same host at the same time.' )
     cmdParsers = parser.add_subparsers( dest='command', required=True )
 
     cmds = {}
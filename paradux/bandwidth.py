@@ -0,0 +1,469 @@
+#!/usr/bin/python
+#
+# Limits the bandwidth and the number of connections used by all data
+# transfers in a process, so paradux does not saturate the uplink.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import contextlib
+import datetime
+import paradux.logging
+import re
+import threading
+import time
+
+
+# The governor used by all data transfer protocols in this process
+_defaultGovernor     = None
+_defaultGovernorLock = threading.Lock()
+
+# Syntax of a rate, such as 500k or 2.5M, in bytes per second
+_RATE_REGEX = re.compile(r'(\d+(?:\.\d+)?)\s*([kKmMgG]?)$')
+
+_RATE_UNITS = {
+    ''  : 1,
+    'k' : 1024,
+    'm' : 1024 * 1024,
+    'g' : 1024 * 1024 * 1024
+}
+
+# Syntax of a time of day, such as 08:30
+_TIME_REGEX = re.compile(r'(\d{1,2}):(\d{2})$')
+
+
+def defaultGovernor():
+    """
+    Obtain the Governor shared by all data transfers in this process.
+
+    return: Governor
+    """
+    global _defaultGovernor
+
+    with _defaultGovernorLock:
+        if _defaultGovernor is None:
+            _defaultGovernor = Governor()
+        return _defaultGovernor
+
+
+def parseBandwidthLimitJson(j):
+    """
+    Parse a bandwidth limit. This is either a rate, or an object with a
+    default rate and a schedule of rates that apply at certain times of day:
+    {
+        "default"  : "10M",
+        "schedule" : [
+            { "from" : "08:00", "to" : "18:00", "limit" : "1M" }
+        ]
+    }
+    A schedule entry may span midnight. Rates are in bytes per second, with
+    an optional suffix k, M or G; "unlimited" means no limit.
+
+    j: JSON fragment
+    return: BandwidthLimit
+    """
+    if isinstance(j, dict):
+        default  = parseRate(j['default']) if 'default' in j else None
+        schedule = []
+        for entryJ in j.get('schedule', []):
+            schedule.append((
+                    _parseTimeOfDay(entryJ['from']),
+                    _parseTimeOfDay(entryJ['to']),
+                    parseRate(entryJ['limit']) ))
+        return BandwidthLimit(default, schedule)
+
+    return BandwidthLimit(parseRate(j))
+
+
+def parseRate(j):
+    """
+    Parse a rate in bytes per second, such as 1048576, "512k" or "2M".
+
+    j: JSON fragment or string
+    return: the number of bytes per second, or None for unlimited
+    """
+    if isinstance(j, str):
+        if j.strip().lower() == 'unlimited':
+            return None
+        m = _RATE_REGEX.match(j.strip())
+        if m is None:
+            raise ValueError('Not a valid rate: ' + j)
+        ret = float(m.group(1)) * _RATE_UNITS[m.group(2).lower()]
+
+    elif isinstance(j, bool) or not isinstance(j, (int, float)):
+        raise ValueError('Not a valid rate: ' + str(j))
+
+    else:
+        ret = j
+
+    if ret <= 0:
+        raise ValueError('Rate must be positive: ' + str(j))
+    return int(ret)
+
+
+def _parseTimeOfDay(s):
+    """
+    Parse a time of day, such as 08:30.
+
+    s: the string
+    return: the number of minutes since midnight
+    """
+    m = _TIME_REGEX.match(s) if isinstance(s, str) else None
+    if m is None or int(m.group(1)) > 24 or int(m.group(2)) > 59:
+        raise ValueError('Not a valid time of day: ' + str(s))
+    return min(24 * 60, int(m.group(1)) * 60 + int(m.group(2)))
+
+
+class BandwidthLimit:
+    """
+    A limit on the number of bytes per second, which may depend on the time
+    of day.
+
+    default: bytes per second when no schedule entry applies, or None for unlimited
+    schedule: list of tuples (from minute, to minute, bytes per second or None),
+         where minutes count from midnight local time; the first matching entry applies
+    """
+    def __init__(self, default, schedule=None):
+        self.default  = default
+        self.schedule = schedule or []
+
+
+    def rateAt(self, now=None):
+        """
+        Determine the rate that applies at a certain time.
+
+        now: the datetime, or None for now
+        return: bytes per second, or None for unlimited
+        """
+        if not self.schedule:
+            return self.default
+
+        if now is None:
+            now = datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+
+        for fromMinute, toMinute, rate in self.schedule:
+            if fromMinute <= toMinute:
+                if fromMinute <= minute < toMinute:
+                    return rate
+            elif minute >= fromMinute or minute < toMinute: # spans midnight
+                return rate
+
+        return self.default
+
+
+    def __str__(self):
+        """
+        Convert to string, to be shown to the user
+
+        return: string
+        """
+        t = _rateAsText(self.default)
+        for fromMinute, toMinute, rate in self.schedule:
+            t += ", {0:02d}:{1:02d}-{2:02d}:{3:02d}: {4:s}".format(
+                    fromMinute // 60, fromMinute % 60, toMinute // 60, toMinute % 60, _rateAsText(rate))
+        return t
+
+
+def _rateAsText(rate):
+    """
+    Show a rate to the user.
+
+    rate: bytes per second, or None
+    return: string
+    """
+    if rate is None:
+        return 'unlimited'
+    return '{0:d} bytes/s'.format(rate)
+
+
+class TokenBucket:
+    """
+    Lets bytes through at the rate of a BandwidthLimit, shared by any number
+    of threads. Up to one second's worth of bytes may be sent in a burst.
+    Those who send more than is available go into debt and wait it off, so
+    large chunks are fine.
+
+    limit: the BandwidthLimit
+    """
+    def __init__(self, limit):
+        self.limit  = limit
+        self.tokens = 0.0
+        self.last   = time.monotonic()
+        self.lock   = threading.Lock()
+
+
+    def consume(self, n):
+        """
+        Take n bytes' worth of tokens, waiting until they are available.
+
+        n: the number of bytes
+        return: void
+        """
+        with self.lock:
+            now  = time.monotonic()
+            rate = self.limit.rateAt()
+            if rate is None:
+                self.tokens = 0.0
+                self.last   = now
+                return
+
+            self.tokens = min(float(rate), self.tokens + (now - self.last) * rate) - n
+            self.last   = now
+            wait        = -self.tokens / rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Governor:
+    """
+    Limits the bandwidth of all data transfers in a process, in total and for
+    individual data locations, and the number of transfers to the same host
+    at the same time. The total limit does not apply to locally mounted file
+    systems.
+
+    Data transfer protocols that move the bytes themselves call throttle(),
+    or read through throttledReader(); those that spawn a process pass it
+    rateFor() in the form the process understands.
+    """
+    def __init__(self):
+        self.globalBucket          = None
+        self.maxConnectionsPerHost = None
+        self.locationBuckets       = {} # str(data location) -> TokenBucket
+        self.hostSlots             = {} # host -> BoundedSemaphore
+        self.activeRemote          = 0  # number of transfers to remote hosts in progress
+        self.lock                  = threading.Lock()
+
+
+    def configure(self, limit=None, maxConnectionsPerHost=None):
+        """
+        Set the limits that apply to all data transfers.
+
+        limit: the BandwidthLimit for all transfers together, or None
+        maxConnectionsPerHost: the maximum number of transfers to the same host at the same time, or None
+        return: void
+        """
+        with self.lock:
+            self.globalBucket          = None if limit is None else TokenBucket(limit)
+            self.maxConnectionsPerHost = maxConnectionsPerHost
+            self.hostSlots             = {}
+
+        if limit is not None:
+            paradux.logging.info('Limiting bandwidth to', limit)
+
+
+    @contextlib.contextmanager
+    def connection(self, dataLocation):
+        """
+        Hold one of the connections to the host of a data location for the
+        duration of a with statement, waiting until one is available.
+
+        dataLocation: the data location
+        """
+        slots  = None
+        remote = _isRemote(dataLocation)
+        with self.lock:
+            if self.maxConnectionsPerHost is not None and remote:
+                host = dataLocation.url.hostname
+                if host not in self.hostSlots:
+                    self.hostSlots[host] = threading.BoundedSemaphore(self.maxConnectionsPerHost)
+                slots = self.hostSlots[host]
+
+        if slots is not None:
+            slots.acquire()
+        with self.lock:
+            if remote:
+                self.activeRemote += 1
+        try:
+            yield
+
+        finally:
+            with self.lock:
+                if remote:
+                    self.activeRemote -= 1
+            if slots is not None:
+                slots.release()
+
+
+    def batchOf(self, items, maxCount, locationOf=lambda item: item):
+        """
+        Pick, in sequence, up to maxCount items whose data locations can all
+        be connected to at the same time without exceeding the number of
+        connections per host. Those that read from a shared stream must not
+        wait for each other's connections.
+
+        items: the data locations, or items that refer to one each
+        maxCount: the maximum number of items to pick
+        locationOf: function that returns the data location of an item
+        return: tuple of (picked items, remaining items)
+        """
+        batch     = []
+        remaining = []
+        perHost   = {}
+        for item in items:
+            location = locationOf(item)
+            host     = location.url.hostname if _isRemote(location) else None
+            if len(batch) >= maxCount or (
+                    host is not None
+                    and self.maxConnectionsPerHost is not None
+                    and perHost.get(host, 0) >= self.maxConnectionsPerHost ):
+                remaining.append(item)
+            else:
+                batch.append(item)
+                if host is not None:
+                    perHost[host] = perHost.get(host, 0) + 1
+
+        return ( batch, remaining )
+
+
+    def throttle(self, dataLocation, n):
+        """
+        Account for n bytes transferred to or from a data location, waiting
+        as long as needed to stay within the limits.
+
+        dataLocation: the data location
+        n: the number of bytes
+        return: void
+        """
+        bucket = self._locationBucketFor(dataLocation)
+        if bucket is not None:
+            bucket.consume(n)
+
+        if self.globalBucket is not None and _isRemote(dataLocation):
+            self.globalBucket.consume(n)
+
+
+    def throttledReader(self, reader, dataLocation):
+        """
+        Wrap a file-like object, so reading from it stays within the limits
+        for the data location.
+
+        reader: the file-like object
+        dataLocation: the data location the content is transferred to
+        return: file-like object
+        """
+        if self.globalBucket is None and getattr(dataLocation, 'bandwidth', None) is None:
+            return reader
+        return ThrottledReader(reader, self, dataLocation)
+
+
+    def throttledWriter(self, writer, dataLocation):
+        """
+        Wrap a file-like object, so writing to it stays within the limits
+        for the data location.
+
+        writer: the file-like object
+        dataLocation: the data location the content is transferred from
+        return: file-like object
+        """
+        if self.globalBucket is None and getattr(dataLocation, 'bandwidth', None) is None:
+            return writer
+        return ThrottledWriter(writer, self, dataLocation)
+
+
+    def rateFor(self, dataLocation):
+        """
+        Determine the rate a spawned process may use for a transfer to or from
+        a data location: the location's own limit, or its share of the total
+        limit among the transfers in progress, whichever is lower.
+
+        dataLocation: the data location
+        return: bytes per second, or None for unlimited
+        """
+        rates = []
+
+        limit = getattr(dataLocation, 'bandwidth', None)
+        if limit is not None and limit.rateAt() is not None:
+            rates.append(limit.rateAt())
+
+        with self.lock:
+            if self.globalBucket is not None and _isRemote(dataLocation):
+                globalRate = self.globalBucket.limit.rateAt()
+                if globalRate is not None:
+                    rates.append(globalRate // max(1, self.activeRemote))
+
+        return max(1, min(rates)) if rates else None
+
+
+    def _locationBucketFor(self, dataLocation):
+        """
+        Find or create the TokenBucket for the limit of a data location.
+
+        dataLocation: the data location
+        return: TokenBucket, or None if the data location has no limit
+        """
+        limit = getattr(dataLocation, 'bandwidth', None)
+        if limit is None:
+            return None
+
+        key = str(dataLocation)
+        with self.lock:
+            if key not in self.locationBuckets:
+                self.locationBuckets[key] = TokenBucket(limit)
+            return self.locationBuckets[key]
+
+
+class ThrottledReader:
+    """
+    A file-like object that reads from another one no faster than the
+    Governor permits.
+
+    reader: the file-like object to read from
+    governor: the Governor
+    dataLocation: the data location the content is transferred to
+    """
+    def __init__(self, reader, governor, dataLocation):
+        self.reader       = reader
+        self.governor     = governor
+        self.dataLocation = dataLocation
+
+
+    def read(self, size=-1):
+        """
+        Read from the underlying file-like object.
+
+        size: the maximum number of bytes to read, or -1 for all
+        return: the bytes
+        """
+        buf = self.reader.read(size)
+        if buf:
+            self.governor.throttle(self.dataLocation, len(buf))
+        return buf
+
+
+class ThrottledWriter:
+    """
+    A file-like object that writes to another one no faster than the
+    Governor permits.
+
+    writer: the file-like object to write to
+    governor: the Governor
+    dataLocation: the data location the content is transferred from
+    """
+    def __init__(self, writer, governor, dataLocation):
+        self.writer       = writer
+        self.governor     = governor
+        self.dataLocation = dataLocation
+
+
+    def write(self, buf):
+        """
+        Write to the underlying file-like object.
+
+        buf: the bytes
+        return: the number of bytes written
+        """
+        self.governor.throttle(self.dataLocation, len(buf))
+        return self.writer.write(buf)
+
+
+def _isRemote(dataLocation):
+    """
+    Does transferring to or from this data location use the network?
+
+    dataLocation: the data location
+    return: True or False
+    """
+    return dataLocation.scheme != 'file'
@@ -0,0 +1,345 @@
+#!/usr/bin/python
+#
+# Remembers what was backed up where and when, so it can be found without
+# asking any destination.
+#
+# The catalog is an SQLite database. Rather than one row per file and
+# snapshot, which would grow by the number of files with every backup, each
+# row is a version of a file at a destination, with the snapshots from which
+# on and until which it was held there; so a snapshot only adds rows for the
+# files that changed. Versions are clustered by path, so a prefix of a path
+# is found with one range scan of the primary key.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os
+import os.path
+import paradux.logging
+import paradux.utils
+import sqlite3
+import threading
+import time
+
+
+# Version of the database schema, kept in PRAGMA user_version
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS locations (
+    id          INTEGER PRIMARY KEY,
+    dataset     TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    UNIQUE ( dataset, destination )
+);
+
+CREATE TABLE IF NOT EXISTS snapshots (
+    id       INTEGER PRIMARY KEY,
+    location INTEGER NOT NULL REFERENCES locations ( id ),
+    time     INTEGER NOT NULL,
+    name     TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_time ON snapshots ( location, time );
+
+CREATE TABLE IF NOT EXISTS versions (
+    path     TEXT NOT NULL,
+    location INTEGER NOT NULL REFERENCES locations ( id ),
+    since    INTEGER NOT NULL REFERENCES snapshots ( id ),
+    until    INTEGER REFERENCES snapshots ( id ),
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash     TEXT,
+    PRIMARY KEY ( path, location, since )
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS versions_current ON versions ( location, until );
+"""
+
+# Sorts after any path that starts with a given prefix, in practice
+_PREFIX_END = '\U0010ffff'
+
+
+class CatalogEntry:
+    """
+    A version of a file held at a destination.
+
+    dataset: name of the Dataset
+    destination: URL of the destination
+    snapshotTime: UNIX time of the snapshot in which it was found
+    snapshotName: name of that snapshot at the destination, or None
+    path: path of the file relative to the root of the dataset
+    size: the number of bytes
+    mtimeNs: time of the last modification of the file, in ns since the epoch
+    hash: SHA-256 of the file as hex, or None if not known
+    since: UNIX time of the first snapshot that had this version
+    until: UNIX time of the first snapshot that no longer had it, or None if it still does
+    """
+    def __init__(self, dataset, destination, snapshotTime, snapshotName, path, size, mtimeNs, hash, since, until):
+        self.dataset      = dataset
+        self.destination  = destination
+        self.snapshotTime = snapshotTime
+        self.snapshotName = snapshotName
+        self.path         = path
+        self.size         = size
+        self.mtimeNs      = mtimeNs
+        self.hash         = hash
+        self.since        = since
+        self.until        = until
+
+
+    def asText(self):
+        """
+        Show this CatalogEntry to the user in plain text.
+
+        return: plain text
+        """
+        return "{0:s}  {1:12d}  {2:s}  {3:s}\n    {4:s} -> {5:s} (snapshot {6:s})".format(
+                paradux.utils.time2string(self.mtimeNs // 1000000000),
+                self.size,
+                self.hash[0:16] if self.hash else '-' * 16,
+                self.path,
+                self.dataset,
+                self.destination,
+                self.snapshotName or paradux.utils.time2string(self.snapshotTime))
+
+
+class Catalog:
+    """
+    The catalog of all files held at all destinations. Thread-safe.
+
+    fileName: name of the SQLite database file, which is created if needed
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.lock     = threading.Lock()
+
+        isNew = not os.path.isfile(fileName)
+        self.db = sqlite3.connect(fileName, check_same_thread=False)
+        if isNew:
+            os.chmod(fileName, 0o600)
+
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise ValueError('Catalog was created by a newer version of paradux: ' + fileName)
+
+        with self.db:
+            self.db.executescript(_SCHEMA)
+            self.db.execute('PRAGMA user_version = {0:d}'.format(SCHEMA_VERSION))
+
+
+    def latestFiles(self, dataset):
+        """
+        Obtain the files of a dataset as they were in its most recent snapshot
+        at any destination, such as for only hashing files that changed since.
+
+        dataset: name of the Dataset
+        return: dict from path to tuple (size, mtime in ns, hash or None)
+        """
+        with self.lock:
+            rows = self.db.execute(
+                    """SELECT v.path, v.size, v.mtime_ns, v.hash FROM versions v
+                       WHERE v.location = (
+                           SELECT s.location FROM snapshots s JOIN locations l ON l.id = s.location
+                           WHERE l.dataset = ? ORDER BY s.time DESC, s.id DESC LIMIT 1 )
+                       AND v.until IS NULL""",
+                    ( dataset, )).fetchall()
+
+        return { path : ( size, mtimeNs, hash ) for path, size, mtimeNs, hash in rows }
+
+
+    def latestSnapshotTime(self, dataset, destination):
+        """
+        Determine when a destination of a dataset was last recorded.
+
+        dataset: name of the Dataset
+        destination: URL of the destination
+        return: UNIX time of its most recent snapshot, or None if there is none
+        """
+        with self.lock:
+            row = self.db.execute(
+                    """SELECT s.time FROM snapshots s JOIN locations l ON l.id = s.location
+                       WHERE l.dataset = ? AND l.destination = ? ORDER BY s.id DESC LIMIT 1""",
+                    ( dataset, destination )).fetchone()
+
+        return None if row is None else row[0]
+
+
+    def recordSnapshot(self, dataset, destination, files, snapshotTime=None, snapshotName=None):
+        """
+        Remember that a destination now holds these files of a dataset. Only
+        the files that changed since the previous snapshot there are written.
+
+        dataset: name of the Dataset
+        destination: URL of the destination
+        files: dict from path to tuple (size, mtime in ns, hash or None)
+        snapshotTime: UNIX time of the snapshot, or None for now
+        snapshotName: name of the snapshot at the destination, if it keeps snapshots
+        return: void
+        """
+        if snapshotTime is None:
+            snapshotTime = time.time()
+
+        with self.lock, self.db:
+            locationId = self._locationId(dataset, destination)
+            snapshotId = self.db.execute(
+                    'INSERT INTO snapshots ( location, time, name ) VALUES ( ?, ?, ? )',
+                    ( locationId, int(snapshotTime), snapshotName )).lastrowid
+
+            current = {}
+            for path, size, mtimeNs, hash, since in self.db.execute(
+                    'SELECT path, size, mtime_ns, hash, since FROM versions WHERE location = ? AND until IS NULL',
+                    ( locationId, )):
+                current[path] = ( size, mtimeNs, hash, since )
+
+            ended = []
+            added = []
+            for path, ( size, mtimeNs, hash, since ) in current.items():
+                now = files.get(path)
+                if now is None or now[0] != size or now[1] != mtimeNs or ( now[2] is not None and now[2] != hash ):
+                    ended.append(( snapshotId, path, locationId, since ))
+
+            for path, ( size, mtimeNs, hash ) in files.items():
+                previous = current.get(path)
+                if previous is None or previous[0] != size or previous[1] != mtimeNs or ( hash is not None and previous[2] != hash ):
+                    added.append(( path, locationId, snapshotId, size, mtimeNs, hash ))
+
+            self.db.executemany('UPDATE versions SET until = ? WHERE path = ? AND location = ? AND since = ?', ended)
+            self.db.executemany('INSERT INTO versions ( path, location, since, size, mtime_ns, hash ) VALUES ( ?, ?, ?, ?, ?, ? )', added)
+
+        paradux.logging.trace('Catalog:', dataset, '->', destination, len(added), 'versions added,', len(ended), 'ended')
+
+
+    def find(self, pathPrefix='', asOf=None, dataset=None, limit=None):
+        """
+        Find the files held at destinations at a point in time.
+
+        pathPrefix: only find files whose path starts with this
+        asOf: UNIX time; for each destination, use its last snapshot at or before then; None for now
+        dataset: only find files of the Dataset with this name, or None
+        limit: the maximum number of entries returned, or None
+        return: list of CatalogEntry, sorted by path
+        """
+        if asOf is None:
+            asOf = time.time()
+
+        sql = """SELECT l.dataset, l.destination, s.time, s.name, v.path, v.size, v.mtime_ns, v.hash, vs.time, vu.time
+                 FROM versions v
+                 JOIN locations l ON l.id = v.location
+                 JOIN snapshots s ON s.id = (
+                     SELECT MAX(id) FROM snapshots WHERE location = v.location AND time <= :asOf )
+                 JOIN snapshots vs ON vs.id = v.since
+                 LEFT JOIN snapshots vu ON vu.id = v.until
+                 WHERE v.path >= :fromPath AND v.path < :toPath
+                 AND v.since <= s.id AND ( v.until IS NULL OR v.until > s.id )"""
+        return self._query(sql, pathPrefix, dataset, limit, { 'asOf' : int(asOf) })
+
+
+    def history(self, pathPrefix='', dataset=None, limit=None):
+        """
+        Find all versions of the files ever held at destinations.
+
+        pathPrefix: only find files whose path starts with this
+        dataset: only find files of the Dataset with this name, or None
+        limit: the maximum number of entries returned, or None
+        return: list of CatalogEntry, sorted by path
+        """
+        sql = """SELECT l.dataset, l.destination, vs.time, vs.name, v.path, v.size, v.mtime_ns, v.hash, vs.time, vu.time
+                 FROM versions v
+                 JOIN locations l ON l.id = v.location
+                 JOIN snapshots vs ON vs.id = v.since
+                 LEFT JOIN snapshots vu ON vu.id = v.until
+                 WHERE v.path >= :fromPath AND v.path < :toPath"""
+        return self._query(sql, pathPrefix, dataset, limit, {})
+
+
+    def close(self):
+        """
+        Close the database.
+
+        return: void
+        """
+        with self.lock:
+            self.db.close()
+
+
+    def _query(self, sql, pathPrefix, dataset, limit, params):
+        """
+        Run a query for CatalogEntry, restricted to a path prefix, dataset and
+        number of entries.
+
+        sql: the query, with parameters :fromPath and :toPath
+        pathPrefix: only find files whose path starts with this
+        dataset: only find files of the Dataset with this name, or None
+        limit: the maximum number of entries returned, or None
+        params: dict of other parameters of the query
+        return: list of CatalogEntry
+        """
+        params = dict(params)
+        params['fromPath'] = pathPrefix
+        params['toPath']   = pathPrefix + _PREFIX_END
+
+        if dataset is not None:
+            sql += ' AND l.dataset = :dataset'
+            params['dataset'] = dataset
+
+        sql += ' ORDER BY v.path, l.dataset, l.destination, v.since'
+
+        if limit is not None:
+            sql += ' LIMIT :limit'
+            params['limit'] = limit
+
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+
+        return [ CatalogEntry(dataset, destination, snapshotTime, snapshotName, path, size, mtimeNs, hash, since, until)
+                 for dataset, destination, snapshotTime, snapshotName, path, size, mtimeNs, hash, since, until in rows ]
+
+
+    def _locationId(self, dataset, destination):
+        """
+        Obtain the id of a destination of a dataset, creating it if needed.
+        The lock must be held.
+
+        dataset: name of the Dataset
+        destination: URL of the destination
+        return: the id
+        """
+        row = self.db.execute('SELECT id FROM locations WHERE dataset = ? AND destination = ?', ( dataset, destination )).fetchone()
+        if row is not None:
+            return row[0]
+
+        return self.db.execute('INSERT INTO locations ( dataset, destination ) VALUES ( ?, ? )', ( dataset, destination )).lastrowid
+
+
+def scanTree(localDir, previous=None):
+    """
+    Determine the files in a local directory hierarchy, as recorded in the
+    catalog. Only files that changed since previous are hashed.
+
+    localDir: the local directory
+    previous: dict from path to tuple (size, mtime in ns, hash or None), as returned by latestFiles
+    return: dict from path to tuple (size, mtime in ns, hash)
+    """
+    previous = previous or {}
+    ret      = {}
+    for dirPath, dirNames, fileNames in os.walk(localDir):
+        relDir = os.path.relpath(dirPath, localDir)
+        relDir = '' if relDir == '.' else relDir.replace(os.sep, '/') + '/'
+
+        for fileName in fileNames:
+            localFile = os.path.join(dirPath, fileName)
+            if os.path.islink(localFile) or not os.path.isfile(localFile):
+                continue
+
+            st   = os.stat(localFile)
+            path = relDir + fileName
+            old  = previous.get(path)
+            if old is not None and old[0] == st.st_size and old[1] == st.st_mtime_ns and old[2] is not None:
+                ret[path] = old
+            else:
+                ret[path] = ( st.st_size, st.st_mtime_ns, paradux.utils.sha256OfFile(localFile) )
+
+    return ret
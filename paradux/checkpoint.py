@@ -0,0 +1,182 @@
+#!/usr/bin/python
+#
+# Checkpoints of uploads in progress, so an interrupted upload can resume
+# where it left off in a later run.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import hashlib
+import os
+import os.path
+import paradux.logging
+import paradux.utils
+import threading
+
+
+class CheckpointStore:
+    """
+    Keeps one Checkpoint per data location, as a JSON file in a directory.
+
+    directory: the directory holding the checkpoint files
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+
+    def checkpointFor(self, dataLocation, localFile):
+        """
+        Obtain the Checkpoint for uploading this local file to this data
+        location. If a checkpoint exists for a different local file, or the
+        local file has changed since, a fresh Checkpoint is returned, which
+        remembers the outdated one, so the transport can clean up after it.
+
+        dataLocation: the data location
+        localFile: name of the local file
+        return: Checkpoint
+        """
+        url      = str(dataLocation)
+        fileName = os.path.join(self.directory, hashlib.sha256(url.encode('utf8')).hexdigest()[:32] + '.json')
+        st       = os.stat(localFile)
+        identity = {
+            'file'     : os.path.abspath(localFile),
+            'size'     : st.st_size,
+            'mtime_ns' : st.st_mtime_ns
+        }
+
+        previousJ = None
+        if os.path.isfile(fileName):
+            try:
+                j = paradux.utils.readJsonFromFile(fileName)
+                if j['url'] == url and j['local'] == identity:
+                    paradux.logging.info('Resuming upload to', url, 'from checkpoint')
+                    return Checkpoint(self, fileName, j)
+                previousJ = j
+
+            except Exception as e:
+                paradux.logging.warning('Ignoring unreadable checkpoint:', fileName, e)
+
+        return Checkpoint(self, fileName, { 'url' : url, 'local' : identity }, previousJ)
+
+
+class Checkpoint:
+    """
+    The state of one upload in progress. Transports keep what they need to
+    resume in its fields, and save it whenever progress has been confirmed.
+
+    fileName: name of the JSON file holding this checkpoint
+    previous: JSON of an outdated checkpoint for the same data location, if any
+    """
+    def __init__(self, store, fileName, j, previous=None):
+        self.store    = store
+        self.fileName = fileName
+        self.j        = j
+        self.previous = previous
+        self.lock     = threading.Lock()
+
+
+    def isResumed(self):
+        """
+        Does this checkpoint continue an upload from an earlier run?
+
+        return: True or False
+        """
+        return 'bytes-confirmed' in self.j or 'remote-temp' in self.j or 'parts' in self.j
+
+
+    def getBytesConfirmed(self):
+        """
+        return: the number of bytes the remote side has confirmed
+        """
+        return self.j.get('bytes-confirmed', 0)
+
+
+    def setBytesConfirmed(self, n):
+        """
+        n: the number of bytes the remote side has confirmed
+        return: void
+        """
+        with self.lock:
+            self.j['bytes-confirmed'] = n
+
+
+    def getRemoteTemp(self):
+        """
+        return: name of the temporary file or object the upload goes to, or None
+        """
+        return self.j.get('remote-temp')
+
+
+    def setRemoteTemp(self, name):
+        """
+        name: name of the temporary file or object the upload goes to
+        return: void
+        """
+        with self.lock:
+            self.j['remote-temp'] = name
+
+
+    def getUploadId(self):
+        """
+        return: the id of a multipart upload, or None
+        """
+        return self.j.get('upload-id')
+
+
+    def setUploadId(self, uploadId):
+        """
+        uploadId: the id of a multipart upload, or None
+        return: void
+        """
+        with self.lock:
+            self.j['upload-id'] = uploadId
+            self.j['parts']     = {}
+
+
+    def getParts(self):
+        """
+        return: dict of part number to the ETag confirmed by the remote side
+        """
+        with self.lock:
+            return { int(k) : v for k, v in self.j.get('parts', {}).items() }
+
+
+    def addPart(self, partNumber, etag, size):
+        """
+        Record that a part has been confirmed by the remote side.
+
+        partNumber: number of the part
+        etag: the ETag the remote side reported
+        size: size of the part
+        return: void
+        """
+        with self.lock:
+            self.j.setdefault('parts', {})[str(partNumber)] = etag
+            self.j['bytes-confirmed'] = self.j.get('bytes-confirmed', 0) + size
+
+
+    def save(self):
+        """
+        Save this checkpoint, so it survives an interruption.
+
+        return: void
+        """
+        with self.lock:
+            if not os.path.isdir(self.store.directory):
+                os.makedirs(self.store.directory, 0o700, exist_ok=True)
+
+            tmpFile = self.fileName + '.tmp'
+            paradux.utils.writeJsonToFile(tmpFile, self.j, 0o600)
+            os.replace(tmpFile, self.fileName)
+
+
+    def remove(self):
+        """
+        The upload has completed: delete this checkpoint.
+
+        return: void
+        """
+        with self.lock:
+            if os.path.isfile(self.fileName):
+                os.remove(self.fileName)
@@ -0,0 +1,716 @@
+#!/usr/bin/python
+#
+# Stores the files of a dataset at a destination as content-defined chunks,
+# so a file that changed only partly, such as a VM image or a mail store,
+# only causes the chunks that changed to be uploaded, and identical chunks
+# are stored once, no matter in how many files or snapshots they occur.
+#
+# Files are split where a rolling gear hash of the last 32 bytes matches a
+# mask, like FastCDC: no cut within MIN_CHUNK_SIZE of the previous one, a
+# harder-to-match mask until AVG_CHUNK_SIZE and an easier one after, and a
+# forced cut at MAX_CHUNK_SIZE. As cut points only depend on the bytes near
+# them, inserting or deleting bytes only changes the chunks around the edit.
+#
+# Layout at the destination:
+#   chunks/<first 2 hex digits of name>/<name>: the content of a chunk
+#   snapshots/<time>.json: the manifest of a snapshot
+#   latest.json: the manifest of the latest snapshot
+# where the name of a chunk is the SHA-256 of its content, or, if the
+# destination is encrypted, the HMAC-SHA256 of its content under the key
+# of the dataset, so names do not reveal content. Chunks and manifests are
+# then encrypted with paradux.encryption.
+#
+# Which chunks exist at a destination is kept in a local ChunkIndex, so
+# nothing needs to be asked of the destination to decide what to upload.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import concurrent.futures
+import hashlib
+import hmac
+import io
+import json
+import mmap
+import os
+import os.path
+import paradux.encryption
+import paradux.logging
+import paradux.processpool
+import paradux.transport
+import paradux.utils
+import re
+import threading
+import time
+from tempfile import NamedTemporaryFile
+
+
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Number of chunks uploaded at the same time
+UPLOAD_WORKERS = 4
+
+# Version of the manifest format
+MANIFEST_VERSION = 1
+
+NAME_SIZE = 32 # bytes in the name of a chunk
+
+# Number of bytes that determine the rolling hash
+_WINDOW = 32
+
+# Number of positions whose hashes are computed at the same time; small enough
+# to stay in the CPU cache, large enough to make the overhead per block small
+_BLOCK_SIZE = 16 * 1024
+
+# FastCDC normalized chunking: more bits than log2(AVG_CHUNK_SIZE) before it, fewer after.
+# The gear hash shifts left, so its high bits depend on the most bytes.
+_MASK_SMALL = 0xFFFFFC00 # 22 bits
+_MASK_LARGE = 0xFFFFC000 # 18 bits
+
+# Random 32-bit values, one per byte value; fixed, so the same content is always cut the same way
+_GEAR = tuple( int.from_bytes(hashlib.sha256(b'paradux-gear' + bytes([ i ])).digest()[:4], 'big') for i in range(256) )
+
+_NAME_REGEX     = re.compile(r'[0-9a-f]{64}$')
+_SNAPSHOT_REGEX = re.compile(r'\d{8}-\d{6}\.json$')
+
+
+def chunkLengthsOfFile(fileName):
+    """
+    Determine where to split a file into chunks. This runs in the processes
+    of the Executor, so it is a module-level function.
+
+    fileName: name of the file
+    return: tuple of (list of the lengths of the chunks, SHA-256 of the file as hex)
+    """
+    lengths = []
+    fileHash = hashlib.sha256()
+    buf      = bytearray()
+    eof      = False
+
+    with open(fileName, 'rb') as fd:
+        while True:
+            while not eof and len(buf) < MAX_CHUNK_SIZE:
+                more = fd.read(MAX_CHUNK_SIZE)
+                if more:
+                    fileHash.update(more)
+                    buf += more
+                else:
+                    eof = True
+
+            if not buf:
+                break
+
+            n = _cutPoint(buf)
+            lengths.append(n)
+            del buf[:n]
+
+    return ( lengths, fileHash.hexdigest() )
+
+
+def _cutPoint(buf):
+    """
+    Determine the length of the next chunk.
+
+    buf: the bytes starting at the beginning of the chunk; at least
+         MAX_CHUNK_SIZE unless the end of the file is near
+    return: the length
+    """
+    size = len(buf)
+    if size <= MIN_CHUNK_SIZE:
+        return size
+
+    normal = min(AVG_CHUNK_SIZE, size)
+    end    = min(MAX_CHUNK_SIZE, size)
+
+    for first, last, maskTables in ( ( MIN_CHUNK_SIZE, normal, _MASK_SMALL_TABLES ), ( normal, end, _MASK_LARGE_TABLES )):
+        for blockStart in range(first, last, _BLOCK_SIZE):
+            i = _firstMatch(buf, blockStart, min(last, blockStart + _BLOCK_SIZE), maskTables)
+            if i >= 0:
+                return i + 1
+
+    return end
+
+
+def _firstMatch(buf, start, stop, maskTables):
+    """
+    Find the first position whose gear hash matches a mask. The hashes of
+    all positions are computed at once with big integer arithmetic, rather
+    than byte by byte: the hash at a position is the sum of the gear values
+    of the last _WINDOW bytes, each shifted left by its distance from the
+    position, modulo 2**32, and the sum itself is less than 2**64. So the
+    gear values are laid out in 64-bit lanes of one integer, and five
+    shifted additions of the integer to itself add up the shifted values in
+    every lane, without carries from one lane into the next.
+
+    buf: the bytes
+    start: the first position to check, at least _WINDOW - 1
+    stop: the position after the last one to check
+    maskTables: the translation tables for the mask, see _maskTables
+    return: the position, or -1 if none matches
+    """
+    count = stop - start
+    data  = buf[start - _WINDOW + 1:stop]
+
+    lanes = bytearray(8 * len(data))
+    for k in range(4):
+        lanes[k::8] = data.translate(_GEAR_BYTES[k])
+
+    sums  = int.from_bytes(lanes, 'little')
+    shift = 65 # one lane plus one bit
+    for step in range(5): # 2**5 == _WINDOW
+        sums  += sums << shift
+        shift *= 2
+    sums = sums.to_bytes(8 * ( len(data) + _WINDOW + 1 ), 'little')
+
+    # Zero bytes where all masked bits of the hash are zero
+    offset = 8 * ( _WINDOW - 1 )
+    misses = 0
+    for k, table in maskTables:
+        lane = sums[offset+k:offset+8*count:8]
+        if table is not None:
+            lane = lane.translate(table)
+        misses |= int.from_bytes(lane, 'little')
+
+    i = misses.to_bytes(count, 'little').find(0)
+    return -1 if i < 0 else start + i
+
+
+def _maskTables(mask):
+    """
+    Prepare checking the bytes of gear hashes against a mask.
+
+    mask: the mask
+    return: tuple of tuples (index of a byte of the hash, translation table that maps
+         the byte to 0 if its masked bits are zero, or None if all of its bits are masked)
+    """
+    ret = []
+    for k in range(4):
+        byteMask = ( mask >> ( 8 * k )) & 0xFF
+        if byteMask == 0xFF:
+            ret.append(( k, None ))
+        elif byteMask:
+            ret.append(( k, bytes( 0 if i & byteMask == 0 else 1 for i in range(256) )))
+    return tuple(ret)
+
+
+# The bytes of the gear values, least significant first, for bytes.translate()
+_GEAR_BYTES = tuple( bytes( ( gear >> ( 8 * k )) & 0xFF for gear in _GEAR ) for k in range(4) )
+
+_MASK_SMALL_TABLES = _maskTables(_MASK_SMALL)
+_MASK_LARGE_TABLES = _maskTables(_MASK_LARGE)
+
+
+class ChunkIndex:
+    """
+    The names of the chunks that exist at a destination, kept in a local
+    file of sorted NAME_SIZE-byte records that is memory-mapped, so it does
+    not need to be read into memory. As names are uniformly distributed,
+    interpolation search finds a name in an expected constant number of
+    probes, even with millions of chunks. Names added are kept in memory
+    until save() merges them into the file.
+
+    fileName: name of the index file
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.added    = set()
+        self.fd       = None
+        self.map      = None
+        self.count    = 0
+        self._open()
+
+
+    def exists(self):
+        """
+        Determine whether the index file exists.
+
+        return: True or False
+        """
+        return os.path.isfile(self.fileName)
+
+
+    def __contains__(self, name):
+        return name in self.added or self._find(name)
+
+
+    def __len__(self):
+        return self.count + len(self.added)
+
+
+    def add(self, name):
+        """
+        Remember that a chunk exists.
+
+        name: the name of the chunk, as bytes
+        return: void
+        """
+        if not self._find(name):
+            self.added.add(name)
+
+
+    def save(self):
+        """
+        Merge the added names into the index file.
+
+        return: void
+        """
+        if not self.added and self.exists():
+            return
+
+        added   = sorted(self.added)
+        tmpFile = self.fileName + '.tmp'
+        with open(tmpFile, 'wb') as out:
+            os.chmod(tmpFile, 0o600)
+
+            i = 0
+            for pos in range(self.count):
+                record = self.map[pos*NAME_SIZE:(pos+1)*NAME_SIZE]
+                while i < len(added) and added[i] < record:
+                    out.write(added[i])
+                    i += 1
+                out.write(record)
+            for name in added[i:]:
+                out.write(name)
+
+        self.close()
+        os.replace(tmpFile, self.fileName)
+        self.added = set()
+        self._open()
+
+
+    def close(self):
+        """
+        Unmap the index file. Added names that have not been saved are kept.
+
+        return: void
+        """
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+        self.count = 0
+
+
+    def _open(self):
+        """
+        Map the index file, if it exists and is not empty.
+
+        return: void
+        """
+        if os.path.isfile(self.fileName) and os.path.getsize(self.fileName) >= NAME_SIZE:
+            self.fd    = open(self.fileName, 'rb')
+            self.map   = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+            self.count = len(self.map) // NAME_SIZE
+
+
+    def _find(self, name):
+        """
+        Interpolation search for a name in the index file.
+
+        name: the name, as bytes
+        return: True if found
+        """
+        lo = 0
+        hi = self.count - 1
+        if hi < 0:
+            return False
+
+        key = int.from_bytes(name[:8], 'big')
+        while lo <= hi:
+            loKey = int.from_bytes(self.map[lo*NAME_SIZE:lo*NAME_SIZE+8], 'big')
+            hiKey = int.from_bytes(self.map[hi*NAME_SIZE:hi*NAME_SIZE+8], 'big')
+            if key < loKey or key > hiKey:
+                return False
+
+            if hiKey == loKey:
+                pos = lo
+            else:
+                pos = lo + ( key - loKey ) * ( hi - lo ) // ( hiKey - loKey )
+
+            record = self.map[pos*NAME_SIZE:(pos+1)*NAME_SIZE]
+            if record == name:
+                return True
+            if record < name:
+                lo = pos + 1
+            else:
+                hi = pos - 1
+
+        return False
+
+
+class ChunkStore:
+    """
+    The chunk store of a dataset at a destination.
+
+    settings: the Settings
+    protocol: the Transport for the destination
+    location: the DestinationDataLocation
+    key: the key of the dataset, if the destination is encrypted
+    """
+    def __init__(self, settings, protocol, location, key=None):
+        self.settings       = settings
+        self.protocol       = protocol
+        self.location       = location
+        self.key            = key
+        self.encryptionInfo = location.encryption_info
+        self.madeDirs       = set() # relative paths of the directories known to exist
+
+        stateName         = hashlib.sha256(str(location).encode('utf8')).hexdigest()[:32]
+        self.index        = ChunkIndex(os.path.join(settings.chunks_dir, stateName + '.idx'))
+        self.manifestFile = os.path.join(settings.chunks_dir, stateName + '.json') # the last one pushed
+
+
+    def push(self, localDir, timeout=None):
+        """
+        Store a new snapshot of a local directory hierarchy. Only files that
+        have changed since the last snapshot are read, and only chunks that
+        the destination does not have yet are uploaded.
+
+        localDir: the local directory
+        timeout: if given, give up after this many seconds
+        return: TreeStats of the files that changed and the bytes uploaded, or None if failed
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ret      = paradux.transport.TreeStats()
+
+        os.makedirs(self.settings.chunks_dir, mode=0o700, exist_ok=True)
+
+        previous = {}
+        if os.path.isfile(self.manifestFile):
+            previous = paradux.utils.readJsonFromFile(self.manifestFile)['files']
+
+        if not self.index.exists():
+            self._rebuildIndex(deadline, timeout)
+
+        # Unchanged files keep their chunks; the others are chunked in parallel
+        files   = {}
+        changed = []
+        for rel, localFile, st in filesIn(localDir):
+            entry = previous.get(rel)
+            if entry is not None and entry['size'] == st.st_size and entry['mtime-ns'] == st.st_mtime_ns:
+                files[rel] = entry
+            else:
+                files[rel] = { 'size' : st.st_size, 'mtime-ns' : st.st_mtime_ns }
+                changed.append(( rel, localFile ))
+
+        try:
+            executor = paradux.processpool.defaultExecutor()
+            tasks    = ( ( localFile, ) for rel, localFile in changed )
+            for ( rel, localFile ), ( lengths, fileHash ) in zip(changed, paradux.processpool.mapInOrder(chunkLengthsOfFile, tasks, executor)):
+                names = self._storeFile(localFile, lengths, deadline, timeout, ret)
+                if names is None:
+                    return None
+
+                files[rel]['sha256'] = fileHash
+                files[rel]['chunks'] = names
+                ret.files += 1
+
+        finally:
+            # Also keep what got uploaded before a failure
+            self.index.save()
+
+        manifest = {
+            'version' : MANIFEST_VERSION,
+            'created' : paradux.utils.time2string(time.time()),
+            'files'   : files
+        }
+        content = json.dumps(manifest, indent=4, sort_keys=True).encode('utf8')
+        if not self._uploadManifest(content, 'snapshots/' + manifest['created'] + '.json', deadline, timeout):
+            return None
+        if not self._uploadManifest(content, 'latest.json', deadline, timeout):
+            return None
+
+        paradux.utils.writeJsonToFile(self.manifestFile, manifest, 0o600)
+        ret.snapshot = manifest['created']
+        paradux.logging.info('Stored snapshot', manifest['created'], 'at', self.location, ':', ret.files, 'files changed,', ret.bytes, 'bytes uploaded,', len(self.index), 'chunks')
+        return ret
+
+
+    def snapshotAsOf(self, asOf=None, timeout=None):
+        """
+        Determine the snapshot that was the latest one at a point in time.
+
+        asOf: UNIX time, or None for the latest snapshot
+        timeout: if given, give up after this many seconds
+        return: path of its manifest relative to the destination, or None if there is none or
+             the data transfer protocol cannot list the snapshots
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        if asOf is None:
+            return 'latest.json'
+
+        if not self.protocol.has(paradux.transport.LIST):
+            return None
+
+        names = self.protocol.list(self.location.childLocation('snapshots'), timeout)
+        if names is None:
+            return None
+
+        last  = paradux.utils.time2string(asOf) + '.json'
+        names = [ name for name in names if _SNAPSHOT_REGEX.match(name) and name <= last ]
+        return 'snapshots/' + max(names) if names else None
+
+
+    def readManifest(self, relPath, timeout=None):
+        """
+        Download and decode a manifest.
+
+        relPath: path of the manifest relative to the destination
+        timeout: if given, give up after this many seconds
+        return: the manifest as JSON, or None if it could not be downloaded
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        throws: ValueError if the manifest is corrupted or encrypted with another key
+        """
+        data = self._download(relPath, timeout)
+        if data is None:
+            return None
+        return json.loads(self._decode(data).decode('utf8'))
+
+
+    def readChunk(self, nameHex, timeout=None):
+        """
+        Download and decode a chunk, and check that its content matches its name.
+
+        nameHex: the name of the chunk as hex
+        timeout: if given, give up after this many seconds
+        return: the content of the chunk, or None if it could not be downloaded
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        throws: ValueError if the chunk is corrupted or encrypted with another key
+        """
+        data = self._download('chunks/' + nameHex[0:2] + '/' + nameHex, timeout)
+        if data is None:
+            return None
+
+        data = self._decode(data)
+        if self._nameOf(data).hex() != nameHex:
+            raise ValueError('Chunk is corrupted: ' + nameHex)
+        return data
+
+
+    def hasChunk(self, nameHex, timeout=None):
+        """
+        Ask the destination whether it has a chunk.
+
+        nameHex: the name of the chunk as hex
+        timeout: if given, give up after this many seconds
+        return: True or False, or None if the data transfer protocol cannot tell
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        if not self.protocol.has(paradux.transport.STAT):
+            return None
+        return self.protocol.stat(self.location.childLocation('chunks/' + nameHex[0:2] + '/' + nameHex), timeout=timeout) is not None
+
+
+    def close(self):
+        """
+        Release the local index.
+
+        return: void
+        """
+        self.index.close()
+
+
+    def _storeFile(self, localFile, lengths, deadline, timeout, stats):
+        """
+        Upload the chunks of a file that the destination does not have yet,
+        UPLOAD_WORKERS at the same time. At most twice that many chunks are
+        held in memory.
+
+        localFile: name of the local file
+        lengths: the lengths of its chunks
+        deadline: time.monotonic() by which the push must have completed, or None
+        timeout: the timeout of the whole push, for reporting
+        stats: the TreeStats, whose bytes are updated
+        return: list of the names of the chunks as hex, or None if failed
+        """
+        names   = []
+        uploads = {} # name -> tuple of (Future, number of bytes uploaded)
+        try:
+            workers = threading.BoundedSemaphore(2 * UPLOAD_WORKERS)
+            with open(localFile, 'rb') as fd, concurrent.futures.ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+                for length in lengths:
+                    chunk = fd.read(length)
+                    if len(chunk) != length:
+                        paradux.logging.error('File changed while it was being stored:', localFile)
+                        return None
+
+                    name = self._nameOf(chunk)
+                    if name not in self.index and name not in uploads:
+                        data    = self._encode(chunk)
+                        nameHex = name.hex()
+
+                        workers.acquire()
+                        if any( future.done() and ( future.exception() is not None or not future.result() ) for future, size in uploads.values() ):
+                            workers.release()
+                            break
+
+                        future = executor.submit(self._upload, data, 'chunks/' + nameHex[0:2], nameHex, deadline, timeout)
+                        future.add_done_callback(lambda f: workers.release())
+                        uploads[name] = ( future, len(data) )
+
+                    names.append(name.hex())
+
+            # Raises the first exception of an upload, if any
+            success = all([ future.result() for future, size in uploads.values() ])
+            return names if success and len(names) == len(lengths) else None
+
+        finally:
+            # Also keep what got uploaded before a failure
+            for name, ( future, size ) in uploads.items():
+                if future.done() and future.exception() is None and future.result():
+                    self.index.add(name)
+                    stats.bytes += size
+
+
+    def _uploadManifest(self, content, relPath, deadline, timeout):
+        """
+        Upload a manifest.
+
+        content: the manifest as bytes
+        relPath: path of the manifest relative to the destination
+        deadline: time.monotonic() by which the push must have completed, or None
+        timeout: the timeout of the whole push, for reporting
+        return: True if successful
+        """
+        relDir, fileName = relPath.rpartition('/')[0::2]
+        return self._upload(self._encode(content), relDir, fileName, deadline, timeout)
+
+
+    def _upload(self, data, relDir, fileName, deadline, timeout):
+        """
+        Upload bytes to a file at the destination, creating its directory
+        if needed. This may run in several threads at the same time; creating
+        a directory twice does no harm.
+
+        data: the bytes
+        relDir: path of the directory relative to the destination, or '' for the destination itself
+        fileName: name of the file in the directory
+        deadline: time.monotonic() by which the push must have completed, or None
+        timeout: the timeout of the whole push, for reporting
+        return: True if successful
+        """
+        if relDir not in self.madeDirs:
+            dirLocation = self.location.childLocation(relDir) if relDir else self.location
+            if not self.protocol.makeDirectories(dirLocation, paradux.utils.remainingTime(deadline, timeout)):
+                return False
+            self.madeDirs.add(relDir)
+
+        fileLocation = self.location.childLocation(relDir + '/' + fileName if relDir else fileName)
+
+        if self.protocol.has(paradux.transport.STREAMING):
+            return self.protocol.uploadStream(io.BytesIO(data), fileLocation, timeout=paradux.utils.remainingTime(deadline, timeout)) is True
+
+        os.makedirs(self.settings.staging_dir, mode=0o700, exist_ok=True)
+        with NamedTemporaryFile(dir=self.settings.staging_dir, prefix='.chunk-') as tmp:
+            tmp.write(data)
+            tmp.flush()
+            return self.protocol.upload(tmp.name, fileLocation, timeout=paradux.utils.remainingTime(deadline, timeout)) is True
+
+
+    def _nameOf(self, chunk):
+        """
+        Determine the name of a chunk.
+
+        chunk: the content of the chunk
+        return: the name, as bytes
+        """
+        if self.encryptionInfo is not None:
+            return hmac.new(self.key, chunk, hashlib.sha256).digest()
+        return hashlib.sha256(chunk).digest()
+
+
+    def _encode(self, data):
+        """
+        Encrypt what is uploaded, if the destination is encrypted.
+
+        data: the plaintext
+        return: what to upload
+        """
+        if self.encryptionInfo is None:
+            return data
+
+        return b''.join(paradux.encryption.encryptChunks(io.BytesIO(data), self.key, self.encryptionInfo))
+
+
+    def _decode(self, data):
+        """
+        Decrypt what was downloaded, if the destination is encrypted.
+
+        data: what was downloaded
+        return: the plaintext
+        throws: ValueError if corrupted or encrypted with another key
+        """
+        if self.encryptionInfo is None:
+            return data
+
+        return b''.join(paradux.encryption.decryptChunks(io.BytesIO(data), self.key))
+
+
+    def _download(self, relPath, timeout):
+        """
+        Download a file at the destination into memory.
+
+        relPath: path of the file relative to the destination
+        timeout: if given, give up after this many seconds
+        return: the bytes, or None if failed
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        os.makedirs(self.settings.staging_dir, mode=0o700, exist_ok=True)
+        with NamedTemporaryFile(dir=self.settings.staging_dir, prefix='.chunk-') as tmp:
+            if self.protocol.download(self.location.childLocation(relPath), tmp.name, timeout=timeout) is not True:
+                return None
+            with open(tmp.name, 'rb') as fd:
+                return fd.read()
+
+
+    def _rebuildIndex(self, deadline, timeout):
+        """
+        Recreate a lost local index from the chunks at the destination, if
+        its data transfer protocol can list them. Otherwise chunks the
+        destination already has are uploaded again.
+
+        deadline: time.monotonic() by which the push must have completed, or None
+        timeout: the timeout of the whole push, for reporting
+        return: void
+        """
+        if not self.protocol.has(paradux.transport.LIST):
+            return
+
+        paradux.logging.info('Rebuilding chunk index of', self.location)
+        for i in range(256):
+            relDir = 'chunks/{0:02x}'.format(i)
+            names  = self.protocol.list(self.location.childLocation(relDir), paradux.utils.remainingTime(deadline, timeout))
+            if names is None:
+                continue
+
+            self.madeDirs.add(relDir)
+            for name in names:
+                if _NAME_REGEX.match(name):
+                    self.index.add(bytes.fromhex(name))
+
+        self.index.save()
+
+
+def filesIn(localDir):
+    """
+    Find the regular files in a local directory hierarchy.
+
+    localDir: the local directory
+    return: generator of tuples (path relative to localDir with / as separator, name of the file, os.stat_result)
+    """
+    for dirPath, dirNames, fileNames in os.walk(localDir):
+        dirNames.sort()
+        relDir = os.path.relpath(dirPath, localDir)
+        relDir = '' if relDir == '.' else relDir.replace(os.sep, '/') + '/'
+
+        for fileName in sorted(fileNames):
+            localFile = os.path.join(dirPath, fileName)
+            if os.path.islink(localFile) or not os.path.isfile(localFile):
+                continue
+            yield ( relDir + fileName, localFile, os.stat(localFile) )
@@ -19,7 +19,10 @@ def run(args, settings) :
     try :
         settings.mountImage()
 
-        conf = settings.getDatasetsConfiguration()
+        if args.fragment:
+            conf = settings.getDatasetsFragmentConfiguration(args.fragment)
+        else:
+            conf = settings.getDatasetsConfiguration()
         if args.clean:
             conf.abortTempConfiguration()
 
@@ -50,4 +53,5 @@ def addSubParser(parentParser, cmdName) :
     cmdName: name of this command
     """
     parser = parentParser.add_parser( cmdName, help='Edit the datasets in a paradux configuration.' )
-    parser.add_argument('--clean', action='store_const', const=True, help='Abandon previous edits and start from current configuration')
+    parser.add_argument('--clean',    action='store_const', const=True, help='Abandon previous edits and start from current configuration')
+    parser.add_argument('--fragment', action='store', help='Only edit the datasets in this fragment in datasets.d (created if needed)')
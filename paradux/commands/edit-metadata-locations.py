@@ -19,7 +19,10 @@ def run(args, settings) :
     try :
         settings.mountImage()
 
-        conf = settings.getMetadataLocationsConfiguration()
+        if args.fragment:
+            conf = settings.getMetadataLocationsFragmentConfiguration(args.fragment)
+        else:
+            conf = settings.getMetadataLocationsConfiguration()
         if args.clean:
             conf.abortTempConfiguration()
 
@@ -50,4 +53,5 @@ def addSubParser(parentParser, cmdName) :
     cmdName: name of this command
     """
     parser = parentParser.add_parser( cmdName, help='Edit the metadata locations in a paradux configuration.' )
-    parser.add_argument('--clean', action='store_const', const=True, help='Abandon previous edits and start from current configuration')
+    parser.add_argument('--clean',    action='store_const', const=True, help='Abandon previous edits and start from current configuration')
+    parser.add_argument('--fragment', action='store', help='Only edit the metadata locations in this fragment in metadata.d (created if needed)')
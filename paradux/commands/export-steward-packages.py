@@ -5,8 +5,12 @@
 #
 
 import argparse
+import concurrent.futures
+import json
+import os
 import os.path
 import paradux
+import paradux.logging
 import paradux.utils
 
 
@@ -20,38 +24,31 @@ def run(args, settings) :
     if args.json and os.path.isfile(args.json):
         raise FileExistsError(args.json)
 
+    if args.output_dir and os.path.exists(args.output_dir) and not os.path.isdir(args.output_dir):
+        raise NotADirectoryError(args.output_dir)
+
     try :
         settings.mountImage()
 
-        stewardPackages = settings.getStewardPackages()
-
-        # stdout only right now
-
+        stewardIds = None
         if args.stewardid:
-            if args.stewardid in stewardPackages:
-                toExport = dict()
-                toExport[args.stewardid] = stewardPackages[args.stewardid]
+            if args.stewardid in settings.getStewardsConfiguration().getStewards():
+                stewardIds = [ args.stewardid ]
             else:
                 paradux.logging.fatal( 'Cannot find steward with id:', args.stewardid )
 
-        else:
-            toExport = stewardPackages
-
-        if args.json:
-            j = []
-            for stewardId, stewardPackage in toExport.items():
-                j.append(stewardPackage.asJson())
+        stewardPackages = settings.iterStewardPackages(stewardIds)
 
-            paradux.utils.writeJsonToFile(args.json, j, 0o600 )
+        if args.output_dir:
+            count = _exportToDirectory(args.output_dir, stewardPackages)
 
-        elif len(toExport) > 0:
-            print( "\n=== CUT HERE ===\n\n".join(
-                    map(lambda t : "--- Steward Package start ---\n\n"
-                                   + t.asText()
-                                   + "\n--- Steward Package end ---\n",
-                        toExport.values() )))
+        elif args.json:
+            count = _exportToJsonFile(args.json, stewardPackages)
 
         else:
+            count = _exportToStdout(stewardPackages)
+
+        if count == 0 and not args.json:
             print( "No stewards have been defined. Not exporting any steward packages." )
 
     finally:
@@ -60,6 +57,102 @@ def run(args, settings) :
     return 0
 
 
+def _exportToDirectory(directory, stewardPackages):
+    """
+    Write one text and one JSON file per steward into the directory. The
+    StewardPackages are rendered concurrently, and each file is written as
+    soon as its content is ready.
+
+    directory: the directory to write to; created if needed
+    stewardPackages: iterable of (stewardId, StewardPackage)
+    return: number of exported StewardPackages
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+
+    count = 0
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = []
+        for stewardId, stewardPackage in stewardPackages:
+            futures.append(executor.submit(_writeStewardPackageFiles, directory, stewardId, stewardPackage))
+
+        for future in concurrent.futures.as_completed(futures):
+            paradux.logging.info('Exported steward package:', future.result())
+            count += 1
+
+    return count
+
+
+def _writeStewardPackageFiles(directory, stewardId, stewardPackage):
+    """
+    Write the text and the JSON file for a single StewardPackage.
+
+    directory: the directory to write to
+    stewardId: id of the steward, used as the base of the file names
+    stewardPackage: the StewardPackage
+    return: the steward id
+    """
+    if '/' in stewardId or stewardId.startswith('.'):
+        raise ValueError('Steward id cannot be used as file name: ' + stewardId)
+
+    txtFile  = os.path.join(directory, stewardId + '.txt')
+    jsonFile = os.path.join(directory, stewardId + '.json')
+    for f in ( txtFile, jsonFile ):
+        if os.path.exists(f):
+            raise FileExistsError(f)
+
+    paradux.utils.saveFile(txtFile, stewardPackage.asText(), 0o600)
+    paradux.utils.writeJsonToFile(jsonFile, [ stewardPackage.asJson() ], 0o600)
+
+    return stewardId
+
+
+def _exportToJsonFile(fileName, stewardPackages):
+    """
+    Write all StewardPackages as a single JSON array into a file, appending
+    each StewardPackage as soon as it has been created.
+
+    fileName: name of the file to write
+    stewardPackages: iterable of (stewardId, StewardPackage)
+    return: number of exported StewardPackages
+    """
+    count = 0
+    with open(fileName, 'w') as fd:
+        os.chmod(fileName, 0o600)
+
+        fd.write('[')
+        for stewardId, stewardPackage in stewardPackages:
+            if count > 0:
+                fd.write(',')
+            fd.write('\n')
+            fd.write(json.dumps(stewardPackage.asJson(), indent=4, sort_keys=True))
+            count += 1
+        fd.write('\n]\n')
+
+    return count
+
+
+def _exportToStdout(stewardPackages):
+    """
+    Print all StewardPackages as text to the terminal, each as soon as
+    it has been rendered.
+
+    stewardPackages: iterable of (stewardId, StewardPackage)
+    return: number of exported StewardPackages
+    """
+    count = 0
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        for text in executor.map(lambda t : t[1].asText(), stewardPackages):
+            if count > 0:
+                print( "\n=== CUT HERE ===\n" )
+            print( "--- Steward Package start ---\n\n"
+                   + text
+                   + "\n--- Steward Package end ---", flush=True )
+            count += 1
+
+    return count
+
+
 def addSubParser(parentParser, cmdName) :
     """
     Enable this command to add its own command-line options
@@ -67,7 +160,9 @@ def addSubParser(parentParser, cmdName) :
     cmdName: name of this command
     """
     parser = parentParser.add_parser( cmdName, help='Export the steward packages.' )
-    parser.add_argument( '--json',      action='store', help='Export to a JSON file instead of plain text to the terminal.' )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument( '--json',       action='store', help='Export to a JSON file instead of plain text to the terminal.' )
+    group.add_argument( '--output-dir', action='store', help='Export to one text and one JSON file per steward in this directory.' )
     parser.add_argument( '--stewardid', action='store', help='ID of the steward.' )
     # FUTURE: parser.add_argument( '--paper',     action='store_const', const=True, help='Print to paper instead of USB sticks.' )
     # FUTURE: parser.add_argument( '--usbsticks', action='store_const', const=True, help='Save to USB sticks instead of printing to paper.' )
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os.path
+import paradux
+import paradux.catalog
+import paradux.logging
+import paradux.utils
+
+def run(args, settings) :
+    """
+    Run this command.
+
+    args: parsed command-line arguments
+    settings: settings for this paradux instance
+    """
+    if not os.path.isfile(settings.catalog_file):
+        paradux.logging.fatal( "Nothing has been backed up yet. To back up, run 'paradux sync-datasets'." )
+
+    catalog = paradux.catalog.Catalog(settings.catalog_file)
+    try:
+        if args.history:
+            entries = catalog.history(args.path, args.dataset, args.limit)
+        else:
+            entries = catalog.find(args.path, args.as_of, args.dataset, args.limit)
+
+    finally:
+        catalog.close()
+
+    for entry in entries:
+        text = entry.asText()
+        if args.history:
+            text += '\n    held from {0:s} until {1:s}'.format(
+                    paradux.utils.time2string(entry.since),
+                    'now' if entry.until is None else paradux.utils.time2string(entry.until))
+        print( text )
+
+    if not entries:
+        print( 'No backups found.' )
+        return 1
+
+    if args.limit is not None and len(entries) == args.limit:
+        print( 'Showing the first ' + str(args.limit) + ' entries only.' )
+
+    return 0
+
+
+def addSubParser(parentParser, cmdName) :
+    """
+    Enable this command to add its own command-line options
+    parentParser: the parent argparse parser
+    cmdName: name of this command
+    """
+
+    parser = parentParser.add_parser( cmdName, help='Find which destinations hold backups of files, without contacting them.' )
+    parser.add_argument( 'path',      nargs='?', default='',                               help='Path of the file relative to the root of its dataset, or a prefix of such paths.' )
+    parser.add_argument( '--dataset',                                                      help='Only find files of the dataset with this name.' )
+    parser.add_argument( '--as-of',   type=paradux.utils.pointInTimeArgument,              help='Find what was held at this time, such as 2019-10-22, "2019-10-22 14:30" or 7d for a week ago. Default: now.' )
+    parser.add_argument( '--history', action='store_true',                                 help='Find all versions ever held, and when.' )
+    parser.add_argument( '--limit',   type=paradux.utils.positiveIntArgument, default=100, help='Show at most this many entries.' )
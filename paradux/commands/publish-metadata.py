@@ -8,7 +8,12 @@ import argparse
 import os
 import os.path
 import paradux
+import paradux.compression
+import paradux.health
 import paradux.logging
+import paradux.utils
+from paradux.publisher import Publisher, PublishRecord
+from paradux.verifier import Verifier
 import tempfile
 
 def run(args, settings) :
@@ -18,6 +23,7 @@ def run(args, settings) :
     args: parsed command-line arguments
     settings: settings for this paradux instance
     """
+    ret    = 0
     tmpDir = None
     try :
         settings.mountImage()
@@ -26,16 +32,53 @@ def run(args, settings) :
         if len(metadataLocations) == 0:
             paradux.logging.fatal( "No metadata locations have been defined. To configure, run 'paradux edit-metadata-locations'." )
 
+        if args.quorum is not None and args.quorum > len(metadataLocations):
+            paradux.logging.fatal( 'Quorum cannot be larger than the number of metadata locations:', args.quorum, '>', len(metadataLocations))
+
+        if args.stream:
+            for metadataLocation in metadataLocations:
+                if not settings.canUploadStream(metadataLocation):
+                    paradux.logging.fatal( 'Cannot stream to this metadata location, publish without --stream:', metadataLocation )
+
+        source = settings.metadataIdentity() # needs the image, which is unmounted next
+
         settings.cleanup()
 
-        # Export into a private temp directory
-        tmpDir  = tempfile.mkdtemp(prefix='paradux-')
-        tmpFile = tmpDir + '/paradux.img'
-        settings.exportMetadataToFile(tmpFile)
+        signalQuorum = None
+        if args.quorum is not None:
+            # The command returns once the quorum has been reached; the remaining
+            # uploads, and the final report, continue in the background
+            signalQuorum = paradux.utils.continueInBackground()
+
+        def onQuorum(results):
+            if signalQuorum is not None:
+                print( 'Quorum reached: published to ' + str(args.quorum) + ' locations. The remaining uploads continue in the background.', flush=True )
+                signalQuorum()
+            else:
+                print( 'Quorum reached: published to ' + str(args.quorum) + ' locations. Waiting for the remaining uploads to finish.', flush=True )
+
+        publishRecord = PublishRecord(settings.published_file)
+        retryPolicy   = paradux.health.RetryPolicy(maxDelay=args.max_backoff)
+        publisher     = Publisher(settings, args.workers, args.timeout, args.retries, publishRecord, args.force, args.compression, retryPolicy, not args.include_unhealthy)
+
+        if args.stream:
+            results = publisher.publishStream(settings.exportMetadataStream, metadataLocations, args.quorum, onQuorum, source)
+
+        else:
+            # Export into a private temp directory
+            tmpDir  = tempfile.mkdtemp(prefix='paradux-')
+            tmpFile = tmpDir + '/paradux.img'
+            settings.exportMetadataToFile(tmpFile)
+
+            results = publisher.publish(tmpFile, metadataLocations, args.quorum, onQuorum, source)
+
+        if signalQuorum is not None:
+            print( 'Final report:' )
 
         uploadCount = 0
-        for metadataLocation in metadataLocations:
-            if settings.uploadToDataLocation(tmpFile, metadataLocation):
+        for result in results:
+            print( result.asText() )
+            if result.success:
                 uploadCount += 1
 
         if uploadCount == 0:
@@ -43,6 +86,24 @@ def run(args, settings) :
         else:
             print( 'Published to ' + str(uploadCount) + ' locations.' )
 
+        if args.quorum is not None and uploadCount < args.quorum:
+            paradux.logging.error( 'Quorum not reached:', uploadCount, '<', args.quorum )
+            ret = 1
+
+        if args.verify:
+            verifier      = Verifier(settings, publishRecord, args.workers, args.timeout)
+            verifyResults = verifier.verify([ result.location for result in results if result.success ])
+
+            verifiedCount = 0
+            for verifyResult in verifyResults:
+                print( verifyResult.asText() )
+                if verifyResult.isOk():
+                    verifiedCount += 1
+
+            print( 'Verified ' + str(verifiedCount) + ' of ' + str(len(verifyResults)) + ' locations.' )
+            if verifiedCount < len(verifyResults):
+                ret = 1
+
     finally:
         settings.cleanup() # This probably will noop because we did it before, but might not in case of an error
 
@@ -51,7 +112,7 @@ def run(args, settings) :
                 os.remove( tmpDir + '/' + f )
             os.rmdir(tmpDir)
 
-    return 0
+    return ret
 
 
 def addSubParser(parentParser, cmdName) :
@@ -60,4 +121,31 @@ def addSubParser(parentParser, cmdName) :
     parentParser: the parent argparse parser
     cmdName: name of this command
     """
+
+    def compression_level(value):
+        """
+        Check and convert a string representing a compression level.
+
+        value: the string
+        return: the integer
+        throws argparse.ArgumentTypeException: if not a valid compression level
+        """
+        try:
+            ret = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError('Not an integer: ' + value)
+        if ret < 0 or ret > paradux.compression.MAX_LEVEL:
+            raise argparse.ArgumentTypeError('Must be between 0 and ' + str(paradux.compression.MAX_LEVEL))
+        return ret
+
     parser = parentParser.add_parser( cmdName, help='Publish the paradux metadata to the defined metadata locations.' )
+    parser.add_argument( '--workers', type=paradux.utils.positiveIntArgument, default=4, help='Maximum number of uploads to run at the same time.' )
+    parser.add_argument( '--timeout', type=float,                                        help='Give up on an upload attempt after this many seconds, unless the location specifies otherwise.' )
+    parser.add_argument( '--retries', type=int,          default=0,                      help='Retry a failed upload this many times, unless the location specifies otherwise.' )
+    parser.add_argument( '--quorum',  type=paradux.utils.positiveIntArgument,            help='Return success as soon as this many locations have confirmed; the remaining uploads continue in the background, and report when done.' )
+    parser.add_argument( '--force',   action='store_const', const=True,                  help='Upload even to locations that already hold the current metadata.' )
+    parser.add_argument( '--verify',  action='store_const', const=True,                  help='After publishing, check that each location holds exactly what was published.' )
+    parser.add_argument( '--stream',  action='store_const', const=True,                  help='Read the metadata once and stream it to up to --workers locations at the same time, without a temporary copy.' )
+    parser.add_argument( '--compression', type=compression_level, default=1,             help='Compress the uploaded metadata at this level, from 0 (none) to 9 (smallest), unless the location specifies otherwise.' )
+    parser.add_argument( '--max-backoff', type=float, default=60.0,                      help='Wait at most this many seconds before retrying a failed upload; the wait grows exponentially with each attempt.' )
+    parser.add_argument( '--include-unhealthy', action='store_const', const=True,        help='Also upload to locations that have failed persistently in recent runs, rather than skipping them.' )
@@ -5,8 +5,10 @@
 #
 
 import argparse
+import os
 import os.path
 import paradux
+import paradux.compression
 import paradux.data.stewardshare
 from paradux.shamir import ShamirSecretSharing
 import paradux.utils
@@ -23,6 +25,9 @@ def run(args, settings) :
         # Cannot recover from non-existing JSON recovery file
         raise FileNotFoundError(args.json)
 
+    if args.image is not None and not os.path.isfile(args.image):
+        raise FileNotFoundError(args.image)
+
     recoveryJ = paradux.utils.readJsonFromFile(args.json)
 
     mersenne     = None
@@ -50,6 +55,21 @@ def run(args, settings) :
     shamir = ShamirSecretSharing(mersenne)
     recoverySecret = shamir.restore(shamirShares)
 
+    if args.image is not None:
+        if os.path.exists(settings.image_file):
+            paradux.logging.fatal('Image exists already, not overwriting:', settings.image_file)
+
+        # Published images may have been compressed. Write next to the image, so
+        # an interrupted recovery does not leave a partial image behind.
+        tmpFile = settings.image_file + '.tmp'
+        try:
+            paradux.compression.decompressFile(args.image, tmpFile)
+            os.replace(tmpFile, settings.image_file)
+
+        finally:
+            if os.path.exists(tmpFile):
+                os.remove(tmpFile)
+
     try:
         settings.recoverSetEverydayPassphrase(recoverySecret)
 
@@ -66,4 +86,5 @@ def addSubParser( parentParser, cmdName ) :
     cmdName: name of this command
     """
     parser = parentParser.add_parser( cmdName, help='Recover the paradux configuration from steward packages.' )
-    parser.add_argument( '--json', action='store', required=True, help='Recovery data is in this JSON file' )
+    parser.add_argument( '--json',  action='store', required=True, help='Recovery data is in this JSON file' )
+    parser.add_argument( '--image', action='store',                help='Recover the paradux metadata from this published image file, which may be compressed' )
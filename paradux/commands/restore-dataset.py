@@ -0,0 +1,84 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os.path
+import paradux
+import paradux.catalog
+import paradux.logging
+import paradux.utils
+from paradux.restorer import Restorer
+
+def run(args, settings) :
+    """
+    Run this command.
+
+    args: parsed command-line arguments
+    settings: settings for this paradux instance
+    """
+    if not args.to and not args.probe_only:
+        paradux.logging.fatal( 'Specify the directory to restore into with --to.' )
+
+    catalog = None
+    try :
+        settings.mountImage()
+
+        conf    = settings.getDatasetsConfiguration()
+        dataset = conf.getDataset(args.name)
+        if dataset is None:
+            paradux.logging.fatal( 'Cannot find dataset with name:', args.name )
+
+        locations = dataset.destinations
+        if args.from_url:
+            locations = [ location for location in dataset.destinations if str(location) in args.from_url ]
+            if len(locations) < len(args.from_url):
+                paradux.logging.fatal( 'Not a destination of dataset', args.name, ':', ', '.join(args.from_url) )
+        if not locations:
+            paradux.logging.fatal( 'Dataset has no destinations:', args.name )
+
+        datasetKeys = {}
+        if any( location.encryption_info is not None for location in locations ):
+            key = settings.getSecretsConfiguration().getDatasetKey(dataset.name)
+            if key is not None:
+                datasetKeys[dataset.name] = key
+
+        settings.cleanup()
+
+        if os.path.isfile(settings.catalog_file):
+            catalog = paradux.catalog.Catalog(settings.catalog_file)
+
+        restorer = Restorer(settings, args.workers, args.timeout, datasetKeys=datasetKeys, catalog=catalog)
+        if args.probe_only:
+            probes = restorer.probe(dataset, args.as_of, locations)
+            for probe in probes:
+                print( probe.asText() )
+            return 0 if probes and probes[0].usable else 1
+
+        result = restorer.restore(dataset, args.to, args.as_of, locations, args.replace)
+        print( result.asText() )
+        return 0 if result.success else 1
+
+    finally:
+        if catalog is not None:
+            catalog.close()
+        settings.cleanup() # This probably will noop because we did it before, but might not in case of an error
+
+
+def addSubParser(parentParser, cmdName) :
+    """
+    Enable this command to add its own command-line options
+    parentParser: the parent argparse parser
+    cmdName: name of this command
+    """
+
+    parser = parentParser.add_parser( cmdName, help='Restore a dataset from the fastest complete destinations into a local directory.' )
+    parser.add_argument( '--name',       required=True,                                     help='Name of the dataset to restore.' )
+    parser.add_argument( '--to',                                                            help='The local directory to restore into. It must not exist or be empty, unless --replace is given.' )
+    parser.add_argument( '--as-of',      type=paradux.utils.pointInTimeArgument,            help='Restore the dataset as it was at this time, such as 2019-10-22, "2019-10-22 14:30" or 7d for a week ago. Default: latest.' )
+    parser.add_argument( '--from',       dest='from_url', action='append',                  help='Only restore from the destination with this URL. May be repeated.' )
+    parser.add_argument( '--workers',    type=paradux.utils.positiveIntArgument, default=8, help='Maximum number of files, and of chunks, to download at the same time.' )
+    parser.add_argument( '--timeout',    type=float,                                        help='Give up on restoring after this many seconds.' )
+    parser.add_argument( '--replace',    action='store_true',                               help='Replace the content of the local directory once the dataset has been restored.' )
+    parser.add_argument( '--probe-only', action='store_true',                               help='Only show how quickly each destination responds and whether it is complete.' )
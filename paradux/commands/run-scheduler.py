@@ -0,0 +1,84 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import paradux
+import paradux.logging
+import paradux.utils
+import signal
+import threading
+from paradux.scheduler import Scheduler
+from paradux.syncer import Syncer, obtainDatasetKeys
+
+def run(args, settings) :
+    """
+    Run this command.
+
+    args: parsed command-line arguments
+    settings: settings for this paradux instance
+    """
+    ret = 0
+    try :
+        settings.mountImage()
+
+        conf     = settings.getDatasetsConfiguration()
+        datasets = conf.getDatasets()
+        if len(datasets) == 0:
+            paradux.logging.fatal( "No datasets have been defined. To configure, run 'paradux edit-datasets'." )
+
+        datasetKeys = obtainDatasetKeys(settings, datasets) # needs the image, which is unmounted next
+
+        settings.cleanup()
+
+        syncer    = Syncer(settings, args.workers, args.push_workers, args.timeout, datasetKeys=datasetKeys, skipUnhealthy=not args.include_unhealthy)
+        scheduler = Scheduler(settings, syncer, settings.schedule_file)
+
+        count = scheduler.load(datasets)
+        if count == 0:
+            paradux.logging.fatal( 'None of the destinations of the datasets have a frequency.' )
+
+        if args.once:
+            results = scheduler.runDue()
+            for result in results:
+                print( result.asText() )
+                if not result.success:
+                    ret = 1
+
+            try:
+                scheduler.save()
+            except OSError as e:
+                paradux.logging.warning('Cannot save schedule:', e)
+
+        else:
+            stopEvent = threading.Event()
+
+            def stop(signum, frame):
+                paradux.logging.info('Stopping after the backups in progress.')
+                stopEvent.set()
+
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGINT,  stop)
+
+            scheduler.run(stopEvent)
+
+    finally:
+        settings.cleanup() # This probably will noop because we did it before, but might not in case of an error
+
+    return ret
+
+
+def addSubParser(parentParser, cmdName) :
+    """
+    Enable this command to add its own command-line options
+    parentParser: the parent argparse parser
+    cmdName: name of this command
+    """
+
+    parser = parentParser.add_parser( cmdName, help='Back up the datasets to their destinations whenever they are due, according to the frequency of each destination.' )
+    parser.add_argument( '--once',         action='store_true',                               help='Only run the backups that are due now, then exit; e.g. when invoked by a timer.' )
+    parser.add_argument( '--workers',      type=paradux.utils.positiveIntArgument, default=2, help='Maximum number of datasets to sync at the same time.' )
+    parser.add_argument( '--push-workers', type=paradux.utils.positiveIntArgument, default=4, help='Maximum number of destinations of a dataset to push to at the same time.' )
+    parser.add_argument( '--timeout',      type=float,                                        help='Give up on pulling or pushing a dataset after this many seconds.' )
+    parser.add_argument( '--include-unhealthy', action='store_const', const=True,               help='Also push to destinations that have failed persistently in recent runs, rather than skipping them.' )
@@ -0,0 +1,37 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import argparse
+import paradux
+
+
+def run(args, settings) :
+    """
+    Run this command.
+
+    args: parsed command-line arguments
+    settings: settings for this paradux instance
+    """
+    try :
+        settings.mountImage()
+
+        conf = settings.getCredentialsConfiguration()
+
+        print( conf.asText() )
+
+    finally:
+        settings.cleanup()
+
+    return 0
+
+
+def addSubParser(parentParser, cmdName) :
+    """
+    Enable this command to add its own command-line options
+    parentParser: the parent argparse parser
+    cmdName: name of this command
+    """
+    parser = parentParser.add_parser( cmdName, help='Print the shared credentials of this paradux configuration, without their secrets.' )
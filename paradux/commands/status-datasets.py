@@ -6,6 +6,8 @@
 
 import argparse
 import paradux
+import paradux.configuration.datasets
+import paradux.logging
 
 
 def run(args, settings) :
@@ -20,7 +22,15 @@ def run(args, settings) :
 
         conf = settings.getDatasetsConfiguration()
 
-        print( conf.asText() )
+        if args.name:
+            dataset = conf.getDataset(args.name)
+            if dataset is None:
+                paradux.logging.fatal( 'Cannot find dataset with name:', args.name )
+
+            print( paradux.configuration.datasets.datasetAsText(dataset) )
+
+        else:
+            print( conf.asText() )
 
     finally:
         settings.cleanup()
@@ -35,3 +45,4 @@ def addSubParser(parentParser, cmdName) :
     cmdName: name of this command
     """
     parser = parentParser.add_parser( cmdName, help='Print the current status of the datasets of this paradux configuration.' )
+    parser.add_argument('--name', action='store', help='Only print the dataset with this name.' )
@@ -22,6 +22,13 @@ def run(args, settings) :
 
         print( conf.asText() )
 
+        metadataLocations = conf.getMetadataLocations()
+        if metadataLocations:
+            healthRecord = settings.getHealthRecord()
+            print( 'Health of uploads:' )
+            for metadataLocation in metadataLocations:
+                print( '* {0:s}: {1:s}'.format(str(metadataLocation), healthRecord.asText(metadataLocation)))
+
     finally:
         settings.cleanup()
 
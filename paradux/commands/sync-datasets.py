@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import paradux
+import paradux.logging
+import paradux.utils
+from paradux.syncer import Syncer, obtainDatasetKeys
+
+def run(args, settings) :
+    """
+    Run this command.
+
+    args: parsed command-line arguments
+    settings: settings for this paradux instance
+    """
+    ret = 0
+    try :
+        settings.mountImage()
+
+        conf = settings.getDatasetsConfiguration()
+        if args.name:
+            datasets = []
+            for name in args.name:
+                dataset = conf.getDataset(name)
+                if dataset is None:
+                    paradux.logging.fatal( 'Cannot find dataset with name:', name )
+                datasets.append(dataset)
+
+        else:
+            datasets = conf.getDatasets()
+            if len(datasets) == 0:
+                paradux.logging.fatal( "No datasets have been defined. To configure, run 'paradux edit-datasets'." )
+
+        datasetKeys = obtainDatasetKeys(settings, datasets) # needs the image, which is unmounted next
+
+        settings.cleanup()
+
+        syncer  = Syncer(settings, args.workers, args.push_workers, args.timeout, datasetKeys=datasetKeys, skipUnhealthy=not args.include_unhealthy)
+        results = syncer.sync(datasets)
+
+        syncedCount = 0
+        for result in results:
+            print( result.asText() )
+            if result.success:
+                syncedCount += 1
+
+        print( 'Synced ' + str(syncedCount) + ' of ' + str(len(results)) + ' datasets.' )
+        if syncedCount < len(results):
+            ret = 1
+
+    finally:
+        settings.cleanup() # This probably will noop because we did it before, but might not in case of an error
+
+    return ret
+
+
+def addSubParser(parentParser, cmdName) :
+    """
+    Enable this command to add its own command-line options
+    parentParser: the parent argparse parser
+    cmdName: name of this command
+    """
+
+    parser = parentParser.add_parser( cmdName, help='Pull the source of each dataset into a local copy, and push it to the destinations of the dataset.' )
+    parser.add_argument( '--name',         action='append',                                   help='Only sync the dataset with this name. May be repeated.' )
+    parser.add_argument( '--workers',      type=paradux.utils.positiveIntArgument, default=2, help='Maximum number of datasets to sync at the same time.' )
+    parser.add_argument( '--push-workers', type=paradux.utils.positiveIntArgument, default=4, help='Maximum number of destinations of a dataset to push to at the same time.' )
+    parser.add_argument( '--timeout',      type=float,                                        help='Give up on pulling or pushing a dataset after this many seconds.' )
+    parser.add_argument( '--include-unhealthy', action='store_const', const=True,               help='Also push to destinations that have failed persistently in recent runs, rather than skipping them.' )
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import paradux
+import paradux.logging
+import paradux.utils
+from paradux.publisher import PublishRecord
+from paradux.verifier import Verifier
+
+def run(args, settings) :
+    """
+    Run this command.
+
+    args: parsed command-line arguments
+    settings: settings for this paradux instance
+    """
+    ret = 0
+    try :
+        settings.mountImage()
+
+        metadataLocations = settings.getMetadataLocationsConfiguration().getMetadataLocations()
+        if len(metadataLocations) == 0:
+            paradux.logging.fatal( "No metadata locations have been defined. To configure, run 'paradux edit-metadata-locations'." )
+
+        settings.cleanup() # the publish record is outside of the image
+
+        verifier = Verifier(settings, PublishRecord(settings.published_file), args.workers, args.timeout)
+        results  = verifier.verify(metadataLocations)
+
+        verifiedCount = 0
+        for result in results:
+            print( result.asText() )
+            if result.isOk():
+                verifiedCount += 1
+
+        print( 'Verified ' + str(verifiedCount) + ' of ' + str(len(results)) + ' locations.' )
+        if verifiedCount < len(results):
+            ret = 1
+
+    finally:
+        settings.cleanup() # This probably will noop because we did it before, but might not in case of an error
+
+    return ret
+
+
+def addSubParser(parentParser, cmdName) :
+    """
+    Enable this command to add its own command-line options
+    parentParser: the parent argparse parser
+    cmdName: name of this command
+    """
+
+    parser = parentParser.add_parser( cmdName, help='Check that each metadata location holds exactly what was last published to it.' )
+    parser.add_argument( '--workers', type=paradux.utils.positiveIntArgument, default=4, help='Maximum number of locations to check at the same time.' )
+    parser.add_argument( '--timeout', type=float,                                        help='Give up on checking a location after this many seconds, unless the location specifies otherwise.' )
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+#
+# Compresses and decompresses exported metadata images as a stream. The
+# images are mostly unused, zero-filled space, so they compress well.
+#
+# A compressed file starts with a small header, so it can be told apart
+# from an uncompressed image, and decompressed transparently:
+#   4 bytes: MAGIC
+#   1 byte:  format version
+#   1 byte:  codec id
+#   1 byte:  compression level used (informational)
+#   1 byte:  reserved, 0
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import lzma
+import os
+import paradux.logging
+import shutil
+import zlib
+
+
+MAGIC       = b'PDXC'
+VERSION     = 1
+HEADER_SIZE = 8
+
+# Codecs, keyed by id stored in the header
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+
+CODECS = {
+    'zlib' : CODEC_ZLIB,
+    'lzma' : CODEC_LZMA
+}
+
+# Compression levels are 0..MAX_LEVEL; 0 means: do not compress
+MAX_LEVEL = 9
+
+
+def _compressorFor(codecId, level):
+    """
+    Create a compressor object.
+
+    codecId: id of the codec
+    level: the compression level, 1..MAX_LEVEL
+    return: object with compress() and flush() methods
+    """
+    if codecId == CODEC_ZLIB:
+        return zlib.compressobj(level)
+    if codecId == CODEC_LZMA:
+        return lzma.LZMACompressor(preset=level)
+    raise ValueError('Unknown compression codec: ' + str(codecId))
+
+
+def _decompressorFor(codecId):
+    """
+    Create a decompressor object.
+
+    codecId: id of the codec
+    return: object with a decompress() method
+    """
+    if codecId == CODEC_ZLIB:
+        return zlib.decompressobj()
+    if codecId == CODEC_LZMA:
+        return lzma.LZMADecompressor()
+    raise ValueError('Unknown compression codec: ' + str(codecId))
+
+
+def compressFile(inFile, outFile, level, codec='zlib', bufSize=1024*1024):
+    """
+    Compress a file into another, without holding either in memory.
+
+    inFile: name of the file to compress
+    outFile: name of the file to write
+    level: the compression level, 1..MAX_LEVEL
+    codec: name of the codec, see CODECS
+    bufSize: number of bytes to read at a time
+    return: tuple of (bytes read, bytes written)
+    """
+    compressor = StreamCompressor(level, codec)
+    bytesIn    = 0
+    bytesOut   = 0
+
+    with open(inFile, 'rb') as inFd, open(outFile, 'wb') as outFd:
+        os.chmod(outFile, 0o600)
+
+        while True:
+            buf = inFd.read(bufSize)
+            if not buf:
+                break
+            bytesIn += len(buf)
+
+            out = compressor.compress(buf)
+            if out:
+                outFd.write(out)
+                bytesOut += len(out)
+
+        out = compressor.flush()
+        outFd.write(out)
+        bytesOut += len(out)
+
+    paradux.logging.trace('Compressed', inFile, bytesIn, '->', bytesOut)
+    return ( bytesIn, bytesOut )
+
+
+class StreamCompressor:
+    """
+    Compresses a stream of bytes handed to it piece by piece, emitting the
+    header before the first compressed bytes.
+
+    level: the compression level, 1..MAX_LEVEL
+    codec: name of the codec, see CODECS
+    """
+    def __init__(self, level, codec='zlib'):
+        if codec not in CODECS:
+            raise ValueError('Unknown compression codec: ' + codec)
+        if level < 1 or level > MAX_LEVEL:
+            raise ValueError('Invalid compression level: ' + str(level))
+
+        codecId         = CODECS[codec]
+        self.compressor = _compressorFor(codecId, level)
+        self.header     = MAGIC + bytes([ VERSION, codecId, level, 0 ]) # emitted as soon as possible
+
+
+    def compress(self, buf):
+        """
+        Compress the next piece of the stream.
+
+        buf: the bytes
+        return: compressed bytes, possibly none
+        """
+        out = self.compressor.compress(buf)
+        if self.header is not None:
+            out         = self.header + out
+            self.header = None
+        return out
+
+
+    def flush(self):
+        """
+        Obtain the remaining compressed bytes at the end of the stream.
+
+        return: compressed bytes
+        """
+        out = self.compressor.flush()
+        if self.header is not None:
+            out         = self.header + out
+            self.header = None
+        return out
+
+
+def isCompressed(fileName):
+    """
+    Determine whether a file has been compressed by compressFile.
+
+    fileName: name of the file
+    return: True or False
+    """
+    with open(fileName, 'rb') as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+
+def decompressFile(inFile, outFile, bufSize=1024*1024):
+    """
+    Decompress a file created by compressFile into another. If the file is not
+    compressed, it is copied as is, so callers do not need to know.
+
+    inFile: name of the file to decompress
+    outFile: name of the file to write
+    bufSize: number of bytes to read at a time
+    return: void
+    """
+    with open(inFile, 'rb') as inFd, open(outFile, 'wb') as outFd:
+        os.chmod(outFile, 0o600)
+
+        header = inFd.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE or header[0:len(MAGIC)] != MAGIC:
+            outFd.write(header)
+            shutil.copyfileobj(inFd, outFd, bufSize)
+            return
+
+        if header[4] != VERSION:
+            raise ValueError('Unsupported compression format version: ' + str(header[4]))
+
+        decompressor = _decompressorFor(header[5])
+        while True:
+            buf = inFd.read(bufSize)
+            if not buf:
+                break
+            outFd.write(decompressor.decompress(buf))
+
+        if hasattr(decompressor, 'flush'):
+            outFd.write(decompressor.flush())
+
+        if not decompressor.eof:
+            raise ValueError('Compressed file is truncated: ' + inFile)
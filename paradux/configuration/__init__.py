@@ -5,12 +5,69 @@
 #
 
 import abc
+import concurrent.futures
+import glob
 import os
 from paradux.configuration.report import Level, Report, ReportItem
 import paradux.logging
+import paradux.utils
 import shutil
 
 
+def findFragmentFiles(fragmentDir):
+    """
+    Find the configuration fragment files in a fragment directory, such as
+    datasets.d. Fragments are the files ending in .json; files starting with
+    a period, such as in-progress edits, are ignored.
+
+    fragmentDir: name of the fragment directory, or None
+    return: sorted list of file names
+    """
+    if fragmentDir is None or not os.path.isdir(fragmentDir):
+        return []
+
+    return sorted(glob.glob(os.path.join(glob.escape(fragmentDir), '*.json')))
+
+
+def fragmentFileNames(fragmentDir, fragmentName):
+    """
+    Determine the names of the file for a named fragment, and of the
+    file holding in-progress edits to that fragment.
+
+    fragmentDir: name of the fragment directory
+    fragmentName: name of the fragment, without directory and .json extension
+    return: tuple of (fragment file name, temp file name)
+    throws: ValueError if the fragment name cannot be used as file name
+    """
+    if not fragmentName or '/' in fragmentName or fragmentName.startswith('.'):
+        raise ValueError('Invalid fragment name: ' + fragmentName)
+
+    return ( os.path.join(fragmentDir, fragmentName + '.json'),
+             os.path.join(fragmentDir, '.' + fragmentName + '.temp.json'))
+
+
+def loadFragments(fileNames, parse, context=None):
+    """
+    Read and parse a number of configuration files in parallel.
+
+    fileNames: the files to parse; files that do not exist are skipped
+    parse: function that converts the JSON content of a file, and the context, into the desired value
+    context: passed into the parse function, such as the credentials registry
+    return: list of parsed values, in the sequence of fileNames
+    """
+    toParse = [ fileName for fileName in fileNames if os.path.isfile(fileName) ]
+
+    def parseOne(fileName):
+        paradux.logging.trace('Parsing configuration fragment:', fileName)
+        return parse(paradux.utils.readJsonFromFile(fileName), context)
+
+    if len(toParse) <= 1:
+        return [ parseOne(fileName) for fileName in toParse ]
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        return list(executor.map(parseOne, toParse))
+
+
 class Configuration:
     """
     Abstract superclass for all configurations. This defines code common
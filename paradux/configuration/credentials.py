@@ -0,0 +1,160 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os.path
+from paradux.configuration import Configuration
+from paradux.configuration.report import Level, Report, ReportItem
+import paradux.data.credential
+import paradux.logging
+import paradux.utils
+import threading
+
+
+def saveInitial(fileName):
+    """
+    Save the initial JSON content of a CredentialsConfiguration to this file.
+
+    return: void
+    """
+    content = """{
+    "credentials" : {
+    }
+}"""
+    paradux.utils.saveFile(fileName, content, 0o600)
+
+
+def createFromFile(masterFile, tmpFile):
+    """
+    Create a CredentialsConfiguration that reads from and uses the specified files.
+    If the master file does not exist, there are no shared credentials.
+
+    masterFile: name of a JSON file containing the current master
+    tmpFile: potential name of a JSON file containing the current in-progress edits to the master
+    """
+    if os.path.isfile(masterFile):
+        j = paradux.utils.readJsonFromFile(masterFile)
+        credentialsJ = j['credentials']
+    else:
+        credentialsJ = {}
+
+    return CredentialsConfiguration(masterFile, tmpFile, credentialsJ)
+
+
+class CredentialsConfiguration(Configuration):
+    """
+    Encapsulates the registry of credentials that are shared by data locations,
+    which refer to them by id. Each credential is parsed only once, when first
+    needed, and the same Credentials instance is used by all data locations
+    that refer to it.
+    """
+    def __init__(self, masterFile, tmpFile, credentialsJ):
+        """
+        Constructor.
+
+        credentialsJ: dict of JSON credentials definitions, keyed by id
+        """
+        super().__init__(masterFile, tmpFile)
+        self.credentialsJ   = credentialsJ
+        self.credentials    = {} # parsed as needed, keyed by id
+        self.validatedProto = {} # set of protocols already checked, keyed by id
+        self.lock           = threading.Lock()
+
+
+    def getCredentialIds(self):
+        """
+        Obtain the ids of all credentials in the registry.
+
+        return: list of string
+        """
+        return sorted(self.credentialsJ.keys())
+
+
+    def getCredentials(self, credentialsId):
+        """
+        Obtain the Credentials with this id.
+
+        credentialsId: the id
+        return: instance of a subclass of Credentials
+        throws: ValueError if no credentials with this id exist
+        """
+        with self.lock:
+            if credentialsId not in self.credentials:
+                if credentialsId not in self.credentialsJ:
+                    raise ValueError( 'Unknown credentials id: ' + credentialsId )
+
+                self.credentials[credentialsId]    = paradux.data.credential.parseCredentialsJson(self.credentialsJ[credentialsId])
+                self.validatedProto[credentialsId] = set()
+
+            return self.credentials[credentialsId]
+
+
+    def getCredentialsFor(self, credentialsId, proto):
+        """
+        Obtain the Credentials with this id, for use with the provided protocol.
+
+        credentialsId: the id
+        proto: the URL protocol, such as "scp", or None
+        return: instance of a subclass of Credentials
+        throws: ValueError if no credentials with this id exist, or they cannot be used with this protocol
+        """
+        ret = self.getCredentials(credentialsId)
+
+        if proto is not None:
+            with self.lock:
+                if proto not in self.validatedProto[credentialsId]:
+                    if not ret.isSuitableForProtocol(proto):
+                        raise ValueError('Credential type not suitable for protocol ' + proto + ': ' + credentialsId)
+                    self.validatedProto[credentialsId].add(proto)
+
+        return ret
+
+
+    def createReport(self,fileName):
+        """
+        Implementation for this subclass.
+        """
+        reportItems = []
+        try :
+            j = paradux.utils.readJsonFromFile(fileName)
+            for credentialsId, credentialsJ in j['credentials'].items():
+                try :
+                    paradux.data.credential.parseCredentialsJson(credentialsJ)
+
+                except Exception as e:
+                    reportItems.append(ReportItem(Level.ERROR, credentialsId + ': ' + str(type(e)) + ': ' + str(e)))
+
+        except Exception as e:
+            reportItems.append(ReportItem(Level.ERROR, str(type(e)) + ': ' + str(e)))
+
+        return Report(reportItems)
+
+
+    def asText(self):
+        """
+        Show this CredentialsConfiguration to the user in plain text. This
+        does not show any secrets.
+
+        return: plain text
+        """
+        credentialIds = self.getCredentialIds()
+        if len(credentialIds) == 0:
+            t = """You currently have 0 shared credentials configured. To configure some, run 'paradux edit-credentials'\n"""
+
+        else:
+            t = "You currently have {0:d} shared credential(s) configured. They are:\n".format(len(credentialIds))
+            for credentialsId in credentialIds:
+                try :
+                    credentials = self.getCredentials(credentialsId)
+                    t += "* ID:   {0:s}\n".format( credentialsId )
+                    t += "  Type: {0:s}\n".format( type(credentials).__name__ )
+                    if hasattr(credentials, 'username'):
+                        t += "  User: {0:s}\n".format( credentials.username )
+
+                except Exception as e:
+                    t += "* ID:   {0:s}\n".format( credentialsId )
+                    t += "  Error: {0:s}\n".format( str(e) )
+
+        return t
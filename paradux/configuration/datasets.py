@@ -4,6 +4,7 @@
 # All rights reserved. License: see package.
 #
 
+import paradux.configuration
 from paradux.configuration import Configuration
 from paradux.configuration.report import Level, Report, ReportItem
 import paradux.data.dataset
@@ -23,36 +24,98 @@ def saveInitial(fileName):
     paradux.utils.saveFile(fileName, content, 0o600)
 
 
-def createFromFile(masterFile, tmpFile):
+def createFromFile(masterFile, tmpFile, fragmentDir=None, credentialsRegistry=None):
     """
     Create a DatasetsConfiguration that reads from and uses the specified files.
+    The files are only parsed once the datasets are needed.
 
     masterFile: name of a JSON file containing the current master
     tmpFile: potential name of a JSON file containing the current in-progress edits to the master
+    fragmentDir: potential name of a directory containing additional JSON files with datasets
+    credentialsRegistry: the registry of shared credentials referred to by id, if any
     """
-    j = paradux.utils.readJsonFromFile(masterFile)
+    return DatasetsConfiguration(masterFile, tmpFile, fragmentDir, credentialsRegistry)
 
+
+def _parseDatasetsJson(j, credentialsRegistry=None):
+    """
+    Helper function to parse the JSON content of a datasets file or
+    fragment.
+
+    j: JSON content
+    credentialsRegistry: the registry of shared credentials, if any
+    return: list of Dataset
+    """
     datasets = []
 
     for datasetJ in j['datasets']:
-        dataset = paradux.data.dataset.parseDatasetJson(datasetJ)
+        dataset = paradux.data.dataset.parseDatasetJson(datasetJ, credentialsRegistry)
         datasets.append(dataset)
 
-    return DatasetsConfiguration(masterFile, tmpFile, datasets)
+    return datasets
 
 
 class DatasetsConfiguration(Configuration):
     """
     Encapsulates the configuration information related to datasets.
     """
-    def __init__(self, masterFile, tmpFile, datasets):
+    def __init__(self, masterFile, tmpFile, fragmentDir=None, credentialsRegistry=None):
         """
         Constructor.
 
-        datasets: list of Dataset
+        fragmentDir: name of the directory containing additional JSON files with datasets, if any
+        credentialsRegistry: the registry of shared credentials referred to by id, if any
         """
         super().__init__(masterFile, tmpFile)
-        self.datasets = datasets
+        self.credentialsRegistry = credentialsRegistry
+        self.fragmentDir         = fragmentDir
+        self.datasets            = None # parsed as needed
+
+
+    def getDatasets(self):
+        """
+        Obtain all datasets, from the master file and from all fragments.
+
+        return: list of Dataset
+        """
+        if self.datasets is None:
+            fileNames = [ self.masterFile ] + paradux.configuration.findFragmentFiles(self.fragmentDir)
+
+            self.datasets = []
+            for fragmentDatasets in paradux.configuration.loadFragments(fileNames, _parseDatasetsJson, self.credentialsRegistry):
+                self.datasets += fragmentDatasets
+
+        return self.datasets
+
+
+    def getDataset(self, name):
+        """
+        Obtain the dataset with this name. This only parses as many files as needed
+        to find it: first the fragment named like the dataset, if it exists,
+        then the master file, then the other fragments.
+
+        name: name of the dataset
+        return: Dataset, or None if not found
+        """
+        if self.datasets is not None:
+            for dataset in self.datasets:
+                if dataset.name == name:
+                    return dataset
+            return None
+
+        fileNames = [ self.masterFile ] + paradux.configuration.findFragmentFiles(self.fragmentDir)
+        if self.fragmentDir is not None and '/' not in name and not name.startswith('.'):
+            namedFragment = paradux.configuration.fragmentFileNames(self.fragmentDir, name)[0]
+            if namedFragment in fileNames:
+                fileNames.remove(namedFragment)
+                fileNames.insert(0, namedFragment)
+
+        for fileName in fileNames:
+            for fragmentDatasets in paradux.configuration.loadFragments([ fileName ], _parseDatasetsJson, self.credentialsRegistry):
+                for dataset in fragmentDatasets:
+                    if dataset.name == name:
+                        return dataset
+        return None
 
 
     def createReport(self,fileName):
@@ -62,8 +125,7 @@ class DatasetsConfiguration(Configuration):
         reportItems = []
         try :
             j = paradux.utils.readJsonFromFile(fileName)
-            for datasetJ in j['datasets']:
-                paradux.data.dataset.parseDatasetJson(datasetJ)
+            _parseDatasetsJson(j, self.credentialsRegistry)
 
         except Exception as e:
             reportItems.append(ReportItem(Level.ERROR, str(type(e)) + ': ' + str(e)))
@@ -77,19 +139,32 @@ class DatasetsConfiguration(Configuration):
 
         return: plain text
         """
-        if len(self.datasets) == 0:
+        datasets = self.getDatasets()
+        if len(datasets) == 0:
             t = """You currently have 0 datasets configured. To configure some, run 'paradux edit-datasets'\n"""
 
         else:
-            t = "You currently have {0:d} dataset(s) configured. They are:\n".format(len(self.datasets))
-            for dataset in self.datasets:
-                t += "* name:         {0:s}\n".format(dataset.name)
-                if dataset.description != None:
-                    t += "  description:  {0:s}\n".format(dataset.description)
-                if dataset.source is not None:
-                    t += "  source:       {0:s}\n".format(str(dataset.source))
-                for destination in dataset.destinations:
-                    t += "  destination:  {0:s}\n".format(str(destination))
+            t = "You currently have {0:d} dataset(s) configured. They are:\n".format(len(datasets))
+            for dataset in datasets:
+                t += datasetAsText(dataset)
 
         return t
 
+
+def datasetAsText(dataset):
+    """
+    Show a single Dataset to the user in plain text.
+
+    dataset: the Dataset
+    return: plain text
+    """
+    t = "* name:         {0:s}\n".format(dataset.name)
+    if dataset.description != None:
+        t += "  description:  {0:s}\n".format(dataset.description)
+    if dataset.source is not None:
+        t += "  source:       {0:s}\n".format(str(dataset.source))
+    for destination in dataset.destinations:
+        t += "  destination:  {0:s}\n".format(str(destination))
+
+    return t
+
@@ -4,6 +4,7 @@
 # All rights reserved. License: see package.
 #
 
+import paradux.configuration
 from paradux.configuration import Configuration
 from paradux.configuration.report import Level, Report, ReportItem
 import paradux.data.datalocation
@@ -22,22 +23,35 @@ def saveInitial(fileName):
     paradux.utils.saveFile(fileName, content, 0o600)
 
 
-def createFromFile(masterFile, tmpFile):
+def createFromFile(masterFile, tmpFile, fragmentDir=None, credentialsRegistry=None):
     """
     Create a MetadataLocationsConfiguration that reads from and uses the specified files.
+    The files are only parsed once the metadata locations are needed.
 
     masterFile: name of a JSON file containing the current master
     tmpFile: potential name of a JSON file containing the current in-progress edits to the master
+    fragmentDir: potential name of a directory containing additional JSON files with metadata locations
+    credentialsRegistry: the registry of shared credentials referred to by id, if any
     """
-    j = paradux.utils.readJsonFromFile(masterFile)
+    return MetadataLocationsConfiguration(masterFile, tmpFile, fragmentDir, credentialsRegistry)
 
+
+def _parseMetadataLocationsJson(j, credentialsRegistry=None):
+    """
+    Helper function to parse the JSON content of a metadata locations file
+    or fragment.
+
+    j: JSON content
+    credentialsRegistry: the registry of shared credentials, if any
+    return: list of MetadataLocation
+    """
     metadataLocations = []
 
     for locationJ in j['locations']:
-        metadataLocation = paradux.data.datalocation.parseMetadataLocationJson(locationJ)
+        metadataLocation = paradux.data.datalocation.parseMetadataLocationJson(locationJ, credentialsRegistry)
         metadataLocations.append( metadataLocation )
 
-    return MetadataLocationsConfiguration(masterFile, tmpFile, metadataLocations)
+    return metadataLocations
 
 
 class MetadataLocationsConfiguration(Configuration):
@@ -45,22 +59,33 @@ class MetadataLocationsConfiguration(Configuration):
     Encapsulates the configuration information related to the locations
     of the copies of the paradux metadata
     """
-    def __init__(self, masterFile, tmpFile, metadataLocations):
+    def __init__(self, masterFile, tmpFile, fragmentDir=None, credentialsRegistry=None):
         """
         Constructor.
 
-        metadataLocations: array of MetadataLocation
+        fragmentDir: name of the directory containing additional JSON files with metadata locations, if any
+        credentialsRegistry: the registry of shared credentials referred to by id, if any
         """
         super().__init__(masterFile, tmpFile)
-        self.metadataLocations = metadataLocations
+        self.credentialsRegistry = credentialsRegistry
+        self.fragmentDir         = fragmentDir
+        self.metadataLocations   = None # parsed as needed
 
 
     def getMetadataLocations(self):
         """
-        Obtain the metadata locations of this paradux installation
+        Obtain the metadata locations of this paradux installation, from the
+        master file and from all fragments.
 
         return: array of MetadataLocation
         """
+        if self.metadataLocations is None:
+            fileNames = [ self.masterFile ] + paradux.configuration.findFragmentFiles(self.fragmentDir)
+
+            self.metadataLocations = []
+            for fragmentLocations in paradux.configuration.loadFragments(fileNames, _parseMetadataLocationsJson, self.credentialsRegistry):
+                self.metadataLocations += fragmentLocations
+
         return self.metadataLocations
 
 
@@ -71,8 +96,7 @@ class MetadataLocationsConfiguration(Configuration):
         reportItems = []
         try :
             j = paradux.utils.readJsonFromFile(fileName)
-            for locationJ in j['locations']:
-                paradux.data.datalocation.parseMetadataLocationJson(locationJ)
+            _parseMetadataLocationsJson(j, self.credentialsRegistry)
 
         except Exception as e:
             reportItems.append(ReportItem(Level.ERROR, str(type(e)) + ': ' + str(e)))
@@ -86,9 +110,10 @@ class MetadataLocationsConfiguration(Configuration):
 
         return: plain text
         """
-        if self.metadataLocations is not None and len(self.metadataLocations) > 0:
+        metadataLocations = self.getMetadataLocations()
+        if metadataLocations is not None and len(metadataLocations) > 0:
             t = ''
-            for metadataLocation in self.metadataLocations:
+            for metadataLocation in metadataLocations:
                 if metadataLocation.name is not None:
                     t += "* Name:        {0:s}\n".format(metadataLocation.name)
                     t += "  URL:         {0:s}\n".format(str(metadataLocation))
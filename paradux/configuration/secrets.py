@@ -7,6 +7,7 @@
 from paradux.data.stewardshare import StewardShare
 from paradux.shamir import ShamirSecretSharing
 import paradux.configuration
+import paradux.encryption
 import time
 
 
@@ -29,6 +30,7 @@ def createAndSaveInitial(nbits, recoverySecret, requiredShares, fileName):
     j['watermark-x']     = 1 # the next x value to be issued
     j['recovery-secret'] = recoverySecret
     j['issued-shares']   = {}
+    j['dataset-keys']    = {}
 
     paradux.utils.writeJsonToFile(fileName, j, 0o600)
 
@@ -51,7 +53,11 @@ def createFromFile(masterFile):
         stewardShare = paradux.data.stewardshare.parseStewardShareJson(stewardShareJ)
         issuedStewardShares[stewardId] = stewardShare
 
-    return SecretsConfiguration(masterFile, mersenne, polyK1, watermarkX, recoverySecret, issuedStewardShares)
+    datasetKeys = {}
+    for datasetName, keyHex in j.get('dataset-keys', {}).items(): # optional, absent in older files
+        datasetKeys[datasetName] = bytes.fromhex(keyHex)
+
+    return SecretsConfiguration(masterFile, mersenne, polyK1, watermarkX, recoverySecret, issuedStewardShares, datasetKeys)
 
 
 def _parseIntegerArray(j):
@@ -71,7 +77,7 @@ class SecretsConfiguration:
     """
     Encapsulates the configuration information related to secrets.
     """
-    def __init__(self, masterFile, mersenne, polyK1, watermarkX, recoverySecret, issuedStewardShares):
+    def __init__(self, masterFile, mersenne, polyK1, watermarkX, recoverySecret, issuedStewardShares, datasetKeys=None):
         """
         Constructor.
 
@@ -81,6 +87,7 @@ class SecretsConfiguration:
         watermarkX: the next x to issue
         recoverySecret: the recovery secret
         issuedStewardShares: dict of issued shares, keyed by steward id
+        datasetKeys: dict of the keys with which datasets are encrypted, keyed by dataset name
         """
         self.masterFile          = masterFile
         self.mersenne            = mersenne
@@ -88,6 +95,7 @@ class SecretsConfiguration:
         self.watermarkX          = watermarkX
         self.recoverySecret      = recoverySecret
         self.issuedStewardShares = issuedStewardShares
+        self.datasetKeys         = datasetKeys or {}
 
 
     def getIssuedStewardShare(self, stewardId):
@@ -103,6 +111,37 @@ class SecretsConfiguration:
         return None
 
 
+    def getDatasetKey(self, datasetName):
+        """
+        Obtain the key with which the backups of a dataset are encrypted.
+
+        datasetName: name of the Dataset
+        return: the key as bytes, or None if none
+        """
+        if datasetName in self.datasetKeys:
+            return self.datasetKeys[datasetName]
+
+        return None
+
+
+    def createDatasetKey(self, datasetName):
+        """
+        Create a new key with which the backups of a dataset are encrypted.
+        Note that after this has been invoked, save() must be invoked
+        before anything is encrypted with the key, otherwise the backups
+        could not be decrypted.
+
+        datasetName: name of the Dataset
+        return: the new key as bytes, or None if the dataset has a key already
+        """
+        if datasetName in self.datasetKeys:
+            return None
+
+        ret = paradux.encryption.generateKey()
+        self.datasetKeys[datasetName] = ret
+        return ret
+
+
     def getMersenne(self):
         """
         Obtain which Mersenne prime is to be used
@@ -156,9 +195,12 @@ class SecretsConfiguration:
             'polynomial'      : self.polyK1,
             'watermark-x'     : self.watermarkX,
             'recovery-secret' : self.recoverySecret,
-            'issued-shares'   : {}
+            'issued-shares'   : {},
+            'dataset-keys'    : {}
         }
         for stewardId, issuedStewardShare in self.issuedStewardShares.items():
             j['issued-shares'][stewardId] = issuedStewardShare.asJson()
+        for datasetName, key in self.datasetKeys.items():
+            j['dataset-keys'][datasetName] = key.hex()
 
         paradux.utils.writeJsonToFile(self.masterFile, j, 0o600)
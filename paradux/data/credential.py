@@ -5,17 +5,58 @@
 #
 
 import abc
+import os
 import paradux.logging
+from tempfile import NamedTemporaryFile
+import threading
 
 
-def parseCredentialsJson(j, url=None):
+# The SshCredentials whose private key is currently accessible through a file name
+_materializedSshCredentials     = set()
+_materializedSshCredentialsLock = threading.Lock()
+
+
+def resolveCredentialsJson(j, proto=None, credentialsRegistry=None):
+    """
+    Helper function to obtain the Credentials for a data location. The JSON is
+    either a full credentials definition, or the id of a credential defined
+    in the credentials registry.
+
+    j: JSON fragment, or string id
+    proto: the URL protocol, such as "scp"
+    credentialsRegistry: the registry to look up ids in, if any
+    return: instance of a subclass of Credentials
+    """
+    if isinstance(j, str):
+        if credentialsRegistry is None:
+            raise ValueError( 'Cannot resolve credentials id without credentials registry: ' + j )
+        return credentialsRegistry.getCredentialsFor(j, proto)
+
+    return parseCredentialsJson(j, proto)
+
+
+def disposeMaterializedCredentials():
+    """
+    Delete all private key files, or in-memory copies, that have been created
+    for SshCredentials. They will be re-created if needed again.
+
+    return: void
+    """
+    with _materializedSshCredentialsLock:
+        toDispose = list(_materializedSshCredentials)
+
+    for cred in toDispose:
+        cred.disposePrivateKeyFile()
+
+
+def parseCredentialsJson(j, proto=None):
     """
     Helper function to parse a JSON credentials definition into an instance
-    of the right subclass of Credentials. If u is given, also check that
-    these Credentials work with the URL with this protocol.
+    of the right subclass of Credentials. If proto is given, also check that
+    these Credentials work with URLs with this protocol.
 
     j: JSON fragment
-    url: parsed URL
+    proto: the URL protocol, such as "scp"
     return: instance of a subclass of Credentials
     """
     paradux.logging.trace('parseCredentialsJson')
@@ -28,14 +69,18 @@ def parseCredentialsJson(j, url=None):
         ret = SshCredentials( j['ssh-user'], j['ssh-private-key'] )
 
     elif 'aws-access-key' in j and 'aws-secret-key' in j:
-        ret = AwsApiCredentials( j['aws-access-key'], j['aws-secret-key'] )
+        ret = AwsApiCredentials(
+                j['aws-access-key'],
+                j['aws-secret-key'],
+                j['aws-region']   if 'aws-region'   in j else None,
+                j['aws-endpoint'] if 'aws-endpoint' in j else None )
 
     if ret is None:
         raise ValueError( 'Unknown credential type' )
 
-    if url is not None:
-        if ret is not None and not ret.isSuitableForProtocol(url.scheme):
-            raise ValueError('Credential type not suitable for protocol ' + url.scheme + ': ' + str(type(ret)))
+    if proto is not None:
+        if ret is not None and not ret.isSuitableForProtocol(proto):
+            raise ValueError('Credential type not suitable for protocol ' + proto + ': ' + str(type(ret)))
 
     return ret
 
@@ -44,6 +89,7 @@ class Credentials:
     """
     Abstract superclass for all types of username/password and the like
     """
+    __slots__ = ()
 
     @abc.abstractmethod
     def isSuitableForProtocol(self, proto):
@@ -58,6 +104,8 @@ class PasswordCredentials(Credentials):
     """
     A username/password combination
     """
+    __slots__ = ( 'username', 'usersecret' )
+
     def __init__(self, username, usersecret):
         """
         Constructor.
@@ -70,14 +118,15 @@ class PasswordCredentials(Credentials):
 
 
     def isSuitableForProtocol(self, proto):
-        # FIXME
-        return False
+        return proto in ( 'http', 'https', 'webdav', 'webdavs' )
 
 
 class SshCredentials(Credentials):
     """
     A username/private key pair combination
     """
+    __slots__ = ( 'username', 'private_key', '_privateKeyFile', '_privateKeyFd', '_lock' )
+
     def __init__(self, username, private_key):
         """
         Constructor.
@@ -85,28 +134,100 @@ class SshCredentials(Credentials):
         username: user name
         private_key: private SSH key that goes with the user name
         """
-        self.username    = username
-        self.private_key = private_key
+        self.username        = username
+        self.private_key     = private_key
+        self._privateKeyFile = None # created as needed
+        self._privateKeyFd   = None # if the private key is held in memory
+        self._lock           = threading.Lock()
 
 
     def isSuitableForProtocol(self, proto):
-        return 'scp' == proto or 'rsync+ssh' == proto
+        return 'scp' == proto or 'rsync+ssh' == proto or 'sftp' == proto
+
+
+    def getPrivateKeyFile(self):
+        """
+        Obtain the name of a file that contains the private key, so it can be
+        passed to ssh. Where supported, the key is only held in memory, in a
+        memfd that child processes can open through /proc; otherwise it is
+        written to a temporary file. This only happens once; the file is
+        shared by all transfers that use these SshCredentials until it is
+        disposed.
+
+        return: name of the file
+        """
+        with self._lock:
+            if self._privateKeyFile is None:
+                if hasattr(os, 'memfd_create'):
+                    fd = os.memfd_create('paradux-ssh-key', os.MFD_CLOEXEC)
+                    os.fchmod(fd, 0o600) # ssh refuses keys others could read
+                    view = memoryview(self.private_key.encode())
+                    while view:
+                        view = view[os.write(fd, view):]
+
+                    self._privateKeyFd   = fd
+                    self._privateKeyFile = '/proc/' + str(os.getpid()) + '/fd/' + str(fd)
+                    paradux.logging.trace( 'Holding private key in memory:', self._privateKeyFile )
+
+                else:
+                    f = NamedTemporaryFile(delete=False)
+                    f.write(self.private_key.encode())
+                    f.close()
+
+                    paradux.logging.trace( 'Created private key file:', f.name )
+                    self._privateKeyFile = f.name
+
+                with _materializedSshCredentialsLock:
+                    _materializedSshCredentials.add(self)
+
+            return self._privateKeyFile
+
+
+    def disposePrivateKeyFile(self):
+        """
+        Delete the file containing the private key, if it has been created.
+
+        return: void
+        """
+        with self._lock:
+            if self._privateKeyFd is not None:
+                paradux.logging.trace( 'Releasing in-memory private key:', self._privateKeyFile )
+                os.close(self._privateKeyFd)
+                self._privateKeyFd   = None
+                self._privateKeyFile = None
+
+            elif self._privateKeyFile is not None:
+                paradux.logging.trace( 'Unlinking private key file:', self._privateKeyFile )
+                try:
+                    os.unlink(self._privateKeyFile)
+                except FileNotFoundError:
+                    pass
+                self._privateKeyFile = None
+
+            with _materializedSshCredentialsLock:
+                _materializedSshCredentials.discard(self)
 
 
 class AwsApiCredentials(Credentials):
     """
     A pair of API key and secret access key to access Amazon Web Services via
-    its API.
+    its API. The endpoint may point to another S3-compatible service.
     """
-    def __init__(self, awsAccessKey, awsSecretKey):
+    __slots__ = ( 'awsAccessKey', 'awsSecretKey', 'awsRegion', 'awsEndpoint' )
+
+    def __init__(self, awsAccessKey, awsSecretKey, awsRegion=None, awsEndpoint=None):
         """
         Constructor.
 
         awsAccessKey: the AWS access key
         awsSecretKey: the AWS secret key
+        awsRegion: the AWS region, or None for the default
+        awsEndpoint: base URL of the S3 API, such as http://localhost:9000, or None for AWS
         """
         self.awsAccessKey = awsAccessKey
         self.awsSecretKey = awsSecretKey
+        self.awsRegion    = awsRegion
+        self.awsEndpoint  = awsEndpoint
 
 
     def isSuitableForProtocol(self, proto):
@@ -4,17 +4,32 @@
 # All rights reserved. License: see package.
 #
 
+import copy
+import paradux.bandwidth
+import paradux.compression
 import paradux.data.credential
+import paradux.encryption
 import paradux.logging
-from urllib.parse import urlparse
+import paradux.scheduler
+import re
+import sys
+from urllib.parse import quote, urlparse
 
 
-def parseSourceDataLocationJson(j):
+# How the backups are stored at a destination
+FORMAT_TREE   = 'tree'   # a copy of the directory hierarchy of the source
+FORMAT_CHUNKS = 'chunks' # a deduplicating store of content-defined chunks, see paradux.chunkstore
+
+STORAGE_FORMATS = ( FORMAT_TREE, FORMAT_CHUNKS )
+
+
+def parseSourceDataLocationJson(j, credentialsRegistry=None):
     """
     Helper function to parse a JSON source data location definition into an instance
     of SourceDataLocation
 
     j: JSON fragment
+    credentialsRegistry: the registry of shared credentials, if any
     return: instance of SourceDataLocation
     """
     paradux.logging.trace('parseSourceDataLocationJson')
@@ -22,18 +37,20 @@ def parseSourceDataLocationJson(j):
     name        = j['name']           if 'name'        in j else None
     description = j['description']    if 'description' in j else None
     url         = _parseUrl(j['url']) # required
+    bandwidth   = _parseBandwidthJson(j['bandwidth']) if 'bandwidth' in j else None
 
-    credentials = paradux.data.credential.parseCredentialsJson(j['credentials'], url) if 'credentials' in j else None
+    credentials = paradux.data.credential.resolveCredentialsJson(j['credentials'], _schemeOf(url), credentialsRegistry) if 'credentials' in j else None
 
-    return SourceDataLocation(name, description, url, credentials)
+    return SourceDataLocation(name, description, url, credentials, bandwidth)
 
 
-def parseDestinationDataLocationJson(j):
+def parseDestinationDataLocationJson(j, credentialsRegistry=None):
     """
     Helper function to parse a JSON destination data location definition into an
     instance of DestinationDataLocation
 
     j: JSON fragment
+    credentialsRegistry: the registry of shared credentials, if any
     return: instance of DestinationDataLocation
     """
     paradux.logging.trace('parseDestinationDataLocationJson')
@@ -43,18 +60,21 @@ def parseDestinationDataLocationJson(j):
     url         = _parseUrl(j['url'])                     if 'url'         in j else None
     frequency   = _parseFrequencyJson(  j['frequency']  ) if 'frequency'   in j else None
     encryption  = _parseEncryptionJson( j['encryption'] ) if 'encryption'  in j else None
+    bandwidth   = _parseBandwidthJson(  j['bandwidth']  ) if 'bandwidth'   in j else None
+    storageFmt  = _parseStorageFormatJson( j['format']  ) if 'format'      in j else None
 
-    credentials = paradux.data.credential.parseCredentialsJson(j['credentials'], url) if 'credentials' in j else None
+    credentials = paradux.data.credential.resolveCredentialsJson(j['credentials'], _schemeOf(url), credentialsRegistry) if 'credentials' in j else None
 
-    return DestinationDataLocation(name, description, url, credentials, frequency, encryption)
+    return DestinationDataLocation(name, description, url, credentials, frequency, encryption, bandwidth, storageFmt)
 
 
-def parseMetadataLocationJson(j):
+def parseMetadataLocationJson(j, credentialsRegistry=None):
     """
     Helper function to parse a JSON metadata location into an instance
     of MetadataLocation
 
     j: JSON fragment
+    credentialsRegistry: the registry of shared credentials, if any
     return: instance of MetadataLocation
     """
     paradux.logging.trace('parseMetadataLocationJson')
@@ -62,29 +82,126 @@ def parseMetadataLocationJson(j):
     name        = j['name']           if 'name'        in j else None
     description = j['description']    if 'description' in j else None
     url         = _parseUrl(j['url']) # required
-    credentials = paradux.data.credential.parseCredentialsJson(j['credentials'], url) if 'credentials' in j else None
+    timeout     = _parsePositiveNumberJson(j['timeout']) if 'timeout' in j else None
+    retries     = _parseRetriesJson(j['retries'])        if 'retries' in j else None
+    compression = _parseCompressionLevelJson(j['compression']) if 'compression' in j else None
+    bandwidth   = _parseBandwidthJson(j['bandwidth'])          if 'bandwidth'   in j else None
+    credentials = paradux.data.credential.resolveCredentialsJson(j['credentials'], _schemeOf(url), credentialsRegistry) if 'credentials' in j else None
+
+    return MetadataLocation(name, description, url, credentials, timeout, retries, compression, bandwidth)
 
-    return MetadataLocation(name, description, url, credentials)
+
+# Syntax of the scheme of a URL, per RFC 3986
+_SCHEME_REGEX = re.compile(r'([A-Za-z][A-Za-z0-9+.-]*):')
 
 
 def _parseUrl(u):
     """
-    Parse a URL.
+    Check a URL. The full parse is deferred until somebody actually needs
+    the parsed URL; most of the time, only the scheme is needed.
 
     u: URL as string
-    return: ParseResult
+    return: the URL as string
+    """
+    if not isinstance(u, str):
+        raise ValueError('URL must be a string: ' + str(u))
+    return u
+
+
+def _schemeOf(u):
+    """
+    Determine the scheme of a URL without parsing all of it. Schemes are
+    interned, as there are only a few distinct ones.
+
+    u: URL as string, or None
+    return: the lower-case scheme, or None if u is None
+    """
+    if u is None:
+        return None
+
+    m = _SCHEME_REGEX.match(u)
+    if m:
+        return sys.intern(m.group(1).lower())
+    return ''
+
+
+def _parsePositiveNumberJson(j):
+    """
+    Parse a positive number, such as a timeout in seconds.
+
+    j: JSON fragment
+    return: the number
+    """
+    if isinstance(j, bool) or not isinstance(j, (int, float)) or j <= 0:
+        raise ValueError('Not a positive number: ' + str(j))
+    return j
+
+
+def _parseRetriesJson(j):
+    """
+    Parse the number of times an operation may be retried.
+
+    j: JSON fragment
+    return: the number
+    """
+    if isinstance(j, bool) or not isinstance(j, int) or j < 0:
+        raise ValueError('Not a valid number of retries: ' + str(j))
+    return j
+
+
+def _parseCompressionLevelJson(j):
+    """
+    Parse the level at which to compress what is uploaded. 0 means: do not compress.
+
+    j: JSON fragment
+    return: the level
+    """
+    if isinstance(j, bool) or not isinstance(j, int) or j < 0 or j > paradux.compression.MAX_LEVEL:
+        raise ValueError('Not a valid compression level: ' + str(j))
+    return j
+
+
+def _parseBandwidthJson(j):
+    """
+    Parse the limit on the bandwidth used for transfers to or from a data location.
+
+    j: JSON fragment
+    return: the BandwidthLimit
     """
-    return urlparse(u)
+    return paradux.bandwidth.parseBandwidthLimitJson(j)
 
 
 def _parseFrequencyJson(j):
-    # FIXME
-    return None
+    """
+    Parse how frequently a backup is to be created.
+
+    j: JSON fragment
+    return: the number of seconds between backups
+    """
+    return paradux.scheduler.parseFrequencyJson(j)
+
+
+def _parseStorageFormatJson(j):
+    """
+    Parse how the backups are stored at a destination: as a copy of the
+    directory hierarchy, or in a deduplicating chunk store.
+
+    j: JSON fragment
+    return: the format
+    """
+    if j not in STORAGE_FORMATS:
+        raise ValueError('Not a valid format: ' + str(j) + ', supported: ' + ', '.join(STORAGE_FORMATS))
+    return j
 
 
 def _parseEncryptionJson(j):
-    # FIXME
-    return None
+    """
+    Parse how what is backed up to a destination is to be encrypted.
+
+    j: JSON fragment
+    return: the EncryptionInfo, or None if not to be encrypted
+    """
+    return paradux.encryption.parseEncryptionJson(j)
 
 
 
@@ -94,14 +211,51 @@ class DataLocation:
 
     name: name used to refer to it within paradux (required)
     description: text that reminds the user about this data location (optional)
-    url: how to access this data location (required), as a parsed URL
+    urlString: how to access this data location (required), as a string
+    scheme: the scheme of urlString, such as 'scp'
     credentials: access credentials (optional)
+    bandwidth: the BandwidthLimit for transfers to or from here (optional)
     """
-    def __init__(self, name, description, url, credentials):
+    __slots__ = ( 'name', 'description', 'urlString', 'scheme', 'credentials', 'bandwidth', '_parsedUrl' )
+
+    def __init__(self, name, description, url, credentials, bandwidth=None):
         self.name        = name
         self.description = description
-        self.url         = url
+        self.urlString   = url
+        self.scheme      = _schemeOf(url)
         self.credentials = credentials
+        self.bandwidth   = bandwidth
+        self._parsedUrl  = None # parsed as needed
+
+
+    @property
+    def url(self):
+        """
+        The parsed URL of this data location. It is parsed upon first use. The host
+        part is interned, as many data locations tend to share the same few hosts.
+
+        return: ParseResult, or None
+        """
+        if self._parsedUrl is None and self.urlString is not None:
+            parsed = urlparse(self.urlString)
+            self._parsedUrl = parsed._replace(
+                    scheme = self.scheme,
+                    netloc = sys.intern(parsed.netloc))
+        return self._parsedUrl
+
+
+    def childLocation(self, relativePath):
+        """
+        Obtain a DataLocation for a file below this one, which is a directory.
+        Everything else is the same as for this one.
+
+        relativePath: the path of the file relative to this one, with / as separator
+        return: DataLocation of the same class
+        """
+        ret = copy.copy(self)
+        ret.urlString  = self.urlString.rstrip('/') + '/' + quote(relativePath, safe="/~!$&'()*+,;=:@")
+        ret._parsedUrl = None
+        return ret
 
 
     """
@@ -110,8 +264,8 @@ class DataLocation:
     return: string
     """
     def __str__(self):
-        if self.url is not None:
-            return self.url.geturl()
+        if self.urlString is not None:
+            return self.urlString
 
         if self.name is not None:
             return self.name
@@ -123,29 +277,44 @@ class SourceDataLocation(DataLocation):
     """
     A DataLocation that is used as a source in a Dataset.
     """
-    def __init__(self, name, description, url, downloadCredentials):
-        super().__init__(name, description, url, downloadCredentials)
+    __slots__ = ()
+
+    def __init__(self, name, description, url, downloadCredentials, bandwidth=None):
+        super().__init__(name, description, url, downloadCredentials, bandwidth)
 
 
 class DestinationDataLocation(DataLocation):
     """
     A DataLocation that is used as a destination in a Dataset.
 
-    frequency: specifies how frequently a backup is created to this destination
-    encryption_info: specifies how the backup is encrypted
+    frequency: the number of seconds between backups to this destination, or None
+    encryption_info: the EncryptionInfo that specifies how the backup is encrypted, or None
+    storage_format: how the backup is stored, see STORAGE_FORMATS
     """
-    def __init__(self, name, description, url, uploadCredentials, frequency, encryption_info):
-        super().__init__(name, description, url, uploadCredentials )
+    __slots__ = ( 'frequency', 'encryption_info', 'storage_format' )
+
+    def __init__(self, name, description, url, uploadCredentials, frequency, encryption_info, bandwidth=None, storage_format=None):
+        super().__init__(name, description, url, uploadCredentials, bandwidth)
 
         self.frequency       = frequency
         self.encryption_info = encryption_info
+        self.storage_format  = FORMAT_TREE if storage_format is None else storage_format
 
 
 class MetadataLocation(DataLocation):
     """
     A DataLocation that is used as place where to deposit copies of
     the paradux metadata
+
+    timeout: number of seconds after which to give up on an upload attempt, or None for the default
+    retries: number of times to retry a failed upload, or None for the default
+    compression: level at which to compress the uploaded metadata, 0 for none, or None for the default
     """
-    def __init__(self, name, description, url, uploadCredentials):
-        super().__init__(name, description, url, uploadCredentials)
+    __slots__ = ( 'timeout', 'retries', 'compression' )
+
+    def __init__(self, name, description, url, uploadCredentials, timeout=None, retries=None, compression=None, bandwidth=None):
+        super().__init__(name, description, url, uploadCredentials, bandwidth)
 
+        self.timeout     = timeout
+        self.retries     = retries
+        self.compression = compression
@@ -7,11 +7,12 @@
 import paradux.logging
 import paradux.data.datalocation
 
-def parseDatasetJson(j):
+def parseDatasetJson(j, credentialsRegistry=None):
     """
     Helper function to parse a JSON dataset definition into an instance of Dataset
 
     j: JSON fragment
+    credentialsRegistry: the registry of shared credentials, if any
     return: instance of Dataset
     """
     paradux.logging.trace('parseDatasetJson')
@@ -20,21 +21,23 @@ def parseDatasetJson(j):
     description = j['description'] if 'description' in j else None
     sourceJ     = j['source']      # required
 
-    source       = paradux.data.datalocation.parseSourceDataLocationJson(sourceJ)
+    source       = paradux.data.datalocation.parseSourceDataLocationJson(sourceJ, credentialsRegistry)
     destinations = []
 
     if 'destinations' in j:
         for destinationJ in j['destinations']:
-            destination = paradux.data.datalocation.parseDestinationDataLocationJson(destinationJ)
+            destination = paradux.data.datalocation.parseDestinationDataLocationJson(destinationJ, credentialsRegistry)
             destinations.append(destination)
 
-    return Dataset(name,description,source,destinations)
+    return Dataset(name,description,source,tuple(destinations))
 
 
 class Dataset:
     """
     Encapsulates everything there's to be said about a Dataset.
     """
+    __slots__ = ( 'name', 'description', 'source', 'destinations' )
+
     def __init__(self, name, description, source, destinations):
         """
         Constructor.
@@ -42,7 +45,7 @@ class Dataset:
         name: the name of this Dataset
         description: any description for this Dataset
         source: the sourceDataLocation for this Dataset
-        destinations: the array of DestinationDataLocation for this Dataset
+        destinations: the sequence of DestinationDataLocation for this Dataset
         """
         self.name         = name
         self.description  = description
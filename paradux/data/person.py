@@ -28,6 +28,8 @@ class Person:
     """
     Represents a Person. This is used for the User and for Stewards.
     """
+    __slots__ = ( 'name', 'address', 'contactEmail', 'contactPhone' )
+
     def __init__(self, name, address, contactEmail, contactPhone):
         """
         Constructor.
@@ -35,6 +35,8 @@ class Steward(Person):
 
     acceptedTs: UNIX timestamp when they accepted to be a Steward for this user
     """
+    __slots__ = ( 'acceptedTs', )
+
     def __init__(self, name, address, contactEmail, contactPhone, acceptedTs):
         super().__init__(name, address, contactEmail, contactPhone)
         self.acceptedTs = acceptedTs
@@ -43,6 +43,8 @@ class StewardShare:
     """
     All information issued to a Steward that is specific to that Steward.
     """
+    __slots__ = ( 'shamirShare', 'issuedTs' )
+
     def __init__(self, shamirShare, issuedTs):
         """
         Constructor.
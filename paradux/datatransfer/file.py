@@ -0,0 +1,481 @@
+#!/usr/bin/python
+#
+# Functionality to copy files to and from the local file system, such as
+# USB sticks, NAS mounts and locally mounted cloud drives.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import errno
+import fcntl
+import os
+import os.path
+import paradux.bandwidth
+import paradux.logging
+import paradux.transport
+import paradux.utils
+import shutil
+import stat
+import subprocess
+import tempfile
+import time
+from urllib.parse import unquote
+
+# ioctl to share the data blocks of one file with another on copy-on-write
+# file systems such as btrfs and XFS, from linux/fs.h
+FICLONE = 0x40049409
+
+# Number of bytes to copy at a time, so timeouts can be checked
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class FileTransport(paradux.transport.Transport):
+    """
+    Copies files on the local file system.
+    """
+    schemes      = ( 'file', )
+    capabilities = frozenset((
+            paradux.transport.STREAMING,
+            paradux.transport.SERVER_SIDE_HASH,
+            paradux.transport.ATOMIC_RENAME,
+            paradux.transport.DOWNLOAD,
+            paradux.transport.STAT,
+            paradux.transport.LIST,
+            paradux.transport.TREES ))
+
+
+    def upload(self, localFile, destination, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        try:
+            copyFile(localFile, _pathOf(destination), timeout, _throttleFor(destination))
+            return True
+
+        except OSError as e:
+            paradux.logging.error('Copying to', destination, 'failed:', e)
+            return False
+
+
+    def uploadStream(self, reader, destination, timeout=None):
+        """
+        Implementation for this subclass. Blocks of zeros become holes.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        reader   = paradux.bandwidth.defaultGovernor().throttledReader(reader, destination)
+
+        def write(outFd):
+            size = 0
+            while True:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise subprocess.TimeoutExpired('copy', timeout)
+
+                buf = reader.read(CHUNK_SIZE)
+                if not buf:
+                    break
+                size += len(buf)
+
+                if buf == bytes(len(buf)):
+                    os.lseek(outFd, len(buf), os.SEEK_CUR)
+                else:
+                    view = memoryview(buf)
+                    while view:
+                        view = view[os.write(outFd, view):]
+
+            os.ftruncate(outFd, size) # in case it ended with a hole
+            os.fchmod(outFd, 0o600)
+
+        try:
+            _writeAtomically(_pathOf(destination), write)
+            return True
+
+        except OSError as e:
+            paradux.logging.error('Copying to', destination, 'failed:', e)
+            return False
+
+
+    def download(self, source, localFile, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        try:
+            copyFile(_pathOf(source), localFile, timeout, _throttleFor(source))
+            return True
+
+        except OSError as e:
+            paradux.logging.error('Copying from', source, 'failed:', e)
+            return False
+
+
+    def stat(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        path = _pathOf(location)
+        if not os.path.isfile(path):
+            return None
+        st = os.stat(path)
+        return paradux.transport.RemoteStat(st.st_size, int(st.st_mtime))
+
+
+    def remoteHash(self, location, timeout=None):
+        """
+        Implementation for this subclass. The file is read locally.
+        """
+        path = _pathOf(location)
+        if not os.path.isfile(path):
+            return None
+        return paradux.utils.sha256OfFile(path)
+
+
+    def list(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        path = _pathOf(location)
+        if not os.path.isdir(path):
+            return None
+        return sorted(os.listdir(path))
+
+
+    def makeDirectories(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        try:
+            os.makedirs(_pathOf(location), exist_ok=True)
+            return True
+
+        except OSError as e:
+            paradux.logging.error('Cannot create directory at', location, ':', e)
+            return False
+
+
+    def pullTree(self, source, localDir, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        try:
+            return mirrorTree(_pathOf(source), localDir, timeout, _throttleFor(source))
+
+        except OSError as e:
+            paradux.logging.error('Copying from', source, 'failed:', e)
+            return None
+
+
+    def pushTree(self, localDir, destination, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        try:
+            return mirrorTree(localDir, _pathOf(destination), timeout, _throttleFor(destination))
+
+        except OSError as e:
+            paradux.logging.error('Copying to', destination, 'failed:', e)
+            return None
+
+
+def mirrorTree(fromDir, toDir, timeout=None, throttle=None):
+    """
+    Make one directory hierarchy a copy of another. Files are only copied if
+    their size or modification time differ, each with copyFile(). Symbolic
+    links are copied as links. Whatever is in toDir but not in fromDir is
+    deleted.
+
+    fromDir: name of the directory to copy
+    toDir: name of the directory to make the copy, which is created if needed
+    timeout: if given, give up after this many seconds
+    throttle: if given, invoked with the number of bytes copied after each chunk
+    return: TreeStats
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    ret      = paradux.transport.TreeStats()
+
+    if not os.path.isdir(fromDir):
+        raise FileNotFoundError(errno.ENOENT, 'No such directory', fromDir)
+    os.makedirs(toDir, exist_ok=True)
+
+    for dirPath, dirNames, fileNames in os.walk(fromDir):
+        rel      = os.path.relpath(dirPath, fromDir)
+        toPath   = toDir if rel == '.' else os.path.join(toDir, rel)
+        expected = set(dirNames) | set(fileNames)
+
+        for name in os.listdir(toPath):
+            if name not in expected:
+                _removeEntry(os.path.join(toPath, name))
+
+        for name in list(dirNames):
+            fromEntry = os.path.join(dirPath, name)
+            toEntry   = os.path.join(toPath, name)
+            if os.path.islink(fromEntry):
+                dirNames.remove(name) # os.walk does not follow it
+                _copyLink(fromEntry, toEntry)
+            else:
+                if os.path.islink(toEntry) or ( os.path.lexists(toEntry) and not os.path.isdir(toEntry) ):
+                    _removeEntry(toEntry)
+                os.makedirs(toEntry, exist_ok=True)
+                shutil.copystat(fromEntry, toEntry)
+
+        for name in fileNames:
+            if deadline is not None and time.monotonic() > deadline:
+                raise subprocess.TimeoutExpired('copy', timeout)
+
+            fromEntry = os.path.join(dirPath, name)
+            toEntry   = os.path.join(toPath, name)
+            if os.path.islink(fromEntry):
+                _copyLink(fromEntry, toEntry)
+                continue
+
+            fromSt = os.stat(fromEntry)
+            if os.path.lexists(toEntry):
+                if os.path.isdir(toEntry) and not os.path.islink(toEntry):
+                    _removeEntry(toEntry)
+                else:
+                    toSt = os.lstat(toEntry)
+                    if stat.S_ISREG(toSt.st_mode) and toSt.st_size == fromSt.st_size and toSt.st_mtime_ns == fromSt.st_mtime_ns:
+                        continue
+
+            copyFile(fromEntry, toEntry, paradux.utils.remainingTime(deadline, timeout), throttle)
+            os.utime(toEntry, ns=( fromSt.st_atime_ns, fromSt.st_mtime_ns ))
+            ret.files += 1
+            ret.bytes += fromSt.st_size
+
+    return ret
+
+
+def _copyLink(fromLink, toLink):
+    """
+    Copy a symbolic link, unless the copy already points to the same place.
+
+    fromLink: name of the symbolic link to copy
+    toLink: name of the copy
+    return: void
+    """
+    target = os.readlink(fromLink)
+    if os.path.islink(toLink) and os.readlink(toLink) == target:
+        return
+    if os.path.lexists(toLink):
+        _removeEntry(toLink)
+    os.symlink(target, toLink)
+
+
+def _removeEntry(path):
+    """
+    Delete a file, symbolic link or directory hierarchy.
+
+    path: the name of what to delete
+    return: void
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+
+def copyFile(fromFile, toFile, timeout=None, throttle=None):
+    """
+    Copy a file. The copy is written to a temporary file next to toFile and
+    renamed, so toFile either has its old or its new content, never
+    something in between. Uses reflinks where the file system supports them,
+    otherwise copies in the kernel where possible. Holes in sparse files are
+    preserved.
+
+    fromFile: name of the file to copy
+    toFile: name of the file to create or replace
+    timeout: if given, give up after this many seconds
+    throttle: if given, invoked with the number of bytes copied after each chunk;
+         reflinks are not used then
+    return: void
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    def write(outFd):
+        with open(fromFile, 'rb') as inF:
+            inFd = inF.fileno()
+            st   = os.fstat(inFd)
+
+            if throttle is None and _reflink(inFd, outFd):
+                paradux.logging.trace('Reflinked', fromFile, 'to', toFile)
+            else:
+                _copySparse(inFd, outFd, st.st_size, deadline, timeout, throttle)
+
+            os.fchmod(outFd, stat.S_IMODE(st.st_mode))
+
+    _writeAtomically(toFile, write)
+
+
+def _writeAtomically(toFile, write):
+    """
+    Write a file through a temporary file next to it, which is renamed once
+    complete, so the file either has its old or its new content, never
+    something in between.
+
+    toFile: name of the file to create or replace
+    write: function that writes the content, given the file descriptor of the temporary file
+    return: void
+    """
+    toDir = os.path.dirname(os.path.abspath(toFile))
+
+    outFd, tmpFile = tempfile.mkstemp(prefix='.' + os.path.basename(toFile) + '.', suffix='.tmp', dir=toDir)
+    try:
+        write(outFd)
+        os.fsync(outFd)
+
+        os.close(outFd)
+        outFd = None
+
+        os.replace(tmpFile, toFile)
+        tmpFile = None
+
+        _fsyncDirectory(toDir)
+
+    finally:
+        if outFd is not None:
+            os.close(outFd)
+        if tmpFile is not None:
+            os.unlink(tmpFile)
+
+
+def _pathOf(dataLocation):
+    """
+    Determine the local path of a file:// DataLocation.
+
+    dataLocation: the DataLocation
+    return: the path
+    """
+    url = dataLocation.url
+    if url.netloc not in ( '', 'localhost' ):
+        raise ValueError('Cannot access files on other hosts: ' + str(dataLocation))
+    return unquote(url.path)
+
+
+def _throttleFor(dataLocation):
+    """
+    Determine how to stay within the bandwidth limit of a data location.
+
+    dataLocation: the DataLocation
+    return: function to invoke with the number of bytes copied, or None if not limited
+    """
+    if dataLocation.bandwidth is None:
+        return None
+
+    governor = paradux.bandwidth.defaultGovernor()
+    return lambda n: governor.throttle(dataLocation, n)
+
+
+def _reflink(inFd, outFd):
+    """
+    Attempt to make the output file share the data blocks of the input file.
+
+    inFd: file descriptor to copy from
+    outFd: file descriptor to copy to
+    return: True if successful, False if not supported here
+    """
+    try:
+        fcntl.ioctl(outFd, FICLONE, inFd)
+        return True
+
+    except OSError:
+        return False
+
+
+def _copySparse(inFd, outFd, size, deadline, timeout, throttle=None):
+    """
+    Copy only the data regions of the input file, leaving holes where it has
+    holes. On file systems that cannot report holes, the whole file is one
+    data region.
+
+    inFd: file descriptor to copy from
+    outFd: file descriptor to copy to
+    size: the size of the input file
+    deadline: time.monotonic() value after which to give up, or None
+    timeout: the timeout, for reporting
+    throttle: if given, invoked with the number of bytes copied after each chunk
+    return: void
+    throws: subprocess.TimeoutExpired if the deadline was reached
+    """
+    pos = 0
+    while pos < size:
+        try:
+            dataStart = os.lseek(inFd, pos, os.SEEK_DATA)
+            dataEnd   = os.lseek(inFd, dataStart, os.SEEK_HOLE)
+
+        except OSError as e:
+            if e.errno == errno.ENXIO: # no more data after pos
+                break
+            if e.errno != errno.EINVAL: # EINVAL: holes not supported
+                raise
+            dataStart = pos
+            dataEnd   = size
+
+        _copyRange(inFd, outFd, dataStart, min(dataEnd, size) - dataStart, deadline, timeout, throttle)
+        pos = dataEnd
+
+    # Trailing holes have no data to write, but the size needs to be right
+    os.ftruncate(outFd, size)
+
+
+def _copyRange(inFd, outFd, offset, count, deadline, timeout, throttle=None):
+    """
+    Copy a range of bytes to the same offset in the output file, in the kernel
+    if possible.
+
+    inFd: file descriptor to copy from
+    outFd: file descriptor to copy to
+    offset: where the range starts
+    count: number of bytes in the range
+    deadline: time.monotonic() value after which to give up, or None
+    timeout: the timeout, for reporting
+    throttle: if given, invoked with the number of bytes copied after each chunk
+    return: void
+    throws: subprocess.TimeoutExpired if the deadline was reached
+    """
+    useKernel = hasattr(os, 'copy_file_range')
+    end       = offset + count
+
+    while offset < end:
+        if deadline is not None and time.monotonic() > deadline:
+            raise subprocess.TimeoutExpired('copy', timeout)
+
+        chunk = min(CHUNK_SIZE, end - offset)
+        done  = 0
+        if useKernel:
+            try:
+                done = os.copy_file_range(inFd, outFd, chunk, offset, offset)
+
+            except OSError as e:
+                # Not supported between these file systems
+                if e.errno not in ( errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP ):
+                    raise
+                useKernel = False
+
+        if not useKernel:
+            buf  = os.pread(inFd, chunk, offset)
+            done = os.pwrite(outFd, buf, offset)
+
+        if done == 0:
+            raise OSError(errno.EIO, 'File shrank while being copied')
+        offset += done
+
+        if throttle is not None:
+            throttle(done)
+
+
+def _fsyncDirectory(dirName):
+    """
+    Make sure a rename in this directory has reached the disk.
+
+    dirName: name of the directory
+    return: void
+    """
+    dirFd = os.open(dirName, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(dirFd)
+    finally:
+        os.close(dirFd)
+
+
+TRANSPORT = FileTransport()
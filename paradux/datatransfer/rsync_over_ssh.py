@@ -6,74 +6,271 @@
 # All rights reserved. License: see package.
 #
 
-import inspect
-import os
-from paradux.data.credential import SshCredentials
+import paradux.bandwidth
+import paradux.logging
+import paradux.sshpool
+import paradux.transport
 import paradux.utils
-from tempfile import NamedTemporaryFile
+import re
+import time
 
-def supportsProtocol(proto):
-    """
-    Determine whether this data transfer protocol support URL protocol
-    proto.
 
-    proto: the URL protocol, such as "scp"
-    return: True or False
-    """
-    return 'rsync+ssh' == proto
+# Directory, relative to the directory of each file, that rsync keeps partly
+# pushed files in, so an interrupted push continues where it left off. rsync
+# neither sends such directories nor deletes them at the receiving side.
+PARTIAL_DIR = '.paradux-partial'
 
 
-def upload(localFile, destination):
+class RsyncOverSshTransport(paradux.transport.Transport):
     """
-    Upload the local file to the specified DataLocation.
-
-    localFile: name of the local file
-    destination: DataLocation for upload
-    return: True if successful
+    Copies files with rsync over ssh. Everything else is done over the
+    pooled ssh connection.
     """
+    schemes      = ( 'rsync+ssh', )
+    capabilities = frozenset((
+            paradux.transport.STREAMING,
+            paradux.transport.RANGED_WRITES,
+            paradux.transport.SERVER_SIDE_HASH,
+            paradux.transport.ATOMIC_RENAME,
+            paradux.transport.DOWNLOAD,
+            paradux.transport.STAT,
+            paradux.transport.LIST,
+            paradux.transport.TREES ))
+
 
-    ret = True
-    try:
-        cred = destination.credentials
+    def upload(self, localFile, destination, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        user, host, port, privKeyFile = paradux.sshpool.sshParametersFor(destination)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        path = destination.url.path
+        if len(path) > 0:
+            path = path[1:] # remove leading /
 
         cmd = "rsync"
         cmd += " -rtlvH --delete-after --delay-updates --safe-links"
-        cmd += " -e 'ssh"
+        cmd += self._sshOption(user, host, port, privKeyFile, timeout)
+        cmd += self._bwlimitOption(destination)
+
+        cmd += " '" + localFile + "'"
 
-        privKeyFile = None
-        if cred:
-            if isinstance(cred, SshCredentials):
-                privKeyFile = NamedTemporaryFile(delete=False)
-                privKeyFile.write(cred.private_key.encode())
-                privKeyFile.close()
+        if user is not None:
+            cmd += " '" + user + "@" + host + ":" + path + "'"
+        else:
+            cmd += " '" + host + ":" + path + "'"
 
-            else:
-                paradux.logging.fatal('Should not happen:', cred)
+        return paradux.utils.myexec(cmd, timeout=paradux.utils.remainingTime(deadline, timeout)) == 0
 
-        if privKeyFile is not None:
-            cmd += " -i " + privKeyFile.name
 
-        cmd += "'"
+    def uploadResumable(self, localFile, destination, checkpoint, timeout=None):
+        """
+        Implementation for this subclass. rsync keeps what it transferred in
+        a remote temporary file (--partial), and appends to it once it has
+        verified the content so far (--append-verify). The temporary file is
+        renamed once complete.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
 
-        host = destination.url.hostname
-        path = destination.url.path
+        user, host, port, privKeyFile = paradux.sshpool.sshParametersFor(destination)
 
-        if len(path) > 0:
-            path = path[1:0] # remove leading /
+        resumed    = checkpoint.isResumed()
+        remoteTemp = checkpoint.getRemoteTemp()
+        if remoteTemp is None:
+            remoteTemp = destination.url.path + '.paradux-partial'
+            checkpoint.setRemoteTemp(remoteTemp)
+            checkpoint.save()
+
+        tmpPath = remoteTemp
+        if len(tmpPath) > 0:
+            tmpPath = tmpPath[1:] # remove leading /
+
+        if resumed:
+            confirmed = paradux.sshpool.remoteFileSize(
+                    user, host, port, privKeyFile,
+                    paradux.sshpool.remoteShellPath(remoteTemp),
+                    paradux.utils.remainingTime(deadline, timeout))
+            if confirmed:
+                paradux.logging.info('Resuming upload to', destination, 'after byte', confirmed)
+                checkpoint.setBytesConfirmed(confirmed)
+                checkpoint.save()
+
+        cmd = "rsync"
+        cmd += " -tvH --partial --append-verify"
+        cmd += self._sshOption(user, host, port, privKeyFile, paradux.utils.remainingTime(deadline, timeout))
+        cmd += self._bwlimitOption(destination)
 
         cmd += " '" + localFile + "'"
 
-        if privKeyFile is not None:
-            cmd += " '" + cred.username + "@" + host + ":" + path + "'"
+        if user is not None:
+            cmd += " '" + user + "@" + host + ":" + tmpPath + "'"
         else:
-            cmd += " '" + host + ":" + path + "'"
+            cmd += " '" + host + ":" + tmpPath + "'"
+
+        if paradux.utils.myexec(cmd, timeout=paradux.utils.remainingTime(deadline, timeout)) != 0:
+            return False
+
+        status, out, err = paradux.sshpool.runRemoteCommand(
+                user, host, port, privKeyFile,
+                'mv ' + paradux.sshpool.remoteShellPath(remoteTemp) + ' ' + paradux.sshpool.remoteShellPath(destination.url.path),
+                paradux.utils.remainingTime(deadline, timeout))
+        return status == 0
+
+
+    def uploadStream(self, reader, destination, timeout=None):
+        """
+        Implementation for this subclass. rsync cannot read from a pipe, so
+        this uses ssh directly.
+        """
+        return paradux.sshpool.uploadStream(destination, reader, timeout)
+
+
+    def download(self, source, localFile, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        return paradux.sshpool.download(source, localFile, timeout)
+
+
+    def stat(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        return paradux.sshpool.remoteStat(location, timeout)
+
+
+    def remoteHash(self, location, timeout=None):
+        """
+        Implementation for this subclass. Runs sha256sum on the remote host.
+        """
+        return paradux.sshpool.remoteSha256(location, timeout)
+
 
-        exitCode = paradux.utils.myexec(cmd)
-        if exitCode != 0:
-            ret = 1
+    def list(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        return paradux.sshpool.remoteList(location, timeout)
+
+
+    def makeDirectories(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        return paradux.sshpool.remoteMakeDirectories(location, timeout)
+
+
+    def pullTree(self, source, localDir, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        return self._rsyncTree(source, self._remoteSpec(source) + "/", localDir + "/", timeout)
+
+
+    def pushTree(self, localDir, destination, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        if not self.makeDirectories(destination, timeout):
+            return None
+
+        return self._rsyncTree(destination, localDir + "/", self._remoteSpec(destination) + "/", paradux.utils.remainingTime(deadline, timeout), PARTIAL_DIR)
+
+
+    def _rsyncTree(self, dataLocation, fromSpec, toSpec, timeout, partialDir=None):
+        """
+        Make one directory hierarchy a copy of another with rsync. If a partial
+        directory is given, files that were partly transferred when rsync was
+        interrupted are kept there, and the next run continues them instead
+        of starting over.
+
+        dataLocation: the DataLocation at the remote end
+        fromSpec: the directory to copy, as rsync argument
+        toSpec: the directory to make the copy, as rsync argument
+        timeout: if given, give up after this many seconds
+        partialDir: the directory for partly transferred files, relative to the directory of each file, or None
+        return: TreeStats if successful, None otherwise
+        """
+        user, host, port, privKeyFile = paradux.sshpool.sshParametersFor(dataLocation)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        cmd = "rsync"
+        cmd += " -aH --delete-after --delay-updates --safe-links --stats"
+        if partialDir is not None:
+            cmd += " --partial-dir='" + partialDir + "'"
+        cmd += self._sshOption(user, host, port, privKeyFile, timeout)
+        cmd += self._bwlimitOption(dataLocation)
+        cmd += " '" + fromSpec + "' '" + toSpec + "'"
+
+        status, out, err = paradux.utils.myexec(cmd, None, True, True, paradux.utils.remainingTime(deadline, timeout))
+        if status != 0:
+            paradux.logging.error('rsync with', dataLocation, 'failed:', err.decode('utf8', errors='replace').strip())
+            return None
+
+        out   = out.decode('utf8', errors='replace')
+        files = re.search(r'Number of (?:regular )?files transferred: ([\d,.]+)', out)
+        size  = re.search(r'Total transferred file size: ([\d,.]+)', out)
+        return paradux.transport.TreeStats(
+                int(re.sub(r'[,.]', '', files.group(1))) if files else 0,
+                int(re.sub(r'[,.]', '', size.group(1)))  if size  else 0)
+
+
+    def _remoteSpec(self, dataLocation):
+        """
+        Construct the rsync argument for the path of an ssh-based data location.
+
+        dataLocation: the DataLocation
+        return: the argument, such as user@host:path, without quotes
+        """
+        user, host, port, privKeyFile = paradux.sshpool.sshParametersFor(dataLocation)
+
+        path = dataLocation.url.path
+        if len(path) > 0:
+            path = path[1:] # remove leading /
+
+        if user is not None:
+            return user + "@" + host + ":" + path
+        return host + ":" + path
+
+
+    def _sshOption(self, user, host, port, privKeyFile, timeout=None):
+        """
+        Construct the option that makes rsync use the pooled ssh connection.
+
+        user: the user to log on as, or None
+        host: the host to connect to
+        port: the port to connect to, or None for the default
+        privKeyFile: name of the private key file to authenticate with, or None
+        timeout: if given, give up on establishing the connection after this many seconds
+        return: the option, with a leading space
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        ret = " -e \"ssh " + paradux.sshpool.defaultPool().getSshOptions(user, host, port, privKeyFile, timeout)
+
+        if port is not None:
+            ret += " -p " + str(port)
 
-    finally:
         if privKeyFile is not None:
-            os.unlink(privKeyFile.name)
+            ret += " -i " + privKeyFile
+
+        ret += "\""
+        return ret
+
+
+    def _bwlimitOption(self, destination):
+        """
+        Construct the option that keeps rsync within the bandwidth limits.
+
+        destination: DataLocation for upload
+        return: the option, with a leading space, or an empty string
+        """
+        rate = paradux.bandwidth.defaultGovernor().rateFor(destination)
+        if rate is None:
+            return ''
+        return " --bwlimit=" + str(max(1, rate // 1024)) # in KiB/s
+
 
-    return ret
+TRANSPORT = RsyncOverSshTransport()
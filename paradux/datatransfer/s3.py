@@ -0,0 +1,751 @@
+#!/usr/bin/python
+#
+# Functionality to copy files to and from Amazon S3, or another S3-compatible
+# service, using its REST API directly.
+#
+# URLs have the form s3://bucket/key. The credentials may name a region
+# ("aws-region") and, for services other than AWS, the base URL of the
+# API ("aws-endpoint"), such as http://localhost:9000.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import base64
+import concurrent.futures
+import datetime
+import email.utils
+import hashlib
+import hmac
+import http.client
+import os
+import paradux.bandwidth
+from paradux.data.credential import AwsApiCredentials
+import paradux.httppool
+import paradux.logging
+import paradux.transport
+import subprocess
+import threading
+import time
+from urllib.parse import quote, unquote, urlparse
+import xml.etree.ElementTree
+
+
+DEFAULT_REGION        = 'us-east-1'
+MULTIPART_THRESHOLD   = 16 * 1024 * 1024   # files larger than this are uploaded in parts
+PART_SIZE             = 8 * 1024 * 1024    # must be at least 5 MiB, except for the last part
+MAX_PARTS             = 10000              # S3 does not accept more parts than this
+STREAM_PARTS_PER_SIZE = 1000               # streams of unknown length: parts of each size before doubling it
+MAX_WORKERS           = 4                  # number of parts uploaded at the same time
+SHA256_META           = 'x-amz-meta-sha256' # holds the SHA-256 hash of the content of uploaded objects
+
+
+class S3Transport(paradux.transport.Transport):
+    """
+    Transfers objects with the S3 API, over pooled HTTP connections.
+    """
+    schemes      = ( 's3', )
+    capabilities = frozenset((
+            paradux.transport.STREAMING,
+            paradux.transport.RANGED_WRITES,
+            paradux.transport.RECORDED_HASH,
+            paradux.transport.ATOMIC_RENAME,
+            paradux.transport.DOWNLOAD,
+            paradux.transport.STAT,
+            paradux.transport.LIST ))
+
+
+    def upload(self, localFile, destination, timeout=None):
+        """
+        Implementation for this subclass. If the object there has the same
+        ETag as the local file would have, nothing is uploaded.
+        """
+        return self.uploadResumable(localFile, destination, None, timeout)
+
+
+    def uploadResumable(self, localFile, destination, checkpoint, timeout=None):
+        """
+        Implementation for this subclass. Large files are uploaded in parts;
+        the parts confirmed by S3 are recorded in the checkpoint, if given,
+        so an interrupted upload continues with the missing parts when
+        invoked again with the same checkpoint. If the object there has the
+        same ETag as the local file would have, nothing is uploaded.
+        """
+        client = _S3Client(destination, timeout)
+        try:
+            digests = _FileDigests(localFile)
+
+            head = client.head()
+            if head is not None and head.getheader('ETag', '').strip('"') == digests.etag():
+                paradux.logging.info('Object is unchanged, not uploading:', destination)
+                return True
+
+            if digests.size <= MULTIPART_THRESHOLD:
+                client.putObject(localFile, digests)
+            else:
+                client.putObjectInParts(localFile, digests, checkpoint)
+            return True
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('upload', timeout)
+
+        except ( S3Error, OSError, http.client.HTTPException ) as e:
+            paradux.logging.error('Uploading to', destination, 'failed:', e)
+            return False
+
+
+    def uploadStream(self, reader, destination, timeout=None):
+        """
+        Implementation for this subclass. As the content is not known in
+        advance, it is always uploaded: in a single request if it fits into
+        one part, such as the chunks of a chunk store, in parts otherwise.
+        """
+        client = _S3Client(destination, timeout)
+        try:
+            client.putStream(reader)
+            return True
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('upload', timeout)
+
+        except ( S3Error, OSError, ValueError, http.client.HTTPException ) as e:
+            paradux.logging.error('Uploading to', destination, 'failed:', e)
+            return False
+
+
+    def download(self, source, localFile, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        client = _S3Client(source, timeout)
+        try:
+            client.getObject(localFile)
+            return True
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('download', timeout)
+
+        except ( S3Error, OSError, http.client.HTTPException ) as e:
+            paradux.logging.error('Downloading from', source, 'failed:', e)
+            return False
+
+
+    def stat(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        client = _S3Client(location, timeout)
+        try:
+            head = client.head()
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('head', timeout)
+
+        if head is None:
+            return None
+
+        lastModified = head.getheader('Last-Modified')
+        return paradux.transport.RemoteStat(
+                int(head.getheader('Content-Length', '0')),
+                None if lastModified is None else int(email.utils.parsedate_to_datetime(lastModified).timestamp()))
+
+
+    def remoteHash(self, location, timeout=None):
+        """
+        Implementation for this subclass. The hash is the one recorded in the
+        metadata of the object when it was uploaded.
+        """
+        client = _S3Client(location, timeout)
+        try:
+            head = client.head()
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('head', timeout)
+
+        if head is None:
+            return None
+        return head.getheader(SHA256_META)
+
+
+    def list(self, location, timeout=None):
+        """
+        Implementation for this subclass. The key of the location is the
+        prefix of the keys of the objects listed, up to a /.
+        """
+        client = _S3Client(location, timeout)
+        try:
+            return client.listKeys()
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('list', timeout)
+
+
+    def close(self):
+        """
+        Implementation for this subclass.
+        """
+        paradux.httppool.closeDefaultPool()
+
+
+class S3Error(Exception):
+    """
+    The S3 API returned an error.
+
+    status: the HTTP status
+    code: the S3 error code, if any
+    """
+    def __init__(self, status, code, message):
+        super().__init__('HTTP ' + str(status) + ('' if code is None else ' ' + code) + ': ' + message)
+        self.status = status
+        self.code   = code
+
+
+class _FileDigests:
+    """
+    The checksums of a local file needed to upload it, obtained in a single
+    pass over the file.
+
+    size: size of the file
+    sha256: hex SHA-256 digest of the whole file
+    md5: binary MD5 digest of the whole file
+    partSize: the size of the parts the file is uploaded in, if it is uploaded in parts
+    parts: list of tuples (binary MD5 digest, hex SHA-256 digest), one per part of partSize
+    """
+    def __init__(self, fileName):
+        wholeSha256 = hashlib.sha256()
+        wholeMd5    = hashlib.md5()
+
+        # Large files need larger parts, to stay within MAX_PARTS; round up to MiB
+        self.partSize = PART_SIZE
+        fileSize      = os.path.getsize(fileName)
+        if fileSize > PART_SIZE * MAX_PARTS:
+            mib           = 1024 * 1024
+            self.partSize = ( fileSize // MAX_PARTS // mib + 1 ) * mib
+
+        self.size  = 0
+        self.parts = []
+        with open(fileName, 'rb') as fd:
+            while True:
+                buf = fd.read(self.partSize)
+                if not buf:
+                    break
+                self.size += len(buf)
+                wholeSha256.update(buf)
+                wholeMd5.update(buf)
+                self.parts.append( ( hashlib.md5(buf).digest(), hashlib.sha256(buf).hexdigest() ))
+
+        self.sha256 = wholeSha256.hexdigest()
+        self.md5    = wholeMd5.digest()
+
+
+    def etag(self):
+        """
+        Determine the ETag S3 assigns to an object with this content, when
+        uploaded the way upload() does it.
+
+        return: the ETag, without quotes
+        """
+        if self.size <= MULTIPART_THRESHOLD:
+            return self.md5.hex()
+
+        return hashlib.md5(b''.join( md5 for md5, sha256 in self.parts )).hexdigest() + '-' + str(len(self.parts))
+
+
+class _S3Client:
+    """
+    Makes signed (AWS Signature Version 4) requests regarding one object.
+
+    dataLocation: the s3:// DataLocation of the object
+    timeout: if given, give up after this many seconds
+    """
+    def __init__(self, dataLocation, timeout=None):
+        cred = dataLocation.credentials
+        if not isinstance(cred, AwsApiCredentials):
+            raise ValueError('No AWS API credentials given for: ' + str(dataLocation))
+
+        self.dataLocation = dataLocation
+        self.credentials  = cred
+        self.region       = cred.awsRegion or DEFAULT_REGION
+        self.deadline     = None if timeout is None else time.monotonic() + timeout
+
+        bucket = dataLocation.url.netloc
+        key    = unquote(dataLocation.url.path.lstrip('/'))
+
+        if cred.awsEndpoint is not None:
+            endpoint     = urlparse(cred.awsEndpoint)
+            self.scheme  = endpoint.scheme
+            self.host    = endpoint.hostname
+            self.port    = endpoint.port
+            bucketPath   = endpoint.path.rstrip('/') + '/' + bucket + '/'
+
+        elif '.' in bucket:
+            # Host names with dots in the bucket do not match the certificate
+            self.scheme  = 'https'
+            self.host    = 's3.' + self.region + '.amazonaws.com'
+            self.port    = None
+            bucketPath   = '/' + bucket + '/'
+
+        else:
+            self.scheme  = 'https'
+            self.host    = bucket + '.s3.' + self.region + '.amazonaws.com'
+            self.port    = None
+            bucketPath   = '/'
+
+        self.key        = key
+        self.bucketPath = quote(bucketPath, safe='/-_.~')
+        self.path       = quote(bucketPath + key, safe='/-_.~')
+
+
+    def head(self):
+        """
+        Obtain the metadata of the object.
+
+        return: HTTPResponse, or None if the object does not exist
+        """
+        status, response, body = self._request('HEAD')
+        if status == 404:
+            return None
+        self._check(status, body, 200)
+        return response
+
+
+    def putObject(self, localFile, digests):
+        """
+        Upload the local file in a single request.
+
+        localFile: name of the local file
+        digests: the _FileDigests of the local file
+        return: void
+        """
+        with open(localFile, 'rb') as fd:
+            body = fd.read()
+
+        self.putBytes(body, digests.md5, digests.sha256)
+
+
+    def putBytes(self, body, md5, sha256):
+        """
+        Upload bytes in a single request.
+
+        body: the bytes
+        md5: the binary MD5 digest of the bytes
+        sha256: the hex SHA-256 digest of the bytes
+        return: void
+        """
+        status, response, responseBody = self._request(
+                'PUT',
+                headers     = {
+                    'Content-MD5' : base64.b64encode(md5).decode('ascii'),
+                    SHA256_META   : sha256
+                },
+                body        = body,
+                payloadHash = sha256 )
+        self._check(status, responseBody, 200)
+
+
+    def putObjectInParts(self, localFile, digests, checkpoint=None):
+        """
+        Upload the local file in parts, several at the same time. If a
+        checkpoint is given, confirmed parts are recorded in it, and parts
+        confirmed in an earlier run are not uploaded again. Otherwise, if
+        the upload fails, the incomplete upload is aborted.
+
+        localFile: name of the local file
+        digests: the _FileDigests of the local file
+        checkpoint: the Checkpoint for this upload, or None
+        return: void
+        """
+        with open(localFile, 'rb') as fd:
+            def parts(done):
+                for i in range(len(digests.parts)):
+                    if i+1 in done:
+                        yield ( None, digests.parts[i] )
+                    else:
+                        yield ( os.pread(fd.fileno(), digests.partSize, i * digests.partSize), digests.parts[i] )
+
+            self._multipartUpload(parts, { SHA256_META : digests.sha256 }, checkpoint)
+
+
+    def putStream(self, reader):
+        """
+        Upload everything that can be read from a stream: in a single request
+        if it ends within the first part, in parts otherwise.
+
+        reader: file-like object whose content to upload
+        return: void
+        """
+        first = bytearray()
+        while len(first) < PART_SIZE:
+            buf = reader.read(PART_SIZE - len(first))
+            if not buf:
+                self.putBytes(first, hashlib.md5(first).digest(), hashlib.sha256(first).hexdigest())
+                return
+            first += buf
+
+        self.putStreamInParts(reader, first)
+
+
+    def putStreamInParts(self, reader, first=b''):
+        """
+        Upload everything that can be read from a stream in parts, several at
+        the same time. At most MAX_WORKERS parts are held in memory. As the
+        length of the stream is not known, the size of the parts doubles every
+        STREAM_PARTS_PER_SIZE parts, so even the largest objects S3 accepts
+        stay within MAX_PARTS.
+
+        reader: file-like object whose content to upload
+        first: bytes read from the stream already, to be uploaded first
+        return: void
+        """
+        def parts(done):
+            partNumber = 1
+            while True:
+                if partNumber > MAX_PARTS:
+                    raise ValueError('Stream is too long for a single object')
+                partSize = PART_SIZE << (( partNumber - 1 ) // STREAM_PARTS_PER_SIZE )
+
+                body = bytearray(first if partNumber == 1 else b'')
+                while len(body) < partSize:
+                    buf = reader.read(partSize - len(body))
+                    if not buf:
+                        break
+                    body += buf
+
+                if not body and partNumber > 1:
+                    break
+
+                yield ( body, ( hashlib.md5(body).digest(), hashlib.sha256(body).hexdigest() ))
+
+                if len(body) < partSize:
+                    break
+                partNumber += 1
+
+        self._multipartUpload(parts, {})
+
+
+    def _multipartUpload(self, parts, headers, checkpoint=None):
+        """
+        Perform a multipart upload, or continue the one in the checkpoint.
+        Parts are obtained from the iterator only once there is a worker
+        available to upload them. If the upload fails, the incomplete upload
+        is aborted, unless there is a checkpoint to resume it from.
+
+        parts: function that, given the set of numbers of the parts confirmed already,
+             returns an iterator over tuples of (body, ( binary MD5 digest, hex SHA-256 digest )),
+             where body is None for parts confirmed already
+        headers: dict of additional headers for the object
+        checkpoint: the Checkpoint for this upload, or None
+        return: void
+        """
+        uploadId, done = self._resumeMultipartUpload(checkpoint)
+        if uploadId is None:
+            status, response, body = self._request(
+                    'POST',
+                    query   = { 'uploads' : '' },
+                    headers = headers)
+            self._check(status, body, 200)
+            uploadId = self._findXmlText(body, 'UploadId')
+
+            if checkpoint is not None:
+                checkpoint.setUploadId(uploadId)
+                checkpoint.save()
+
+        try:
+            workers = threading.BoundedSemaphore(MAX_WORKERS)
+            futures = []
+            with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                for partNumber, ( partBody, partDigests ) in enumerate(parts(set(done.keys())), 1):
+                    if partBody is None:
+                        future = concurrent.futures.Future()
+                        future.set_result(done[partNumber])
+                        futures.append(future)
+                        continue
+
+                    workers.acquire()
+                    if any( future.done() and future.exception() is not None for future in futures ):
+                        workers.release()
+                        break
+
+                    future = executor.submit(self._putPart, partBody, uploadId, partNumber, partDigests, checkpoint)
+                    future.add_done_callback(lambda f: workers.release())
+                    futures.append(future)
+
+            etags = [ future.result() for future in futures ]
+
+            completeXml = '<CompleteMultipartUpload>'
+            for partNumber, etag in enumerate(etags, 1):
+                completeXml += '<Part><PartNumber>{0:d}</PartNumber><ETag>{1:s}</ETag></Part>'.format(partNumber, etag)
+            completeXml += '</CompleteMultipartUpload>'
+
+            status, response, body = self._request(
+                    'POST',
+                    query = { 'uploadId' : uploadId },
+                    body  = completeXml.encode('utf8'))
+            self._check(status, body, 200)
+
+            # S3 may report an error with status 200 once it has started responding
+            if b'<Error>' in body:
+                raise S3Error(status, self._findXmlText(body, 'Code'), self._findXmlText(body, 'Message'))
+
+        except BaseException:
+            if checkpoint is None:
+                self._abortMultipartUpload(uploadId)
+            raise
+
+
+    def _resumeMultipartUpload(self, checkpoint):
+        """
+        Determine which multipart upload to continue, if any, and which of its
+        parts S3 has confirmed. Parts only count if S3 reports the same
+        ETag as recorded in the checkpoint. An outdated upload remembered
+        by the checkpoint is aborted.
+
+        checkpoint: the Checkpoint for this upload, or None
+        return: tuple of (upload id or None, dict of part number to ETag)
+        """
+        if checkpoint is None:
+            return ( None, {} )
+
+        if checkpoint.previous is not None and checkpoint.previous.get('upload-id') is not None:
+            self._abortMultipartUpload(checkpoint.previous['upload-id'])
+
+        uploadId = checkpoint.getUploadId()
+        if uploadId is None:
+            return ( None, {} )
+
+        recorded  = checkpoint.getParts()
+        confirmed = {}
+        marker    = None
+        while True:
+            query = { 'uploadId' : uploadId }
+            if marker is not None:
+                query['part-number-marker'] = marker
+
+            status, response, body = self._request('GET', query = query)
+            if status == 404:
+                paradux.logging.info('Multipart upload has gone away, starting over:', uploadId)
+                return ( None, {} )
+            self._check(status, body, 200)
+
+            root = xml.etree.ElementTree.fromstring(body)
+            for part in root.findall('.//{*}Part'):
+                partNumber = int(part.find('{*}PartNumber').text)
+                etag       = part.find('{*}ETag').text
+                if recorded.get(partNumber) == etag:
+                    confirmed[partNumber] = etag
+
+            if self._findXmlText(body, 'IsTruncated') != 'true':
+                break
+            marker = self._findXmlText(body, 'NextPartNumberMarker')
+
+        paradux.logging.info('Resuming multipart upload with', len(confirmed), 'part(s) confirmed:', uploadId)
+        return ( uploadId, confirmed )
+
+
+    def _abortMultipartUpload(self, uploadId):
+        """
+        Abort a multipart upload, so S3 discards its parts.
+
+        uploadId: identifies the multipart upload
+        return: void
+        """
+        try:
+            self._request('DELETE', query = { 'uploadId' : uploadId })
+        except Exception as e:
+            paradux.logging.warning('Failed to abort multipart upload:', uploadId, e)
+
+
+    def _putPart(self, body, uploadId, partNumber, partDigests, checkpoint=None):
+        """
+        Upload one part of a multipart upload.
+
+        body: the content of the part
+        uploadId: identifies the multipart upload
+        partNumber: number of the part, starting with 1
+        partDigests: tuple of (binary MD5 digest, hex SHA-256 digest) of the part
+        checkpoint: if given, the Checkpoint in which to record the confirmed part
+        return: the ETag of the part
+        """
+        status, response, responseBody = self._request(
+                'PUT',
+                query       = { 'partNumber' : str(partNumber), 'uploadId' : uploadId },
+                headers     = { 'Content-MD5' : base64.b64encode(partDigests[0]).decode('ascii') },
+                body        = body,
+                payloadHash = partDigests[1] )
+        self._check(status, responseBody, 200)
+
+        etag = response.getheader('ETag')
+        if checkpoint is not None:
+            checkpoint.addPart(partNumber, etag, len(body))
+            checkpoint.save()
+        return etag
+
+
+    def getObject(self, localFile):
+        """
+        Download the object into a local file, without holding it in memory.
+
+        localFile: name of the local file
+        return: void
+        """
+        def writeTo(response):
+            with open(localFile, 'wb') as fd:
+                os.chmod(localFile, 0o600)
+                while True:
+                    buf = response.read(1024 * 1024)
+                    if not buf:
+                        break
+                    paradux.bandwidth.defaultGovernor().throttle(self.dataLocation, len(buf))
+                    fd.write(buf)
+
+        status, response, body = self._request('GET', onSuccess=writeTo)
+        self._check(status, body, 200)
+
+
+    def listKeys(self):
+        """
+        List the objects whose keys start with the key of this object,
+        followed by a /, as if it were a directory. Objects further down
+        are not included.
+
+        return: sorted list of the rest of the keys after the /
+        """
+        prefix = self.key if self.key == '' or self.key.endswith('/') else self.key + '/'
+        query  = { 'list-type' : '2', 'prefix' : prefix, 'delimiter' : '/' }
+        ret    = []
+        while True:
+            status, response, body = self._request('GET', query = query, path = self.bucketPath)
+            self._check(status, body, 200)
+
+            root = xml.etree.ElementTree.fromstring(body)
+            for keyElement in root.findall('./{*}Contents/{*}Key'):
+                ret.append(keyElement.text[len(prefix):])
+
+            if self._findXmlText(body, 'IsTruncated') != 'true':
+                break
+            query['continuation-token'] = self._findXmlText(body, 'NextContinuationToken')
+
+        return sorted(ret)
+
+
+    def _request(self, method, query=None, headers=None, body=b'', payloadHash=None, onSuccess=None, path=None):
+        """
+        Make a signed request, over a pooled connection if possible.
+
+        method: the HTTP method
+        query: dict of query parameters
+        headers: dict of additional headers
+        body: the request body
+        payloadHash: hex SHA-256 digest of body, if known already
+        onSuccess: if given, invoked with the response instead of reading the response
+             body if the status is 200
+        path: the quoted path of the request, if not the one of the object
+        return: tuple of (HTTP status, HTTPResponse, response body)
+        throws: TimeoutError if the timeout was reached
+        """
+        query   = query or {}
+        headers = dict(headers or {})
+        path    = self.path if path is None else path
+
+        if payloadHash is None:
+            payloadHash = hashlib.sha256(body).hexdigest()
+
+        hostHeader = self.host if self.port is None else self.host + ':' + str(self.port)
+        queryString = '&'.join(
+                quote(k, safe='-_.~') + '=' + quote(v, safe='-_.~')
+                for k, v in sorted(query.items()))
+        self._sign(method, hostHeader, path, queryString, headers, payloadHash)
+
+        target = path + ('?' + queryString if queryString else '')
+
+        if body:
+            paradux.bandwidth.defaultGovernor().throttle(self.dataLocation, len(body))
+
+        return paradux.httppool.defaultPool().request(
+                self.scheme, self.host, self.port, method, target, body, headers, self.deadline, onSuccess)
+
+
+    def _sign(self, method, hostHeader, path, queryString, headers, payloadHash):
+        """
+        Add the AWS Signature Version 4 headers to a request.
+
+        method: the HTTP method
+        hostHeader: value of the Host header
+        path: the quoted path of the request
+        queryString: the canonical query string
+        headers: dict of headers, which is updated
+        payloadHash: hex SHA-256 digest of the request body
+        return: void
+        """
+        now       = datetime.datetime.now(datetime.timezone.utc)
+        amzDate   = now.strftime('%Y%m%dT%H%M%SZ')
+        dateStamp = now.strftime('%Y%m%d')
+
+        headers['Host']                 = hostHeader
+        headers['x-amz-date']           = amzDate
+        headers['x-amz-content-sha256'] = payloadHash
+
+        canonicalHeaders = sorted( ( k.lower(), str(v).strip() ) for k, v in headers.items() )
+        signedHeaders    = ';'.join( k for k, v in canonicalHeaders )
+
+        canonicalRequest = '\n'.join([
+                method,
+                path,
+                queryString,
+                ''.join( k + ':' + v + '\n' for k, v in canonicalHeaders ),
+                signedHeaders,
+                payloadHash ])
+
+        scope        = dateStamp + '/' + self.region + '/s3/aws4_request'
+        stringToSign = '\n'.join([
+                'AWS4-HMAC-SHA256',
+                amzDate,
+                scope,
+                hashlib.sha256(canonicalRequest.encode('utf8')).hexdigest() ])
+
+        key = ( 'AWS4' + self.credentials.awsSecretKey ).encode('utf8')
+        for part in ( dateStamp, self.region, 's3', 'aws4_request' ):
+            key = hmac.new(key, part.encode('utf8'), hashlib.sha256).digest()
+        signature = hmac.new(key, stringToSign.encode('utf8'), hashlib.sha256).hexdigest()
+
+        headers['Authorization'] = 'AWS4-HMAC-SHA256 Credential={0:s}/{1:s}, SignedHeaders={2:s}, Signature={3:s}'.format(
+                self.credentials.awsAccessKey, scope, signedHeaders, signature )
+
+
+    def _check(self, status, body, expectedStatus):
+        """
+        Raise an S3Error unless the status is as expected.
+
+        status: the HTTP status
+        body: the response body, which may contain an S3 error document
+        expectedStatus: the expected HTTP status
+        return: void
+        """
+        if status != expectedStatus:
+            code    = self._findXmlText(body, 'Code')    if body else None
+            message = self._findXmlText(body, 'Message') if body else None
+            raise S3Error(status, code, message or 'Unexpected response')
+
+
+    @staticmethod
+    def _findXmlText(body, tag):
+        """
+        Find the text of the first element with this tag in an XML response body,
+        in whatever namespace.
+
+        body: the response body
+        tag: the tag
+        return: the text, or None
+        """
+        try:
+            root = xml.etree.ElementTree.fromstring(body)
+        except xml.etree.ElementTree.ParseError:
+            return None
+
+        if root.tag.split('}')[-1] == tag:
+            return root.text
+        element = root.find('.//{*}' + tag)
+        return None if element is None else element.text
+
+
+TRANSPORT = S3Transport()
@@ -6,70 +6,131 @@
 # All rights reserved. License: see package.
 #
 
-import inspect
-import os
-from paradux.data.credential import SshCredentials
+import paradux.bandwidth
+import paradux.datatransfer.rsync_over_ssh
+import paradux.sshpool
+import paradux.transport
 import paradux.utils
-from tempfile import NamedTemporaryFile
-
-def supportsProtocol(proto):
-    """
-    Determine whether this data transfer protocol support URL protocol
-    proto.
-
-    proto: the URL protocol, such as "scp"
-    return: True or False
-    """
-    return 'scp' == proto
+import time
 
 
-def upload(localFile, destination):
+class ScpTransport(paradux.transport.Transport):
     """
-    Upload the local file to the specified DataLocation.
-
-    localFile: name of the local file
-    destination: DataLocation for upload
-    return: True if successful
+    Copies files with scp. Everything else is done over the pooled ssh
+    connection.
     """
+    schemes      = ( 'scp', )
+    capabilities = frozenset((
+            paradux.transport.STREAMING,
+            paradux.transport.RANGED_WRITES,
+            paradux.transport.SERVER_SIDE_HASH,
+            paradux.transport.ATOMIC_RENAME,
+            paradux.transport.DOWNLOAD,
+            paradux.transport.STAT,
+            paradux.transport.LIST,
+            paradux.transport.TREES ))
+
+
+    def upload(self, localFile, destination, timeout=None):
+        """
+        Implementation for this subclass. scp itself writes into the
+        destination file; paradux uploads through uploadResumable(), which
+        renames once complete.
+        """
+        user, host, port, privKeyFile = paradux.sshpool.sshParametersFor(destination)
+        deadline = None if timeout is None else time.monotonic() + timeout
 
-    ret = True
-    try:
-        cred = destination.credentials
+        path = destination.url.path
+        if len(path) > 0:
+            path = path[1:] # remove leading /
 
         cmd = "scp"
+        cmd += " " + paradux.sshpool.defaultPool().getSshOptions(user, host, port, privKeyFile, timeout)
 
-        privKeyFile = None
-        if cred:
-            if isinstance(cred, SshCredentials):
-                privKeyFile = NamedTemporaryFile(delete=False)
-                privKeyFile.write(cred.private_key.encode())
-                privKeyFile.close()
-
-            else:
-                paradux.logging.fatal('Should not happen:', cred)
+        if port is not None:
+            cmd += " -P " + str(port)
 
         if privKeyFile is not None:
-            cmd += " -i '" + privKeyFile.name + "'"
+            cmd += " -i '" + privKeyFile + "'"
 
-        host = destination.url.hostname
-        path = destination.url.path
-
-        if len(path) > 0:
-            path = path[1:0] # remove leading /
+        rate = paradux.bandwidth.defaultGovernor().rateFor(destination)
+        if rate is not None:
+            cmd += " -l " + str(max(1, rate * 8 // 1000)) # in Kbit/s
 
         cmd += " '" + localFile + "'"
 
-        if privKeyFile is not None:
-            cmd += " '" + cred.username + "@" + host + ":" + path + "'"
+        if user is not None:
+            cmd += " '" + user + "@" + host + ":" + path + "'"
         else:
             cmd += " '" + host + ":" + path + "'"
 
-        exitCode = paradux.utils.myexec(cmd)
-        if exitCode != 0:
-            ret = 1
+        return paradux.utils.myexec(cmd, timeout=paradux.utils.remainingTime(deadline, timeout)) == 0
+
+
+    def uploadResumable(self, localFile, destination, checkpoint, timeout=None):
+        """
+        Implementation for this subclass. scp cannot resume, so this appends
+        to a remote temporary file over the pooled ssh connection.
+        """
+        return paradux.sshpool.uploadResumable(destination, localFile, checkpoint, timeout)
+
+
+    def uploadStream(self, reader, destination, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        return paradux.sshpool.uploadStream(destination, reader, timeout)
+
+
+    def download(self, source, localFile, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        return paradux.sshpool.download(source, localFile, timeout)
+
+
+    def stat(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        return paradux.sshpool.remoteStat(location, timeout)
+
+
+    def remoteHash(self, location, timeout=None):
+        """
+        Implementation for this subclass. Runs sha256sum on the remote host.
+        """
+        return paradux.sshpool.remoteSha256(location, timeout)
+
+
+    def list(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        return paradux.sshpool.remoteList(location, timeout)
+
+
+    def makeDirectories(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        return paradux.sshpool.remoteMakeDirectories(location, timeout)
+
+
+    def pullTree(self, source, localDir, timeout=None):
+        """
+        Implementation for this subclass. scp cannot tell what has changed,
+        so this uses rsync over the pooled ssh connection.
+        """
+        return paradux.datatransfer.rsync_over_ssh.TRANSPORT.pullTree(source, localDir, timeout)
+
+
+    def pushTree(self, localDir, destination, timeout=None):
+        """
+        Implementation for this subclass. scp cannot tell what has changed,
+        so this uses rsync over the pooled ssh connection.
+        """
+        return paradux.datatransfer.rsync_over_ssh.TRANSPORT.pushTree(localDir, destination, timeout)
 
-    finally:
-        if privKeyFile is not None:
-            os.unlink(privKeyFile.name)
 
-    return ret
+TRANSPORT = ScpTransport()
@@ -0,0 +1,231 @@
+#!/usr/bin/python
+#
+# Functionality to copy files via SFTP, in-process
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os
+import paradux.bandwidth
+import paradux.logging
+import paradux.sftp
+import paradux.sshpool
+import paradux.transport
+import time
+
+# Number of bytes after which the progress of a resumable upload is saved
+CHECKPOINT_INTERVAL = 8 * 1024 * 1024
+
+
+class SftpTransport(paradux.transport.Transport):
+    """
+    Copies files with SFTP, without starting a process per transfer: all
+    transfers to the same host share one long-lived session, over the
+    pooled ssh connection. Writes and reads are pipelined.
+    """
+    schemes      = ( 'sftp', )
+    capabilities = frozenset((
+            paradux.transport.STREAMING,
+            paradux.transport.RANGED_WRITES,
+            paradux.transport.SERVER_SIDE_HASH,
+            paradux.transport.ATOMIC_RENAME,
+            paradux.transport.DOWNLOAD,
+            paradux.transport.STAT,
+            paradux.transport.LIST ))
+
+
+    def upload(self, localFile, destination, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        with open(localFile, 'rb') as fd:
+            return self.uploadStream(fd, destination, timeout)
+
+
+    def uploadStream(self, reader, destination, timeout=None):
+        """
+        Implementation for this subclass. The content is written to a
+        temporary file first, which is renamed once complete.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        path     = paradux.sftp.sftpPath(destination.url.path)
+        tmpPath  = path + '.paradux-tmp'
+        reader   = paradux.bandwidth.defaultGovernor().throttledReader(reader, destination)
+
+        try:
+            session = paradux.sftp.defaultSessionPool().sessionFor(destination, deadline)
+            handle  = session.open(
+                    tmpPath,
+                    paradux.sftp.SSH_FXF_WRITE | paradux.sftp.SSH_FXF_CREAT | paradux.sftp.SSH_FXF_TRUNC,
+                    0o600,
+                    deadline)
+            try:
+                session.writeFrom(handle, reader, 0, deadline)
+            finally:
+                session.closeHandle(handle, deadline)
+
+            session.rename(tmpPath, path, deadline)
+            return True
+
+        except OSError as e:
+            paradux.logging.error('Uploading to', destination, 'failed:', e)
+            return False
+
+
+    def uploadResumable(self, localFile, destination, checkpoint, timeout=None):
+        """
+        Implementation for this subclass. The file is written to a remote
+        temporary file, which is renamed once complete. The server confirms
+        each write, so when resuming, writing continues after the bytes
+        confirmed in the checkpoint, as far as the temporary file still
+        holds them.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        path     = paradux.sftp.sftpPath(destination.url.path)
+
+        resumed    = checkpoint.isResumed()
+        remoteTemp = checkpoint.getRemoteTemp()
+        if remoteTemp is None:
+            remoteTemp = path + '.paradux-partial'
+            checkpoint.setRemoteTemp(remoteTemp)
+            checkpoint.save()
+
+        try:
+            session = paradux.sftp.defaultSessionPool().sessionFor(destination, deadline)
+
+            offset = 0
+            if resumed:
+                attrs = session.stat(remoteTemp, deadline)
+                if attrs is not None and 'size' in attrs:
+                    offset = min(attrs['size'], checkpoint.getBytesConfirmed())
+                if offset > 0:
+                    paradux.logging.info('Resuming upload to', destination, 'at byte', offset)
+
+            checkpoint.setBytesConfirmed(offset)
+            checkpoint.save()
+
+            flags = paradux.sftp.SSH_FXF_WRITE | paradux.sftp.SSH_FXF_CREAT
+            if offset == 0:
+                flags |= paradux.sftp.SSH_FXF_TRUNC
+
+            saved = { 'at' : offset }
+            def onConfirmed(n):
+                checkpoint.setBytesConfirmed(n)
+                if n - saved['at'] >= CHECKPOINT_INTERVAL:
+                    checkpoint.save()
+                    saved['at'] = n
+
+            handle = session.open(remoteTemp, flags, 0o600, deadline)
+            try:
+                with open(localFile, 'rb') as fd:
+                    fd.seek(offset)
+                    reader = paradux.bandwidth.defaultGovernor().throttledReader(fd, destination)
+                    session.writeFrom(handle, reader, offset, deadline, onConfirmed)
+            finally:
+                checkpoint.save()
+                session.closeHandle(handle, deadline)
+
+            session.rename(remoteTemp, path, deadline)
+            return True
+
+        except OSError as e:
+            paradux.logging.error('Uploading to', destination, 'failed:', e)
+            return False
+
+
+    def download(self, source, localFile, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        path     = paradux.sftp.sftpPath(source.url.path)
+
+        try:
+            session = paradux.sftp.defaultSessionPool().sessionFor(source, deadline)
+            attrs   = session.stat(path, deadline)
+            if attrs is None:
+                paradux.logging.error('Downloading from', source, 'failed: does not exist')
+                return False
+
+            handle = session.open(path, paradux.sftp.SSH_FXF_READ, None, deadline)
+            try:
+                with open(localFile, 'wb') as fd:
+                    os.chmod(localFile, 0o600)
+                    writer = paradux.bandwidth.defaultGovernor().throttledWriter(fd, source)
+                    session.readInto(handle, writer, attrs.get('size', 0), deadline)
+            finally:
+                session.closeHandle(handle, deadline)
+            return True
+
+        except OSError as e:
+            paradux.logging.error('Downloading from', source, 'failed:', e)
+            return False
+
+
+    def stat(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        session = paradux.sftp.defaultSessionPool().sessionFor(location, deadline)
+        attrs   = session.stat(paradux.sftp.sftpPath(location.url.path), deadline)
+        if attrs is None:
+            return None
+        return paradux.transport.RemoteStat(attrs.get('size'), attrs.get('mtime'))
+
+
+    def remoteHash(self, location, timeout=None):
+        """
+        Implementation for this subclass. SFTP cannot hash, so this runs
+        sha256sum on the remote host over the pooled ssh connection, which
+        fails on accounts restricted to SFTP.
+        """
+        return paradux.sshpool.remoteSha256(location, timeout)
+
+
+    def list(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        session = paradux.sftp.defaultSessionPool().sessionFor(location, deadline)
+        return session.listDir(paradux.sftp.sftpPath(location.url.path) or '.', deadline)
+
+
+    def makeDirectories(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        path     = paradux.sftp.sftpPath(location.url.path)
+
+        try:
+            session = paradux.sftp.defaultSessionPool().sessionFor(location, deadline)
+            if session.stat(path, deadline) is not None:
+                return True
+
+            prefix = '/' if path.startswith('/') else ''
+            for part in path.split('/'):
+                if part:
+                    prefix += part
+                    if session.stat(prefix, deadline) is None:
+                        session.makeDirectory(prefix, deadline)
+                    prefix += '/'
+            return True
+
+        except OSError as e:
+            paradux.logging.error('Cannot create directory at', location, ':', e)
+            return False
+
+
+    def close(self):
+        """
+        Implementation for this subclass.
+        """
+        paradux.sftp.closeDefaultSessionPool()
+
+
+TRANSPORT = SftpTransport()
@@ -0,0 +1,490 @@
+#!/usr/bin/python
+#
+# Functionality to copy files to and from web servers with HTTP PUT and GET,
+# and WebDAV shares such as Nextcloud or NAS boxes.
+#
+# URLs have the form http(s)://host/path or webdav(s)://host/path; the
+# latter are the same as the former, over http and https respectively.
+# The credentials, if any, are a user and password (Basic authentication).
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import base64
+import email.utils
+import hashlib
+import http.client
+import os
+import paradux.bandwidth
+from paradux.data.credential import PasswordCredentials
+import paradux.httppool
+import paradux.logging
+import paradux.transport
+import paradux.utils
+import subprocess
+import time
+from urllib.parse import quote, unquote, urlparse
+import xml.etree.ElementTree
+
+
+CHUNK_SIZE       = 1024 * 1024 # number of bytes sent or received at a time
+PARADUX_DAV_NS   = 'https://paradux.org/ns/webdav' # namespace of the WebDAV properties paradux sets
+SHA256_PROPERTY  = 'sha256'  # holds the SHA-256 hash of the content of uploaded files
+
+_SCHEMES = {
+    'http'    : 'http',
+    'https'   : 'https',
+    'webdav'  : 'http',
+    'webdavs' : 'https'
+}
+
+
+class WebdavTransport(paradux.transport.Transport):
+    """
+    Transfers files with HTTP PUT and GET, over pooled keep-alive
+    connections. Where the server speaks WebDAV, the hash of the content
+    is stored with each uploaded file as a property, so unchanged files
+    need not be uploaded again, and listing directories is possible.
+    """
+    schemes      = tuple(_SCHEMES.keys())
+    capabilities = frozenset((
+            paradux.transport.STREAMING,
+            paradux.transport.RECORDED_HASH,
+            paradux.transport.DOWNLOAD,
+            paradux.transport.STAT,
+            paradux.transport.LIST ))
+
+
+    def upload(self, localFile, destination, timeout=None):
+        """
+        Implementation for this subclass. If the file there has the same hash
+        as the local file, nothing is uploaded. Otherwise, the upload is
+        conditional on the file there not having changed since it was
+        looked at: a concurrent change makes the upload fail rather than
+        being overwritten.
+        """
+        client = _WebdavClient(destination, timeout)
+        try:
+            sha256 = paradux.utils.sha256OfFile(localFile)
+
+            props = client.properties()
+            if props is not None and props.get(SHA256_PROPERTY) == sha256:
+                paradux.logging.info('File is unchanged, not uploading:', destination)
+                return True
+
+            headers = { 'Content-Length' : str(os.path.getsize(localFile)) }
+            if props is None:
+                headers['If-None-Match'] = '*'
+            elif props.get('getetag') is not None:
+                headers['If-Match'] = props['getetag']
+
+            with open(localFile, 'rb') as fd:
+                client.put(_throttledChunks(fd, destination), headers, sha256)
+            return True
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('upload', timeout)
+
+        except ( WebdavError, OSError, http.client.HTTPException ) as e:
+            paradux.logging.error('Uploading to', destination, 'failed:', e)
+            return False
+
+
+    def uploadStream(self, reader, destination, timeout=None):
+        """
+        Implementation for this subclass. As the length of the content is not
+        known in advance, it is sent with chunked transfer encoding, which
+        not all servers accept.
+        """
+        client = _WebdavClient(destination, timeout)
+        try:
+            digest = hashlib.sha256()
+            client.put(_throttledChunks(reader, destination, digest), {}, digest)
+            return True
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('upload', timeout)
+
+        except ( WebdavError, OSError, http.client.HTTPException ) as e:
+            paradux.logging.error('Uploading to', destination, 'failed:', e)
+            return False
+
+
+    def download(self, source, localFile, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        client = _WebdavClient(source, timeout)
+        try:
+            client.get(localFile)
+            return True
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('download', timeout)
+
+        except ( WebdavError, OSError, http.client.HTTPException ) as e:
+            paradux.logging.error('Downloading from', source, 'failed:', e)
+            return False
+
+
+    def stat(self, location, timeout=None):
+        """
+        Implementation for this subclass.
+        """
+        client = _WebdavClient(location, timeout)
+        try:
+            head = client.head()
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('head', timeout)
+
+        if head is None:
+            return None
+
+        lastModified = head.getheader('Last-Modified')
+        return paradux.transport.RemoteStat(
+                int(head.getheader('Content-Length', '0')),
+                None if lastModified is None else int(email.utils.parsedate_to_datetime(lastModified).timestamp()))
+
+
+    def remoteHash(self, location, timeout=None):
+        """
+        Implementation for this subclass. The hash is the one stored as a
+        WebDAV property of the file when it was uploaded, if the server
+        speaks WebDAV.
+        """
+        client = _WebdavClient(location, timeout)
+        try:
+            props = client.properties()
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('propfind', timeout)
+
+        if props is None:
+            return None
+        return props.get(SHA256_PROPERTY)
+
+
+    def list(self, location, timeout=None):
+        """
+        Implementation for this subclass. Requires a server that speaks
+        WebDAV.
+        """
+        client = _WebdavClient(location, timeout)
+        try:
+            return client.listCollection()
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('propfind', timeout)
+
+
+    def makeDirectories(self, location, timeout=None):
+        """
+        Implementation for this subclass. Requires a server that speaks
+        WebDAV.
+        """
+        client = _WebdavClient(location, timeout)
+        try:
+            client.makeCollections()
+            return True
+
+        except TimeoutError:
+            raise subprocess.TimeoutExpired('mkcol', timeout)
+
+        except ( WebdavError, OSError, http.client.HTTPException ) as e:
+            paradux.logging.error('Cannot create directory at', location, ':', e)
+            return False
+
+
+    def close(self):
+        """
+        Implementation for this subclass.
+        """
+        paradux.httppool.closeDefaultPool()
+
+
+class WebdavError(Exception):
+    """
+    The server returned an unexpected HTTP status.
+
+    status: the HTTP status
+    """
+    def __init__(self, status, message):
+        super().__init__('HTTP ' + str(status) + ': ' + message)
+        self.status = status
+
+
+def _throttledChunks(reader, dataLocation, digest=None):
+    """
+    Read from a stream in chunks, within the bandwidth limits for the data
+    location.
+
+    reader: file-like object to read from
+    dataLocation: the DataLocation the chunks are sent to
+    digest: if given, a hashlib object updated with the chunks
+    return: generator of bytes
+    """
+    governor = paradux.bandwidth.defaultGovernor()
+    while True:
+        buf = reader.read(CHUNK_SIZE)
+        if not buf:
+            break
+        governor.throttle(dataLocation, len(buf))
+        if digest is not None:
+            digest.update(buf)
+        yield buf
+
+
+class _WebdavClient:
+    """
+    Makes requests regarding one file, or directory.
+
+    dataLocation: the DataLocation of the file
+    timeout: if given, give up after this many seconds
+    """
+    def __init__(self, dataLocation, timeout=None):
+        cred = dataLocation.credentials
+        if cred is not None and not isinstance(cred, PasswordCredentials):
+            raise ValueError('No user and password given for: ' + str(dataLocation))
+
+        url = dataLocation.url
+
+        self.dataLocation = dataLocation
+        self.scheme       = _SCHEMES[dataLocation.scheme]
+        self.host         = url.hostname
+        self.port         = url.port
+        self.path         = quote(unquote(url.path or '/'), safe="/-_.~!$&'()*+,;=:@")
+        self.deadline     = None if timeout is None else time.monotonic() + timeout
+
+        self.headers = {}
+        if cred is not None:
+            self.headers['Authorization'] = 'Basic ' + base64.b64encode(
+                    ( cred.username + ':' + cred.usersecret ).encode('utf8')).decode('ascii')
+
+
+    def head(self):
+        """
+        Obtain the headers of the file.
+
+        return: HTTPResponse, or None if the file does not exist
+        """
+        status, response, body = self._request('HEAD')
+        if status == 404:
+            return None
+        self._check(status, 200)
+        return response
+
+
+    def properties(self):
+        """
+        Obtain the WebDAV properties of the file that paradux uses. If the
+        server does not speak WebDAV, only the ETag is known.
+
+        return: dict from property name (without namespace) to value, or None
+             if the file does not exist
+        """
+        responses = self._propfind(self.path, 0)
+        if responses is None:
+            return None
+
+        if responses is False:
+            head = self.head()
+            if head is None:
+                return None
+            return { 'getetag' : head.getheader('ETag') }
+
+        for href, props in responses:
+            return props
+        return {}
+
+
+    def listCollection(self):
+        """
+        List the files in the directory this client is for.
+
+        return: sorted list of file names, or None if the directory does not exist
+        throws: NotImplementedError if the server does not speak WebDAV
+        """
+        path      = self.path if self.path.endswith('/') else self.path + '/'
+        responses = self._propfind(path, 1)
+        if responses is None:
+            return None
+        if responses is False:
+            raise NotImplementedError('Server does not speak WebDAV: ' + str(self.dataLocation))
+
+        ret = []
+        for href, props in responses:
+            name = unquote(urlparse(href).path).rstrip('/')
+            if name != unquote(path).rstrip('/'):
+                ret.append(name.split('/')[-1])
+        return sorted(ret)
+
+
+    def makeCollections(self):
+        """
+        Create the directory this client is for, and its parents, unless
+        they exist already. The parents are only looked at if the server
+        reports that they are missing.
+
+        return: void
+        """
+        parts = [ part for part in self.path.split('/') if part ]
+        if self._makeCollection('/' + '/'.join(parts) + '/'):
+            return
+
+        path = ''
+        for part in parts:
+            path += '/' + part
+            if not self._makeCollection(path + '/'):
+                raise WebdavError(409, 'Cannot create directory ' + unquote(path))
+
+
+    def put(self, chunks, headers, digest):
+        """
+        Upload content, and then store its hash as a WebDAV property of the
+        file, if the server speaks WebDAV. The property is only stored if
+        the file has not changed again in the meantime.
+
+        chunks: iterable of bytes, the content
+        headers: dict of additional headers, such as conditions
+        digest: hex SHA-256 digest of the content, or a hashlib object that
+             has seen all of it once chunks has been consumed
+        return: void
+        """
+        status, response, body = self._request('PUT', headers = headers, body = chunks)
+        if status == 412:
+            raise WebdavError(status, 'File has been changed by somebody else, not overwriting')
+        if status not in ( 200, 201, 204 ):
+            raise WebdavError(status, 'Unexpected response')
+
+        sha256 = digest if isinstance(digest, str) else digest.hexdigest()
+        etag   = response.getheader('ETag')
+
+        propHeaders = { 'Content-Type' : 'application/xml; charset="utf-8"' }
+        if etag is not None:
+            propHeaders['If-Match'] = etag
+
+        status, response, body = self._request(
+                'PROPPATCH',
+                headers = propHeaders,
+                body    = ( '<?xml version="1.0" encoding="utf-8"?>'
+                          + '<d:propertyupdate xmlns:d="DAV:" xmlns:p="' + PARADUX_DAV_NS + '">'
+                          + '<d:set><d:prop><p:' + SHA256_PROPERTY + '>' + sha256 + '</p:' + SHA256_PROPERTY + '></d:prop></d:set>'
+                          + '</d:propertyupdate>' ).encode('utf8'))
+        if status != 207:
+            paradux.logging.trace('Cannot store hash with', self.dataLocation, ': HTTP', status)
+
+
+    def get(self, localFile):
+        """
+        Download the file into a local file, without holding it in memory.
+
+        localFile: name of the local file
+        return: void
+        """
+        def writeTo(response):
+            with open(localFile, 'wb') as fd:
+                os.chmod(localFile, 0o600)
+                while True:
+                    buf = response.read(CHUNK_SIZE)
+                    if not buf:
+                        break
+                    paradux.bandwidth.defaultGovernor().throttle(self.dataLocation, len(buf))
+                    fd.write(buf)
+
+        status, response, body = self._request('GET', onSuccess=writeTo)
+        self._check(status, 200)
+
+
+    def _makeCollection(self, path):
+        """
+        Create a directory, unless it exists already.
+
+        path: the quoted path of the directory
+        return: True if it exists now, False if its parent does not exist
+        """
+        status, response, body = self._request('MKCOL', path = path)
+        if status == 409:
+            return False
+        if status not in ( 200, 201, 405 ): # 405: exists already
+            raise WebdavError(status, http.client.responses.get(status, 'Unexpected response'))
+        return True
+
+
+    def _propfind(self, path, depth):
+        """
+        Obtain the WebDAV properties that paradux uses of a file, or of the
+        files in a directory.
+
+        path: the quoted path of the file or directory
+        depth: 0 for the file or directory itself, 1 for the files in a directory as well
+        return: list of tuples (href, dict from property name to value), None if
+             it does not exist, or False if the server does not speak WebDAV
+        """
+        status, response, body = self._request(
+                'PROPFIND',
+                headers = {
+                    'Depth'        : str(depth),
+                    'Content-Type' : 'application/xml; charset="utf-8"'
+                },
+                body = ( '<?xml version="1.0" encoding="utf-8"?>'
+                       + '<d:propfind xmlns:d="DAV:" xmlns:p="' + PARADUX_DAV_NS + '"><d:prop>'
+                       + '<d:getetag/><d:getcontentlength/><d:getlastmodified/><p:' + SHA256_PROPERTY + '/>'
+                       + '</d:prop></d:propfind>' ).encode('utf8'),
+                path = path)
+        if status == 404:
+            return None
+        if status in ( 400, 405, 501 ):
+            return False
+        self._check(status, 207)
+
+        ret = []
+        root = xml.etree.ElementTree.fromstring(body)
+        for responseElement in root.findall('{DAV:}response'):
+            href  = responseElement.findtext('{DAV:}href')
+            props = {}
+            for propstat in responseElement.findall('{DAV:}propstat'):
+                if ' 200 ' not in ( propstat.findtext('{DAV:}status') or '' ) + ' ':
+                    continue
+                for prop in propstat.findall('{DAV:}prop/*'):
+                    if prop.text is not None:
+                        props[prop.tag.split('}')[-1]] = prop.text.strip()
+            ret.append(( href, props ))
+        return ret
+
+
+    def _request(self, method, headers=None, body=None, onSuccess=None, path=None):
+        """
+        Make a request, over a pooled connection if possible.
+
+        method: the HTTP method
+        headers: dict of additional headers
+        body: the request body: bytes, or an iterable of bytes
+        onSuccess: if given, invoked with the response instead of reading the response
+             body if the status is 2xx
+        path: the quoted path of the request, if not the one of the file
+        return: tuple of (HTTP status, HTTPResponse, response body)
+        throws: TimeoutError if the timeout was reached
+        """
+        allHeaders = dict(self.headers)
+        allHeaders.update(headers or {})
+
+        return paradux.httppool.defaultPool().request(
+                self.scheme, self.host, self.port, method, self.path if path is None else path,
+                body, allHeaders, self.deadline, onSuccess)
+
+
+    def _check(self, status, expectedStatus):
+        """
+        Raise a WebdavError unless the status is as expected.
+
+        status: the HTTP status
+        expectedStatus: the expected HTTP status
+        return: void
+        """
+        if status != expectedStatus:
+            raise WebdavError(status, http.client.responses.get(status, 'Unexpected response'))
+
+
+TRANSPORT = WebdavTransport()
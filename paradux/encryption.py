@@ -0,0 +1,405 @@
+#!/usr/bin/python
+#
+# Encrypts and decrypts what is backed up to destinations as a stream, so
+# third parties only ever see ciphertext. The stream is split into chunks
+# of a fixed size, each of which is sealed with an AEAD cipher under a key
+# derived for the file from the key of the dataset. Chunks are sealed in the
+# calling thread: with AES-NI, sealing runs at several GB/s on one core,
+# faster than handing the chunks to other processes.
+#
+# An encrypted file starts with a header, which is also the associated data
+# of every chunk:
+#   4 bytes:  MAGIC
+#   1 byte:   format version
+#   1 byte:   cipher id
+#   1 byte:   log2 of the chunk size
+#   1 byte:   reserved, 0
+#   32 bytes: random salt, unique per file
+# followed by the sealed chunks, each the size of the chunk plus TAG_SIZE,
+# except for the last one, which may be shorter. The key of the file is
+# derived with HKDF-SHA256 from the key of the dataset and the salt, so
+# however many files are encrypted with the key of a dataset, nonces never
+# repeat under the same key. The nonce of a chunk is 7 zero bytes, the
+# 4-byte index of the chunk and a byte that is 1 for the last chunk only, so
+# chunks cannot be reordered, and a truncated file does not decrypt.
+#
+# The Python package cryptography is only needed once something is
+# encrypted or decrypted.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os
+import paradux.logging
+import re
+
+
+MAGIC        = b'PDXE'
+VERSION      = 2
+HEADER_SIZE  = 40
+SALT_SIZE    = 32
+TAG_SIZE     = 16
+KEY_SIZE     = 32
+
+# Distinguishes the keys derived for files from others derived from the same key
+HKDF_INFO = b'paradux file key'
+
+# The beginning of the nonce of every chunk; unique keys per file make it unique
+NONCE_PREFIX = bytes(7)
+
+# Ciphers, keyed by id stored in the header
+CIPHER_AES_256_GCM       = 1
+CIPHER_CHACHA20_POLY1305 = 2
+
+CIPHERS = {
+    'aes-256-gcm'       : CIPHER_AES_256_GCM,
+    'chacha20-poly1305' : CIPHER_CHACHA20_POLY1305
+}
+
+DEFAULT_CIPHER     = 'aes-256-gcm'
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE     = 64 * 1024
+MAX_CHUNK_SIZE     = 64 * 1024 * 1024
+
+# The maximum number of chunks in a file, limited by the index in the nonce
+MAX_CHUNKS = 2**32
+
+_CHUNK_SIZE_REGEX = re.compile(r'(\d+)\s*([kKmM]?)$')
+
+
+def parseEncryptionJson(j):
+    """
+    Parse how a destination is to be encrypted. This is either true for the
+    defaults, the name of a cipher, or an object:
+    {
+        "cipher"     : "aes-256-gcm",
+        "chunk-size" : "1M"
+    }
+    The chunk size is a power of 2, in bytes, with an optional suffix k or M.
+
+    j: JSON fragment
+    return: EncryptionInfo, or None if not to be encrypted
+    """
+    if j is False or j is None:
+        return None
+    if j is True:
+        return EncryptionInfo()
+    if isinstance(j, str):
+        return EncryptionInfo(_parseCipher(j))
+    if isinstance(j, dict):
+        cipher    = _parseCipher(j['cipher'])         if 'cipher'     in j else DEFAULT_CIPHER
+        chunkSize = _parseChunkSize(j['chunk-size'])  if 'chunk-size' in j else DEFAULT_CHUNK_SIZE
+        return EncryptionInfo(cipher, chunkSize)
+
+    raise ValueError('Not a valid encryption: ' + str(j))
+
+
+def _parseCipher(j):
+    """
+    Parse the name of a cipher.
+
+    j: JSON fragment
+    return: the name of the cipher
+    """
+    if not isinstance(j, str) or j.strip().lower() not in CIPHERS:
+        raise ValueError('Unknown cipher: ' + str(j) + ', supported: ' + ', '.join(CIPHERS))
+    return j.strip().lower()
+
+
+def _parseChunkSize(j):
+    """
+    Parse the size of the chunks of the stream that are encrypted separately.
+
+    j: JSON fragment
+    return: the number of bytes
+    """
+    if isinstance(j, str):
+        m = _CHUNK_SIZE_REGEX.match(j.strip())
+        if m is None:
+            raise ValueError('Not a valid chunk size: ' + j)
+        ret = int(m.group(1)) * { '' : 1, 'k' : 1024, 'm' : 1024 * 1024 }[m.group(2).lower()]
+
+    elif isinstance(j, bool) or not isinstance(j, int):
+        raise ValueError('Not a valid chunk size: ' + str(j))
+
+    else:
+        ret = j
+
+    if ret < MIN_CHUNK_SIZE or ret > MAX_CHUNK_SIZE or ret & ( ret - 1 ):
+        raise ValueError('Chunk size must be a power of 2 between {0:d} and {1:d}: {2:s}'.format(MIN_CHUNK_SIZE, MAX_CHUNK_SIZE, str(j)))
+    return ret
+
+
+def generateKey():
+    """
+    Generate a new random key, such as for a dataset.
+
+    return: the key as bytes
+    """
+    return os.urandom(KEY_SIZE)
+
+
+def encryptChunks(reader, key, info):
+    """
+    Encrypt everything that can be read from a stream.
+
+    reader: file-like object whose content to encrypt
+    key: the key
+    info: the EncryptionInfo
+    return: generator of bytes: the header, then one sealed chunk at a time
+    """
+    cipherId = CIPHERS[info.cipher]
+    header   = MAGIC + bytes([ VERSION, cipherId, info.chunkSize.bit_length() - 1, 0 ]) + os.urandom(SALT_SIZE)
+
+    aeadCipher = _aeadFor(cipherId, _fileKey(key, header))
+    yield header
+
+    for index, chunk, isLast in _chunksOf(reader, info.chunkSize):
+        yield aeadCipher.encrypt(_nonce(index, isLast), chunk, header)
+
+
+def decryptChunks(reader, key):
+    """
+    Decrypt everything that can be read from a stream created by encryptChunks.
+
+    reader: file-like object whose content to decrypt
+    key: the key
+    return: generator of bytes: one decrypted chunk at a time
+    throws: ValueError if the stream is not encrypted, corrupted, truncated or encrypted with another key
+    """
+    header = _readFully(reader, HEADER_SIZE)
+    if len(header) < len(MAGIC) + 1 or header[0:len(MAGIC)] != MAGIC:
+        raise ValueError('Not encrypted')
+    if header[4] != VERSION:
+        raise ValueError('Unsupported encryption format version: ' + str(header[4]))
+    if len(header) < HEADER_SIZE:
+        raise ValueError('Encrypted data is truncated')
+
+    cipherId  = header[5]
+    chunkSize = 1 << header[6]
+    if cipherId not in CIPHERS.values() or chunkSize < MIN_CHUNK_SIZE or chunkSize > MAX_CHUNK_SIZE:
+        raise ValueError('Unsupported encryption: cipher {0:d}, chunk size {1:d}'.format(cipherId, chunkSize))
+
+    aeadCipher = _aeadFor(cipherId, _fileKey(key, header))
+
+    from cryptography.exceptions import InvalidTag
+    for index, chunk, isLast in _chunksOf(reader, chunkSize + TAG_SIZE):
+        try:
+            yield aeadCipher.decrypt(_nonce(index, isLast), chunk, header)
+        except InvalidTag:
+            raise ValueError('Encrypted data is corrupted, truncated, or encrypted with another key')
+
+
+class EncryptingReader:
+    """
+    A file-like object from which the encrypted content of another one can
+    be read, such as for uploading it as a stream.
+
+    reader: file-like object whose content to encrypt
+    key: the key
+    info: the EncryptionInfo
+    """
+    def __init__(self, reader, key, info):
+        self.chunks  = encryptChunks(reader, key, info)
+        self.pending = bytearray()
+        self.eof     = False
+
+
+    def read(self, size=-1):
+        """
+        Read encrypted bytes. Unless the end of the stream has been reached,
+        this returns exactly size bytes.
+
+        size: the number of bytes to read, or -1 for all remaining bytes
+        return: the bytes; empty at the end of the stream
+        """
+        while not self.eof and ( size < 0 or len(self.pending) < size ):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+            else:
+                self.pending += chunk
+
+        if size < 0 or size > len(self.pending):
+            size = len(self.pending)
+
+        ret = bytes(self.pending[:size])
+        del self.pending[:size]
+        return ret
+
+
+    def close(self):
+        """
+        Stop encrypting.
+
+        return: void
+        """
+        self.chunks.close()
+
+
+def encryptFile(inFile, outFile, key, info):
+    """
+    Encrypt a file into another, without holding either in memory.
+
+    inFile: name of the file to encrypt
+    outFile: name of the file to write
+    key: the key
+    info: the EncryptionInfo
+    return: tuple of (bytes read, bytes written)
+    """
+    bytesOut = 0
+    with open(inFile, 'rb') as inFd, open(outFile, 'wb') as outFd:
+        os.chmod(outFile, 0o600)
+
+        for chunk in encryptChunks(inFd, key, info):
+            outFd.write(chunk)
+            bytesOut += len(chunk)
+
+        bytesIn = inFd.tell()
+
+    paradux.logging.trace('Encrypted', inFile, bytesIn, '->', bytesOut)
+    return ( bytesIn, bytesOut )
+
+
+def decryptFile(inFile, outFile, key):
+    """
+    Decrypt a file created by encryptFile into another.
+
+    inFile: name of the file to decrypt
+    outFile: name of the file to write
+    key: the key
+    return: void
+    throws: ValueError if the file is not encrypted, corrupted, truncated or encrypted with another key
+    """
+    with open(inFile, 'rb') as inFd, open(outFile, 'wb') as outFd:
+        os.chmod(outFile, 0o600)
+
+        for chunk in decryptChunks(inFd, key):
+            outFd.write(chunk)
+
+
+def encryptedSize(size, info):
+    """
+    Determine the size of what encryptFile writes for a file.
+
+    size: the number of bytes in the file
+    info: the EncryptionInfo
+    return: the number of bytes written
+    """
+    chunks = max(1, -( -size // info.chunkSize )) # an empty file has one empty chunk
+    return HEADER_SIZE + size + chunks * TAG_SIZE
+
+
+def isEncrypted(fileName):
+    """
+    Determine whether a file has been encrypted by encryptFile.
+
+    fileName: name of the file
+    return: True or False
+    """
+    with open(fileName, 'rb') as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+
+class EncryptionInfo:
+    """
+    How what is backed up to a destination is encrypted.
+
+    cipher: name of the cipher, see CIPHERS
+    chunkSize: the number of bytes encrypted separately
+    """
+    def __init__(self, cipher=DEFAULT_CIPHER, chunkSize=DEFAULT_CHUNK_SIZE):
+        self.cipher    = cipher
+        self.chunkSize = chunkSize
+
+
+def _chunksOf(reader, size):
+    """
+    Split a stream into chunks, knowing which one is the last. An empty
+    stream has one empty chunk.
+
+    reader: file-like object to read from
+    size: the size of the chunks
+    return: generator of tuples (index, chunk, True if the last chunk)
+    """
+    chunk = _readFully(reader, size)
+    index = 0
+    while True:
+        nextChunk = _readFully(reader, size) if len(chunk) == size else b''
+        isLast    = not nextChunk
+        yield ( index, chunk, isLast )
+        if isLast:
+            return
+
+        index += 1
+        if index >= MAX_CHUNKS:
+            raise ValueError('Stream is too long to encrypt with this chunk size')
+        chunk = nextChunk
+
+
+def _readFully(reader, size):
+    """
+    Read from a stream until size bytes have been read or the stream ends.
+
+    reader: file-like object to read from
+    size: the number of bytes
+    return: the bytes
+    """
+    ret = reader.read(size)
+    while 0 < len(ret) < size:
+        more = reader.read(size - len(ret))
+        if not more:
+            break
+        ret += more
+    return ret
+
+
+def _nonce(index, isLast):
+    """
+    Determine the nonce of a chunk.
+
+    index: the index of the chunk
+    isLast: True if this is the last chunk
+    return: the nonce
+    """
+    return NONCE_PREFIX + index.to_bytes(4, 'big') + ( b'\1' if isLast else b'\0' )
+
+
+def _fileKey(key, header):
+    """
+    Derive the key of a file from the key of its dataset and the salt in
+    its header.
+
+    key: the key of the dataset
+    header: the header of the file
+    return: the key of the file
+    """
+    try:
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+    except ImportError:
+        raise RuntimeError('Encryption requires the Python package cryptography, which is not installed')
+
+    return HKDF(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=header[8:8+SALT_SIZE], info=HKDF_INFO).derive(key)
+
+
+def _aeadFor(cipherId, key):
+    """
+    Create the AEAD cipher object.
+
+    cipherId: id of the cipher
+    key: the key
+    return: object with encrypt() and decrypt() methods
+    """
+    try:
+        from cryptography.hazmat.primitives.ciphers import aead
+    except ImportError:
+        raise RuntimeError('Encryption requires the Python package cryptography, which is not installed')
+
+    if cipherId == CIPHER_AES_256_GCM:
+        return aead.AESGCM(key)
+    if cipherId == CIPHER_CHACHA20_POLY1305:
+        return aead.ChaCha20Poly1305(key)
+    raise ValueError('Unknown cipher: ' + str(cipherId))
+
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+#
+# Remembers how transfers to each data location have fared across runs, so
+# persistently unreachable locations do not stall every run, and spaces out
+# retries of failed transfers.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os
+import os.path
+import paradux.utils
+import random
+import statistics
+import threading
+import time
+
+
+# Number of most recent attempts and latencies remembered per location
+WINDOW = 10
+
+# Number of consecutive failures after which the circuit of a location opens
+CIRCUIT_THRESHOLD = 3
+
+# Number of seconds after the last failure during which an open circuit stays
+# open; after that, a single attempt is let through
+CIRCUIT_COOLDOWN = 3600
+
+
+class RetryPolicy:
+    """
+    Determines how long to wait before retrying a failed transfer: an
+    exponentially growing delay, of which a random fraction is taken, so
+    retries to the same host do not all happen at the same time.
+
+    baseDelay: number of seconds of the delay before the first retry
+    maxDelay: maximum number of seconds of any delay
+    """
+    def __init__(self, baseDelay=1.0, maxDelay=60.0):
+        self.baseDelay = baseDelay
+        self.maxDelay  = maxDelay
+
+
+    def delayFor(self, attempt):
+        """
+        Determine how long to wait after a failed attempt.
+
+        attempt: the number of the attempt that failed, starting with 1
+        return: number of seconds
+        """
+        return random.uniform(0, min(self.maxDelay, self.baseDelay * 2 ** (attempt - 1)))
+
+
+    def wait(self, attempt):
+        """
+        Wait after a failed attempt.
+
+        attempt: the number of the attempt that failed, starting with 1
+        return: void
+        """
+        delay = self.delayFor(attempt)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HealthRecord:
+    """
+    Remembers, for each data location, when a transfer to it last succeeded
+    and failed, whether the most recent attempts succeeded, and how long the
+    most recent successful ones took. A location whose most recent attempts
+    all failed has an open circuit: it should not be tried again until some
+    time has passed.
+
+    fileName: name of the JSON file that holds the record
+    """
+    def __init__(self, fileName):
+        self.fileName  = fileName
+        self.locations = {} # keyed by URL of the data location
+        self.lock      = threading.Lock()
+
+        if os.path.isfile(fileName):
+            j = paradux.utils.readJsonFromFile(fileName)
+            self.locations = j['locations']
+
+
+    def recordSuccess(self, location, latency):
+        """
+        Remember that a transfer to this location succeeded.
+
+        location: the data location
+        latency: the number of seconds the transfer took
+        return: void
+        """
+        with self.lock:
+            entry = self.locations.setdefault(str(location), {})
+            entry['last-success']         = paradux.utils.time2string(time.time())
+            entry['consecutive-failures'] = 0
+            entry['outcomes']             = ( entry.get('outcomes', []) + [ True ] )[-WINDOW:]
+            entry['latencies']            = ( entry.get('latencies', []) + [ round(latency, 3) ] )[-WINDOW:]
+
+
+    def recordFailure(self, location, error):
+        """
+        Remember that a transfer to this location failed.
+
+        location: the data location
+        error: description of what went wrong
+        return: void
+        """
+        with self.lock:
+            entry = self.locations.setdefault(str(location), {})
+            entry['last-failure']         = paradux.utils.time2string(time.time())
+            entry['last-error']           = error
+            entry['consecutive-failures'] = entry.get('consecutive-failures', 0) + 1
+            entry['outcomes']             = ( entry.get('outcomes', []) + [ False ] )[-WINDOW:]
+
+
+    def failureCount(self, location):
+        """
+        Determine how many of the most recent attempts to this location failed.
+
+        location: the data location
+        return: the number
+        """
+        with self.lock:
+            entry = self.locations.get(str(location), {})
+            return entry.get('outcomes', []).count(False)
+
+
+    def medianLatency(self, location):
+        """
+        Determine the median duration of the most recent successful transfers
+        to this location.
+
+        location: the data location
+        return: number of seconds, or None if not known
+        """
+        with self.lock:
+            latencies = self.locations.get(str(location), {}).get('latencies')
+            return statistics.median(latencies) if latencies else None
+
+
+    def isCircuitOpen(self, location, now=None):
+        """
+        Determine whether this location has failed so persistently that it
+        should not be tried now.
+
+        location: the data location
+        now: the UNIX time to check for, or None for now
+        return: True or False
+        """
+        with self.lock:
+            entry = self.locations.get(str(location), {})
+            if entry.get('consecutive-failures', 0) < CIRCUIT_THRESHOLD:
+                return False
+
+            if now is None:
+                now = time.time()
+            return now < paradux.utils.string2time(entry['last-failure']) + CIRCUIT_COOLDOWN
+
+
+    def prioritize(self, locations):
+        """
+        Sort locations so that those with open circuits come last, then
+        those that failed more often recently, then those that are slow.
+        Otherwise the sequence is kept.
+
+        locations: the data locations
+        return: sorted list of data locations
+        """
+        def key(location):
+            latency = self.medianLatency(location)
+            return (
+                    self.isCircuitOpen(location),
+                    self.failureCount(location),
+                    0.0 if latency is None else latency )
+        return sorted(locations, key=key)
+
+
+    def asText(self, location):
+        """
+        Show the health of this location to the user in plain text.
+
+        location: the data location
+        return: plain text
+        """
+        with self.lock:
+            entry = dict(self.locations.get(str(location), {}))
+
+        if not entry:
+            return 'no transfers recorded'
+
+        latency = self.medianLatency(location)
+        t = "{0:d} of last {1:d} failed".format(entry.get('outcomes', []).count(False), len(entry.get('outcomes', [])))
+        if latency is not None:
+            t += ", median {0:.1f}s".format(latency)
+        if 'last-success' in entry:
+            t += ", last success " + entry['last-success']
+        if self.isCircuitOpen(location):
+            t += ", circuit open: " + entry.get('last-error', '')
+        return t
+
+
+    def save(self):
+        """
+        Save this record to disk.
+
+        return: void
+        """
+        with self.lock:
+            j = { 'locations' : { k : dict(v) for k, v in self.locations.items() } }
+            tmpFile = self.fileName + '.tmp'
+            paradux.utils.writeJsonToFile(tmpFile, j, 0o600)
+            os.replace(tmpFile, self.fileName)
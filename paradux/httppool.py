@@ -0,0 +1,206 @@
+#!/usr/bin/python
+#
+# Pool of persistent (keep-alive) HTTP connections, so the TCP and TLS
+# handshakes only need to be performed once per server during a run.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import http.client
+import select
+import threading
+import time
+
+
+# The pool used by all data transfer protocols in this process
+_defaultPool     = None
+_defaultPoolLock = threading.Lock()
+
+# Number of idle connections kept per server
+MAX_IDLE_PER_SERVER = 8
+
+
+def defaultPool():
+    """
+    Obtain the HttpConnectionPool shared by all data transfers in this process.
+
+    return: HttpConnectionPool
+    """
+    global _defaultPool
+
+    with _defaultPoolLock:
+        if _defaultPool is None:
+            _defaultPool = HttpConnectionPool()
+        return _defaultPool
+
+
+def closeDefaultPool():
+    """
+    Close all idle connections in the default pool, if it has been created.
+
+    return: void
+    """
+    with _defaultPoolLock:
+        pool = _defaultPool
+
+    if pool is not None:
+        pool.close()
+
+
+class HttpConnectionPool:
+    """
+    Keeps idle HTTP connections open after a request, keyed by scheme, host
+    and port, and hands them out again for the next request to the same
+    server. Thread-safe; each connection is only used by one thread at a
+    time.
+    """
+    def __init__(self):
+        self.idle     = {} # ( scheme, host, port ) -> list of HTTPConnection
+        self.idleLock = threading.Lock()
+
+
+    def request(self, scheme, host, port, method, target, body=None, headers=None, deadline=None, onSuccess=None):
+        """
+        Make a request over a pooled connection if possible.
+
+        scheme: 'http' or 'https'
+        host: the host to connect to
+        port: the port to connect to, or None for the default
+        method: the HTTP method
+        target: the quoted path of the request, with query string
+        body: the request body: bytes, or an iterable of bytes, which is
+             sent with chunked transfer encoding unless headers has a Content-Length
+        headers: dict of headers
+        deadline: time.monotonic() by which the request must have completed, or None
+        onSuccess: if given, invoked with the response instead of reading the response
+             body if the status is 2xx
+        return: tuple of (HTTP status, HTTPResponse, response body)
+        throws: TimeoutError if the deadline was reached
+        """
+        headers = dict(headers or {})
+        chunked = body is not None and not isinstance(body, ( bytes, bytearray )) and 'Content-Length' not in headers
+        if chunked:
+            headers['Transfer-Encoding'] = 'chunked'
+
+        for attempt in ( 1, 2 ):
+            conn, reused = self._take(scheme, host, port, deadline)
+            try:
+                conn.request(method, target, body=body, headers=headers, encode_chunked=chunked)
+                response = conn.getresponse()
+                if onSuccess is not None and 200 <= response.status < 300:
+                    onSuccess(response)
+                    responseBody = b''
+                else:
+                    responseBody = response.read()
+
+            except ( http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError ):
+                conn.close()
+                if reused and attempt == 1 and isinstance(body, ( bytes, bytearray, type(None) )):
+                    continue # the server had closed the idle connection; a stream cannot be sent again
+                raise
+
+            except BaseException:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._give(scheme, host, port, conn)
+
+            return ( response.status, response, responseBody )
+
+
+    def close(self):
+        """
+        Close all idle connections. The pool may be used again afterwards.
+
+        return: void
+        """
+        with self.idleLock:
+            connections = [ conn for conns in self.idle.values() for conn in conns ]
+            self.idle.clear()
+
+        for conn in connections:
+            conn.close()
+
+
+    def _take(self, scheme, host, port, deadline):
+        """
+        Obtain an idle connection to the server, or create a new one. Its
+        socket timeout is the time remaining until the deadline. Idle
+        connections the server has closed in the meantime are skipped.
+
+        scheme: 'http' or 'https'
+        host: the host to connect to
+        port: the port to connect to, or None for the default
+        deadline: time.monotonic() by which the request must have completed, or None
+        return: tuple of (HTTPConnection, True if it was used before)
+        throws: TimeoutError if the deadline has passed
+        """
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError()
+
+        conn = None
+        with self.idleLock:
+            idle = self.idle.get(( scheme, host, port ))
+            while idle and conn is None:
+                conn = idle.pop()
+                if self._isClosedByServer(conn):
+                    conn.close()
+                    conn = None
+
+        reused = conn is not None
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(host, port)
+            else:
+                conn = http.client.HTTPConnection(host, port)
+
+        conn.timeout = remaining
+        if conn.sock is not None:
+            conn.sock.settimeout(remaining)
+
+        return ( conn, reused )
+
+
+    def _give(self, scheme, host, port, conn):
+        """
+        Make a connection available for reuse.
+
+        scheme: 'http' or 'https'
+        host: the host connected to
+        port: the port connected to, or None for the default
+        conn: the HTTPConnection
+        return: void
+        """
+        with self.idleLock:
+            idle = self.idle.setdefault(( scheme, host, port ), [])
+            if len(idle) < MAX_IDLE_PER_SERVER:
+                idle.append(conn)
+                conn = None
+
+        if conn is not None:
+            conn.close()
+
+
+    @staticmethod
+    def _isClosedByServer(conn):
+        """
+        Determine whether the server has closed an idle connection. An idle
+        connection has nothing to read unless the server closed it.
+
+        conn: the HTTPConnection
+        return: True or False
+        """
+        if conn.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([ conn.sock ], [], [], 0)
+        except ( OSError, ValueError ):
+            return True
+        return bool(readable)
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+#
+# Pool of worker processes for work that is bound by the CPU, such as
+# chunking what is backed up, so it can use all cores.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+
+
+# The pool used for all CPU-bound work in this process
+_defaultExecutor     = None
+_defaultExecutorLock = threading.Lock()
+
+
+def defaultExecutor():
+    """
+    Obtain the pool of processes shared by all CPU-bound work in this
+    process, with one process per CPU. The processes are spawned rather
+    than forked, as forking a process that runs threads is not safe. With
+    only one CPU, handing work to another process only adds overhead.
+
+    return: concurrent.futures.Executor, or None to do the work in the calling thread
+    """
+    global _defaultExecutor
+
+    if cpuCount() < 2:
+        return None
+
+    with _defaultExecutorLock:
+        if _defaultExecutor is None:
+            _defaultExecutor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers = cpuCount(),
+                    mp_context  = multiprocessing.get_context('spawn'))
+        return _defaultExecutor
+
+
+def closeDefaultExecutor():
+    """
+    Stop the processes of the default pool, if it has been created.
+
+    return: void
+    """
+    global _defaultExecutor
+
+    with _defaultExecutorLock:
+        executor         = _defaultExecutor
+        _defaultExecutor = None
+
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def cpuCount():
+    """
+    Determine the number of CPUs.
+
+    return: the number, at least 1
+    """
+    return os.cpu_count() or 1
+
+
+def mapInOrder(fn, tasks, executor):
+    """
+    Apply a function to each task, in parallel if there is an executor, and
+    emit the results in the sequence of the tasks. Only a bounded number of
+    tasks is outstanding, so memory use does not depend on the number of
+    tasks. Tasks are only handed to the executor once there is more than one.
+
+    fn: the function, which must be defined at module level if there is an executor
+    tasks: iterable of tuples of arguments to the function
+    executor: the Executor, or None
+    return: generator of results
+    """
+    tasks = iter(tasks)
+    first = next(tasks, None)
+    if first is None:
+        return
+    second = next(tasks, None)
+
+    if executor is None or second is None:
+        yield fn(*first)
+        if second is not None:
+            yield fn(*second)
+            for task in tasks:
+                yield fn(*task)
+        return
+
+    window  = 2 * cpuCount()
+    pending = collections.deque()
+    try:
+        for task in _prepended(( first, second ), tasks):
+            pending.append(executor.submit(fn, *task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _prepended(firsts, rest):
+    """
+    Iterate over some items, then over an iterator.
+
+    firsts: the first items
+    rest: the iterator
+    return: generator
+    """
+    yield from firsts
+    yield from rest
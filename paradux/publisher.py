@@ -0,0 +1,568 @@
+#!/usr/bin/python
+#
+# Uploads a file to several data locations concurrently.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import concurrent.futures
+import os.path
+import paradux.bandwidth
+import paradux.compression
+import hashlib
+import paradux.health
+import paradux.logging
+from paradux.stream import StreamChannel
+import paradux.utils
+import subprocess
+import threading
+import time
+
+
+class PublishRecord:
+    """
+    Remembers what was last confirmed to have been published to each data
+    location: the identity of the metadata it was exported from, and the hash
+    of the bytes that were uploaded. Every export differs, so only the
+    identity tells whether a location needs to be uploaded to again; the hash
+    tells whether the location still holds what was uploaded.
+
+    fileName: name of the JSON file that holds the record
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.hashes   = {} # keyed by URL of the data location
+        self.sources  = {} # keyed by URL of the data location
+        self.lock     = threading.Lock()
+
+        if os.path.isfile(fileName):
+            j = paradux.utils.readJsonFromFile(fileName)
+            self.hashes  = j['hashes']
+            self.sources = j.get('sources', {})
+
+
+    def getHash(self, location):
+        """
+        Obtain the hash of the content last confirmed at this location.
+
+        location: the data location
+        return: hex digest, or None
+        """
+        with self.lock:
+            return self.hashes.get(str(location))
+
+
+    def getSource(self, location):
+        """
+        Obtain the identity of what the content last confirmed at this
+        location was created from.
+
+        location: the data location
+        return: the identity, or None if not known
+        """
+        with self.lock:
+            return self.sources.get(str(location))
+
+
+    def confirm(self, location, contentHash, source=None):
+        """
+        Remember that content with this hash has been published to this location.
+
+        location: the data location
+        contentHash: hex digest of the published content
+        source: identity of what the content was created from, if known
+        return: void
+        """
+        with self.lock:
+            self.hashes[str(location)] = contentHash
+            if source is None:
+                self.sources.pop(str(location), None)
+            else:
+                self.sources[str(location)] = source
+
+
+    def save(self):
+        """
+        Save this record to disk.
+
+        return: void
+        """
+        with self.lock:
+            j = {
+                'hashes'  : dict(self.hashes),
+                'sources' : dict(self.sources)
+            }
+        paradux.utils.writeJsonToFile(self.fileName, j, 0o600)
+
+
+class UploadResult:
+    """
+    The outcome of uploading a file to one data location.
+
+    location: the data location
+    success: True if the upload was confirmed, or was not needed
+    skipped: True if the location already held the content, so no upload was needed
+    attempts: the number of upload attempts made
+    size: the number of bytes uploaded, after compression
+    duration: the number of seconds from the start of the first attempt to the end of the last
+    error: description of the most recent failure, if any
+    """
+    def __init__(self, location):
+        self.location = location
+        self.success  = False
+        self.skipped  = False
+        self.attempts = 0
+        self.size     = None
+        self.duration = None
+        self.error    = None
+
+
+    def asText(self):
+        """
+        Show this UploadResult to the user in plain text.
+
+        return: plain text
+        """
+        if self.skipped:
+            return "{0:7s} {1:s} (unchanged)".format('OK', str(self.location))
+
+        t = "{0:7s} {1:s} ({2:d} attempt(s), {3:.1f}s".format(
+                'OK' if self.success else 'FAILED',
+                str(self.location),
+                self.attempts,
+                0.0 if self.duration is None else self.duration )
+        if self.size is not None:
+            t += ", {0:d} bytes".format(self.size)
+        t += ")"
+        if not self.success and self.error is not None:
+            t += ": " + self.error
+        return t
+
+
+class Publisher:
+    """
+    Uploads a file to several data locations concurrently, with a timeout
+    and a retry budget for each. Locations that have failed recently are
+    tried last, and those that have failed persistently are skipped, as
+    remembered in the health record of the settings.
+
+    settings: the Settings, which know how to upload to a single data location
+    maxWorkers: the maximum number of uploads in progress at the same time
+    timeout: number of seconds after which an upload attempt is abandoned, or None;
+         used unless a location specifies its own
+    retries: number of times a failed upload is retried; used unless a
+         location specifies its own
+    publishRecord: if given, the PublishRecord used to skip locations that
+         already hold content created from the same source, and updated with
+         the successful uploads
+    force: if True, upload even to locations that already hold the content
+    compression: level at which to compress the uploaded file, 0 for none; used
+         unless a location specifies its own
+    retryPolicy: the RetryPolicy that determines how long to wait before a retry
+    skipUnhealthy: if True, skip locations whose circuit is open
+    """
+    def __init__(self, settings, maxWorkers=4, timeout=None, retries=0, publishRecord=None, force=False, compression=0, retryPolicy=None, skipUnhealthy=True):
+        self.settings      = settings
+        self.maxWorkers    = maxWorkers
+        self.timeout       = timeout
+        self.retries       = retries
+        self.publishRecord = publishRecord
+        self.force         = force
+        self.compression   = compression
+        self.retryPolicy   = paradux.health.RetryPolicy() if retryPolicy is None else retryPolicy
+        self.skipUnhealthy = skipUnhealthy
+
+
+    def publish(self, localFile, locations, quorum=None, onQuorum=None, source=None):
+        """
+        Upload the local file to all locations. This returns once all uploads
+        have either succeeded or given up. The file is compressed once for
+        each compression level needed, next to the local file.
+
+        localFile: name of the file to upload
+        locations: the data locations to upload to
+        quorum: if given, invoke onQuorum as soon as this many uploads have succeeded
+        onQuorum: function invoked with the list of UploadResult so far, while the other
+             uploads continue
+        source: identity of what the file was created from, such as Settings.metadataIdentity();
+             locations that hold content created from the same are skipped
+        return: list of UploadResult, in the sequence of locations
+        """
+        paradux.logging.trace('publish', localFile, len(locations))
+
+        results       = [ UploadResult(location) for location in locations ]
+        confirmed     = 0
+        quorumReached = False
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            levels   = set( self._compressionLevelFor(location) for location in locations )
+            variants = dict( executor.map( lambda level: ( level, self._prepareVariant(localFile, level, source)), levels ))
+
+            futures = [
+                    executor.submit(self._uploadWithRetries, *variants[self._compressionLevelFor(result.location)], result)
+                    for result in self._healthyFirst(results) ]
+
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                if result.success:
+                    confirmed += 1
+
+                if quorum is not None and not quorumReached and confirmed >= quorum:
+                    quorumReached = True
+                    if onQuorum is not None:
+                        onQuorum(results)
+
+        if self.publishRecord is not None:
+            self.publishRecord.save()
+
+        return results
+
+
+    def publishStream(self, openStream, locations, quorum=None, onQuorum=None, source=None):
+        """
+        Upload a stream to all locations, reading it only once for up to
+        maxWorkers locations: the bytes are handed to the uploads to all of
+        them at the same time, through bounded buffers, and compressed once
+        per compression level. Locations that hold content created from the
+        same source are skipped. Failed uploads that may be retried are
+        retried together, reading the stream again.
+
+        openStream: function without arguments that returns an iterable over the chunks
+             of the stream; invoked once per pass
+        locations: the data locations to upload to
+        quorum: if given, invoke onQuorum as soon as this many uploads have succeeded
+        onQuorum: function invoked with the list of UploadResult so far, while the other
+             uploads continue
+        source: identity of what the stream was created from, such as Settings.metadataIdentity();
+             locations that hold content created from the same are skipped
+        return: list of UploadResult, in the sequence of locations
+        """
+        paradux.logging.trace('publishStream', len(locations))
+
+        results = [ UploadResult(location) for location in locations ]
+        pending = []
+        state   = { 'confirmed' : 0, 'quorumReached' : False }
+
+        def onDone(result):
+            if result.success:
+                state['confirmed'] += 1
+
+            if quorum is not None and not state['quorumReached'] and state['confirmed'] >= quorum:
+                state['quorumReached'] = True
+                if onQuorum is not None:
+                    onQuorum(results)
+
+        for result in self._healthyFirst(results):
+            if self._isUnchanged(result.location, _variantSource(source, self._compressionLevelFor(result.location)), self._timeoutFor(result.location)):
+                paradux.logging.info('Skipping upload, location holds this content already:', result.location)
+                result.success = True
+                result.skipped = True
+                onDone(result)
+            else:
+                pending.append(result)
+
+        governor = paradux.bandwidth.defaultGovernor()
+        while len(pending) > 0:
+            batch, pending = governor.batchOf(pending, self.maxWorkers, lambda result: result.location)
+
+            self._streamPass(openStream, batch, onDone, source)
+
+            retried = []
+            for result in batch:
+                if not result.success and result.attempts <= self._retriesFor(result.location):
+                    paradux.logging.warning('Upload to', result.location, 'failed, retrying:', result.error)
+                    retried.append(result)
+
+            if len(retried) > 0:
+                if len(pending) == 0:
+                    # Nothing else to do in the meantime
+                    self.retryPolicy.wait(max( result.attempts for result in retried ))
+                pending += retried
+
+        if self.publishRecord is not None:
+            self.publishRecord.save()
+
+        return results
+
+
+    def _streamPass(self, openStream, results, onDone, source=None):
+        """
+        Read the stream once, and upload it to the locations of the results
+        at the same time.
+
+        openStream: function that returns an iterable over the chunks of the stream
+        results: the UploadResults of the locations, which are updated
+        onDone: function invoked with each UploadResult as soon as its upload has ended
+        source: identity of what the stream was created from, or None
+        return: void
+        """
+        channels = [ StreamChannel() for result in results ]
+
+        # One group per compression level: compressor, hash, channels
+        groups = {}
+        for result, channel in zip(results, channels):
+            level = self._compressionLevelFor(result.location)
+            if level not in groups:
+                groups[level] = (
+                        None if level == 0 else paradux.compression.StreamCompressor(level),
+                        hashlib.sha256(),
+                        [] )
+            groups[level][2].append(channel)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(results)+1) as executor:
+            producer = executor.submit(self._produceStream, openStream, groups.values(), channels)
+            futures  = [
+                    executor.submit(self._consumeStream, channel, result)
+                    for result, channel in zip(results, channels) ]
+
+            for future in concurrent.futures.as_completed(futures):
+                onDone(future.result())
+
+            try:
+                producer.result()
+            except Exception as e:
+                paradux.logging.error('Reading the stream failed:', e)
+
+        if self.publishRecord is not None:
+            for result in results:
+                if result.success:
+                    level = self._compressionLevelFor(result.location)
+                    self.publishRecord.confirm(result.location, groups[level][1].hexdigest(), _variantSource(source, level))
+
+
+    def _produceStream(self, openStream, groups, channels):
+        """
+        Read the stream, and hand it to all channels. Stops early if all
+        consumers have gone away.
+
+        openStream: function that returns an iterable over the chunks of the stream
+        groups: tuples of (compressor or None, hash, channels), one per compression level
+        channels: all channels
+        return: void
+        """
+        try:
+            for chunk in openStream():
+                for compressor, contentHash, groupChannels in groups:
+                    out = chunk if compressor is None else compressor.compress(chunk)
+                    if out:
+                        contentHash.update(out)
+                        for channel in groupChannels:
+                            channel.offer(out)
+
+                if all( channel.isClosed() for channel in channels ):
+                    break
+
+            for compressor, contentHash, groupChannels in groups:
+                if compressor is not None:
+                    out = compressor.flush()
+                    contentHash.update(out)
+                    for channel in groupChannels:
+                        channel.offer(out)
+
+            for channel in channels:
+                channel.end()
+
+        except BaseException as e:
+            for channel in channels:
+                channel.end(e)
+            raise
+
+
+    def _consumeStream(self, channel, result):
+        """
+        Upload what can be read from a channel to the location of the result.
+
+        channel: the StreamChannel
+        result: the UploadResult for the location, which is updated
+        return: the UploadResult
+        """
+        location = result.location
+        timeout  = self._timeoutFor(location)
+
+        result.attempts += 1
+        start = time.monotonic()
+        try:
+            result.success = self.settings.uploadStreamToDataLocation(channel, location, timeout)
+            if not result.success:
+                result.error = 'Upload failed'
+
+        except subprocess.TimeoutExpired:
+            result.error = 'Timed out after {0:g} seconds'.format(timeout)
+
+        except Exception as e:
+            result.error = str(type(e)) + ': ' + str(e)
+
+        finally:
+            channel.close()
+
+        result.duration = ( result.duration or 0.0 ) + time.monotonic() - start
+        result.size     = channel.bytesRead
+        return result
+
+
+    def _healthyFirst(self, results):
+        """
+        Sort the results so that the locations that have been healthy
+        recently come first. If unhealthy locations are to be skipped, the
+        results of those whose circuit is open are marked as skipped.
+
+        results: the UploadResults
+        return: sorted list of the UploadResults that are not skipped
+        """
+        healthRecord = self.settings.getHealthRecord()
+        byLocation   = { id(result.location) : result for result in results }
+
+        ret = []
+        for location in healthRecord.prioritize([ result.location for result in results ]):
+            result = byLocation[id(location)]
+            if self.skipUnhealthy and healthRecord.isCircuitOpen(location):
+                paradux.logging.warning('Skipping location that failed persistently:', location)
+                result.error = 'Skipped, failed persistently: ' + healthRecord.asText(location)
+            else:
+                ret.append(result)
+        return ret
+
+
+    def _timeoutFor(self, location):
+        """
+        Determine the timeout for uploads to a location.
+
+        location: the data location
+        return: number of seconds, or None
+        """
+        return self.timeout if getattr(location, 'timeout', None) is None else location.timeout
+
+
+    def _retriesFor(self, location):
+        """
+        Determine how often a failed upload to a location may be retried.
+
+        location: the data location
+        return: the number
+        """
+        return self.retries if getattr(location, 'retries', None) is None else location.retries
+
+
+    def _compressionLevelFor(self, location):
+        """
+        Determine the level at which to compress what is uploaded to a location.
+
+        location: the data location
+        return: the level, 0 for none
+        """
+        level = getattr(location, 'compression', None)
+        return self.compression if level is None else level
+
+
+    def _prepareVariant(self, localFile, level, source=None):
+        """
+        Create the file to be uploaded to all locations that use this compression level.
+
+        localFile: name of the uncompressed file
+        level: the compression level, 0 for none
+        source: identity of what the file was created from, or None
+        return: tuple of (name of the file to upload, hex digest of its content or None,
+             identity of what it was created from or None)
+        """
+        if level == 0:
+            fileName = localFile
+        else:
+            fileName = localFile + '.z' + str(level)
+            paradux.compression.compressFile(localFile, fileName, level)
+
+        if self.publishRecord is not None:
+            return ( fileName, paradux.utils.sha256OfFile(fileName), _variantSource(source, level) )
+        return ( fileName, None, None )
+
+
+    def _uploadWithRetries(self, localFile, localHash, source, result):
+        """
+        Upload to a single location, retrying as permitted.
+
+        localFile: name of the file to upload
+        localHash: hex digest of the content of the file, if known
+        source: identity of what the file was created from, if known
+        result: the UploadResult for the location, which is updated
+        return: the UploadResult
+        """
+        location = result.location
+        timeout  = self._timeoutFor(location)
+        retries  = self._retriesFor(location)
+
+        if self._isUnchanged(location, source, timeout):
+            paradux.logging.info('Skipping upload, location holds this content already:', location)
+            result.success = True
+            result.skipped = True
+            return result
+
+        start = time.monotonic()
+        while not result.success and result.attempts <= retries:
+            result.attempts += 1
+            try:
+                result.success = self.settings.uploadToDataLocation(localFile, location, timeout)
+                if not result.success:
+                    result.error = 'Upload failed'
+
+            except subprocess.TimeoutExpired:
+                result.error = 'Timed out after {0:g} seconds'.format(timeout)
+
+            except Exception as e:
+                result.error = str(type(e)) + ': ' + str(e)
+
+            if not result.success and result.attempts <= retries:
+                paradux.logging.warning('Upload to', location, 'failed, retrying:', result.error)
+                self.retryPolicy.wait(result.attempts)
+
+        result.duration = time.monotonic() - start
+        result.size     = os.path.getsize(localFile)
+
+        if result.success and localHash is not None:
+            self.publishRecord.confirm(location, localHash, source)
+
+        return result
+
+
+    def _isUnchanged(self, location, source, timeout):
+        """
+        Determine whether the location already holds content created from the
+        same source. This is the case if such content was last published
+        there, and, if the remote hash can be determined, the remote copy
+        still has the hash of what was published.
+
+        location: the data location
+        source: identity of what the content is created from, if known
+        timeout: if given, give up determining the remote hash after this many seconds
+        return: True or False
+        """
+        if self.force or source is None or self.publishRecord is None:
+            return False
+
+        if self.publishRecord.getSource(location) != source:
+            return False
+
+        # The hash recorded at upload time will do: it is only compared with what
+        # was uploaded from here
+        if not self.settings.canDetermineRemoteHash(location, recorded=True):
+            return True
+
+        try:
+            return self.settings.remoteHashOfDataLocation(location, timeout, recorded=True) == self.publishRecord.getHash(location)
+
+        except Exception as e:
+            paradux.logging.info('Cannot determine remote hash, uploading:', location, e)
+            return False
+
+
+def _variantSource(source, level):
+    """
+    Determine the identity of what is uploaded at a compression level, given
+    the identity of what it is created from.
+
+    source: identity of what the uploaded content is created from, or None
+    level: the compression level, 0 for none
+    return: the identity, or None
+    """
+    if source is None:
+        return None
+    return source + '/z' + str(level)
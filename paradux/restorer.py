@@ -0,0 +1,606 @@
+#!/usr/bin/python
+#
+# Restores a dataset from its destinations into a local directory.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import concurrent.futures
+import os
+import os.path
+import paradux.chunkstore
+import paradux.data.datalocation
+import paradux.encryption
+import paradux.logging
+import paradux.processpool
+import paradux.transport
+import paradux.utils
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+
+# Number of files or chunks whose presence is checked when probing a destination
+PROBE_SAMPLES = 4
+
+
+class ProbeResult:
+    """
+    What probing a destination of a dataset found out.
+
+    location: the destination data location
+    usable: True if the dataset can be restored from here
+    complete: True if the samples checked were all present, False if some were
+         missing, None if nothing could be checked
+    latency: the number of seconds the first request took, or None
+    files: dict from path to dict with 'size', 'mtime-ns', 'sha256' (may be None) and,
+         for chunk stores, 'chunks'; or None if not known, so the whole tree must be pulled
+    snapshot: description of the snapshot found, or None
+    chunkStore: the ChunkStore, if the destination is one
+    error: description of the failure, if any
+    """
+    def __init__(self, location):
+        self.location   = location
+        self.usable     = False
+        self.complete   = None
+        self.latency    = None
+        self.files      = None
+        self.snapshot   = None
+        self.chunkStore = None
+        self.error      = None
+
+
+    def asText(self):
+        """
+        Show this ProbeResult to the user in plain text.
+
+        return: plain text
+        """
+        if not self.usable:
+            return "    {0:10s} {1:s}: {2:s}".format('UNUSABLE', str(self.location), self.error or 'unknown error')
+
+        return "    {0:10s} {1:s} ({2:s}, {3:s}, latency {4:s})".format(
+                { True : 'COMPLETE', False : 'INCOMPLETE', None : 'UNVERIFIED' }[self.complete],
+                str(self.location),
+                'all files' if self.files is None else str(len(self.files)) + ' files',
+                'snapshot ' + self.snapshot if self.snapshot else 'latest',
+                '-' if self.latency is None else '{0:.3f}s'.format(self.latency))
+
+
+class RestoreResult:
+    """
+    The outcome of restoring a dataset.
+
+    dataset: the Dataset
+    targetDir: the directory restored into
+    success: True if everything was restored and verified
+    probes: list of ProbeResult, best first
+    files: the number of files restored
+    bytes: the number of bytes in the files restored
+    sources: dict from URL of the destination to the number of files restored from there
+    duration: the number of seconds the restore took
+    error: description of the failure, if any
+    """
+    def __init__(self, dataset, targetDir):
+        self.dataset   = dataset
+        self.targetDir = targetDir
+        self.success   = False
+        self.probes    = []
+        self.files     = 0
+        self.bytes     = 0
+        self.sources   = {}
+        self.duration  = None
+        self.error     = None
+
+
+    def asText(self):
+        """
+        Show this RestoreResult to the user in plain text.
+
+        return: plain text
+        """
+        t = "{0:7s} {1:s} -> {2:s} ({3:d} files, {4:d} bytes, {5:.1f}s)".format(
+                'OK' if self.success else 'FAILED',
+                self.dataset.name,
+                self.targetDir,
+                self.files,
+                self.bytes,
+                0.0 if self.duration is None else self.duration )
+        if self.error is not None:
+            t += ": " + self.error
+        for probe in self.probes:
+            t += "\n" + probe.asText()
+            if str(probe.location) in self.sources:
+                t += " -- restored {0:d} files".format(self.sources[str(probe.location)])
+        return t
+
+
+class Restorer:
+    """
+    Restores datasets. All destinations of a dataset are probed concurrently
+    for how quickly they respond and whether they hold everything; the best
+    one determines which files to restore. Each file is then fetched by one
+    of many parallel workers from whichever destination that holds the same
+    version of it is least busy, so fetches are striped across equivalent
+    destinations, and a failed or corrupted fetch is retried from the next.
+    Files are verified against their hashes, and only once all are in place
+    does the restored tree replace the target directory.
+
+    settings: the Settings
+    maxWorkers: the maximum number of files fetched at the same time, and of chunks
+    timeout: number of seconds after which a restore is abandoned, or None
+    datasetKeys: dict from dataset name to the key of its encrypted destinations
+    catalog: the Catalog that knows which files the destinations hold, or None
+    """
+    def __init__(self, settings, maxWorkers=8, timeout=None, datasetKeys=None, catalog=None):
+        self.settings    = settings
+        self.maxWorkers  = maxWorkers
+        self.timeout     = timeout
+        self.datasetKeys = datasetKeys or {}
+        self.catalog     = catalog
+        self.busy        = {}   # URL of destination -> number of fetches in progress
+        self.busyLock    = threading.Lock()
+
+
+    def probe(self, dataset, asOf=None, locations=None):
+        """
+        Probe destinations of a dataset concurrently.
+
+        dataset: the Dataset
+        asOf: UNIX time to restore the dataset as of, or None for the latest
+        locations: the destinations to probe, or None for all destinations of the dataset
+        return: list of ProbeResult, best first
+        """
+        if locations is None:
+            locations = dataset.destinations
+
+        results = [ ProbeResult(location) for location in locations ]
+        if results:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(results)) as executor:
+                for future in [ executor.submit(self._probe, dataset, asOf, result) for result in results ]:
+                    future.result()
+
+        health = self.settings.getHealthRecord()
+        def key(result):
+            return (
+                    not result.usable,
+                    { True : 0, None : 1, False : 2 }[result.complete],
+                    health.isCircuitOpen(result.location),
+                    float('inf') if result.latency is None else result.latency )
+        return sorted(results, key=key)
+
+
+    def restore(self, dataset, targetDir, asOf=None, locations=None, replace=False):
+        """
+        Restore a dataset into a local directory. The directory must not
+        exist or be empty, unless replace is given.
+
+        dataset: the Dataset
+        targetDir: the local directory
+        asOf: UNIX time to restore the dataset as of, or None for the latest
+        locations: the destinations to restore from, or None for all destinations of the dataset
+        replace: if True, replace the content of the directory
+        return: RestoreResult
+        """
+        result   = RestoreResult(dataset, targetDir)
+        start    = time.monotonic()
+        deadline = None if self.timeout is None else start + self.timeout
+
+        if not replace and os.path.isdir(targetDir) and os.listdir(targetDir):
+            result.error = 'Directory is not empty'
+            return result
+        if os.path.exists(targetDir) and not os.path.isdir(targetDir):
+            result.error = 'Not a directory'
+            return result
+
+        result.probes = self.probe(dataset, asOf, locations)
+        usable = [ probe for probe in result.probes if probe.usable ]
+        if not usable:
+            result.error = 'No destination can be restored from'
+            return result
+
+        best = usable[0]
+        paradux.logging.info('Restoring', dataset.name, 'from', best.location)
+
+        parentDir = os.path.dirname(os.path.abspath(targetDir))
+        os.makedirs(parentDir, exist_ok=True)
+        workDir = tempfile.mkdtemp(prefix='.' + os.path.basename(os.path.abspath(targetDir)) + '.restoring-', dir=parentDir)
+        try:
+            if best.files is None:
+                self._pullAll(best, workDir, deadline, result)
+            else:
+                self._fetchAll(best, usable, workDir, deadline, result)
+
+            if result.error is None:
+                _install(workDir, targetDir)
+                workDir        = None
+                result.success = True
+
+        except subprocess.TimeoutExpired as e:
+            result.error = 'Timed out after {0:g} seconds'.format(e.timeout)
+
+        except Exception as e:
+            result.error = str(type(e)) + ': ' + str(e)
+
+        finally:
+            if workDir is not None:
+                shutil.rmtree(workDir, ignore_errors=True)
+
+        result.duration = time.monotonic() - start
+        return result
+
+
+    def _probe(self, dataset, asOf, result):
+        """
+        Probe one destination.
+
+        dataset: the Dataset
+        asOf: UNIX time to restore the dataset as of, or None for the latest
+        result: the ProbeResult, which is updated
+        return: void
+        """
+        location = result.location
+        try:
+            protocol = self.settings.findDataTransferProtocolFor(location)
+            if protocol is None:
+                result.error = 'No support for this protocol'
+                return
+
+            key = self.datasetKeys.get(dataset.name)
+            if location.encryption_info is not None and key is None:
+                result.error = 'No key to decrypt with'
+                return
+
+            if location.storage_format == paradux.data.datalocation.FORMAT_CHUNKS:
+                self._probeChunkStore(protocol, key, asOf, result)
+            else:
+                self._probeTree(protocol, dataset, asOf, result)
+
+        except subprocess.TimeoutExpired as e:
+            result.error = 'Timed out after {0:g} seconds'.format(e.timeout)
+
+        except Exception as e:
+            result.error = str(type(e)) + ': ' + str(e)
+
+
+    def _probeChunkStore(self, protocol, key, asOf, result):
+        """
+        Probe a destination that is a chunk store: obtain the manifest of the
+        snapshot, and check that some of its chunks are there.
+
+        protocol: the Transport for the destination
+        key: the key of the dataset, or None
+        asOf: UNIX time to restore the dataset as of, or None for the latest
+        result: the ProbeResult, which is updated
+        return: void
+        """
+        if not protocol.has(paradux.transport.DOWNLOAD):
+            result.error = 'Cannot download with this protocol'
+            return
+
+        store = paradux.chunkstore.ChunkStore(self.settings, protocol, result.location, key)
+        store.close() # the local index is not needed for reading
+
+        start        = time.monotonic()
+        manifestPath = store.snapshotAsOf(asOf, self.timeout)
+        if manifestPath is None:
+            result.error = 'No snapshot found'
+            return
+
+        manifest = store.readManifest(manifestPath, self.timeout)
+        if manifest is None:
+            result.error = 'Cannot download manifest ' + manifestPath
+            return
+        result.latency = time.monotonic() - start
+
+        result.chunkStore = store
+        result.snapshot   = manifest['created']
+        result.files      = manifest['files']
+        result.usable     = True
+
+        chunks = [ name for entry in result.files.values() for name in entry['chunks'] ]
+        found  = [ store.hasChunk(name, self.timeout) for name in random.sample(chunks, min(PROBE_SAMPLES, len(chunks))) ]
+        result.complete = _completeness(found)
+
+
+    def _probeTree(self, protocol, dataset, asOf, result):
+        """
+        Probe a destination that holds a copy of the directory hierarchy: find
+        which files it holds in the catalog, and check that some of them are
+        there. If the catalog does not know, the whole tree needs to be pulled.
+        Such a destination only holds its latest copy, so it cannot restore
+        as of an earlier snapshot.
+
+        protocol: the Transport for the destination
+        dataset: the Dataset
+        asOf: UNIX time to restore the dataset as of, or None for the latest
+        result: the ProbeResult, which is updated
+        return: void
+        """
+        location       = result.location
+        encryptionInfo = location.encryption_info
+
+        entries = []
+        if self.catalog is not None:
+            entries = [ entry for entry in self.catalog.find('', asOf, dataset.name) if entry.destination == str(location) ]
+
+        if asOf is not None and entries and entries[0].snapshotTime != self.catalog.latestSnapshotTime(dataset.name, str(location)):
+            result.error = 'Only holds a newer copy than requested'
+            return
+
+        if entries and protocol.has(paradux.transport.DOWNLOAD):
+            result.files = {
+                entry.path : {
+                    'size'     : entry.size,
+                    'mtime-ns' : entry.mtimeNs,
+                    'sha256'   : entry.hash
+                } for entry in entries }
+            result.snapshot = entries[0].snapshotName or paradux.utils.time2string(entries[0].snapshotTime)
+
+        elif protocol.has(paradux.transport.TREES) and asOf is None:
+            result.files = None # the whole tree, as it is now
+
+        elif asOf is not None and not entries:
+            result.error = 'The catalog does not know what was held then'
+            return
+
+        else:
+            result.error = 'Cannot download with this protocol'
+            return
+
+        result.usable = True
+
+        if not protocol.has(paradux.transport.STAT):
+            return
+
+        if result.files is None:
+            start = time.monotonic()
+            protocol.stat(location, timeout=self.timeout)
+            result.latency = time.monotonic() - start
+            return
+
+        found = []
+        for path in random.sample(sorted(result.files), min(PROBE_SAMPLES, len(result.files))):
+            size = result.files[path]['size']
+            if encryptionInfo is not None:
+                size = paradux.encryption.encryptedSize(size, encryptionInfo)
+
+            start = time.monotonic()
+            stat  = protocol.stat(location.childLocation(path), timeout=self.timeout)
+            if result.latency is None:
+                result.latency = time.monotonic() - start
+            found.append(stat is not None and stat.size == size)
+
+        result.complete = _completeness(found)
+
+
+    def _pullAll(self, probe, workDir, deadline, result):
+        """
+        Pull the whole tree from a destination whose files are not known,
+        decrypting them if needed.
+
+        probe: the ProbeResult of the destination
+        workDir: the directory to restore into
+        deadline: time.monotonic() by which the restore must have completed, or None
+        result: the RestoreResult, which is updated
+        return: void
+        """
+        location = probe.location
+        stats    = self.settings.pullTreeFromDataLocation(location, workDir, paradux.utils.remainingTime(deadline, self.timeout))
+        if stats is None:
+            result.error = 'Pull failed'
+            return
+
+        key = self.datasetKeys.get(result.dataset.name)
+        for path, localFile, st in paradux.chunkstore.filesIn(workDir):
+            if location.encryption_info is not None:
+                # Authenticated, so a corrupted file does not decrypt
+                tmpFile = localFile + '.decrypting'
+                paradux.encryption.decryptFile(localFile, tmpFile, key)
+                os.replace(tmpFile, localFile)
+                os.utime(localFile, ns=( st.st_atime_ns, st.st_mtime_ns ))
+
+            result.files += 1
+            result.bytes += os.path.getsize(localFile)
+
+        result.sources[str(location)] = result.files
+
+
+    def _fetchAll(self, best, usable, workDir, deadline, result):
+        """
+        Fetch the files of the best destination in parallel. Each file may be
+        fetched from any usable destination that holds the same version of it.
+
+        best: the ProbeResult of the best destination, which determines the files
+        usable: the ProbeResults of all usable destinations, best first
+        workDir: the directory to restore into
+        deadline: time.monotonic() by which the restore must have completed, or None
+        result: the RestoreResult, which is updated
+        return: void
+        """
+        key        = self.datasetKeys.get(result.dataset.name)
+        failures   = []
+        resultLock = threading.Lock()
+
+        def fetch(path, entry):
+            sources = [ probe for probe in usable if probe.files is not None and _sameVersion(probe.files.get(path), entry) ]
+            localFile = os.path.join(workDir, *path.split('/'))
+            os.makedirs(os.path.dirname(localFile), exist_ok=True)
+
+            errors = []
+            while sources:
+                probe = self._leastBusy(sources)
+                sources.remove(probe)
+                try:
+                    if self._fetchFile(probe, path, probe.files[path], localFile, key, chunkExecutor, deadline):
+                        with resultLock:
+                            result.files += 1
+                            result.bytes += entry['size']
+                            result.sources[str(probe.location)] = result.sources.get(str(probe.location), 0) + 1
+                        return
+
+                    errors.append(str(probe.location) + ': failed')
+
+                except subprocess.TimeoutExpired:
+                    raise
+
+                except Exception as e:
+                    errors.append(str(probe.location) + ': ' + str(e))
+
+                finally:
+                    with self.busyLock:
+                        self.busy[str(probe.location)] -= 1
+
+            with resultLock:
+                failures.append(path)
+            paradux.logging.error('Cannot restore', path, ':', '; '.join(errors))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers) as chunkExecutor, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers) as fileExecutor:
+            # Largest first, so a big file does not start last
+            paths = sorted(best.files, key=lambda path: -best.files[path]['size'])
+            for future in [ fileExecutor.submit(fetch, path, best.files[path]) for path in paths ]:
+                future.result()
+
+        if failures:
+            result.error = 'Cannot restore {0:d} of {1:d} files'.format(len(failures), len(best.files))
+
+
+    def _fetchFile(self, probe, path, entry, localFile, key, chunkExecutor, deadline):
+        """
+        Fetch one file from one destination, and verify it.
+
+        probe: the ProbeResult of the destination
+        path: path of the file relative to the root of the dataset
+        entry: what the destination holds of the file: dict with 'size', 'mtime-ns', 'sha256' and, for chunk stores, 'chunks'
+        localFile: the local file to write
+        key: the key of the dataset, or None
+        chunkExecutor: the Executor that fetches chunks
+        deadline: time.monotonic() by which the restore must have completed, or None
+        return: True if successful
+        throws: ValueError if the file does not match its hash
+        """
+        location = probe.location
+        tmpFile  = localFile + '.fetching'
+        try:
+            if probe.chunkStore is not None:
+                def readChunk(name):
+                    data = probe.chunkStore.readChunk(name, paradux.utils.remainingTime(deadline, self.timeout))
+                    if data is None:
+                        raise IOError('Cannot download chunk ' + name)
+                    return data
+
+                with open(tmpFile, 'wb') as fd:
+                    for data in paradux.processpool.mapInOrder(readChunk, ( ( name, ) for name in entry['chunks'] ), chunkExecutor):
+                        fd.write(data)
+
+            elif location.encryption_info is not None:
+                encryptedFile = localFile + '.encrypted'
+                try:
+                    if not self.settings.downloadFromDataLocation(location.childLocation(path), encryptedFile, paradux.utils.remainingTime(deadline, self.timeout)):
+                        return False
+                    paradux.encryption.decryptFile(encryptedFile, tmpFile, key)
+                finally:
+                    if os.path.exists(encryptedFile):
+                        os.remove(encryptedFile)
+
+            elif not self.settings.downloadFromDataLocation(location.childLocation(path), tmpFile, paradux.utils.remainingTime(deadline, self.timeout)):
+                return False
+
+            if entry.get('sha256') is not None and paradux.utils.sha256OfFile(tmpFile) != entry['sha256']:
+                raise ValueError('Does not match its hash')
+            if os.path.getsize(tmpFile) != entry['size']:
+                raise ValueError('Does not match its size')
+
+            os.utime(tmpFile, ns=( entry['mtime-ns'], entry['mtime-ns'] ))
+            os.replace(tmpFile, localFile)
+            return True
+
+        finally:
+            if os.path.exists(tmpFile):
+                os.remove(tmpFile)
+
+
+    def _leastBusy(self, probes):
+        """
+        Pick the destination with the fewest fetches in progress, preferring
+        better ones, and count the fetch about to start.
+
+        probes: the ProbeResults to pick from, best first
+        return: the ProbeResult
+        """
+        with self.busyLock:
+            ret = min(probes, key=lambda probe: self.busy.get(str(probe.location), 0))
+            self.busy[str(ret.location)] = self.busy.get(str(ret.location), 0) + 1
+            return ret
+
+
+def _completeness(found):
+    """
+    Summarize which samples were found.
+
+    found: list of True, False or None per sample
+    return: True if all were found, False if any was missing, None if none could be checked
+    """
+    if False in found:
+        return False
+    if found and None not in found:
+        return True
+    return None
+
+
+def _sameVersion(entry, other):
+    """
+    Determine whether two destinations hold the same version of a file.
+
+    entry: what one destination holds, or None
+    other: what the other holds
+    return: True or False
+    """
+    if entry is None:
+        return False
+    if entry.get('sha256') is not None and other.get('sha256') is not None:
+        return entry['sha256'] == other['sha256']
+    return entry['size'] == other['size'] and entry['mtime-ns'] == other['mtime-ns']
+
+
+def _install(workDir, targetDir):
+    """
+    Atomically put the restored tree in place of the target directory. If
+    the target directory has content, it is moved aside first, and removed
+    once the restored tree is in place.
+
+    workDir: the directory that holds the restored tree, on the same file system
+    targetDir: the target directory
+    return: void
+    """
+    os.chmod(workDir, 0o755 & ~_umask())
+
+    if not os.path.exists(targetDir):
+        os.rename(workDir, targetDir)
+        return
+
+    if not os.listdir(targetDir):
+        os.replace(workDir, targetDir) # replacing an empty directory is atomic
+        return
+
+    oldDir = tempfile.mkdtemp(prefix='.' + os.path.basename(os.path.abspath(targetDir)) + '.replaced-', dir=os.path.dirname(os.path.abspath(targetDir)))
+    os.rmdir(oldDir)
+    os.rename(targetDir, oldDir)
+    os.rename(workDir, targetDir)
+    shutil.rmtree(oldDir, ignore_errors=True)
+
+
+def _umask():
+    """
+    Determine the umask of this process.
+
+    return: the umask
+    """
+    ret = os.umask(0)
+    os.umask(ret)
+    return ret
@@ -0,0 +1,369 @@
+#!/usr/bin/python
+#
+# Decides when each destination of each dataset is due for a backup,
+# according to its frequency, and runs the backups when they are due.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import hashlib
+import heapq
+import math
+import os
+import os.path
+import paradux.data.dataset
+import paradux.logging
+import paradux.utils
+import random
+import re
+import threading
+import time
+
+
+# Fraction of the interval by which a due time is randomly delayed
+JITTER_FRACTION = 0.05
+
+# Maximum number of seconds by which a due time is randomly delayed
+MAX_JITTER = 15 * 60
+
+# Number of seconds over which backups are spread that were missed while
+# paradux was not running
+CATCH_UP_WINDOW = 10 * 60
+
+# Number of seconds before the first retry of a failed backup; doubles with
+# each failure, up to the interval of the destination
+RETRY_DELAY = 5 * 60
+
+# Backups that are due within this many seconds of each other are run together
+COALESCE_WINDOW = 60
+
+# Maximum number of seconds to sleep at a time, so the schedule is looked at
+# again after a suspend or a change of the clock
+MAX_SLEEP = 5 * 60
+
+_FREQUENCY_REGEX = re.compile(r'(\d+(?:\.\d+)?)\s*([smhdw]?)$')
+
+_FREQUENCY_UNITS = {
+    ''  : 1,
+    's' : 1,
+    'm' : 60,
+    'h' : 60 * 60,
+    'd' : 24 * 60 * 60,
+    'w' : 7 * 24 * 60 * 60
+}
+
+_FREQUENCY_NAMES = {
+    'hourly' : 60 * 60,
+    'daily'  : 24 * 60 * 60,
+    'weekly' : 7 * 24 * 60 * 60
+}
+
+
+def parseFrequencyJson(j):
+    """
+    Parse how frequently a backup is to be created: a number of seconds,
+    such as 86400, or a string such as "12h", "1d", "2w" or "daily".
+
+    j: JSON fragment
+    return: the number of seconds between backups
+    """
+    if isinstance(j, str):
+        s = j.strip().lower()
+        if s in _FREQUENCY_NAMES:
+            return _FREQUENCY_NAMES[s]
+        m = _FREQUENCY_REGEX.match(s)
+        if m is None:
+            raise ValueError('Not a valid frequency: ' + j)
+        ret = float(m.group(1)) * _FREQUENCY_UNITS[m.group(2)]
+
+    elif isinstance(j, bool) or not isinstance(j, (int, float)):
+        raise ValueError('Not a valid frequency: ' + str(j))
+
+    else:
+        ret = j
+
+    if ret <= 0:
+        raise ValueError('Frequency must be positive: ' + str(j))
+    return int(ret) if ret == int(ret) else ret
+
+
+class ScheduleEntry:
+    """
+    When one destination of one dataset is due for a backup.
+
+    dataset: the Dataset
+    destination: the DestinationDataLocation
+    interval: the number of seconds between backups
+    due: the UNIX time at which the next backup is due
+    lastSuccess: the UNIX time of the last successful backup, or None
+    failures: the number of consecutive failed backups
+    """
+    def __init__(self, dataset, destination, interval):
+        self.dataset     = dataset
+        self.destination = destination
+        self.interval    = interval
+        self.due         = None
+        self.lastSuccess = None
+        self.failures    = 0
+
+
+    def phase(self):
+        """
+        Determine the offset of the backup slots of this entry within its
+        interval. It is derived from the names, so it stays the same across
+        restarts, and different destinations with the same interval are
+        spread across it instead of all being due at the same time.
+
+        return: number of seconds
+        """
+        h = hashlib.sha256(( self.dataset.name + '\n' + str(self.destination) ).encode('utf8')).digest()
+        return int.from_bytes(h[:4], 'big') / 2**32 * self.interval
+
+
+    def nextSlot(self, after):
+        """
+        Determine the next backup slot of this entry, plus some random jitter.
+
+        after: the UNIX time after which the slot is
+        return: UNIX time
+        """
+        phase = self.phase()
+        slot  = phase + math.floor(( after - phase ) / self.interval + 1) * self.interval
+        return slot + random.uniform(0, min(MAX_JITTER, self.interval * JITTER_FRACTION))
+
+
+class Scheduler:
+    """
+    Keeps the backups of all destinations that have a frequency in a heap
+    ordered by due time, and runs them when they are due. Each runs in its
+    own slot within its interval, so they are spread out; backups missed
+    while paradux was not running are caught up once each, spread over a
+    short window; failed backups are retried with an exponentially growing
+    delay. The schedule is saved, so a restart continues it.
+
+    settings: the Settings
+    syncer: the Syncer that runs the backups
+    stateFile: name of the JSON file that holds the schedule
+    """
+    def __init__(self, settings, syncer, stateFile):
+        self.settings  = settings
+        self.syncer    = syncer
+        self.stateFile = stateFile
+        self.heap      = [] # tuples of (due, sequence number, ScheduleEntry)
+        self.sequence  = 0  # breaks ties in the heap
+        self.lock      = threading.Lock()
+
+
+    def load(self, datasets, now=None):
+        """
+        Create the schedule for the destinations of these datasets that have a
+        frequency, continuing the saved schedule where possible.
+
+        datasets: the Datasets
+        now: the current UNIX time, or None for now
+        return: the number of ScheduleEntry scheduled
+        """
+        if now is None:
+            now = time.time()
+
+        state = {}
+        if os.path.isfile(self.stateFile):
+            state = paradux.utils.readJsonFromFile(self.stateFile)['datasets']
+
+        entries = []
+        overdue = []
+        for dataset in datasets:
+            for destination in dataset.destinations:
+                if destination.frequency is None:
+                    paradux.logging.info('No frequency, not scheduling:', dataset.name, '->', destination)
+                    continue
+
+                entry  = ScheduleEntry(dataset, destination, destination.frequency)
+                saved  = state.get(dataset.name, {}).get(str(destination), {})
+                if 'last-success' in saved:
+                    entry.lastSuccess = paradux.utils.string2time(saved['last-success'])
+                entry.failures = saved.get('failures', 0)
+
+                if 'due' in saved and saved.get('interval') == entry.interval:
+                    entry.due = paradux.utils.string2time(saved['due'])
+                elif entry.lastSuccess is not None:
+                    entry.due = entry.nextSlot(entry.lastSuccess)
+
+                if entry.due is None or entry.due <= now:
+                    overdue.append(entry) # missed, or never run
+                else:
+                    entries.append(entry)
+
+        # Catch up once, most overdue first, rather than all at the same time
+        overdue.sort(key = lambda entry: -math.inf if entry.due is None else entry.due)
+        for i, entry in enumerate(overdue):
+            entry.due = now + i * CATCH_UP_WINDOW / len(overdue)
+            entries.append(entry)
+
+        with self.lock:
+            self.heap = []
+            for entry in entries:
+                self._push(entry)
+            return len(self.heap)
+
+
+    def nextDue(self):
+        """
+        Determine when the next backup is due.
+
+        return: UNIX time, or None if nothing is scheduled
+        """
+        with self.lock:
+            return self.heap[0][0] if self.heap else None
+
+
+    def takeDue(self, now=None):
+        """
+        Remove all entries from the schedule that are due, or will be due
+        shortly.
+
+        now: the current UNIX time, or None for now
+        return: list of ScheduleEntry
+        """
+        if now is None:
+            now = time.time()
+
+        ret = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now + COALESCE_WINDOW:
+                ret.append(heapq.heappop(self.heap)[2])
+        return ret
+
+
+    def runDue(self, now=None):
+        """
+        Run the backups that are due, and schedule them again. If running
+        them fails, those not rescheduled yet are rescheduled as failed.
+
+        now: the current UNIX time, or None for now
+        return: list of SyncResult
+        """
+        entries = self.takeDue(now)
+        if not entries:
+            return []
+
+        rescheduled = set() # ids of the entries
+        try:
+            # Pull each dataset once, and push to its destinations that are due
+            byDataset = {}
+            for entry in entries:
+                byDataset.setdefault(entry.dataset.name, []).append(entry)
+
+            datasets = [
+                    paradux.data.dataset.Dataset(
+                            dueEntries[0].dataset.name,
+                            dueEntries[0].dataset.description,
+                            dueEntries[0].dataset.source,
+                            tuple( entry.destination for entry in dueEntries ))
+                    for dueEntries in byDataset.values() ]
+
+            results = self.syncer.sync(datasets)
+
+            done = time.time()
+            for result, dueEntries in zip(results, byDataset.values()):
+                for push, entry in zip(result.pushes, dueEntries):
+                    self.reschedule(entry, push.success, done)
+                    rescheduled.add(id(entry))
+
+        finally:
+            # Entries taken from the schedule must not get lost
+            done = time.time()
+            for entry in entries:
+                if id(entry) not in rescheduled:
+                    self.reschedule(entry, False, done)
+
+            try:
+                self.save()
+            except OSError as e:
+                paradux.logging.warning('Cannot save schedule:', e)
+
+        return results
+
+
+    def reschedule(self, entry, success, now):
+        """
+        Schedule an entry again, after its backup has been run.
+
+        entry: the ScheduleEntry
+        success: True if the backup succeeded
+        now: the UNIX time at which the backup ended
+        return: void
+        """
+        if success:
+            entry.lastSuccess = now
+            entry.failures    = 0
+            entry.due         = entry.nextSlot(now)
+
+        else:
+            entry.failures += 1
+            delay     = min(entry.interval, RETRY_DELAY * 2 ** (entry.failures - 1))
+            entry.due = now + random.uniform(delay / 2, delay)
+            paradux.logging.warning('Backup failed', entry.failures, 'time(s), retrying at', paradux.utils.time2string(entry.due), ':',
+                    entry.dataset.name, '->', entry.destination)
+
+        with self.lock:
+            self._push(entry)
+
+
+    def run(self, stopEvent):
+        """
+        Run backups as they become due, until asked to stop. A backup in
+        progress is completed before stopping.
+
+        stopEvent: threading.Event that is set to stop
+        return: void
+        """
+        while not stopEvent.is_set():
+            try:
+                self.runDue()
+            except Exception as e:
+                paradux.logging.error('Running backups failed:', e)
+
+            nextDue = self.nextDue()
+            if nextDue is None:
+                paradux.logging.warning('Nothing is scheduled.')
+                stopEvent.wait()
+                break
+
+            paradux.logging.info('Next backup due at', paradux.utils.time2string(nextDue))
+            stopEvent.wait(max(0, min(MAX_SLEEP, nextDue - time.time())))
+
+
+    def save(self):
+        """
+        Save the schedule to disk.
+
+        return: void
+        """
+        with self.lock:
+            j = { 'datasets' : {} }
+            for due, sequence, entry in self.heap:
+                saved = {
+                    'interval' : entry.interval,
+                    'due'      : paradux.utils.time2string(due),
+                    'failures' : entry.failures
+                }
+                if entry.lastSuccess is not None:
+                    saved['last-success'] = paradux.utils.time2string(entry.lastSuccess)
+                j['datasets'].setdefault(entry.dataset.name, {})[str(entry.destination)] = saved
+
+            tmpFile = self.stateFile + '.tmp'
+            paradux.utils.writeJsonToFile(tmpFile, j, 0o600)
+            os.replace(tmpFile, self.stateFile)
+
+
+    def _push(self, entry):
+        """
+        Add an entry to the heap. The lock must be held.
+
+        entry: the ScheduleEntry
+        return: void
+        """
+        heapq.heappush(self.heap, ( entry.due, self.sequence, entry ))
+        self.sequence += 1
@@ -4,25 +4,41 @@
 # All rights reserved. License: see package.
 #
 
+import contextlib
+import hashlib
 import importlib
 import os
 import os.path
+import paradux.bandwidth
+import paradux.checkpoint
+import paradux.chunkstore
+import paradux.configuration.credentials
 import paradux.configuration.datasets
 import paradux.configuration.metadatalocations
 import paradux.configuration.secrets
 import paradux.configuration.stewards
 import paradux.configuration.user
+import paradux.data.credential
+import paradux.data.datalocation
 import paradux.datatransfer
+import paradux.encryption
+import paradux.health
 import paradux.logging
+import paradux.processpool
+import paradux.sshpool
 from paradux.stewardpackage import StewardPackage
+import paradux.transport
 import paradux.utils
 import pathlib
 import posixpath
 import random
 import re
 import shutil
+import subprocess
+import tempfile
 from tempfile import NamedTemporaryFile
 import threading
+import time
 
 
 # Default paradux data directory
@@ -41,9 +57,12 @@ def create(args):
     if hasattr(args,'image_size'):
         # This is a little bit of a hack, but allows us to use the same
         # factory method for init and all the other commands
-        return Settings(args.directory, args.image_size)
+        ret = Settings(args.directory, args.image_size)
     else:
-        return Settings(args.directory, None)
+        ret = Settings(args.directory, None)
+
+    ret.configureBandwidth(getattr(args, 'bwlimit', None), getattr(args, 'connections_per_host', None))
+    return ret
 
 
 class Settings:
@@ -64,23 +83,41 @@ class Settings:
         self.crypt_device_name = 'paradux'                                    # short name of the device created by cryptsetup
         self.crypt_device_path = '/dev/mapper/' + self.crypt_device_name      # path name of the device created by cryptsetup
         self.image_mount_point = self.directory + '/configuration'            # mount point for the image
-
+        self.published_file    = self.directory + '/published.json'           # hashes of what has been published where
+        self.checkpoints_dir   = self.directory + '/checkpoints'              # state of interrupted uploads
+        self.staging_dir       = self.directory + '/staging'                  # local copies of the sources of datasets
+        self.synced_file       = self.directory + '/synced.json'              # files pushed to destinations one by one
+        self.schedule_file     = self.directory + '/schedule.json'            # when each destination is next due for a backup
+        self.chunks_dir        = self.directory + '/chunks'                   # indexes of the chunk stores at destinations
+        self.catalog_file      = self.directory + '/catalog.sqlite'           # what was backed up where and when
+        self.bandwidth_file    = self.directory + '/bandwidth.json'           # limits on bandwidth and connections
+        self.health_file       = self.directory + '/health.json'              # how transfers to each location have fared
+
+        self.credentials_config_file             = self.image_mount_point + '/credentials.json'      # configuration JSON for shared credentials
+        self.temp_credentials_config_file        = self.image_mount_point + '/credentials.temp.json' # being edited configuration JSON for shared credentials
         self.metadata_locations_config_file      = self.image_mount_point + '/metadata.json'      # configuration JSON for metadata locations
         self.temp_metadata_locations_config_file = self.image_mount_point + '/metadata.temp.json' # being edited configuration JSON for metadata locations
+        self.metadata_locations_config_dir       = self.image_mount_point + '/metadata.d'         # configuration JSON fragments for metadata locations
         self.datasets_config_file                = self.image_mount_point + '/datasets.json'      # configuration JSON for datasets
         self.temp_datasets_config_file           = self.image_mount_point + '/datasets.temp.json' # being edited configuration JSON for datasets
+        self.datasets_config_dir                 = self.image_mount_point + '/datasets.d'         # configuration JSON fragments for datasets
         self.secrets_config_file                 = self.image_mount_point + '/secrets.json'       # configuration JSON for secrets
         self.stewards_config_file                = self.image_mount_point + '/stewards.json'      # configuration JSON for stewards
         self.temp_stewards_config_file           = self.image_mount_point + '/stewards.temp.json' # being edited configuration JSON for stewards
         self.user_config_file                    = self.image_mount_point + '/user.json'          # configuration JSON for user info
         self.temp_user_config_file               = self.image_mount_point + '/user.tmp.json'      # being edited configuration JSON for user info
 
+        self.credentialsConfiguration       = None # allocated as needed
         self.datasetsConfiguration          = None # allocated as needed
         self.metadataLocationsConfiguration = None # allocated as needed
         self.secretsConfiguration           = None # allocated as needed
         self.stewardsConfiguration          = None # allocated as needed
         self.userConfiguration              = None # allocated as needed
         self.dataTransferProtocols          = None # allocated as needed
+        self.dataTransferProtocolsLock      = threading.Lock()
+        self.checkpointStore                = paradux.checkpoint.CheckpointStore(self.checkpoints_dir)
+        self.healthRecord                   = None # allocated as needed
+        self.healthRecordLock               = threading.Lock()
 
 
     def checkCanCreateImage(self):
@@ -142,6 +179,7 @@ class Settings:
         """
         paradux.logging.info('Populating with initial default data')
 
+        paradux.configuration.credentials.saveInitial(self.credentials_config_file)
         paradux.configuration.metadatalocations.saveInitial(self.metadata_locations_config_file)
         paradux.configuration.datasets.saveInitial(self.datasets_config_file)
         paradux.configuration.secrets.createAndSaveInitial(nbits, recoverySecret, min_stewards, self.secrets_config_file)
@@ -149,6 +187,17 @@ class Settings:
         paradux.configuration.user.saveInitial(self.user_config_file)
 
 
+    def getCredentialsConfiguration(self):
+        """
+        Obtain the current registry of shared credentials.
+
+        return: CredentialsConfiguration
+        """
+        if self.credentialsConfiguration == None:
+            self.credentialsConfiguration = paradux.configuration.credentials.createFromFile( self.credentials_config_file, self.temp_credentials_config_file )
+        return self.credentialsConfiguration
+
+
     def getMetadataLocationsConfiguration(self):
         """
         Obtain the current configuration of the metadata locations.
@@ -158,10 +207,30 @@ class Settings:
         paradux.logging.trace('getMetadataLocationConfiguration')
 
         if self.metadataLocationsConfiguration == None:
-            self.metadataLocationsConfiguration = paradux.configuration.metadatalocations.createFromFile( self.metadata_locations_config_file, self.temp_metadata_locations_config_file )
+            self.metadataLocationsConfiguration = paradux.configuration.metadatalocations.createFromFile( self.metadata_locations_config_file, self.temp_metadata_locations_config_file, self.metadata_locations_config_dir, self.getCredentialsConfiguration() )
         return self.metadataLocationsConfiguration
 
 
+    def getMetadataLocationsFragmentConfiguration(self, fragmentName):
+        """
+        Obtain the configuration of the metadata locations in a single fragment
+        in the metadata locations fragment directory. Creates the fragment if it
+        does not exist yet.
+
+        fragmentName: name of the fragment, without directory and .json extension
+        return: MetadataLocationsConfiguration
+        """
+        paradux.logging.trace('getMetadataLocationsFragmentConfiguration', fragmentName)
+
+        fragmentFile, tmpFile = paradux.configuration.fragmentFileNames(self.metadata_locations_config_dir, fragmentName)
+        if not os.path.isfile(fragmentFile):
+            if not os.path.isdir(self.metadata_locations_config_dir):
+                os.makedirs(self.metadata_locations_config_dir, mode=0o700)
+            paradux.configuration.metadatalocations.saveInitial(fragmentFile)
+
+        return paradux.configuration.metadatalocations.createFromFile( fragmentFile, tmpFile, None, self.getCredentialsConfiguration() )
+
+
     def getDatasetsConfiguration(self):
         """
         Obtain the current configuration of the datasets.
@@ -169,10 +238,29 @@ class Settings:
         return: DatasetsConfiguration
         """
         if self.datasetsConfiguration == None:
-            self.datasetsConfiguration = paradux.configuration.datasets.createFromFile( self.datasets_config_file, self.temp_datasets_config_file )
+            self.datasetsConfiguration = paradux.configuration.datasets.createFromFile( self.datasets_config_file, self.temp_datasets_config_file, self.datasets_config_dir, self.getCredentialsConfiguration() )
         return self.datasetsConfiguration
 
 
+    def getDatasetsFragmentConfiguration(self, fragmentName):
+        """
+        Obtain the configuration of the datasets in a single fragment in the
+        datasets fragment directory. Creates the fragment if it does not exist yet.
+
+        fragmentName: name of the fragment, without directory and .json extension
+        return: DatasetsConfiguration
+        """
+        paradux.logging.trace('getDatasetsFragmentConfiguration', fragmentName)
+
+        fragmentFile, tmpFile = paradux.configuration.fragmentFileNames(self.datasets_config_dir, fragmentName)
+        if not os.path.isfile(fragmentFile):
+            if not os.path.isdir(self.datasets_config_dir):
+                os.makedirs(self.datasets_config_dir, mode=0o700)
+            paradux.configuration.datasets.saveInitial(fragmentFile)
+
+        return paradux.configuration.datasets.createFromFile( fragmentFile, tmpFile, None, self.getCredentialsConfiguration() )
+
+
     def getSecretsConfiguration(self):
         """
         Obtain the current configuration of the secrets.
@@ -208,40 +296,62 @@ class Settings:
 
     def getStewardPackages(self):
         """
-        Obtain a list of StewardPackage ready for export.
+        Obtain a dict of StewardPackage ready for export.
 
-        return: list fo StewardPackage
+        return: dict of StewardPackage, keyed by steward id
         """
         paradux.logging.trace('getStewardPackages')
 
+        return dict(self.iterStewardPackages())
+
+
+    def iterStewardPackages(self, stewardIds=None):
+        """
+        Generate the StewardPackages ready for export, one at a time, so that
+        the caller can process each as soon as it has been created. Shares that
+        need to be newly issued are saved once the generator is done, or
+        is abandoned.
+
+        stewardIds: if given, only generate the StewardPackages for these steward ids
+        return: generator of (stewardId, StewardPackage)
+        throws: KeyError if one of the stewardIds is not known
+        """
+        paradux.logging.trace('iterStewardPackages')
+
         stewardsConf          = self.getStewardsConfiguration()
         userConf              = self.getUserConfiguration()
         secretsConf           = self.getSecretsConfiguration()
         metadataLocationsConf = self.getMetadataLocationsConfiguration()
         version               = paradux.version()
 
-        ret       = dict()
-        needsSave = False
-
-        for stewardId, steward in stewardsConf.getStewards().items() :
-            stewardShare = secretsConf.getIssuedStewardShare(stewardId)
-            if stewardShare is None:
-                stewardShare = secretsConf.issueStewardShare(stewardId)
-                needsSave = True
-
-            ret[stewardId] = StewardPackage(
-                    userConf.getUser(),
-                    steward,
-                    stewardShare,
-                    secretsConf.getMersenne(),
-                    secretsConf.getMinStewards(),
-                    metadataLocationsConf,
-                    version)
-
-        if needsSave:
-            secretsConf.save()
+        stewards = stewardsConf.getStewards()
+        if stewardIds is None:
+            stewardIds = list(stewards.keys())
+        else:
+            for stewardId in stewardIds:
+                if stewardId not in stewards:
+                    raise KeyError(stewardId)
 
-        return ret
+        needsSave = False
+        try:
+            for stewardId in stewardIds:
+                stewardShare = secretsConf.getIssuedStewardShare(stewardId)
+                if stewardShare is None:
+                    stewardShare = secretsConf.issueStewardShare(stewardId)
+                    needsSave = True
+
+                yield ( stewardId, StewardPackage(
+                        userConf.getUser(),
+                        stewards[stewardId],
+                        stewardShare,
+                        secretsConf.getMersenne(),
+                        secretsConf.getMinStewards(),
+                        metadataLocationsConf,
+                        version))
+
+        finally:
+            if needsSave:
+                secretsConf.save()
 
 
     def hasEverydayPassphrase(self, imageFile=None):
@@ -298,22 +408,127 @@ class Settings:
         shutil.copyfile(self.image_file, exportFile)
         os.chmod(exportFile, 0o600)
 
+        self._stripEverydayPassphrase(exportFile)
+
+        paradux.logging.info( 'Exported file without everyday passphrase:', exportFile )
+
+
+    def metadataIdentity(self):
+        """
+        Determine an identity of the metadata that only changes when the
+        metadata does. The image cannot serve as such, as mounting it writes to
+        the file system in it, and neither can an export, as stripping the
+        everyday passphrase wipes its key slot with random data. Instead, this
+        covers the LUKS header of the image, which holds the key slots, and the
+        names and content of the files in the image. The image must be mounted.
+
+        return: hex digest
+        """
+        h = hashlib.sha256()
+
+        tmpDir     = tempfile.mkdtemp(prefix='paradux-')
+        headerFile = tmpDir + '/header.img'
+        try:
+            if paradux.utils.myexec(
+                      'cryptsetup luksHeaderBackup'
+                    + ' --batch-mode'
+                    + " '" + self.image_file + "'"
+                    + " --header-backup-file '" + headerFile + "'"):
+                paradux.logging.fatal('cryptsetup luksHeaderBackup failed')
+            h.update(b'header ' + paradux.utils.sha256OfFile(headerFile).encode('ascii') + b'\n')
+
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+        for dirPath, dirNames, fileNames in os.walk(self.image_mount_point):
+            dirNames.sort()
+            for fileName in sorted(fileNames):
+                localFile = os.path.join(dirPath, fileName)
+                if not os.path.isfile(localFile) or os.path.islink(localFile):
+                    continue
+                relPath = os.path.relpath(localFile, self.image_mount_point)
+                h.update(b'file ' + relPath.encode('utf8', errors='surrogateescape') + b' ' + paradux.utils.sha256OfFile(localFile).encode('ascii') + b'\n')
+
+        return h.hexdigest()
+
+
+    def exportMetadataStream(self, bufSize=1024*1024):
+        """
+        Export the image as a stream, stripping the everyday passphrase, without
+        making a copy of the image. Only the LUKS header, which holds the key
+        slots, is copied so the everyday passphrase can be stripped from it; it
+        is streamed first, followed by the rest of the image as it is.
+
+        bufSize: the maximum size of the chunks of the stream
+        return: generator of bytes
+        """
+        paradux.logging.info('Exporting metadata stream with stripped everyday secret')
+
+        if not self._image_exists():
+            raise FileNotFoundError(self.image_file)
+
+        if not self.hasRecoverySecret():
+            paradux.logging.fatal('No recovery secret has been set. Cannot export.')
+
+        tmpDir     = tempfile.mkdtemp(prefix='paradux-')
+        headerFile = tmpDir + '/header.img'
+        try:
+            if paradux.utils.myexec(
+                      'cryptsetup luksHeaderBackup'
+                    + ' --batch-mode'
+                    + " '" + self.image_file + "'"
+                    + " --header-backup-file '" + headerFile + "'"):
+                paradux.logging.fatal('cryptsetup luksHeaderBackup failed')
+            os.chmod(headerFile, 0o600)
+
+            self._stripEverydayPassphrase(headerFile)
+
+            # The header backup extends to where the encrypted data starts
+            headerSize = os.path.getsize(headerFile)
+            if headerSize > os.path.getsize(self.image_file):
+                paradux.logging.fatal('Export failed: header larger than image')
+
+            with open(headerFile, 'rb') as fd:
+                while True:
+                    buf = fd.read(bufSize)
+                    if not buf:
+                        break
+                    yield buf
+
+            with open(self.image_file, 'rb') as fd:
+                fd.seek(headerSize)
+                while True:
+                    buf = fd.read(bufSize)
+                    if not buf:
+                        break
+                    yield buf
+
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+
+    def _stripEverydayPassphrase(self, imageFile):
+        """
+        Remove the everyday passphrase from a copy of the image, or of its header,
+        and check that only the recovery secret remains.
+
+        imageFile: name of the copy
+        return: void
+        """
         if paradux.utils.myexec(
                   'cryptsetup luksKillSlot'
                 + ' --batch-mode'
-                + " '" + exportFile + "'"
+                + " '" + imageFile + "'"
                 + " " + str(self.everyday_key_slot)):
             paradux.logging.fatal('cryptsetup luksKillSlot failed')
 
         # Sanity checking for security purposes
-        if self.hasEverydayPassphrase(exportFile):
+        if self.hasEverydayPassphrase(imageFile):
             paradux.logging.fatal('Export failed: everyday passphrase has not been removed.')
 
-        if not self.hasRecoverySecret(exportFile):
+        if not self.hasRecoverySecret(imageFile):
             paradux.logging.fatal('Export failed: no recovery secret has been set.')
 
-        paradux.logging.info( 'Exported file without everyday passphrase:', exportFile )
-
 
     def recoverSetEverydayPassphrase(self, recoverySecret):
         """
@@ -333,25 +548,458 @@ class Settings:
         self._cryptsetup_recover(recoverySecret)
 
 
-    def uploadToDataLocation(self, localFile, dataLocation):
+    def configureBandwidth(self, limit=None, maxConnectionsPerHost=None):
         """
-        Copy the local file to the given (remote) data location.
+        Set the limits on bandwidth and connections for all data transfers in
+        this process, from the bandwidth file in the paradux directory, if it
+        exists, overridden by the arguments if they are given. The file looks
+        like:
+        {
+            "limit" : "2M", # or with a schedule, see paradux.bandwidth.parseBandwidthLimitJson
+            "connections-per-host" : 2
+        }
+
+        limit: the limit for all transfers together, as string, such as '2M', or None
+        maxConnectionsPerHost: the maximum number of transfers to the same host at the same time, or None
+        return: void
+        """
+        bandwidthLimit = None
+        if os.path.isfile(self.bandwidth_file):
+            j = paradux.utils.readJsonFromFile(self.bandwidth_file)
+            if 'limit' in j:
+                bandwidthLimit = paradux.bandwidth.parseBandwidthLimitJson(j['limit'])
+            if 'connections-per-host' in j and maxConnectionsPerHost is None:
+                maxConnectionsPerHost = j['connections-per-host']
+
+        if limit is not None:
+            bandwidthLimit = paradux.bandwidth.parseBandwidthLimitJson(limit)
+
+        paradux.bandwidth.defaultGovernor().configure(bandwidthLimit, maxConnectionsPerHost)
+
+
+    def getHealthRecord(self):
+        """
+        Obtain the record of how transfers to each data location have fared.
+
+        return: HealthRecord
+        """
+        with self.healthRecordLock:
+            if self.healthRecord is None:
+                self.healthRecord = paradux.health.HealthRecord(self.health_file)
+            return self.healthRecord
+
+
+    def uploadToDataLocation(self, localFile, dataLocation, timeout=None):
+        """
+        Copy the local file to the given (remote) data location. If the data
+        transfer protocol can resume interrupted uploads, a checkpoint is kept
+        until the upload has completed, and an earlier, interrupted upload of
+        the same file is resumed. The outcome is remembered in the health record.
 
         localFile: the local file
         dataLocation: the location to upload the local file to
+        timeout: if given, give up after this many seconds
         return: True if upload was performed successfully
+        throws: subprocess.TimeoutExpired if the timeout was reached
         """
         ret = False;
-        protocol = self._findDataTransferProtocolFor(dataLocation)
+        protocol = self.findDataTransferProtocolFor(dataLocation)
         if protocol is None:
             paradux.logging.warning( 'No support for this upload protocol:', dataLocation, '-- skipping')
         else:
-            paradux.logging.info( 'Uploading to:', dataLocation)
-            ret = protocol.upload(localFile, dataLocation)
+            with paradux.bandwidth.defaultGovernor().connection(dataLocation), self._recordingHealth(dataLocation) as outcome:
+                paradux.logging.info( 'Uploading to:', dataLocation)
+                ret = self._upload(protocol, localFile, dataLocation, timeout)
+                outcome['success'] = ret
 
         return ret
 
 
+    def _upload(self, protocol, localFile, dataLocation, timeout=None):
+        """
+        Copy the local file to the given (remote) data location with the given
+        Transport, resuming an interrupted upload if the Transport can.
+
+        protocol: the Transport for the data location
+        localFile: the local file
+        dataLocation: the location to upload the local file to
+        timeout: if given, give up after this many seconds
+        return: True if upload was performed successfully
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        if protocol.has(paradux.transport.RANGED_WRITES):
+            checkpoint = self.checkpointStore.checkpointFor(dataLocation, localFile)
+            ret = protocol.uploadResumable(localFile, dataLocation, checkpoint, timeout=timeout) is True
+            if ret:
+                checkpoint.remove()
+            return ret
+
+        return protocol.upload(localFile, dataLocation, timeout=timeout) is True
+
+
+    @contextlib.contextmanager
+    def _recordingHealth(self, dataLocation):
+        """
+        Remember the outcome of a transfer in the health record, and save it.
+        The with statement sets 'success' in the yielded dict; if it raises,
+        the transfer failed.
+
+        dataLocation: the data location transferred to
+        """
+        outcome = { 'success' : False, 'error' : 'Upload failed' }
+        start   = time.monotonic()
+        try:
+            yield outcome
+
+        except subprocess.TimeoutExpired as e:
+            outcome['error'] = 'Timed out after {0:g} seconds'.format(e.timeout)
+            raise
+
+        except Exception as e:
+            outcome['error'] = str(type(e)) + ': ' + str(e)
+            raise
+
+        finally:
+            healthRecord = self.getHealthRecord()
+            if outcome['success']:
+                healthRecord.recordSuccess(dataLocation, time.monotonic() - start)
+            else:
+                healthRecord.recordFailure(dataLocation, outcome['error'])
+
+            try:
+                healthRecord.save()
+            except OSError as e:
+                paradux.logging.warning('Cannot save health record:', e)
+
+
+    def findDataTransferProtocolFor(self, dataLocation):
+        """
+        Find the Transport that knows how to transfer data to and from this
+        data location.
+
+        dataLocation: the data location to upload to
+        return: the Transport, or None if not found
+        """
+        with self.dataTransferProtocolsLock:
+            if self.dataTransferProtocols is None:
+                self.dataTransferProtocols = dict()
+                for moduleName in paradux.utils.findSubmodules(paradux.datatransfer):
+                    mod = importlib.import_module('paradux.datatransfer.' + moduleName)
+                    self.dataTransferProtocols[moduleName] = paradux.transport.transportOf(mod)
+
+        proto = dataLocation.scheme
+        for dataTransferProtocol in self.dataTransferProtocols.values():
+            if dataTransferProtocol.supportsProtocol(proto):
+                return dataTransferProtocol
+
+        return None
+
+
+    def hasCapability(self, dataLocation, capability):
+        """
+        Determine whether the data transfer protocol of the given data location
+        has a capability.
+
+        dataLocation: the data location
+        capability: one of the capability constants in paradux.transport
+        return: True or False
+        """
+        protocol = self.findDataTransferProtocolFor(dataLocation)
+        return protocol is not None and protocol.has(capability)
+
+
+    def canUploadStream(self, dataLocation):
+        """
+        Determine whether the data transfer protocol of the given data location
+        can upload a stream, rather than a local file.
+
+        dataLocation: the data location
+        return: True or False
+        """
+        return self.hasCapability(dataLocation, paradux.transport.STREAMING)
+
+
+    def uploadStreamToDataLocation(self, reader, dataLocation, timeout=None):
+        """
+        Upload everything that can be read from a stream to the given (remote)
+        data location.
+
+        reader: file-like object whose content to upload
+        dataLocation: the location to upload to
+        timeout: if given, give up after this many seconds
+        return: True if upload was performed successfully
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        if not self.canUploadStream(dataLocation):
+            paradux.logging.warning( 'No support for streaming with this upload protocol:', dataLocation, '-- skipping')
+            return False
+
+        protocol = self.findDataTransferProtocolFor(dataLocation)
+
+        with paradux.bandwidth.defaultGovernor().connection(dataLocation), self._recordingHealth(dataLocation) as outcome:
+            paradux.logging.info( 'Streaming to:', dataLocation)
+            outcome['success'] = protocol.uploadStream(reader, dataLocation, timeout=timeout) is True
+            return outcome['success']
+
+
+    def canDownload(self, dataLocation):
+        """
+        Determine whether the data transfer protocol of the given data location
+        can download from it.
+
+        dataLocation: the data location
+        return: True or False
+        """
+        return self.hasCapability(dataLocation, paradux.transport.DOWNLOAD)
+
+
+    def downloadFromDataLocation(self, dataLocation, localFile, timeout=None):
+        """
+        Copy the file at the given (remote) data location to a local file.
+
+        dataLocation: the location to download from
+        localFile: the local file
+        timeout: if given, give up after this many seconds
+        return: True if download was performed successfully
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        if not self.canDownload(dataLocation):
+            paradux.logging.warning( 'No support for downloading with this protocol:', dataLocation, '-- skipping')
+            return False
+
+        protocol = self.findDataTransferProtocolFor(dataLocation)
+
+        with paradux.bandwidth.defaultGovernor().connection(dataLocation):
+            paradux.logging.info( 'Downloading from:', dataLocation)
+            return protocol.download(dataLocation, localFile, timeout=timeout) is True
+
+
+    def canDetermineRemoteHash(self, dataLocation, recorded=False):
+        """
+        Determine whether the data transfer protocol of the given data location
+        knows how to determine the hash of the file there.
+
+        dataLocation: the data location
+        recorded: if True, the hash recorded with the file when it was uploaded
+             will do; otherwise, only a hash of what the remote side holds does
+        return: True or False
+        """
+        if self.hasCapability(dataLocation, paradux.transport.SERVER_SIDE_HASH):
+            return True
+        return recorded and self.hasCapability(dataLocation, paradux.transport.RECORDED_HASH)
+
+
+    def remoteHashOfDataLocation(self, dataLocation, timeout=None, recorded=False):
+        """
+        Determine the SHA-256 hash of the file at the given (remote) data location,
+        if its data transfer protocol supports that.
+
+        dataLocation: the data location
+        timeout: if given, give up after this many seconds
+        recorded: if True, the hash recorded with the file when it was uploaded
+             will do; otherwise, only a hash of what the remote side holds does
+        return: hex digest, or None if not known
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        if not self.canDetermineRemoteHash(dataLocation, recorded):
+            return None
+
+        protocol = self.findDataTransferProtocolFor(dataLocation)
+
+        paradux.logging.info( 'Determining hash at:', dataLocation)
+        return protocol.remoteHash(dataLocation, timeout=timeout)
+
+
+    def statDataLocation(self, dataLocation, timeout=None):
+        """
+        Determine size and modification time of the file at the given (remote)
+        data location, if its data transfer protocol supports that.
+
+        dataLocation: the data location
+        timeout: if given, give up after this many seconds
+        return: RemoteStat, or None if not known or the file does not exist
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        if not self.hasCapability(dataLocation, paradux.transport.STAT):
+            return None
+
+        protocol = self.findDataTransferProtocolFor(dataLocation)
+        return protocol.stat(dataLocation, timeout=timeout)
+
+
+    def listDataLocation(self, dataLocation, timeout=None):
+        """
+        List the files at the given (remote) data location, which is a directory,
+        if its data transfer protocol supports that.
+
+        dataLocation: the data location
+        timeout: if given, give up after this many seconds
+        return: sorted list of file names, or None if not known or the directory does not exist
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        if not self.hasCapability(dataLocation, paradux.transport.LIST):
+            return None
+
+        protocol = self.findDataTransferProtocolFor(dataLocation)
+        return protocol.list(dataLocation, timeout=timeout)
+
+
+    def pullTreeFromDataLocation(self, dataLocation, localDir, timeout=None):
+        """
+        Make a local directory a copy of the directory hierarchy at the given
+        (remote) data location, transferring only what has changed.
+
+        dataLocation: the location to copy from
+        localDir: the local directory, which is created if needed
+        timeout: if given, give up after this many seconds
+        return: TreeStats if successful, None otherwise
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        if not self.hasCapability(dataLocation, paradux.transport.TREES):
+            paradux.logging.error( 'Cannot copy directories with this protocol:', dataLocation)
+            return None
+
+        protocol = self.findDataTransferProtocolFor(dataLocation)
+
+        with paradux.bandwidth.defaultGovernor().connection(dataLocation):
+            paradux.logging.info( 'Pulling from:', dataLocation)
+            return protocol.pullTree(dataLocation, localDir, timeout=timeout)
+
+
+    def pushTreeToDataLocation(self, localDir, dataLocation, pushedFiles, timeout=None, key=None):
+        """
+        Copy a local directory hierarchy to the given (remote) data location,
+        which is a directory, transferring only what has changed. If its data
+        transfer protocol cannot copy directories, or the data location is
+        encrypted, the files that have changed since they were last pushed
+        are uploaded one by one instead, and files deleted locally are not
+        deleted there. If the data location is a chunk store, a new snapshot
+        is stored in it instead. The outcome is remembered in the health record.
+
+        localDir: the local directory
+        dataLocation: the location to copy to
+        pushedFiles: dict from relative path to [ size, mtime in ns ] of the files
+             pushed one by one before, which is updated
+        timeout: if given, give up after this many seconds
+        key: the key to encrypt with, if the data location has encryption_info
+        return: TreeStats if successful, None otherwise
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        protocol = self.findDataTransferProtocolFor(dataLocation)
+        if protocol is None:
+            paradux.logging.warning( 'No support for this upload protocol:', dataLocation, '-- skipping')
+            return None
+
+        encryptionInfo = getattr(dataLocation, 'encryption_info', None)
+        if encryptionInfo is not None and key is None:
+            paradux.logging.error( 'No key to encrypt with, not pushing:', dataLocation)
+            return None
+
+        with paradux.bandwidth.defaultGovernor().connection(dataLocation), self._recordingHealth(dataLocation) as outcome:
+            paradux.logging.info( 'Pushing to:', dataLocation)
+            if getattr(dataLocation, 'storage_format', None) == paradux.data.datalocation.FORMAT_CHUNKS:
+                store = paradux.chunkstore.ChunkStore(self, protocol, dataLocation, key)
+                try:
+                    ret = store.push(localDir, timeout)
+                finally:
+                    store.close()
+            elif encryptionInfo is None and protocol.has(paradux.transport.TREES):
+                ret = protocol.pushTree(localDir, dataLocation, timeout=timeout)
+            else:
+                ret = self._pushFiles(protocol, localDir, dataLocation, pushedFiles, timeout, key)
+
+            outcome['success'] = ret is not None
+            return ret
+
+
+    def _pushFiles(self, protocol, localDir, dataLocation, pushedFiles, timeout=None, key=None):
+        """
+        Upload the files in a local directory hierarchy that have changed since
+        they were last pushed, one by one, encrypting them if the data location
+        has encryption_info.
+
+        protocol: the Transport for the data location
+        localDir: the local directory
+        dataLocation: the location of the directory to copy to
+        pushedFiles: dict from relative path to [ size, mtime in ns ] of the files
+             pushed before, which is updated
+        timeout: if given, give up after this many seconds
+        key: the key to encrypt with, if the data location has encryption_info
+        return: TreeStats if successful, None otherwise
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        deadline       = None if timeout is None else time.monotonic() + timeout
+        encryptionInfo = getattr(dataLocation, 'encryption_info', None)
+        ret            = paradux.transport.TreeStats()
+
+        for dirPath, dirNames, fileNames in os.walk(localDir):
+            dirNames.sort()
+            relDir   = os.path.relpath(dirPath, localDir)
+            relDir   = '' if relDir == '.' else relDir.replace(os.sep, '/') + '/'
+            dirReady = False
+
+            for fileName in sorted(fileNames):
+                localFile = os.path.join(dirPath, fileName)
+                if os.path.islink(localFile) or not os.path.isfile(localFile):
+                    continue
+
+                st   = os.stat(localFile)
+                rel  = relDir + fileName
+                if pushedFiles.get(rel) == [ st.st_size, st.st_mtime_ns ]:
+                    continue
+
+                if not dirReady:
+                    dirLocation = dataLocation.childLocation(relDir) if relDir else dataLocation
+                    if not protocol.makeDirectories(dirLocation, paradux.utils.remainingTime(deadline, timeout)):
+                        return None
+                    dirReady = True
+
+                fileLocation = dataLocation.childLocation(rel)
+                if encryptionInfo is None:
+                    uploaded = self._upload(protocol, localFile, fileLocation, paradux.utils.remainingTime(deadline, timeout))
+                else:
+                    uploaded = self._uploadEncrypted(protocol, localFile, fileLocation, key, encryptionInfo, paradux.utils.remainingTime(deadline, timeout))
+                if not uploaded:
+                    return None
+
+                pushedFiles[rel] = [ st.st_size, st.st_mtime_ns ]
+                ret.files += 1
+                ret.bytes += st.st_size
+
+        return ret
+
+
+    def _uploadEncrypted(self, protocol, localFile, dataLocation, key, encryptionInfo, timeout=None):
+        """
+        Encrypt the local file and copy it to the given (remote) data location
+        with the given Transport. If the Transport can upload a stream, the
+        file is encrypted while it is uploaded; otherwise it is encrypted into
+        a temporary file first.
+
+        protocol: the Transport for the data location
+        localFile: the local file
+        dataLocation: the location to upload the encrypted file to
+        key: the key to encrypt with
+        encryptionInfo: the EncryptionInfo
+        timeout: if given, give up after this many seconds
+        return: True if upload was performed successfully
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        if protocol.has(paradux.transport.STREAMING):
+            with open(localFile, 'rb') as fd:
+                reader = paradux.encryption.EncryptingReader(fd, key, encryptionInfo)
+                try:
+                    return protocol.uploadStream(reader, dataLocation, timeout=timeout) is True
+                finally:
+                    reader.close()
+
+        os.makedirs(self.staging_dir, mode=0o700, exist_ok=True)
+        with NamedTemporaryFile(dir=self.staging_dir, prefix='.encrypted-') as tmp:
+            paradux.encryption.encryptFile(localFile, tmp.name, key, encryptionInfo)
+            # Not resumable: the ciphertext differs every time
+            return protocol.upload(tmp.name, dataLocation, timeout=timeout) is True
+
+
     def cleanup(self):
         """
         Do whatever necessary to clean up and make private data inaccessible again. This
@@ -362,6 +1010,16 @@ class Settings:
         """
         paradux.logging.info('Cleaning up')
 
+        # Transports may hold sessions over the pooled ssh connections
+        with self.dataTransferProtocolsLock:
+            if self.dataTransferProtocols is not None:
+                for dataTransferProtocol in self.dataTransferProtocols.values():
+                    dataTransferProtocol.close()
+
+        paradux.sshpool.closeDefaultPool()
+        paradux.processpool.closeDefaultExecutor()
+        paradux.data.credential.disposeMaterializedCredentials()
+
         if self._image_ismounted():
             self._image_umount()
 
@@ -604,28 +1262,6 @@ guess, and DO NOT write it down anywhere.
         _deleteTempFile(recoveryKeyFile)
 
 
-    def _findDataTransferProtocolFor(self, dataLocation):
-        """
-        Find the Python module that knows how to upload data to this
-        data location.
-
-        dataLocation: the data location to upload to
-        return: the module, or None if not foudn
-        """
-        if self.dataTransferProtocols is None:
-            self.dataTransferProtocols = dict()
-            for moduleName in paradux.utils.findSubmodules(paradux.datatransfer):
-                mod = importlib.import_module('paradux.datatransfer.' + moduleName)
-                self.dataTransferProtocols[moduleName] = mod
-
-        proto = dataLocation.url.scheme
-        for dataTransferProtocol in self.dataTransferProtocols.values():
-            if dataTransferProtocol.supportsProtocol(proto):
-                return dataTransferProtocol
-
-        return None
-
-
 def _secretToPassphrase(secret):
     """
     Convert an integer (used as secret for Shamir) to a passphrase for cryptsetup. Use
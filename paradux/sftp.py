@@ -0,0 +1,812 @@
+#!/usr/bin/python
+#
+# An SFTP (version 3) client that runs in-process, over a long-lived ssh
+# session per host, so transferring many files does not need a process and
+# a handshake each.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import collections
+import os
+import paradux.logging
+import paradux.sshpool
+import paradux.utils
+import select
+import signal
+import struct
+import subprocess
+import threading
+import time
+from urllib.parse import unquote
+
+
+# The sessions used by all data transfer protocols in this process
+_defaultSessionPool     = None
+_defaultSessionPoolLock = threading.Lock()
+
+# Packet types, per draft-ietf-secsh-filexfer-02
+SSH_FXP_INIT           = 1
+SSH_FXP_VERSION        = 2
+SSH_FXP_OPEN           = 3
+SSH_FXP_CLOSE          = 4
+SSH_FXP_READ           = 5
+SSH_FXP_WRITE          = 6
+SSH_FXP_FSTAT          = 8
+SSH_FXP_OPENDIR        = 11
+SSH_FXP_READDIR        = 12
+SSH_FXP_REMOVE         = 13
+SSH_FXP_MKDIR          = 14
+SSH_FXP_STAT           = 17
+SSH_FXP_RENAME         = 18
+SSH_FXP_STATUS         = 101
+SSH_FXP_HANDLE         = 102
+SSH_FXP_DATA           = 103
+SSH_FXP_NAME           = 104
+SSH_FXP_ATTRS          = 105
+SSH_FXP_EXTENDED       = 200
+SSH_FXP_EXTENDED_REPLY = 201
+
+# Status codes
+SSH_FX_OK                = 0
+SSH_FX_EOF               = 1
+SSH_FX_NO_SUCH_FILE      = 2
+SSH_FX_PERMISSION_DENIED = 3
+SSH_FX_FAILURE           = 4
+
+# Flags for opening files
+SSH_FXF_READ   = 0x01
+SSH_FXF_WRITE  = 0x02
+SSH_FXF_APPEND = 0x04
+SSH_FXF_CREAT  = 0x08
+SSH_FXF_TRUNC  = 0x10
+
+# Flags for file attributes
+SSH_FILEXFER_ATTR_SIZE        = 0x00000001
+SSH_FILEXFER_ATTR_UIDGID      = 0x00000002
+SSH_FILEXFER_ATTR_PERMISSIONS = 0x00000004
+SSH_FILEXFER_ATTR_ACMODTIME   = 0x00000008
+SSH_FILEXFER_ATTR_EXTENDED    = 0x80000000
+
+# Number of bytes per read or write request. Servers accept at least 32 KiB.
+CHUNK_SIZE = 32 * 1024
+
+# Number of read or write requests sent before waiting for the first one to
+# be confirmed, so high-latency links are kept busy
+WINDOW = 64
+
+# Extension that renames even if the new name exists, atomically
+POSIX_RENAME = 'posix-rename@openssh.com'
+
+
+def defaultSessionPool():
+    """
+    Obtain the SftpSessionPool shared by all data transfers in this process.
+
+    return: SftpSessionPool
+    """
+    global _defaultSessionPool
+
+    with _defaultSessionPoolLock:
+        if _defaultSessionPool is None:
+            _defaultSessionPool = SftpSessionPool()
+        return _defaultSessionPool
+
+
+def closeDefaultSessionPool():
+    """
+    Close all sessions in the shared SftpSessionPool, if there is one.
+
+    return: void
+    """
+    global _defaultSessionPool
+
+    with _defaultSessionPoolLock:
+        pool                = _defaultSessionPool
+        _defaultSessionPool = None
+
+    if pool is not None:
+        pool.close()
+
+
+def sftpPath(urlPath):
+    """
+    Convert the path component of an sftp URL into a path on the server. As
+    with scp, sftp://host/foo refers to foo in the home directory, and
+    sftp://host//foo to /foo. The server starts in the home directory, so a
+    leading ~/ can be dropped; other users' home directories are not supported.
+
+    urlPath: the path component of the URL, which may be percent-encoded
+    return: the path
+    """
+    urlPath = unquote(urlPath)
+    if urlPath.startswith('/'):
+        urlPath = urlPath[1:]
+
+    if urlPath == '~':
+        return '.'
+    if urlPath.startswith('~/'):
+        return urlPath[2:]
+    if urlPath.startswith('~'):
+        raise ValueError('Cannot refer to the home directory of another user with sftp: ' + urlPath)
+    return urlPath
+
+
+class SftpError(IOError):
+    """
+    The SFTP server reported an error.
+
+    code: the status code
+    """
+    def __init__(self, code, message):
+        super().__init__('SFTP status ' + str(code) + ': ' + message)
+        self.code = code
+
+
+class _Pending:
+    """
+    A request sent to the server, whose response has not been received yet.
+    """
+    def __init__(self):
+        self.done    = threading.Event()
+        self.type    = None
+        self.payload = None
+
+
+class SftpSession:
+    """
+    One SFTP session, over an ssh process that runs the sftp subsystem on the
+    server. Requests may be sent from several threads at the same time; a
+    reader thread hands each response to whoever is waiting for it. If a
+    deadline passes while a packet is only partially sent, or before the
+    session has started, the ssh process is killed, as the session cannot be
+    used any more.
+
+    cmd: the command that starts ssh with the sftp subsystem
+    deadline: time.monotonic() value after which to give up starting the session, or None
+    """
+    def __init__(self, cmd, deadline=None):
+        self.cmd        = cmd
+        self.nextId     = 0
+        self.pending    = {}    # request id -> _Pending
+        self.lock       = threading.Lock() # protects nextId and pending
+        self.writeLock  = threading.Lock() # serializes sending packets
+        self.alive      = True
+        self.extensions = {}
+        self.version    = _Pending() # the response to SSH_FXP_INIT, which has no request id
+
+        paradux.logging.trace('Starting sftp session:', cmd)
+        self.process = subprocess.Popen(
+                cmd,
+                shell             = True,
+                stdin             = subprocess.PIPE,
+                stdout            = subprocess.PIPE,
+                start_new_session = True)
+
+        # Written to directly, so sending can give up at a deadline
+        self.stdinFd = self.process.stdin.fileno()
+        os.set_blocking(self.stdinFd, False)
+
+        self.reader = threading.Thread(target=self._readResponses, daemon=True)
+        self.reader.start()
+
+        try:
+            self._sendPacket(SSH_FXP_INIT, struct.pack('>I', 3), deadline)
+            packetType, payload = self._wait(self.version, deadline)
+
+        except subprocess.TimeoutExpired:
+            self.kill()
+            raise
+
+        except SftpError:
+            packetType = None
+
+        if packetType != SSH_FXP_VERSION:
+            self.kill()
+            raise SftpError(SSH_FX_FAILURE, 'Cannot start sftp session')
+
+        version, pos = _unpackUint32(payload, 0)
+        while pos < len(payload):
+            name, pos = _unpackString(payload, pos)
+            data, pos = _unpackString(payload, pos)
+            self.extensions[name.decode('utf8', errors='replace')] = data
+        paradux.logging.trace('sftp server version', version, 'with extensions', sorted(self.extensions))
+
+
+    def isAlive(self):
+        """
+        Can this session still be used?
+
+        return: True or False
+        """
+        return self.alive and self.process.poll() is None
+
+
+    def close(self):
+        """
+        End this session.
+
+        return: void
+        """
+        self.alive = False
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.kill()
+
+
+    def kill(self):
+        """
+        End this session at once, killing the ssh process.
+
+        return: void
+        """
+        self.alive = False
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+
+    def open(self, path, flags, permissions=None, deadline=None):
+        """
+        Open a remote file.
+
+        path: the path of the file
+        flags: combination of SSH_FXF_ flags
+        permissions: the permissions of the file, if created
+        deadline: time.monotonic() value after which to give up, or None
+        return: the handle
+        """
+        attrs = _packAttrs(permissions=permissions)
+        return self._expectHandle(self._call(SSH_FXP_OPEN, _packString(path) + struct.pack('>I', flags) + attrs, deadline))
+
+
+    def closeHandle(self, handle, deadline=None):
+        """
+        Close a handle obtained from open().
+
+        handle: the handle
+        deadline: time.monotonic() value after which to give up, or None
+        return: void
+        """
+        self._expectOk(self._call(SSH_FXP_CLOSE, _packString(handle), deadline))
+
+
+    def stat(self, path, deadline=None):
+        """
+        Obtain the attributes of a remote file.
+
+        path: the path of the file
+        deadline: time.monotonic() value after which to give up, or None
+        return: dict with keys 'size', 'permissions' and 'mtime' where known, or None if it does not exist
+        """
+        response = self._call(SSH_FXP_STAT, _packString(path), deadline)
+        if response[0] == SSH_FXP_STATUS and _statusOf(response[1])[0] == SSH_FX_NO_SUCH_FILE:
+            return None
+        return self._expectAttrs(response)
+
+
+    def remove(self, path, deadline=None):
+        """
+        Remove a remote file, if it exists.
+
+        path: the path of the file
+        deadline: time.monotonic() value after which to give up, or None
+        return: void
+        """
+        response = self._call(SSH_FXP_REMOVE, _packString(path), deadline)
+        if _statusOf(response[1])[0] != SSH_FX_NO_SUCH_FILE:
+            self._expectOk(response)
+
+
+    def makeDirectory(self, path, deadline=None):
+        """
+        Create a remote directory, accessible only by the user, unless it
+        exists already.
+
+        path: the path of the directory
+        deadline: time.monotonic() value after which to give up, or None
+        return: void
+        """
+        response = self._call(SSH_FXP_MKDIR, _packString(path) + struct.pack('>II', SSH_FILEXFER_ATTR_PERMISSIONS, 0o700), deadline)
+        if _statusOf(response[1])[0] != SSH_FX_OK and self.stat(path, deadline) is None:
+            self._expectOk(response)
+
+
+    def rename(self, oldPath, newPath, deadline=None):
+        """
+        Rename a remote file, replacing newPath if it exists. This is atomic
+        if the server supports the posix-rename extension.
+
+        oldPath: the current path of the file
+        newPath: the new path of the file
+        deadline: time.monotonic() value after which to give up, or None
+        return: void
+        """
+        if POSIX_RENAME in self.extensions:
+            self._expectOk(self._call(
+                    SSH_FXP_EXTENDED,
+                    _packString(POSIX_RENAME) + _packString(oldPath) + _packString(newPath),
+                    deadline))
+        else:
+            # SFTP v3 renames fail if newPath exists
+            self.remove(newPath, deadline)
+            self._expectOk(self._call(SSH_FXP_RENAME, _packString(oldPath) + _packString(newPath), deadline))
+
+
+    def listDir(self, path, deadline=None):
+        """
+        List the names in a remote directory.
+
+        path: the path of the directory
+        deadline: time.monotonic() value after which to give up, or None
+        return: sorted list of names, without . and .., or None if it does not exist
+        """
+        response = self._call(SSH_FXP_OPENDIR, _packString(path), deadline)
+        if response[0] == SSH_FXP_STATUS and _statusOf(response[1])[0] == SSH_FX_NO_SUCH_FILE:
+            return None
+        handle = self._expectHandle(response)
+
+        ret = []
+        try:
+            while True:
+                packetType, payload = self._call(SSH_FXP_READDIR, _packString(handle), deadline)
+                if packetType == SSH_FXP_STATUS and _statusOf(payload)[0] == SSH_FX_EOF:
+                    break
+                if packetType != SSH_FXP_NAME:
+                    self._expectOk(( packetType, payload ))
+
+                count, pos = _unpackUint32(payload, 0)
+                for i in range(count):
+                    name, pos = _unpackString(payload, pos)
+                    _,    pos = _unpackString(payload, pos) # long name
+                    _,    pos = _unpackAttrs(payload, pos)
+                    name = name.decode('utf8', errors='surrogateescape')
+                    if name not in ( '.', '..' ):
+                        ret.append(name)
+        finally:
+            self.closeHandle(handle, deadline)
+
+        return sorted(ret)
+
+
+    def writeFrom(self, handle, reader, offset=0, deadline=None, onConfirmed=None):
+        """
+        Write everything that can be read from a stream into a remote file,
+        keeping up to WINDOW write requests outstanding.
+
+        handle: the handle of the remote file, opened for writing
+        reader: file-like object whose content to write
+        offset: where in the remote file to start writing
+        deadline: time.monotonic() value after which to give up, or None
+        onConfirmed: if given, invoked with the number of bytes at the beginning
+             of the file that the server has confirmed, after each confirmation
+        return: the number of bytes written
+        """
+        outstanding = collections.deque() # of (_Pending, end of its chunk)
+        end         = offset
+        while True:
+            buf = reader.read(CHUNK_SIZE)
+            if buf:
+                pending = self._send(SSH_FXP_WRITE, _packString(handle) + struct.pack('>Q', end) + _packString(buf), deadline)
+                end    += len(buf)
+                outstanding.append(( pending, end ))
+
+            # Wait for the oldest once the window is full; after the last chunk, for all
+            while outstanding and ( not buf or len(outstanding) >= WINDOW ):
+                pending, confirmed = outstanding.popleft()
+                self._expectOk(self._wait(pending, deadline))
+                if onConfirmed is not None:
+                    onConfirmed(confirmed)
+
+            if not buf:
+                return end - offset
+
+
+    def readInto(self, handle, writer, size, deadline=None):
+        """
+        Read a remote file into a stream, keeping up to WINDOW read requests
+        outstanding.
+
+        handle: the handle of the remote file, opened for reading
+        writer: file-like object to write the content to
+        size: the size of the remote file, as far as known
+        deadline: time.monotonic() value after which to give up, or None
+        return: the number of bytes read
+        """
+        outstanding = collections.deque()
+        nextOffset  = 0 # of the next request
+        done        = 0 # bytes written to the writer
+        while True:
+            # Read ahead as far as the file goes, then one more to find the end
+            while len(outstanding) < WINDOW and ( nextOffset < size or not outstanding ):
+                outstanding.append(self._send(SSH_FXP_READ, _packString(handle) + struct.pack('>QI', nextOffset, CHUNK_SIZE), deadline))
+                nextOffset += CHUNK_SIZE
+
+            packetType, payload = self._wait(outstanding.popleft(), deadline)
+            if packetType == SSH_FXP_STATUS and _statusOf(payload)[0] == SSH_FX_EOF:
+                return done
+            if packetType != SSH_FXP_DATA:
+                self._expectOk(( packetType, payload ))
+
+            data, _ = _unpackString(payload, 0)
+            writer.write(data)
+            done += len(data)
+
+            if len(data) < CHUNK_SIZE:
+                # The server returned less than asked for; the responses to the
+                # requests after this one are ignored, and the rest is requested again
+                outstanding.clear()
+                nextOffset = done
+
+
+    def _call(self, packetType, payload, deadline=None):
+        """
+        Send a request and wait for its response.
+
+        packetType: the type of the request
+        payload: the content of the request, after the request id
+        deadline: time.monotonic() value after which to give up, or None
+        return: tuple of (packet type, payload after the request id) of the response
+        """
+        return self._wait(self._send(packetType, payload, deadline), deadline)
+
+
+    def _send(self, packetType, payload, deadline=None):
+        """
+        Send a request without waiting for its response.
+
+        packetType: the type of the request
+        payload: the content of the request, after the request id
+        deadline: time.monotonic() value after which to give up, or None
+        return: _Pending
+        throws: subprocess.TimeoutExpired if the deadline was reached
+        """
+        pending = _Pending()
+        with self.lock:
+            if not self.alive:
+                raise SftpError(SSH_FX_FAILURE, 'Session has ended')
+            requestId = self.nextId
+            self.nextId = ( self.nextId + 1 ) & 0xffffffff
+            self.pending[requestId] = pending
+
+        self._sendPacket(packetType, struct.pack('>I', requestId) + payload, deadline)
+        return pending
+
+
+    def _wait(self, pending, deadline):
+        """
+        Wait for the response to a request.
+
+        pending: the _Pending of the request
+        deadline: time.monotonic() value after which to give up, or None
+        return: tuple of (packet type, payload after the request id)
+        throws: subprocess.TimeoutExpired if the deadline was reached
+        """
+        remaining = None if deadline is None else max(0, deadline - time.monotonic())
+        if not pending.done.wait(remaining):
+            raise subprocess.TimeoutExpired('sftp', remaining)
+        if pending.type is None:
+            raise SftpError(SSH_FX_FAILURE, 'Session has ended')
+        return ( pending.type, pending.payload )
+
+
+    def _sendPacket(self, packetType, payload, deadline=None):
+        """
+        Send a packet to the server. If the deadline passes first, the session
+        is killed, as the server may have received part of the packet.
+
+        packetType: the type of the packet
+        payload: the content of the packet after the type
+        deadline: time.monotonic() value after which to give up, or None
+        return: void
+        throws: subprocess.TimeoutExpired if the deadline was reached
+        """
+        data = memoryview(struct.pack('>IB', len(payload) + 1, packetType) + payload)
+        with self.writeLock:
+            try:
+                while data:
+                    remaining = paradux.utils.remainingTime(deadline)
+                    if not select.select([], [ self.stdinFd ], [], remaining)[1]:
+                        raise subprocess.TimeoutExpired('sftp', remaining)
+                    data = data[os.write(self.stdinFd, data):]
+
+            except subprocess.TimeoutExpired:
+                paradux.logging.warning('Sending to sftp server timed out, ending session:', self.cmd)
+                self.kill()
+                raise
+
+            except ( OSError, ValueError ) as e:
+                self.alive = False
+                raise SftpError(SSH_FX_FAILURE, 'Session has ended: ' + str(e))
+
+
+    def _readPacket(self):
+        """
+        Read the next packet from the server.
+
+        return: tuple of (packet type, payload after the type), or None at the end
+        """
+        header = self._readExactly(5)
+        if header is None:
+            return None
+        length, packetType = struct.unpack('>IB', header)
+        payload = self._readExactly(length - 1)
+        if payload is None:
+            return None
+        return ( packetType, payload )
+
+
+    def _readExactly(self, n):
+        """
+        Read a number of bytes from the server.
+
+        n: the number of bytes
+        return: the bytes, or None if the server ended the session first
+        """
+        buf = b''
+        while len(buf) < n:
+            chunk = self.process.stdout.read(n - len(buf))
+            if not chunk:
+                return None
+            buf += chunk
+        return buf
+
+
+    def _readResponses(self):
+        """
+        Reader thread: hand each response to the request it belongs to.
+
+        return: void
+        """
+        try:
+            while True:
+                packet = self._readPacket()
+                if packet is None:
+                    break
+
+                packetType, payload = packet
+                if packetType == SSH_FXP_VERSION:
+                    self.version.type    = packetType
+                    self.version.payload = payload
+                    self.version.done.set()
+                    continue
+
+                requestId, = struct.unpack('>I', payload[0:4])
+                with self.lock:
+                    pending = self.pending.pop(requestId, None)
+                if pending is not None:
+                    pending.type    = packetType
+                    pending.payload = payload[4:]
+                    pending.done.set()
+
+        except Exception as e:
+            paradux.logging.warning('sftp session failed:', e)
+
+        finally:
+            with self.lock:
+                self.alive = False
+                remaining  = list(self.pending.values())
+                self.pending.clear()
+            for pending in remaining + [ self.version ]:
+                pending.done.set() # with type None, unless done already
+
+
+    def _expectOk(self, response):
+        """
+        Check that a response reports success.
+
+        response: tuple of (packet type, payload)
+        return: void
+        throws: SftpError if it does not
+        """
+        packetType, payload = response
+        if packetType != SSH_FXP_STATUS:
+            raise SftpError(SSH_FX_FAILURE, 'Unexpected response: ' + str(packetType))
+        code, message = _statusOf(payload)
+        if code != SSH_FX_OK:
+            raise SftpError(code, message)
+
+
+    def _expectHandle(self, response):
+        """
+        Obtain the handle from a response.
+
+        response: tuple of (packet type, payload)
+        return: the handle
+        throws: SftpError if the response reports an error
+        """
+        packetType, payload = response
+        if packetType != SSH_FXP_HANDLE:
+            self._expectOk(response)
+        handle, _ = _unpackString(payload, 0)
+        return handle
+
+
+    def _expectAttrs(self, response):
+        """
+        Obtain the file attributes from a response.
+
+        response: tuple of (packet type, payload)
+        return: dict of attributes
+        throws: SftpError if the response reports an error
+        """
+        packetType, payload = response
+        if packetType != SSH_FXP_ATTRS:
+            self._expectOk(response)
+        attrs, _ = _unpackAttrs(payload, 0)
+        return attrs
+
+
+class SftpSessionPool:
+    """
+    Keeps one SftpSession per (user, host, port, key), shared by all
+    transfers to that host. The sessions run over the connections of the
+    SshConnectionPool, so they do not need their own handshake.
+    """
+    def __init__(self):
+        self.sessions = {} # keyed by (user, host, port, keyFile)
+        self.starting = {} # same keys: lock held while starting the session
+        self.lock     = threading.Lock() # protects sessions and starting
+
+
+    def sessionFor(self, dataLocation, deadline=None):
+        """
+        Obtain the session for the host of an sftp data location, starting it
+        if needed. Only one session per host is started at a time, without
+        holding up obtaining sessions for other hosts.
+
+        dataLocation: the DataLocation
+        deadline: time.monotonic() value after which to give up, or None
+        return: SftpSession
+        throws: subprocess.TimeoutExpired if the deadline was reached
+        """
+        user, host, port, keyFile = paradux.sshpool.sshParametersFor(dataLocation)
+        key = ( user, host, port, keyFile )
+
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is not None and session.isAlive():
+                return session
+            startLock = self.starting.setdefault(key, threading.Lock())
+
+        remaining = paradux.utils.remainingTime(deadline)
+        if not startLock.acquire(timeout=-1 if remaining is None else remaining):
+            raise subprocess.TimeoutExpired('sftp', remaining)
+        try:
+            with self.lock:
+                session = self.sessions.get(key)
+                if session is not None and session.isAlive():
+                    return session # started by another thread in the meantime
+
+            cmd = "ssh " + paradux.sshpool.defaultPool().getSshOptions(user, host, port, keyFile, paradux.utils.remainingTime(deadline))
+            if port is not None:
+                cmd += " -p " + str(port)
+            if keyFile is not None:
+                cmd += " -i '" + keyFile + "'"
+            cmd += " -s '" + (host if user is None else user + '@' + host) + "' sftp"
+
+            session = SftpSession(cmd, deadline)
+            with self.lock:
+                self.sessions[key] = session
+            return session
+
+        finally:
+            startLock.release()
+
+
+    def close(self):
+        """
+        End all sessions in this pool.
+
+        return: void
+        """
+        with self.lock:
+            sessions      = list(self.sessions.values())
+            self.sessions = {}
+
+        for session in sessions:
+            session.close()
+
+
+def _packString(s):
+    """
+    Encode a string or bytes as an SFTP string.
+
+    s: the string or bytes
+    return: bytes
+    """
+    if isinstance(s, str):
+        s = s.encode('utf8', errors='surrogateescape')
+    return struct.pack('>I', len(s)) + s
+
+
+def _unpackString(buf, pos):
+    """
+    Decode an SFTP string.
+
+    buf: the bytes
+    pos: where the string starts
+    return: tuple of (bytes, position after the string)
+    """
+    n, pos = _unpackUint32(buf, pos)
+    return ( buf[pos:pos+n], pos + n )
+
+
+def _unpackUint32(buf, pos):
+    """
+    Decode a 32-bit unsigned integer.
+
+    buf: the bytes
+    pos: where the integer starts
+    return: tuple of (integer, position after the integer)
+    """
+    return ( struct.unpack('>I', buf[pos:pos+4])[0], pos + 4 )
+
+
+def _packAttrs(permissions=None):
+    """
+    Encode file attributes.
+
+    permissions: the permissions, or None
+    return: bytes
+    """
+    if permissions is None:
+        return struct.pack('>I', 0)
+    return struct.pack('>II', SSH_FILEXFER_ATTR_PERMISSIONS, permissions)
+
+
+def _unpackAttrs(buf, pos):
+    """
+    Decode file attributes.
+
+    buf: the bytes
+    pos: where the attributes start
+    return: tuple of (dict of attributes, position after the attributes)
+    """
+    ret = {}
+    flags, pos = _unpackUint32(buf, pos)
+    if flags & SSH_FILEXFER_ATTR_SIZE:
+        ret['size'] = struct.unpack('>Q', buf[pos:pos+8])[0]
+        pos += 8
+    if flags & SSH_FILEXFER_ATTR_UIDGID:
+        pos += 8
+    if flags & SSH_FILEXFER_ATTR_PERMISSIONS:
+        ret['permissions'], pos = _unpackUint32(buf, pos)
+    if flags & SSH_FILEXFER_ATTR_ACMODTIME:
+        pos += 4 # atime
+        ret['mtime'], pos = _unpackUint32(buf, pos)
+    if flags & SSH_FILEXFER_ATTR_EXTENDED:
+        count, pos = _unpackUint32(buf, pos)
+        for i in range(count):
+            _, pos = _unpackString(buf, pos)
+            _, pos = _unpackString(buf, pos)
+    return ( ret, pos )
+
+
+def _statusOf(payload):
+    """
+    Decode the payload of a status response.
+
+    payload: the payload, after the request id
+    return: tuple of (status code, message)
+    """
+    if len(payload) < 4:
+        return ( SSH_FX_FAILURE, 'Malformed status' )
+    code, pos = _unpackUint32(payload, 0)
+    message = ''
+    if pos < len(payload):
+        m, pos  = _unpackString(payload, pos)
+        message = m.decode('utf8', errors='replace')
+    return ( code, message )
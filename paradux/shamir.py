@@ -70,6 +70,8 @@ class Share:
     Collects all the information in one share that is distributed
     to one steward.
     """
+    __slots__ = ( 'x', 'y' )
+
     def __init__(self, x, y):
         """
         Constructor.
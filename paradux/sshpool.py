@@ -0,0 +1,621 @@
+#!/usr/bin/python
+#
+# Pool of multiplexed ssh connections, so the ssh handshake only needs to be
+# performed once per host, user and key during a run.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os
+import os.path
+import paradux.bandwidth
+from paradux.data.credential import SshCredentials
+import paradux.logging
+import paradux.transport
+import paradux.utils
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+
+# Number of seconds to wait for the TCP connection to a host, unless the caller has less time
+CONNECT_TIMEOUT = 30
+
+# Number of seconds to wait for a shared connection to be established, including
+# authentication, unless the caller has less time
+HANDSHAKE_TIMEOUT = 60
+
+# The pool used by all data transfer protocols in this process
+_defaultPool     = None
+_defaultPoolLock = threading.Lock()
+
+
+def defaultPool():
+    """
+    Obtain the SshConnectionPool shared by all data transfers in this process.
+
+    return: SshConnectionPool
+    """
+    global _defaultPool
+
+    with _defaultPoolLock:
+        if _defaultPool is None:
+            _defaultPool = SshConnectionPool()
+        return _defaultPool
+
+
+def sshParametersFor(dataLocation):
+    """
+    Determine how to connect via ssh to the host of an ssh-based data location.
+
+    dataLocation: the DataLocation
+    return: tuple of (user, host, port, keyFile), where user, port and keyFile may be None
+    """
+    user    = None
+    keyFile = None
+    cred    = dataLocation.credentials
+    if cred:
+        if isinstance(cred, SshCredentials):
+            user    = cred.username
+            keyFile = cred.getPrivateKeyFile() # shared by all transfers with these credentials
+
+        else:
+            paradux.logging.fatal('Should not happen:', cred)
+
+    return ( user, dataLocation.url.hostname, dataLocation.url.port, keyFile )
+
+
+def remoteShellPath(urlPath):
+    """
+    Convert the path component of an ssh-based URL into a path for the remote
+    shell. The leading slash is removed, so scp://host/foo refers to foo in
+    the home directory, and scp://host//foo to /foo. A leading ~ or ~user is
+    left for the remote shell to expand; everything else is quoted.
+
+    urlPath: the path component of the URL
+    return: the path, ready to be used in a remote shell command
+    """
+    if urlPath.startswith('/'):
+        urlPath = urlPath[1:]
+
+    m = re.match(r'^(~[A-Za-z0-9._-]*)(/.*)?$', urlPath)
+    if m:
+        if m.group(2) is None:
+            return m.group(1)
+        return m.group(1) + '/' + shlex.quote(m.group(2)[1:])
+
+    return shlex.quote(urlPath)
+
+
+def runRemoteCommand(user, host, port, keyFile, remoteCmd, timeout=None):
+    """
+    Run a command on a remote host over the pooled ssh connection.
+
+    user: the user to log on as, or None
+    host: the host to connect to
+    port: the port to connect to, or None for the default
+    keyFile: name of the private key file to authenticate with, or None
+    remoteCmd: the command to run by the remote shell
+    timeout: if given, give up after this many seconds
+    return: tuple of (exit code, stdout, stderr)
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    cmd  = "ssh " + defaultPool().getSshOptions(user, host, port, keyFile, timeout)
+    if port is not None:
+        cmd += " -p " + str(port)
+    if keyFile is not None:
+        cmd += " -i '" + keyFile + "'"
+    cmd += " '" + (host if user is None else user + '@' + host) + "'"
+    cmd += " " + shlex.quote(remoteCmd)
+
+    return paradux.utils.myexec(cmd, None, True, True, paradux.utils.remainingTime(deadline, timeout))
+
+
+def remoteSha256(dataLocation, timeout=None):
+    """
+    Determine the SHA-256 hash of the file at an ssh-based data location by
+    running sha256sum on the remote host.
+
+    dataLocation: the DataLocation
+    timeout: if given, give up after this many seconds
+    return: hex digest, or None if it could not be determined, e.g. because the file does not exist
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    user, host, port, keyFile = sshParametersFor(dataLocation)
+
+    status, out, err = runRemoteCommand(
+            user, host, port, keyFile,
+            'sha256sum ' + remoteShellPath(dataLocation.url.path),
+            timeout)
+    if status != 0:
+        paradux.logging.trace('Remote sha256sum failed:', dataLocation, err)
+        return None
+
+    m = re.match(r'^([0-9a-f]{64})\s', out.decode('utf8', errors='replace'))
+    return m.group(1) if m else None
+
+
+def remoteMakeDirectories(dataLocation, timeout=None):
+    """
+    Create the directory at an ssh-based data location, and its parents,
+    unless they exist already.
+
+    dataLocation: the DataLocation of the directory
+    timeout: if given, give up after this many seconds
+    return: True if successful
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    user, host, port, keyFile = sshParametersFor(dataLocation)
+
+    status, out, err = runRemoteCommand(
+            user, host, port, keyFile,
+            'mkdir -p ' + remoteShellPath(dataLocation.url.path),
+            timeout)
+    if status != 0:
+        paradux.logging.error('Cannot create directory at', dataLocation, ':', err.decode('utf8', errors='replace').strip())
+        return False
+    return True
+
+
+def remoteStat(dataLocation, timeout=None):
+    """
+    Determine size and modification time of the file at an ssh-based data
+    location.
+
+    dataLocation: the DataLocation
+    timeout: if given, give up after this many seconds
+    return: RemoteStat, or None if the file does not exist
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    user, host, port, keyFile = sshParametersFor(dataLocation)
+
+    status, out, err = runRemoteCommand(
+            user, host, port, keyFile,
+            _statCommand(remoteShellPath(dataLocation.url.path), '%s %Y', '%z %m'),
+            timeout)
+    if status != 0:
+        return None
+
+    m = re.match(r'^(\d+) (\d+)\s*$', out.decode('utf8', errors='replace'))
+    if m is None:
+        return None
+    return paradux.transport.RemoteStat(int(m.group(1)), int(m.group(2)))
+
+
+def remoteList(dataLocation, timeout=None):
+    """
+    List the files in the directory at an ssh-based data location.
+
+    dataLocation: the DataLocation
+    timeout: if given, give up after this many seconds
+    return: sorted list of file names, or None if the directory does not exist
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    user, host, port, keyFile = sshParametersFor(dataLocation)
+
+    status, out, err = runRemoteCommand(
+            user, host, port, keyFile,
+            'ls -1A ' + remoteShellPath(dataLocation.url.path),
+            timeout)
+    if status != 0:
+        return None
+
+    return sorted( name for name in out.decode('utf8', errors='surrogateescape').split('\n') if name )
+
+
+def uploadStream(dataLocation, reader, timeout=None):
+    """
+    Write everything that can be read from a stream into the file at an
+    ssh-based data location, over the pooled ssh connection. The content is
+    written to a temporary file first, which is only renamed once the stream
+    has been written without error, and the temporary file has its size.
+
+    dataLocation: the DataLocation
+    reader: file-like object whose content to upload
+    timeout: if given, give up after this many seconds
+    return: True if successful
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    user, host, port, keyFile = sshParametersFor(dataLocation)
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    path    = remoteShellPath(dataLocation.url.path)
+    tmpPath = remoteShellPath(dataLocation.url.path + '.paradux-tmp')
+
+    cmd  = "ssh " + defaultPool().getSshOptions(user, host, port, keyFile, timeout)
+    if port is not None:
+        cmd += " -p " + str(port)
+    if keyFile is not None:
+        cmd += " -i '" + keyFile + "'"
+    cmd += " '" + (host if user is None else user + '@' + host) + "'"
+    cmd += " " + shlex.quote('cat > ' + tmpPath)
+
+    # If the local side is killed, the remote cat merely sees the end of its
+    # input, so the rename must not be chained to it
+    reader = _CountingReader(paradux.bandwidth.defaultGovernor().throttledReader(reader, dataLocation))
+    if paradux.utils.myexecFromStream(cmd, reader, paradux.utils.remainingTime(deadline, timeout)) != 0:
+        return False
+
+    return _renameIfComplete(user, host, port, keyFile, tmpPath, path, reader.count, paradux.utils.remainingTime(deadline, timeout))
+
+
+def uploadResumable(dataLocation, localFile, checkpoint, timeout=None):
+    """
+    Upload a local file to an ssh-based data location, over the pooled ssh
+    connection, so that an interrupted upload can be resumed. The file is
+    appended to a remote temporary file, which is renamed once it has the
+    size of the local file. When resuming, the remote temporary file is only
+    appended to if its content matches the beginning of the local file.
+
+    dataLocation: the DataLocation
+    localFile: name of the local file
+    checkpoint: the Checkpoint for this upload
+    timeout: if given, give up after this many seconds
+    return: True if successful
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    user, host, port, keyFile = sshParametersFor(dataLocation)
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    resumed    = checkpoint.isResumed()
+    remoteTemp = checkpoint.getRemoteTemp()
+    if remoteTemp is None:
+        remoteTemp = dataLocation.url.path + '.paradux-partial'
+        checkpoint.setRemoteTemp(remoteTemp)
+        checkpoint.save()
+
+    path    = remoteShellPath(dataLocation.url.path)
+    tmpPath = remoteShellPath(remoteTemp)
+
+    offset = 0
+    if resumed:
+        offset = _confirmedRemotePrefix(user, host, port, keyFile, tmpPath, localFile, paradux.utils.remainingTime(deadline, timeout))
+        if offset > 0:
+            paradux.logging.info('Resuming upload to', dataLocation, 'at byte', offset)
+    checkpoint.setBytesConfirmed(offset)
+    checkpoint.save()
+
+    cmd  = "ssh " + defaultPool().getSshOptions(user, host, port, keyFile, paradux.utils.remainingTime(deadline, timeout))
+    if port is not None:
+        cmd += " -p " + str(port)
+    if keyFile is not None:
+        cmd += " -i '" + keyFile + "'"
+    cmd += " '" + (host if user is None else user + '@' + host) + "'"
+    cmd += " " + shlex.quote(( 'cat >> ' if offset > 0 else 'cat > ' ) + tmpPath)
+
+    with open(localFile, 'rb') as fd:
+        fd.seek(offset)
+        reader = paradux.bandwidth.defaultGovernor().throttledReader(fd, dataLocation)
+        if paradux.utils.myexecFromStream(cmd, reader, paradux.utils.remainingTime(deadline, timeout)) != 0:
+            return False
+
+    return _renameIfComplete(user, host, port, keyFile, tmpPath, path, os.path.getsize(localFile), paradux.utils.remainingTime(deadline, timeout))
+
+
+def _statCommand(remotePath, gnuFormat, bsdFormat):
+    """
+    Construct a remote shell command that shows information about a file.
+    GNU stat, as on Linux, and BSD stat, as on the BSDs and macOS, take
+    different options and formats, so the latter is tried if the former fails.
+
+    remotePath: the path of the file, ready to be used in a remote shell command
+    gnuFormat: the format for GNU stat -c
+    bsdFormat: the same format for BSD stat -f
+    return: the command
+    """
+    return "stat -c '" + gnuFormat + "' " + remotePath + " 2>/dev/null || stat -f '" + bsdFormat + "' " + remotePath
+
+
+def _renameIfComplete(user, host, port, keyFile, tmpPath, path, size, timeout):
+    """
+    Rename a remote temporary file to its final name, if it has the expected
+    size.
+
+    user: the user to log on as, or None
+    host: the host to connect to
+    port: the port to connect to, or None for the default
+    keyFile: name of the private key file to authenticate with, or None
+    tmpPath: the path of the remote temporary file, ready to be used in a remote shell command
+    path: the final path of the file, ready to be used in a remote shell command
+    size: the expected number of bytes
+    timeout: if given, give up after this many seconds
+    return: True if successful
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    status, out, err = runRemoteCommand(
+            user, host, port, keyFile,
+            'test "$(' + _statCommand(tmpPath, '%s', '%z') + ')" = ' + str(size) + ' && mv ' + tmpPath + ' ' + path,
+            timeout)
+    if status != 0:
+        paradux.logging.error('Uploaded file is incomplete, not renaming:', tmpPath, err.decode('utf8', errors='replace').strip())
+        return False
+    return True
+
+
+def remoteFileSize(user, host, port, keyFile, remotePath, timeout=None):
+    """
+    Determine the size of a remote file.
+
+    user: the user to log on as, or None
+    host: the host to connect to
+    port: the port to connect to, or None for the default
+    keyFile: name of the private key file to authenticate with, or None
+    remotePath: the path of the file, ready to be used in a remote shell command
+    timeout: if given, give up after this many seconds
+    return: the size, or None if the file does not exist
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    status, out, err = runRemoteCommand(user, host, port, keyFile, _statCommand(remotePath, '%s', '%z'), timeout)
+    if status != 0:
+        return None
+    try:
+        return int(out.strip())
+    except ValueError:
+        return None
+
+
+def _confirmedRemotePrefix(user, host, port, keyFile, tmpPath, localFile, timeout):
+    """
+    Determine how many bytes at the beginning of a local file the remote
+    temporary file holds already.
+
+    user: the user to log on as, or None
+    host: the host to connect to
+    port: the port to connect to, or None for the default
+    keyFile: name of the private key file to authenticate with, or None
+    tmpPath: the path of the remote temporary file, ready to be used in a remote shell command
+    localFile: name of the local file
+    timeout: if given, give up after this many seconds
+    return: number of bytes, 0 if the upload needs to start over
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    remoteSize = remoteFileSize(user, host, port, keyFile, tmpPath, timeout)
+    if remoteSize is None or remoteSize == 0 or remoteSize > os.path.getsize(localFile):
+        return 0
+
+    status, out, err = runRemoteCommand(
+            user, host, port, keyFile,
+            'head -c ' + str(remoteSize) + ' ' + tmpPath + ' | sha256sum',
+            timeout)
+    if status != 0:
+        return 0
+
+    m = re.match(r'^([0-9a-f]{64})\s', out.decode('utf8', errors='replace'))
+    if m is None or m.group(1) != paradux.utils.sha256OfFile(localFile, length=remoteSize):
+        paradux.logging.info('Partial upload does not match the local file, starting over')
+        return 0
+
+    return remoteSize
+
+
+def download(dataLocation, localFile, timeout=None):
+    """
+    Download the file at an ssh-based data location to a local file, over the
+    pooled ssh connection.
+
+    dataLocation: the DataLocation
+    localFile: name of the local file
+    timeout: if given, give up after this many seconds
+    return: True if successful
+    throws: subprocess.TimeoutExpired if the timeout was reached
+    """
+    user, host, port, keyFile = sshParametersFor(dataLocation)
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    cmd  = "ssh " + defaultPool().getSshOptions(user, host, port, keyFile, timeout)
+    if port is not None:
+        cmd += " -p " + str(port)
+    if keyFile is not None:
+        cmd += " -i '" + keyFile + "'"
+    cmd += " '" + (host if user is None else user + '@' + host) + "'"
+    cmd += " " + shlex.quote('cat ' + remoteShellPath(dataLocation.url.path))
+    cmd += " > '" + localFile + "'"
+
+    return paradux.utils.myexec(cmd, timeout=paradux.utils.remainingTime(deadline, timeout)) == 0
+
+
+def closeDefaultPool():
+    """
+    Close all connections in the shared SshConnectionPool, if there is one.
+
+    return: void
+    """
+    global _defaultPool
+
+    with _defaultPoolLock:
+        pool         = _defaultPool
+        _defaultPool = None
+
+    if pool is not None:
+        pool.close()
+
+
+class _CountingReader:
+    """
+    Wraps a file-like object, counting the bytes read from it.
+
+    reader: the wrapped file-like object
+    count: the number of bytes read so far
+    """
+    def __init__(self, reader):
+        self.reader = reader
+        self.count  = 0
+
+
+    def read(self, size=-1):
+        buf = self.reader.read(size)
+        self.count += len(buf)
+        return buf
+
+
+class _Master:
+    """
+    One ssh ControlMaster connection.
+
+    controlPath: the socket through which other ssh processes reuse this connection
+    target: the [user@]host argument for ssh
+    ok: True if the connection was established
+    lock: held while the connection is being established
+    """
+    def __init__(self, controlPath, target):
+        self.controlPath = controlPath
+        self.target      = target
+        self.ok          = False
+        self.lock        = threading.Lock()
+
+
+class SshConnectionPool:
+    """
+    Starts one ssh ControlMaster per (user, host, port, key), and lets all
+    subsequent ssh, scp and rsync invocations for the same combination reuse
+    it instead of performing their own handshake.
+    """
+    def __init__(self):
+        self.controlDir    = None # created as needed
+        self.masters       = {}   # keyed by (user, host, port, keyFile)
+        self.created       = 0    # number of masters created, for naming their control sockets
+        self.lock          = threading.Lock()
+        self.handshakes    = 0    # number of ssh handshakes performed
+        self.handshakeTime = 0.0  # total number of seconds spent on handshakes
+        self.reuses        = 0    # number of times an existing connection was reused
+
+
+    def getSshOptions(self, user, host, port=None, keyFile=None, timeout=None):
+        """
+        Obtain the options to pass to ssh (or scp, or ssh via rsync -e) so it
+        reuses the pooled connection to this host. Establishes that
+        connection if needed. If it cannot be established, returns no options,
+        so the caller connects by itself.
+
+        user: the user to log on as, or None
+        host: the host to connect to
+        port: the port to connect to, or None for the default
+        keyFile: name of the private key file to authenticate with, or None
+        timeout: if given, give up after this many seconds
+        return: string with ssh options
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        key = ( user, host, port, keyFile )
+        with self.lock:
+            if self.controlDir is None:
+                self.controlDir = tempfile.mkdtemp(prefix='paradux-ssh-')
+            master = self.masters.get(key)
+            if master is None:
+                # Unix domain socket names are short, so don't use the key itself
+                master = _Master(
+                        os.path.join(self.controlDir, 'cm-' + str(self.created)),
+                        host if user is None else user + '@' + host)
+                self.masters[key] = master
+                self.created     += 1
+                isNew = True
+            else:
+                isNew = False
+
+        # Another caller may be establishing the connection
+        if not master.lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise subprocess.TimeoutExpired('ssh connection to ' + master.target, timeout)
+        try:
+            if isNew:
+                self._startMaster(key, master, port, keyFile, paradux.utils.remainingTime(deadline, timeout))
+            elif master.ok:
+                with self.lock:
+                    self.reuses += 1
+        finally:
+            master.lock.release()
+
+        if master.ok:
+            return "-o ControlPath='" + master.controlPath + "'"
+        else:
+            return ''
+
+
+    def close(self):
+        """
+        Tear down all connections in this pool.
+
+        return: void
+        """
+        with self.lock:
+            masters         = list(self.masters.values())
+            controlDir      = self.controlDir
+            self.masters    = {}
+            self.controlDir = None
+
+        for master in masters:
+            if master.ok:
+                paradux.logging.trace('Closing ssh connection:', master.target)
+                paradux.utils.myexec(
+                          "ssh -o ControlPath='" + master.controlPath + "'"
+                        + " -O exit"
+                        + " '" + master.target + "'"
+                        + " > /dev/null 2>&1" )
+
+        if controlDir is not None:
+            shutil.rmtree(controlDir, ignore_errors=True)
+
+        if self.handshakes > 0:
+            paradux.logging.info(
+                    'ssh connection pool:', self.handshakes, 'handshake(s) taking',
+                    '{0:.2f}s'.format(self.handshakeTime), 'in total;',
+                    self.reuses, 'transfer(s) reused an existing connection' )
+
+
+    def _startMaster(self, key, master, port, keyFile, timeout=None):
+        """
+        Establish the ControlMaster connection. The lock of the master must be held.
+        If the host does not respond in time, the connection is considered failed,
+        and callers connect by themselves.
+
+        key: the key of the master in this pool
+        master: the _Master to start
+        port: the port to connect to, or None for the default
+        keyFile: name of the private key file to authenticate with, or None
+        timeout: if given, give up after this many seconds
+        return: void
+        throws: subprocess.TimeoutExpired if the timeout was reached
+        """
+        handshakeTimeout = HANDSHAKE_TIMEOUT if timeout is None else min(HANDSHAKE_TIMEOUT, timeout)
+
+        cmd  = "ssh -M -N -f"
+        cmd += " -o ControlPersist=yes"
+        cmd += " -o ConnectTimeout=" + str(max(1, int(min(CONNECT_TIMEOUT, handshakeTimeout))))
+        cmd += " -o ControlPath='" + master.controlPath + "'"
+        if port is not None:
+            cmd += " -p " + str(port)
+        if keyFile is not None:
+            cmd += " -i '" + keyFile + "'"
+        cmd += " '" + master.target + "'"
+
+        start = time.monotonic()
+        try:
+            master.ok = paradux.utils.myexec(cmd, timeout=handshakeTimeout) == 0
+
+        except subprocess.TimeoutExpired:
+            if timeout is not None and handshakeTimeout >= timeout:
+                # The caller ran out of time, which is not necessarily the fault
+                # of the host: let the next caller try again
+                with self.lock:
+                    if self.masters.get(key) is master:
+                        del self.masters[key]
+                raise
+            master.ok = False
+
+        duration = time.monotonic() - start
+
+        with self.lock:
+            self.handshakes    += 1
+            self.handshakeTime += duration
+
+        if master.ok:
+            paradux.logging.info('ssh handshake with', master.target, 'took', '{0:.2f}s'.format(duration))
+        else:
+            paradux.logging.warning('Failed to establish shared ssh connection to', master.target, '-- connecting without')
@@ -38,7 +38,7 @@ class StewardPackage:
         shamirShare       = self.stewardShare.getShamirShare()
         metadataLocations = self.metadataLocationsConf.getMetadataLocations()
 
-        ret = """Dear {steward.name:s},
+        ret = [ """Dear {steward.name:s},
 
 you have graciously agreed to help
     {user.name:s}
@@ -48,30 +48,30 @@ Please keep it in a place where it safe from disasters (like fires) and
 unauthorized access (like burglars).
 
 Should you note unauthorized access, loss of this sheet, or if you do not
-want to assist {user.name:s} any more, please notify them immediately""".format(user = self.user, steward = self.steward)
+want to assist {user.name:s} any more, please notify them immediately""".format(user = self.user, steward = self.steward) ]
 
         if self.user.contactEmail is not None and self.user.contactPhone is not None:
-            ret += """ at:
-"""
+            ret.append( """ at:
+""" )
             if self.user.contactEmail is not None:
-                ret += """    e-mail: {user.contactEmail:s}
-""".format(user = self.user)
+                ret.append( """    e-mail: {user.contactEmail:s}
+""".format(user = self.user))
 
             if self.user.contactPhone is not None:
-                ret += """    phone: {user.contactPhone:s}
-""".format(user = self.user)
+                ret.append( """    phone: {user.contactPhone:s}
+""".format(user = self.user))
 
         else:
-            ret += """.
-"""
+            ret.append( """.
+""" )
 
         if self.paraduxVersion is not None:
-            ret += """
+            ret.append( """
 Paradux version:
     {version:s}
-""".format(version = self.paraduxVersion)
+""".format(version = self.paraduxVersion))
 
-        ret += """
+        ret.append( """
 Your recovery fragment:
     x = {shamir.x:d}
     y = {shamir.y:d}
@@ -79,21 +79,21 @@ Your recovery fragment:
     k = {minStewards:d}
 """.format(     shamir      = shamirShare,
                 mersenne    = self.mersenne,
-                minStewards = self.minStewards)
+                minStewards = self.minStewards))
 
-        ret += """
+        ret.append( """
 Locations of the paradux metadata:
-"""
+""" )
         if metadataLocations is not None and len(metadataLocations) > 0:
             for metadataLocation in metadataLocations:
-                ret += """    {url:s}
-""".format(url = str(metadataLocation))
+                ret.append( """    {url:s}
+""".format(url = str(metadataLocation)))
 
         else:
-            ret += """    <currently none known>
-"""
+            ret.append( """    <currently none known>
+""" )
 
-        return ret
+        return ''.join(ret)
 
 
     def asJson(self):
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+#
+# Bounded buffers through which one producer hands a stream of bytes to
+# several consumers at the same time.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import queue
+import threading
+
+
+class _EndOfStream:
+    """
+    Marks the end of the stream in a StreamChannel.
+
+    error: if the producer failed, the exception
+    """
+    def __init__(self, error=None):
+        self.error = error
+
+
+class StreamChannel:
+    """
+    A bounded buffer between one producer and one consumer. The producer
+    blocks while the buffer is full; the consumer reads from it like from
+    a file. If the consumer stops reading and closes the channel, whatever
+    the producer offers from then on is discarded, so the producer never
+    blocks on a consumer that went away.
+
+    maxChunks: the maximum number of chunks buffered
+    """
+    def __init__(self, maxChunks=8):
+        self.queue     = queue.Queue(maxChunks)
+        self.closed    = threading.Event() # set by the consumer
+        self.pending   = bytearray()       # received by the consumer but not read yet
+        self.eof       = False
+        self.bytesRead = 0
+
+
+    def offer(self, chunk):
+        """
+        Producer: add the next chunk of the stream, waiting while the buffer is full.
+
+        chunk: the bytes
+        return: False if the consumer has closed the channel
+        """
+        while not self.closed.is_set():
+            try:
+                self.queue.put(chunk, timeout=0.1)
+                return True
+
+            except queue.Full:
+                pass
+        return False
+
+
+    def end(self, error=None):
+        """
+        Producer: mark the end of the stream.
+
+        error: if the producer failed, the exception; the consumer's next read raises
+        return: void
+        """
+        self.offer(_EndOfStream(error))
+
+
+    def read(self, size=-1):
+        """
+        Consumer: read from the stream. Unless the end of the stream has been
+        reached, this returns exactly size bytes.
+
+        size: the number of bytes to read, or -1 for all remaining bytes
+        return: the bytes; empty at the end of the stream
+        throws: IOError if the producer failed
+        """
+        while not self.eof and ( size < 0 or len(self.pending) < size ):
+            item = self.queue.get()
+            if isinstance(item, _EndOfStream):
+                self.eof = True
+                if item.error is not None:
+                    raise IOError('Producer of stream failed: ' + str(item.error))
+            else:
+                self.pending += item
+
+        if size < 0 or size > len(self.pending):
+            size = len(self.pending)
+
+        ret = bytes(self.pending[:size])
+        del self.pending[:size]
+
+        self.bytesRead += len(ret)
+        return ret
+
+
+    def close(self):
+        """
+        Consumer: stop reading.
+
+        return: void
+        """
+        self.closed.set()
+
+
+    def isClosed(self):
+        """
+        Has the consumer stopped reading?
+
+        return: True or False
+        """
+        return self.closed.is_set()
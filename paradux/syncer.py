@@ -0,0 +1,399 @@
+#!/usr/bin/python
+#
+# Pulls the source of each dataset into a local staging tree, and pushes
+# the staging tree to all destinations of the dataset.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import concurrent.futures
+import hashlib
+import os
+import os.path
+import paradux.catalog
+import paradux.logging
+import paradux.utils
+import re
+import subprocess
+import threading
+import time
+
+
+def stagingDirFor(settings, dataset):
+    """
+    Determine the local directory that holds the copy of the source of a
+    dataset. Dataset names may contain anything, so the directory name is
+    made safe, and a hash of the name keeps it unique.
+
+    settings: the Settings
+    dataset: the Dataset
+    return: name of the directory
+    """
+    safeName = re.sub(r'[^A-Za-z0-9._-]+', '-', dataset.name).strip('-.')[:64]
+    nameHash = hashlib.sha256(dataset.name.encode('utf8')).hexdigest()[:8]
+    return settings.staging_dir + '/' + safeName + '-' + nameHash
+
+
+def obtainDatasetKeys(settings, datasets):
+    """
+    Obtain the keys of the datasets that have at least one encrypted
+    destination. Keys that do not exist yet are created, and saved with
+    the secrets before anything is encrypted with them, so the image must
+    be mounted.
+
+    settings: the Settings
+    datasets: the Datasets
+    return: dict from dataset name to key
+    """
+    ret         = {}
+    secretsConf = None
+    created     = False
+    for dataset in datasets:
+        if all( destination.encryption_info is None for destination in dataset.destinations ):
+            continue
+
+        if secretsConf is None:
+            secretsConf = settings.getSecretsConfiguration()
+
+        key = secretsConf.getDatasetKey(dataset.name)
+        if key is None:
+            paradux.logging.info('Creating encryption key for dataset', dataset.name)
+            key     = secretsConf.createDatasetKey(dataset.name)
+            created = True
+        ret[dataset.name] = key
+
+    if created:
+        secretsConf.save()
+
+    return ret
+
+
+class SyncRecord:
+    """
+    Remembers which files have been pushed to destinations whose data
+    transfer protocol cannot copy directories, so only files that have
+    changed since need to be pushed again.
+
+    fileName: name of the JSON file that holds the record
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.files    = {} # keyed by URL of the destination, then relative path: [ size, mtime in ns ]
+        self.lock     = threading.Lock()
+
+        if os.path.isfile(fileName):
+            j = paradux.utils.readJsonFromFile(fileName)
+            self.files = j['files']
+
+
+    def getPushedFiles(self, location):
+        """
+        Obtain the files last pushed to this location.
+
+        location: the data location
+        return: dict from relative path to [ size, mtime in ns ], which the caller may modify
+        """
+        with self.lock:
+            return dict(self.files.get(self._keyFor(location), {}))
+
+
+    def setPushedFiles(self, location, pushedFiles):
+        """
+        Remember the files pushed to this location.
+
+        location: the data location
+        pushedFiles: dict from relative path to [ size, mtime in ns ], which the caller
+             must not modify afterwards
+        return: void
+        """
+        with self.lock:
+            self.files[self._keyFor(location)] = pushedFiles
+
+
+    def save(self):
+        """
+        Save this record to disk.
+
+        return: void
+        """
+        with self.lock:
+            j = { 'files' : dict(self.files) }
+            tmpFile = self.fileName + '.tmp'
+            paradux.utils.writeJsonToFile(tmpFile, j, 0o600)
+            os.replace(tmpFile, self.fileName)
+
+
+    @staticmethod
+    def _keyFor(location):
+        """
+        Determine the key of a location in the record. Files pushed in plain
+        text are recorded separately from encrypted ones, so all files are
+        pushed again once a destination gets encrypted.
+
+        location: the data location
+        return: the key
+        """
+        if getattr(location, 'encryption_info', None) is not None:
+            return str(location) + ' (encrypted)'
+        return str(location)
+
+
+class PushResult:
+    """
+    The outcome of pushing the staging tree of a dataset to one destination.
+
+    location: the destination data location
+    success: True if the destination holds everything in the staging tree
+    files: the number of files transferred
+    bytes: the number of bytes in the files transferred
+    duration: the number of seconds the push took
+    snapshot: name of the snapshot created, if the destination keeps snapshots
+    error: description of the failure, if any
+    """
+    def __init__(self, location):
+        self.location = location
+        self.success  = False
+        self.files    = 0
+        self.bytes    = 0
+        self.duration = None
+        self.snapshot = None
+        self.error    = None
+
+
+    def asText(self):
+        """
+        Show this PushResult to the user in plain text.
+
+        return: plain text
+        """
+        t = "    {0:7s} {1:s} ({2:d} files, {3:d} bytes, {4:.1f}s)".format(
+                'OK' if self.success else 'FAILED',
+                str(self.location),
+                self.files,
+                self.bytes,
+                0.0 if self.duration is None else self.duration )
+        if not self.success and self.error is not None:
+            t += ": " + self.error
+        return t
+
+
+class SyncResult:
+    """
+    The outcome of syncing one dataset.
+
+    dataset: the Dataset
+    success: True if the source was pulled and pushed to all destinations
+    files: the number of files pulled from the source
+    bytes: the number of bytes in the files pulled from the source
+    duration: the number of seconds the pull took
+    pushes: list of PushResult, in the sequence of the destinations
+    error: description of the failure to pull, if any
+    """
+    def __init__(self, dataset):
+        self.dataset  = dataset
+        self.success  = False
+        self.files    = 0
+        self.bytes    = 0
+        self.duration = None
+        self.pushes   = [ PushResult(destination) for destination in dataset.destinations ]
+        self.error    = None
+
+
+    def asText(self):
+        """
+        Show this SyncResult to the user in plain text.
+
+        return: plain text
+        """
+        t = "{0:7s} {1:s}\n    pulled from {2:s} ({3:d} files, {4:d} bytes, {5:.1f}s)".format(
+                'OK' if self.success else 'FAILED',
+                self.dataset.name,
+                str(self.dataset.source),
+                self.files,
+                self.bytes,
+                0.0 if self.duration is None else self.duration )
+        if self.error is not None:
+            t += ": " + self.error
+        for push in self.pushes:
+            t += "\n" + push.asText()
+        return t
+
+
+class Syncer:
+    """
+    Syncs several datasets concurrently. For each, the source is pulled into
+    a local staging tree, transferring only what has changed since the last
+    pull; then the staging tree is pushed to all destinations concurrently.
+
+    settings: the Settings, which know how to copy to and from a single data location
+    maxWorkers: the maximum number of datasets synced at the same time
+    maxPushWorkers: the maximum number of destinations of a dataset pushed to at the same time
+    timeout: number of seconds after which a pull or a push is abandoned, or None
+    syncRecord: the SyncRecord of files pushed one by one, which is updated
+    datasetKeys: dict from dataset name to the key with which its encrypted destinations
+         are encrypted, see obtainDatasetKeys
+    catalog: the Catalog in which successful pushes are recorded
+    skipUnhealthy: if True, do not push to destinations that have failed persistently
+         in recent runs
+    """
+    def __init__(self, settings, maxWorkers=2, maxPushWorkers=4, timeout=None, syncRecord=None, datasetKeys=None, catalog=None, skipUnhealthy=True):
+        self.settings       = settings
+        self.maxWorkers     = maxWorkers
+        self.maxPushWorkers = maxPushWorkers
+        self.timeout        = timeout
+        self.syncRecord     = SyncRecord(settings.synced_file) if syncRecord is None else syncRecord
+        self.datasetKeys    = datasetKeys or {}
+        self.catalog        = paradux.catalog.Catalog(settings.catalog_file) if catalog is None else catalog
+        self.skipUnhealthy  = skipUnhealthy
+
+
+    def sync(self, datasets):
+        """
+        Sync all datasets. This returns once all of them have either succeeded
+        or failed.
+
+        datasets: the Datasets
+        return: list of SyncResult, in the sequence of datasets
+        """
+        paradux.logging.trace('sync', len(datasets))
+
+        results = [ SyncResult(dataset) for dataset in datasets ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+            for future in [ executor.submit(self._syncDataset, result) for result in results ]:
+                future.result()
+
+        return results
+
+
+    def _syncDataset(self, result):
+        """
+        Pull the source of one dataset, and push it to its destinations.
+
+        result: the SyncResult of the dataset, which is updated
+        return: void
+        """
+        dataset    = result.dataset
+        stagingDir = stagingDirFor(self.settings, dataset)
+
+        os.makedirs(self.settings.staging_dir, mode=0o700, exist_ok=True) # intermediate directories do not get the mode
+        os.makedirs(stagingDir, mode=0o700, exist_ok=True)
+
+        start = time.monotonic()
+        try:
+            stats = self.settings.pullTreeFromDataLocation(dataset.source, stagingDir, self.timeout)
+            if stats is None:
+                result.error = 'Pull failed'
+            else:
+                result.files = stats.files
+                result.bytes = stats.bytes
+
+        except subprocess.TimeoutExpired as e:
+            result.error = 'Timed out after {0:g} seconds'.format(e.timeout)
+
+        except Exception as e:
+            result.error = str(type(e)) + ': ' + str(e)
+
+        result.duration = time.monotonic() - start
+
+        if result.error is not None:
+            paradux.logging.error('Pulling dataset', dataset.name, 'failed, not pushing:', result.error)
+            for push in result.pushes:
+                push.error = 'Not pushed, as the pull failed'
+            return
+
+        if result.pushes:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxPushWorkers) as executor:
+                for future in [ executor.submit(self._push, stagingDir, push, self.datasetKeys.get(dataset.name)) for push in self._healthyFirst(result.pushes) ]:
+                    future.result()
+
+        result.success = all( push.success for push in result.pushes )
+
+        try:
+            self.syncRecord.save()
+        except OSError as e:
+            paradux.logging.warning('Cannot save sync record:', e)
+
+        self._recordInCatalog(dataset, stagingDir, result.pushes)
+
+
+    def _recordInCatalog(self, dataset, stagingDir, pushes):
+        """
+        Remember in the catalog that the destinations pushed to successfully
+        now hold the files in the staging tree.
+
+        dataset: the Dataset
+        stagingDir: name of the staging directory
+        pushes: the PushResults of the destinations
+        return: void
+        """
+        succeeded = [ push for push in pushes if push.success ]
+        if not succeeded:
+            return
+
+        try:
+            files = paradux.catalog.scanTree(stagingDir, self.catalog.latestFiles(dataset.name))
+            for push in succeeded:
+                self.catalog.recordSnapshot(dataset.name, str(push.location), files, snapshotName=push.snapshot)
+
+        except Exception as e:
+            paradux.logging.warning('Cannot update catalog:', e)
+
+
+    def _healthyFirst(self, pushes):
+        """
+        Sort the pushes so that the destinations that have been healthy
+        recently come first. If unhealthy destinations are to be skipped, the
+        pushes to those whose circuit is open are marked as skipped.
+
+        pushes: the PushResults
+        return: sorted list of the PushResults that are not skipped
+        """
+        healthRecord = self.settings.getHealthRecord()
+        byLocation   = { id(push.location) : push for push in pushes }
+
+        ret = []
+        for location in healthRecord.prioritize([ push.location for push in pushes ]):
+            push = byLocation[id(location)]
+            if self.skipUnhealthy and healthRecord.isCircuitOpen(location):
+                paradux.logging.warning('Skipping destination that failed persistently:', location)
+                push.error = 'Skipped, failed persistently: ' + healthRecord.asText(location)
+            else:
+                ret.append(push)
+        return ret
+
+
+    def _push(self, stagingDir, push, key):
+        """
+        Push the staging tree to one destination.
+
+        stagingDir: name of the staging directory
+        push: the PushResult of the destination, which is updated
+        key: the key of the dataset, or None
+        return: void
+        """
+        pushedFiles = self.syncRecord.getPushedFiles(push.location)
+
+        start = time.monotonic()
+        try:
+            stats = self.settings.pushTreeToDataLocation(stagingDir, push.location, pushedFiles, self.timeout, key)
+            if stats is None:
+                push.error = 'Push failed'
+            else:
+                push.success  = True
+                push.files    = stats.files
+                push.bytes    = stats.bytes
+                push.snapshot = stats.snapshot
+
+        except subprocess.TimeoutExpired as e:
+            push.error = 'Timed out after {0:g} seconds'.format(e.timeout)
+
+        except Exception as e:
+            push.error = str(type(e)) + ': ' + str(e)
+
+        finally:
+            # Also keep what got pushed before a failure
+            if pushedFiles:
+                self.syncRecord.setPushedFiles(push.location, pushedFiles)
+
+        push.duration = time.monotonic() - start
@@ -0,0 +1,345 @@
+#!/usr/bin/python
+#
+# The interface that data transfer protocols implement, and what they can
+# tell about themselves, so the rest of paradux can pick the cheapest way
+# of getting something done at each data location.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+# Capabilities a Transport may have, beyond uploading a local file
+
+# Can upload a stream without a local file: uploadStream()
+STREAMING        = 'streaming'
+
+# Can continue an interrupted upload where it left off: uploadResumable()
+RANGED_WRITES    = 'ranged-writes'
+
+# Can determine the hash of a remote file without downloading it, computed
+# from what the remote side holds: remoteHash()
+SERVER_SIDE_HASH = 'server-side-hash'
+
+# Can determine the hash recorded with a remote file when it was uploaded,
+# without downloading it: remoteHash(). This is what the uploader claimed, so
+# it does not show that the remote file is intact.
+RECORDED_HASH    = 'recorded-hash'
+
+# A completed upload replaces the previous content at once; there never is
+# a partially written file at the data location
+ATOMIC_RENAME    = 'atomic-rename'
+
+# Can download a remote file: download()
+DOWNLOAD         = 'download'
+
+# Can determine size and modification time of a remote file: stat()
+STAT             = 'stat'
+
+# Can list the files at a remote directory: list()
+LIST             = 'list'
+
+# Can copy a directory hierarchy, transferring only what has changed since
+# the previous copy: pullTree(), pushTree()
+TREES            = 'trees'
+
+
+def transportOf(module):
+    """
+    Obtain the Transport implemented by a module in paradux.datatransfer.
+    Modules define theirs as TRANSPORT; older modules that only define
+    module-level functions are adapted.
+
+    module: the module
+    return: the Transport
+    """
+    if hasattr(module, 'TRANSPORT'):
+        return module.TRANSPORT
+    return ModuleTransport(module)
+
+
+class RemoteStat:
+    """
+    What is known about a remote file without downloading it.
+
+    size: the number of bytes
+    mtime: the UNIX time of the last modification, or None if not known
+    """
+    def __init__(self, size, mtime=None):
+        self.size  = size
+        self.mtime = mtime
+
+
+class TreeStats:
+    """
+    What copying a directory hierarchy transferred.
+
+    files: the number of files transferred
+    bytes: the number of bytes in the files transferred
+    snapshot: name of the snapshot created, if the destination keeps snapshots
+    """
+    def __init__(self, files=0, bytes=0, snapshot=None):
+        self.files    = files
+        self.bytes    = bytes
+        self.snapshot = snapshot
+
+
+class Transport:
+    """
+    Transfers files to and from data locations with certain URL schemes.
+    All methods block until done, and may be invoked from several threads at
+    the same time. Those that the Transport does not have the capability for
+    raise NotImplementedError.
+
+    Methods that transfer a file return True if successful and False
+    otherwise, those that copy a directory hierarchy TreeStats or None;
+    all of them raise subprocess.TimeoutExpired if the timeout was reached.
+    """
+    schemes      = () # the URL schemes supported, such as 'scp'
+    capabilities = frozenset()
+
+
+    def supportsProtocol(self, proto):
+        """
+        Determine whether this Transport supports URL protocol proto.
+
+        proto: the URL protocol, such as "scp"
+        return: True or False
+        """
+        return proto in self.schemes
+
+
+    def has(self, capability):
+        """
+        Determine whether this Transport has a capability.
+
+        capability: one of the capability constants in this module
+        return: True or False
+        """
+        return capability in self.capabilities
+
+
+    def upload(self, localFile, destination, timeout=None):
+        """
+        Upload the local file to the specified DataLocation.
+
+        localFile: name of the local file
+        destination: DataLocation for upload
+        timeout: if given, give up after this many seconds
+        return: True if successful
+        """
+        raise NotImplementedError()
+
+
+    def uploadResumable(self, localFile, destination, checkpoint, timeout=None):
+        """
+        Upload the local file to the specified DataLocation, resuming an
+        earlier, interrupted upload recorded in the checkpoint. Requires
+        RANGED_WRITES.
+
+        localFile: name of the local file
+        destination: DataLocation for upload
+        checkpoint: the Checkpoint for this upload
+        timeout: if given, give up after this many seconds
+        return: True if successful
+        """
+        raise NotImplementedError()
+
+
+    def uploadStream(self, reader, destination, timeout=None):
+        """
+        Upload everything that can be read from a stream to the specified
+        DataLocation, without a local file. Requires STREAMING.
+
+        reader: file-like object whose content to upload
+        destination: DataLocation for upload
+        timeout: if given, give up after this many seconds
+        return: True if successful
+        """
+        raise NotImplementedError()
+
+
+    def download(self, source, localFile, timeout=None):
+        """
+        Download the file at the specified DataLocation to a local file.
+        Requires DOWNLOAD.
+
+        source: DataLocation to download from
+        localFile: name of the local file
+        timeout: if given, give up after this many seconds
+        return: True if successful
+        """
+        raise NotImplementedError()
+
+
+    def stat(self, location, timeout=None):
+        """
+        Determine size and modification time of the file at the specified
+        DataLocation. Requires STAT.
+
+        location: the DataLocation
+        timeout: if given, give up after this many seconds
+        return: RemoteStat, or None if the file does not exist
+        """
+        raise NotImplementedError()
+
+
+    def remoteHash(self, location, timeout=None):
+        """
+        Determine the SHA-256 hash of the file at the specified DataLocation.
+        Requires SERVER_SIDE_HASH or RECORDED_HASH.
+
+        location: the DataLocation
+        timeout: if given, give up after this many seconds
+        return: hex digest, or None if it could not be determined
+        """
+        raise NotImplementedError()
+
+
+    def list(self, location, timeout=None):
+        """
+        List the files at the specified DataLocation, which is a directory.
+        Requires LIST.
+
+        location: the DataLocation
+        timeout: if given, give up after this many seconds
+        return: sorted list of file names, or None if the directory does not exist
+        """
+        raise NotImplementedError()
+
+
+    def makeDirectories(self, location, timeout=None):
+        """
+        Create the directory at the specified DataLocation, and its parents,
+        unless they exist already, so files can be uploaded into it. Data
+        locations that have no directories, such as S3 buckets, need nothing.
+
+        location: the DataLocation of the directory
+        timeout: if given, give up after this many seconds
+        return: True if successful
+        """
+        return True
+
+
+    def pullTree(self, source, localDir, timeout=None):
+        """
+        Make a local directory a copy of the directory hierarchy at the
+        specified DataLocation, transferring only what is different. Files in
+        the local directory that are not at the DataLocation are deleted.
+        Requires TREES.
+
+        source: DataLocation of the directory to copy
+        localDir: name of the local directory, which is created if needed
+        timeout: if given, give up after this many seconds
+        return: TreeStats if successful, None otherwise
+        """
+        raise NotImplementedError()
+
+
+    def pushTree(self, localDir, destination, timeout=None):
+        """
+        Make the directory at the specified DataLocation a copy of a local
+        directory hierarchy, transferring only what is different. Files at
+        the DataLocation that are not in the local directory are deleted.
+        Requires TREES.
+
+        localDir: name of the local directory to copy
+        destination: DataLocation of the directory, which is created if needed
+        timeout: if given, give up after this many seconds
+        return: TreeStats if successful, None otherwise
+        """
+        raise NotImplementedError()
+
+
+    def close(self):
+        """
+        Release whatever this Transport holds on to between transfers, such
+        as idle connections. It may be used again afterwards.
+
+        return: void
+        """
+        pass
+
+
+class ModuleTransport(Transport):
+    """
+    Adapts a module that implements a data transfer protocol as module-level
+    functions: supportsProtocol(), upload() and, optionally, the other
+    methods of Transport. Its capabilities are the functions it defines.
+
+    module: the module
+    """
+    _CAPABILITY_FUNCTIONS = {
+        STREAMING        : 'uploadStream',
+        RANGED_WRITES    : 'uploadResumable',
+        SERVER_SIDE_HASH : 'remoteHash',
+        DOWNLOAD         : 'download',
+        STAT             : 'stat',
+        LIST             : 'list',
+        TREES            : 'pushTree'
+    }
+
+    def __init__(self, module):
+        self.module       = module
+        self.capabilities = frozenset(
+                capability
+                for capability, functionName in ModuleTransport._CAPABILITY_FUNCTIONS.items()
+                if hasattr(module, functionName) )
+
+
+    def supportsProtocol(self, proto):
+        return self.module.supportsProtocol(proto)
+
+
+    def upload(self, localFile, destination, timeout=None):
+        # Some modules return 1 on failure, which is not False
+        return self.module.upload(localFile, destination, timeout=timeout) is True
+
+
+    def uploadResumable(self, localFile, destination, checkpoint, timeout=None):
+        return self._invoke('uploadResumable', localFile, destination, checkpoint, timeout=timeout)
+
+
+    def uploadStream(self, reader, destination, timeout=None):
+        return self._invoke('uploadStream', reader, destination, timeout=timeout)
+
+
+    def download(self, source, localFile, timeout=None):
+        return self._invoke('download', source, localFile, timeout=timeout)
+
+
+    def stat(self, location, timeout=None):
+        return self._invoke('stat', location, timeout=timeout)
+
+
+    def remoteHash(self, location, timeout=None):
+        return self._invoke('remoteHash', location, timeout=timeout)
+
+
+    def list(self, location, timeout=None):
+        return self._invoke('list', location, timeout=timeout)
+
+
+    def makeDirectories(self, location, timeout=None):
+        if not hasattr(self.module, 'makeDirectories'):
+            return True
+        return self._invoke('makeDirectories', location, timeout=timeout)
+
+
+    def pullTree(self, source, localDir, timeout=None):
+        return self._invoke('pullTree', source, localDir, timeout=timeout)
+
+
+    def pushTree(self, localDir, destination, timeout=None):
+        return self._invoke('pushTree', localDir, destination, timeout=timeout)
+
+
+    def _invoke(self, functionName, *args, **kwargs):
+        """
+        Invoke a module-level function, if the module defines it.
+
+        functionName: name of the function
+        return: whatever the function returns
+        """
+        if not hasattr(self.module, functionName):
+            raise NotImplementedError(functionName)
+        return getattr(self.module, functionName)(*args, **kwargs)
@@ -6,13 +6,19 @@
 # All rights reserved. License: see package.
 #
 
+import argparse
 import calendar
+import datetime
+import hashlib
 import json
 import os
 import pkgutil
 import paradux.logging
 import re
+import signal
 import subprocess
+import sys
+import threading
 import time
 
 
@@ -29,7 +35,7 @@ def findSubmodules(package) :
     return ret
 
 
-def myexec(cmd,stdin=None, captureStdout=False, captureStderr=False):
+def myexec(cmd,stdin=None, captureStdout=False, captureStderr=False, timeout=None):
     """
     Wrapper around executing sub-commands, so we can log what is happening.
 
@@ -37,7 +43,10 @@ def myexec(cmd,stdin=None, captureStdout=False, captureStderr=False):
     stdin: content to be piped into the command, if any
     captureStdout: if true, capture the commands stdout and return 
     captureStderr: if true, capture the commands stderr and return 
+    timeout: if given, the number of seconds after which the command, and all
+         processes it started, are killed
     return: if no capture: return code; otherwise tuple
+    throws: subprocess.TimeoutExpired if the timeout was reached
     """
     if stdin == None:
         paradux.logging.debugAndSuspend('myexec:', cmd)
@@ -45,19 +54,143 @@ def myexec(cmd,stdin=None, captureStdout=False, captureStderr=False):
         paradux.logging.debugAndSuspend('myexec:', cmd, 'with stdin:', stdin)
     paradux.logging.trace(cmd, 'None' if stdin==None else len(stdin))
 
-    ret = subprocess.run(
+    # Run in its own process group, so on timeout we can kill the shell
+    # and whatever it started
+    with subprocess.Popen(
             cmd,
-            shell  = True,
-            input  = stdin,
-            stdout = subprocess.PIPE if captureStdout else None,
-            stderr = subprocess.PIPE if captureStderr else None)
+            shell             = True,
+            stdin             = subprocess.PIPE if stdin is not None else None,
+            stdout            = subprocess.PIPE if captureStdout else None,
+            stderr            = subprocess.PIPE if captureStderr else None,
+            start_new_session = timeout is not None) as process:
+        try:
+            out, err = process.communicate(stdin, timeout=timeout)
+
+        except subprocess.TimeoutExpired:
+            paradux.logging.warning('Command timed out after', timeout, 'seconds, killing:', cmd)
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            raise
 
     if captureStdout or captureStderr:
-        return (ret.returncode,
-                ret.stdout if hasattr(ret, 'stdout') else None,
-                ret.stderr if hasattr(ret, 'stderr') else None )
+        return (process.returncode, out, err)
     else:
-        return ret.returncode
+        return process.returncode
+
+
+def myexecFromStream(cmd, reader, timeout=None, bufSize=1024*1024):
+    """
+    Execute a sub-command, piping into it everything that can be read from
+    a stream, without holding all of it in memory.
+
+    cmd: the command to be executed by the shell
+    reader: file-like object whose content to pipe into the command
+    timeout: if given, the number of seconds after which the command, and all
+         processes it started, are killed
+    bufSize: number of bytes to read at a time
+    return: return code
+    throws: subprocess.TimeoutExpired if the timeout was reached; whatever the
+         reader raises, after the command has been killed
+    """
+    paradux.logging.debugAndSuspend('myexecFromStream:', cmd)
+    paradux.logging.trace(cmd)
+
+    timedOut = threading.Event()
+
+    # Run in its own process group, so on timeout, or if the reader fails, we
+    # can kill the shell and whatever it started. Merely waiting for it would
+    # hang, as its stdin is still open.
+    with subprocess.Popen(
+            cmd,
+            shell             = True,
+            stdin             = subprocess.PIPE,
+            start_new_session = True) as process:
+
+        def kill():
+            paradux.logging.warning('Command timed out after', timeout, 'seconds, killing:', cmd)
+            timedOut.set()
+            os.killpg(process.pid, signal.SIGKILL)
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+
+        try:
+            while True:
+                buf = reader.read(bufSize)
+                if not buf:
+                    break
+                process.stdin.write(buf)
+            process.stdin.close()
+
+        except BrokenPipeError:
+            pass # the command ended early; its return code will tell
+
+        except BaseException:
+            os.killpg(process.pid, signal.SIGKILL)
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass # unwritten data, which is not needed any more
+            raise
+
+        finally:
+            process.wait()
+            if timer is not None:
+                timer.cancel()
+
+    if timedOut.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+
+    return process.returncode
+
+
+def continueInBackground():
+    """
+    Prepare for the rest of the work of this process to continue in the
+    background. The process is forked: the original process waits until the
+    forked one invokes the returned function, then exits with status 0. If the
+    forked one ends without having invoked it, the original one exits with
+    status 1. The forked process keeps standard output and error, so what it
+    reports later still reaches the user.
+
+    Forking a process that runs threads is not safe, so nothing is forked if
+    other threads are running already.
+
+    return: function without arguments to invoke from the forked process, or
+         None if not forked, so the work continues in the foreground
+    """
+    if threading.active_count() > 1:
+        paradux.logging.warning('Cannot continue in the background, other threads are running already')
+        return None
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    readFd, writeFd = os.pipe()
+    pid = os.fork()
+    if pid != 0:
+        # The original process
+        os.close(writeFd)
+        with os.fdopen(readFd, 'rb') as fd:
+            done = fd.read(1)
+        os._exit(0 if done == b'1' else 1)
+
+    # The forked process
+    os.close(readFd)
+    os.setsid() # so it is not interrupted together with whatever started the original process
+
+    lock = threading.Lock()
+    def release():
+        nonlocal writeFd
+        with lock:
+            if writeFd is not None:
+                os.write(writeFd, b'1')
+                os.close(writeFd)
+                writeFd = None
+
+    return release
 
 
 def readJsonFromFile( fileName ):
@@ -116,6 +249,48 @@ def saveFile(fileName, content, mode=None) :
         os.chmod(fileName, mode)
 
 
+def sha256OfFile(fileName, bufSize=1024*1024, length=None):
+    """
+    Calculate the SHA-256 hash of the content of a file, without reading
+    all of it into memory.
+
+    fileName: name of the file
+    bufSize: number of bytes to read at a time
+    length: if given, only hash this many bytes at the beginning of the file
+    return: hex digest
+    """
+    h = hashlib.sha256()
+    with open(fileName, 'rb') as fd:
+        remaining = length
+        while remaining is None or remaining > 0:
+            buf = fd.read(bufSize if remaining is None else min(bufSize, remaining))
+            if not buf:
+                break
+            h.update(buf)
+            if remaining is not None:
+                remaining -= len(buf)
+    return h.hexdigest()
+
+
+def remainingTime(deadline, timeout=None):
+    """
+    Determine the number of seconds until a deadline, for passing on as the
+    timeout of the next step of an operation.
+
+    deadline: time.monotonic() value, or None
+    timeout: the timeout of the whole operation, for reporting
+    return: number of seconds, or None if there is no deadline
+    throws: subprocess.TimeoutExpired if the deadline has passed
+    """
+    if deadline is None:
+        return None
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise subprocess.TimeoutExpired('operation', timeout)
+    return remaining
+
+
 def time2string(t):
     """
     Format time consistently
@@ -139,4 +314,49 @@ def string2time(s):
     ret    = calendar.timegm(parsed)
     return ret
 
-    
+
+def positiveIntArgument(value):
+    """
+    Check and convert a command-line argument representing a positive integer.
+
+    value: the string
+    return: the integer
+    throws argparse.ArgumentTypeError: if not a positive integer
+    """
+    try:
+        ret = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Not an integer: ' + value)
+    if ret < 1:
+        raise argparse.ArgumentTypeError('Must be at least 1')
+    return ret
+
+
+def pointInTimeArgument(value):
+    """
+    Check and convert a command-line argument representing a point in time:
+    an absolute time such as 2019-10-22, "2019-10-22 14:30" (local time) or
+    20191022-123000 (UTC, as shown by paradux), or how long ago, such as
+    12h or 7d.
+
+    value: the string
+    return: UNIX time
+    throws argparse.ArgumentTypeError: if not a point in time
+    """
+    import paradux.scheduler # not at the top: the scheduler depends on this module
+
+    for format in ( '%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S' ):
+        try:
+            return datetime.datetime.strptime(value, format).timestamp()
+        except ValueError:
+            pass
+
+    try:
+        return string2time(value)
+    except ValueError:
+        pass
+
+    try:
+        return time.time() - paradux.scheduler.parseFrequencyJson(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Not a point in time: ' + value)
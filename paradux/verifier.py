@@ -0,0 +1,167 @@
+#!/usr/bin/python
+#
+# Checks that data locations hold exactly what was published to them.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import concurrent.futures
+import os
+import os.path
+import paradux.logging
+import paradux.utils
+import shutil
+import subprocess
+import tempfile
+import time
+
+
+class VerifyResult:
+    """
+    The outcome of verifying one data location.
+
+    location: the data location
+    status: one of the STATUS_ values
+    method: how the content was checked: 'remote hash' or 'download'
+    latency: the number of seconds the check took
+    error: description of what went wrong, if anything
+    """
+    STATUS_OK       = 'OK'       # holds what was published
+    STATUS_MISMATCH = 'MISMATCH' # holds something else
+    STATUS_MISSING  = 'MISSING'  # holds nothing, or cannot be read
+    STATUS_UNKNOWN  = 'UNKNOWN'  # nothing has been published there from here
+    STATUS_ERROR    = 'ERROR'    # could not be checked
+
+    def __init__(self, location):
+        self.location = location
+        self.status   = None
+        self.method   = None
+        self.latency  = None
+        self.error    = None
+
+
+    def isOk(self):
+        """
+        Does the location hold what was published?
+
+        return: True or False
+        """
+        return self.status == VerifyResult.STATUS_OK
+
+
+    def asText(self):
+        """
+        Show this VerifyResult to the user in plain text.
+
+        return: plain text
+        """
+        t = "{0:8s} {1:s}".format(self.status, str(self.location))
+        if self.method is not None:
+            t += " (by {0:s}, {1:.2f}s)".format(self.method, 0.0 if self.latency is None else self.latency)
+        if self.error is not None:
+            t += ": " + self.error
+        return t
+
+
+class Verifier:
+    """
+    Checks several data locations concurrently against the hashes of what
+    was last published to them. Where the transport can determine the hash
+    of the remote copy, that is used; otherwise the remote copy is
+    downloaded and hashed.
+
+    settings: the Settings, which know how to access a single data location
+    publishRecord: the PublishRecord holding the hashes of what was published
+    maxWorkers: the maximum number of checks in progress at the same time
+    timeout: number of seconds after which a check is abandoned, or None;
+         used unless a location specifies its own
+    """
+    def __init__(self, settings, publishRecord, maxWorkers=4, timeout=None):
+        self.settings      = settings
+        self.publishRecord = publishRecord
+        self.maxWorkers    = maxWorkers
+        self.timeout       = timeout
+
+
+    def verify(self, locations):
+        """
+        Check all locations.
+
+        locations: the data locations to check
+        return: list of VerifyResult, in the sequence of locations
+        """
+        paradux.logging.trace('verify', len(locations))
+
+        results = [ VerifyResult(location) for location in locations ]
+
+        # Downloads for checking go into a private temp directory
+        tmpDir = tempfile.mkdtemp(prefix='paradux-')
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+                futures = [
+                        executor.submit(self._verifyOne, result, os.path.join(tmpDir, str(i)))
+                        for i, result in enumerate(results) ]
+                for future in futures:
+                    future.result()
+
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+        return results
+
+
+    def _verifyOne(self, result, tmpFile):
+        """
+        Check a single location.
+
+        result: the VerifyResult for the location, which is updated
+        tmpFile: name of the file to download to, if needed
+        return: the VerifyResult
+        """
+        location = result.location
+        timeout  = self.timeout if getattr(location, 'timeout', None) is None else location.timeout
+
+        expectedHash = self.publishRecord.getHash(location)
+        if expectedHash is None:
+            result.status = VerifyResult.STATUS_UNKNOWN
+            result.error  = 'Nothing has been published there from here'
+            return result
+
+        start = time.monotonic()
+        try:
+            # A hash merely recorded at upload time says nothing about what is
+            # held there now, so such locations are downloaded instead
+            remoteHash = None
+            if self.settings.canDetermineRemoteHash(location):
+                result.method = 'remote hash'
+                remoteHash    = self.settings.remoteHashOfDataLocation(location, timeout)
+
+            if remoteHash is None and self.settings.canDownload(location):
+                result.method = 'download'
+                if self.settings.downloadFromDataLocation(location, tmpFile, timeout):
+                    remoteHash = paradux.utils.sha256OfFile(tmpFile)
+                if os.path.exists(tmpFile):
+                    os.remove(tmpFile)
+
+            if result.method is None:
+                result.status = VerifyResult.STATUS_ERROR
+                result.error  = 'Cannot check this type of location'
+            elif remoteHash is None:
+                result.status = VerifyResult.STATUS_MISSING
+            elif remoteHash == expectedHash:
+                result.status = VerifyResult.STATUS_OK
+            else:
+                result.status = VerifyResult.STATUS_MISMATCH
+                result.error  = 'Has hash ' + remoteHash + ', expected ' + expectedHash
+
+        except subprocess.TimeoutExpired:
+            result.status = VerifyResult.STATUS_ERROR
+            result.error  = 'Timed out after {0:g} seconds'.format(timeout)
+
+        except Exception as e:
+            result.status = VerifyResult.STATUS_ERROR
+            result.error  = str(type(e)) + ': ' + str(e)
+
+        result.latency = time.monotonic() - start
+        return result
@@ -22,4 +22,8 @@ setup(name='paradux',
           'paradux.data',
           'paradux.datatransfer'
       ],
+      extras_require={
+          # for destinations with "encryption"
+          'encryption' : [ 'cryptography' ]
+      },
       zip_safe=True)
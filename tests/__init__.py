@@ -0,0 +1,4 @@
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
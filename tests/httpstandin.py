@@ -0,0 +1,417 @@
+#!/usr/bin/python
+#
+# Local stand-ins for a WebDAV server and for the S3 API, built on
+# http.server, that keep the files in memory. They understand just enough of
+# the protocols for the requests paradux makes, and record the requests, so
+# tests can check what was sent.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import email.utils
+import hashlib
+import http.server
+import threading
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+import xml.etree.ElementTree
+
+
+PARADUX_DAV_NS = 'https://paradux.org/ns/webdav'
+
+
+class StandInServer:
+    """
+    Runs a stand-in on a free port of localhost, in a thread.
+
+    handlerClass: the StandInHandler subclass that handles requests
+    files: dict from unquoted path to StoredFile, the content of the server
+    uploads: dict from upload id to the multipart upload in progress, for S3
+    requests: list of tuples (method, path with query string, dict of headers), in the order received
+    connections: the number of connections accepted
+    """
+    def __init__(self, handlerClass):
+        self.files       = {}
+        self.uploads     = {}
+        self.requests    = []
+        self.connections = 0
+        self.lock        = threading.Lock()
+
+        self.httpd = http.server.ThreadingHTTPServer(( '127.0.0.1', 0 ), handlerClass)
+        self.httpd.standIn        = self
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+
+    def start(self):
+        """
+        Start serving.
+
+        return: self
+        """
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        """
+        Stop serving and close the socket.
+
+        return: void
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+    def methods(self):
+        """
+        Obtain the methods of the requests received so far, in order.
+
+        return: list of HTTP methods
+        """
+        with self.lock:
+            return [ method for method, target, headers in self.requests ]
+
+
+class StoredFile:
+    """
+    A file held by a stand-in.
+
+    content: the bytes
+    etag: the ETag, with quotes
+    props: dict of other properties or metadata
+    """
+    def __init__(self, content, etag, props=None):
+        self.content  = content
+        self.etag     = etag
+        self.props    = props or {}
+        self.modified = email.utils.formatdate(usegmt=True)
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Common functionality of the stand-ins. Connections are kept alive, and
+    request bodies may be sent with chunked transfer encoding.
+    """
+    protocol_version = 'HTTP/1.1'
+
+
+    def setup(self):
+        super().setup()
+        with self.server.standIn.lock:
+            self.server.standIn.connections += 1
+
+
+    def log_message(self, format, *args):
+        pass # keep test output clean
+
+
+    def readBody(self):
+        """
+        Read the body of the request, with or without chunked transfer encoding.
+
+        return: the bytes
+        """
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    while self.rfile.readline() not in ( b'\r\n', b'\n', b'' ):
+                        pass # trailers
+                    return bytes(body)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+
+        return self.rfile.read(int(self.headers.get('Content-Length', '0')))
+
+
+    def record(self):
+        """
+        Record the current request.
+
+        return: tuple of (unquoted path, dict of query parameters to their first value)
+        """
+        with self.server.standIn.lock:
+            self.server.standIn.requests.append(( self.command, self.path, dict(self.headers.items()) ))
+
+        parts = urlsplit(self.path)
+        query = { k : v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items() }
+        return ( unquote(parts.path), query )
+
+
+    def respond(self, status, body=b'', headers=None):
+        """
+        Send a response.
+
+        status: the HTTP status
+        body: the response body
+        headers: dict of additional headers
+        return: void
+        """
+        self.send_response(status)
+        for k, v in ( headers or {} ).items():
+            self.send_header(k, v)
+        if 'Content-Length' not in ( headers or {} ):
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+class WebdavHandler(StandInHandler):
+    """
+    A WebDAV server. If the class attribute webdav is False, it only
+    speaks plain HTTP PUT, GET and HEAD, as a plain web server might.
+    """
+    webdav = True
+
+
+    def do_HEAD(self):
+        self.do_GET()
+
+
+    def do_GET(self):
+        path, query = self.record()
+        stored = self.server.standIn.files.get(path)
+        if stored is None:
+            self.respond(404)
+            return
+        self.respond(200, stored.content, {
+                'Content-Length' : str(len(stored.content)),
+                'ETag'           : stored.etag,
+                'Last-Modified'  : stored.modified })
+
+
+    def do_PUT(self):
+        path, query = self.record()
+        body   = self.readBody()
+        stored = self.server.standIn.files.get(path)
+
+        if self.headers.get('If-None-Match') == '*' and stored is not None:
+            self.respond(412)
+            return
+        if self.headers.get('If-Match') is not None and ( stored is None or stored.etag != self.headers['If-Match'] ):
+            self.respond(412)
+            return
+
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        self.server.standIn.files[path] = StoredFile(body, etag)
+        self.respond(204 if stored else 201, headers={ 'ETag' : etag })
+
+
+    def do_MKCOL(self):
+        path, query = self.record()
+        self.respond(201 if self.webdav else 405)
+
+
+    def do_PROPFIND(self):
+        path, query = self.record()
+        self.readBody()
+        if not self.webdav:
+            self.respond(405)
+            return
+
+        files = self.server.standIn.files
+        if path.endswith('/'):
+            found = [ p for p in files if p.startswith(path) and '/' not in p[len(path):] ]
+            if not found:
+                self.respond(404)
+                return
+            responses = [ ( path, None ) ] + [ ( p, files[p] ) for p in sorted(found) ]
+        else:
+            if path not in files:
+                self.respond(404)
+                return
+            responses = [ ( path, files[path] ) ]
+
+        xmlBody = '<?xml version="1.0" encoding="utf-8"?><d:multistatus xmlns:d="DAV:" xmlns:p="' + PARADUX_DAV_NS + '">'
+        for href, stored in responses:
+            xmlBody += '<d:response><d:href>' + escape(href) + '</d:href><d:propstat><d:prop>'
+            if stored is not None:
+                xmlBody += '<d:getetag>' + escape(stored.etag) + '</d:getetag>'
+                xmlBody += '<d:getcontentlength>' + str(len(stored.content)) + '</d:getcontentlength>'
+                if 'sha256' in stored.props:
+                    xmlBody += '<p:sha256>' + stored.props['sha256'] + '</p:sha256>'
+            xmlBody += '</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>'
+        xmlBody += '</d:multistatus>'
+        self.respond(207, xmlBody.encode('utf8'), { 'Content-Type' : 'application/xml; charset="utf-8"' })
+
+
+    def do_PROPPATCH(self):
+        path, query = self.record()
+        body   = self.readBody()
+        stored = self.server.standIn.files.get(path)
+        if not self.webdav:
+            self.respond(405)
+            return
+        if stored is None:
+            self.respond(404)
+            return
+        if self.headers.get('If-Match') is not None and stored.etag != self.headers['If-Match']:
+            self.respond(412)
+            return
+
+        root = xml.etree.ElementTree.fromstring(body)
+        for prop in root.findall('.//{DAV:}set/{DAV:}prop/*'):
+            stored.props[prop.tag.split('}')[-1]] = prop.text
+        self.respond(207, b'<?xml version="1.0" encoding="utf-8"?><d:multistatus xmlns:d="DAV:"/>')
+
+
+class PlainHttpHandler(WebdavHandler):
+    """
+    A web server that does not speak WebDAV.
+    """
+    webdav = False
+
+
+class S3Handler(StandInHandler):
+    """
+    The S3 API, for path-style requests to http://localhost:port/bucket/key.
+    Signatures are not checked, only that requests are signed. Multipart
+    uploads are held in uploads until completed.
+    """
+    def do_HEAD(self):
+        self.do_GET()
+
+
+    def do_GET(self):
+        path, query = self.record()
+        if not self._isSigned():
+            return
+
+        if 'list-type' in query:
+            self._list(path, query)
+            return
+
+        stored = self.server.standIn.files.get(path)
+        if stored is None:
+            self.respond(404, self._error('NoSuchKey', 'The specified key does not exist.'))
+            return
+
+        headers = {
+            'Content-Length' : str(len(stored.content)),
+            'ETag'           : stored.etag,
+            'Last-Modified'  : stored.modified
+        }
+        headers.update(stored.props)
+        self.respond(200, stored.content, headers)
+
+
+    def do_PUT(self):
+        path, query = self.record()
+        body = self.readBody()
+        if not self._isSigned():
+            return
+
+        if hashlib.sha256(body).hexdigest() != self.headers.get('x-amz-content-sha256'):
+            self.respond(400, self._error('XAmzContentSHA256Mismatch', 'The provided x-amz-content-sha256 header does not match.'))
+            return
+
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if 'uploadId' in query:
+            upload = self.server.standIn.uploads.get(query['uploadId'])
+            if upload is None:
+                self.respond(404, self._error('NoSuchUpload', 'The specified upload does not exist.'))
+                return
+            upload['parts'][int(query['partNumber'])] = ( body, etag )
+        else:
+            props = { k.lower() : v for k, v in self.headers.items() if k.lower().startswith('x-amz-meta-') }
+            self.server.standIn.files[path] = StoredFile(body, etag, props)
+        self.respond(200, headers={ 'ETag' : etag })
+
+
+    def do_POST(self):
+        path, query = self.record()
+        body = self.readBody()
+        if not self._isSigned():
+            return
+
+        if 'uploads' in query:
+            with self.server.standIn.lock:
+                uploadId = 'upload-' + str(len(self.server.standIn.uploads) + 1)
+                self.server.standIn.uploads[uploadId] = {
+                    'path'  : path,
+                    'props' : { k.lower() : v for k, v in self.headers.items() if k.lower().startswith('x-amz-meta-') },
+                    'parts' : {}
+                }
+            self.respond(200, ( '<InitiateMultipartUploadResult><UploadId>' + uploadId + '</UploadId></InitiateMultipartUploadResult>' ).encode('utf8'))
+            return
+
+        upload = self.server.standIn.uploads.pop(query.get('uploadId'), None)
+        if upload is None:
+            self.respond(404, self._error('NoSuchUpload', 'The specified upload does not exist.'))
+            return
+
+        root    = xml.etree.ElementTree.fromstring(body)
+        content = bytearray()
+        md5s    = b''
+        for i, part in enumerate(root.findall('Part'), 1):
+            partBody, etag = upload['parts'].get(int(part.findtext('PartNumber')), ( None, None ))
+            if int(part.findtext('PartNumber')) != i or etag != part.findtext('ETag'):
+                self.respond(400, self._error('InvalidPart', 'One or more of the specified parts could not be found.'))
+                return
+            content += partBody
+            md5s    += bytes.fromhex(etag.strip('"'))
+
+        etag = '"' + hashlib.md5(md5s).hexdigest() + '-' + str(len(root.findall('Part'))) + '"'
+        self.server.standIn.files[upload['path']] = StoredFile(bytes(content), etag, upload['props'])
+        self.respond(200, ( '<CompleteMultipartUploadResult><ETag>' + escape(etag) + '</ETag></CompleteMultipartUploadResult>' ).encode('utf8'))
+
+
+    def do_DELETE(self):
+        path, query = self.record()
+        if not self._isSigned():
+            return
+
+        self.server.standIn.uploads.pop(query.get('uploadId'), None)
+        self.respond(204)
+
+
+    def _list(self, path, query):
+        prefix = path + query.get('prefix', '')
+        keys   = sorted( p for p in self.server.standIn.files if p.startswith(prefix) and '/' not in p[len(prefix):] )
+
+        xmlBody = '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/"><IsTruncated>false</IsTruncated>'
+        for key in keys:
+            xmlBody += '<Contents><Key>' + escape(key[len(path):]) + '</Key></Contents>'
+        xmlBody += '</ListBucketResult>'
+        self.respond(200, xmlBody.encode('utf8'))
+
+
+    def _isSigned(self):
+        if not self.headers.get('Authorization', '').startswith('AWS4-HMAC-SHA256 Credential='):
+            self.respond(403, self._error('AccessDenied', 'Access Denied'))
+            return False
+        return True
+
+
+    @staticmethod
+    def _error(code, message):
+        return ( '<Error><Code>' + code + '</Code><Message>' + message + '</Message></Error>' ).encode('utf8')
+
+
+def webdavServer(webdav=True):
+    """
+    Start a WebDAV stand-in.
+
+    webdav: if False, the server only speaks plain HTTP
+    return: the StandInServer
+    """
+    return StandInServer(WebdavHandler if webdav else PlainHttpHandler).start()
+
+
+def s3Server():
+    """
+    Start an S3 stand-in.
+
+    return: the StandInServer
+    """
+    return StandInServer(S3Handler).start()
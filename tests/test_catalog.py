@@ -0,0 +1,105 @@
+#!/usr/bin/python
+#
+# Tests finding what was backed up where and when.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os.path
+from paradux.catalog import Catalog
+import tempfile
+import unittest
+
+
+T1 = 1700000000
+T2 = T1 + 86400
+T3 = T2 + 86400
+
+NS = 1000000000
+
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir  = tempfile.TemporaryDirectory()
+        self.catalog = Catalog(os.path.join(self.tmpDir.name, 'catalog.db'))
+
+        # Day 1: a and b/c. Day 2: a changes, b/c is deleted, b/d is added. Day 3: nothing changes.
+        self.catalog.recordSnapshot('ds', 's3://bucket/ds', {
+                'a'   : ( 1, T1 * NS + 1, 'aa1' ),
+                'b/c' : ( 2, T1 * NS,     'bc1' ) }, T1, 'snap-1')
+        self.catalog.recordSnapshot('ds', 's3://bucket/ds', {
+                'a'   : ( 3, T2 * NS + 7, 'aa2' ),
+                'b/d' : ( 4, T2 * NS,     'bd1' ) }, T2, 'snap-2')
+        self.catalog.recordSnapshot('ds', 's3://bucket/ds', {
+                'a'   : ( 3, T2 * NS + 7, 'aa2' ),
+                'b/d' : ( 4, T2 * NS,     'bd1' ) }, T3, 'snap-3')
+
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmpDir.cleanup()
+
+
+    def test_find_latest(self):
+        entries = self.catalog.find()
+
+        self.assertEqual([ ( e.path, e.hash ) for e in entries ], [ ( 'a', 'aa2' ), ( 'b/d', 'bd1' ) ])
+        self.assertEqual([ e.snapshotName for e in entries ], [ 'snap-3', 'snap-3' ])
+        self.assertEqual(( entries[0].since, entries[0].until ), ( T2, None ))
+
+
+    def test_find_as_of(self):
+        self.assertEqual([ ( e.path, e.hash ) for e in self.catalog.find(asOf=T1 + 3600) ], [ ( 'a', 'aa1' ), ( 'b/c', 'bc1' ) ])
+        self.assertEqual([ ( e.path, e.hash ) for e in self.catalog.find(asOf=T2) ],        [ ( 'a', 'aa2' ), ( 'b/d', 'bd1' ) ])
+        self.assertEqual(self.catalog.find(asOf=T1 - 1), [])
+
+
+    def test_mtime_keeps_ns(self):
+        entries = self.catalog.find(asOf=T1)
+        self.assertEqual(entries[0].mtimeNs, T1 * NS + 1)
+        self.assertIsInstance(entries[0].mtimeNs, int)
+
+
+    def test_find_by_prefix_dataset_and_limit(self):
+        self.catalog.recordSnapshot('other', 's3://bucket/other', { 'b/e' : ( 5, T1 * NS, None ) }, T1)
+
+        self.assertEqual([ e.path for e in self.catalog.find('b/') ],                  [ 'b/d', 'b/e' ])
+        self.assertEqual([ e.path for e in self.catalog.find('b/', dataset='ds') ],    [ 'b/d' ])
+        self.assertEqual([ e.path for e in self.catalog.find('b/', dataset='none') ],  [])
+        self.assertEqual([ e.path for e in self.catalog.find('', limit=1) ],           [ 'a' ])
+        self.assertEqual([ e.path for e in self.catalog.find('b') ],                   [ 'b/d', 'b/e' ])
+        self.assertEqual([ e.path for e in self.catalog.find('c') ],                   [])
+
+
+    def test_history(self):
+        entries = self.catalog.history() # snap-3 added no versions
+
+        self.assertEqual([ ( e.path, e.hash, e.since, e.until ) for e in entries ], [
+                ( 'a',   'aa1', T1, T2 ),
+                ( 'a',   'aa2', T2, None ),
+                ( 'b/c', 'bc1', T1, T2 ),
+                ( 'b/d', 'bd1', T2, None ) ])
+        self.assertEqual([ e.snapshotName for e in entries ], [ 'snap-1', 'snap-2', 'snap-1', 'snap-2' ])
+        self.assertEqual([ e.path for e in self.catalog.history('b/c') ], [ 'b/c' ])
+
+
+    def test_destinations_are_separate(self):
+        self.catalog.recordSnapshot('ds', 'sftp://host/ds', { 'a' : ( 1, T1 * NS + 1, 'aa1' ) }, T3)
+
+        entries = self.catalog.find('a')
+        self.assertEqual([ ( e.destination, e.hash ) for e in entries ], [ ( 's3://bucket/ds', 'aa2' ), ( 'sftp://host/ds', 'aa1' ) ])
+        self.assertEqual(self.catalog.latestFiles('ds'), { 'a' : ( 1, T1 * NS + 1, 'aa1' ) })
+
+
+    def test_latest_snapshot_time(self):
+        self.catalog.recordSnapshot('ds', 'sftp://host/ds', { 'a' : ( 1, T1 * NS + 1, 'aa1' ) }, T1)
+
+        self.assertEqual(self.catalog.latestSnapshotTime('ds', 's3://bucket/ds'), T3)
+        self.assertEqual(self.catalog.latestSnapshotTime('ds', 'sftp://host/ds'), T1)
+        self.assertIsNone(self.catalog.latestSnapshotTime('other', 's3://bucket/ds'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#
+# Tests the index of the chunks that exist at a destination.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import hashlib
+import os
+import os.path
+from paradux.chunkstore import ChunkIndex, NAME_SIZE
+import tempfile
+import unittest
+
+
+def names(start, count):
+    return [ hashlib.sha256(str(i).encode('ascii')).digest() for i in range(start, start + count) ]
+
+
+class ChunkIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir    = tempfile.TemporaryDirectory()
+        self.indexFile = os.path.join(self.tmpDir.name, 'index')
+
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+
+    def test_empty(self):
+        index = ChunkIndex(self.indexFile)
+
+        self.assertFalse(index.exists())
+        self.assertEqual(len(index), 0)
+        self.assertNotIn(names(0, 1)[0], index)
+
+        index.save()
+        self.assertTrue(index.exists())
+        self.assertEqual(os.path.getsize(self.indexFile), 0)
+        index.close()
+
+
+    def test_add_and_save(self):
+        index = ChunkIndex(self.indexFile)
+        for name in names(0, 1000):
+            index.add(name)
+
+        self.assertEqual(len(index), 1000)
+        index.save()
+        self.assertEqual(os.path.getsize(self.indexFile), 1000 * NAME_SIZE)
+        index.close()
+
+        index = ChunkIndex(self.indexFile)
+        self.assertEqual(len(index), 1000)
+        for name in names(0, 1000):
+            self.assertIn(name, index)
+        for name in names(1000, 1000):
+            self.assertNotIn(name, index)
+        index.close()
+
+
+    def test_merge_keeps_file_sorted(self):
+        index = ChunkIndex(self.indexFile)
+        for name in names(0, 500):
+            index.add(name)
+        index.save()
+
+        for name in names(250, 500): # half of them exist already
+            index.add(name)
+        self.assertEqual(len(index), 750)
+        index.save()
+        index.close()
+
+        with open(self.indexFile, 'rb') as fd:
+            content = fd.read()
+        records = [ content[i:i+NAME_SIZE] for i in range(0, len(content), NAME_SIZE) ]
+        self.assertEqual(records, sorted(names(0, 750)))
+
+
+    def test_unsaved_names_survive_close(self):
+        index = ChunkIndex(self.indexFile)
+        name  = names(0, 1)[0]
+        index.add(name)
+        index.close()
+
+        self.assertIn(name, index)
+        self.assertFalse(index.exists())
+
+
+    def test_names_sharing_a_prefix(self):
+        # Interpolation search must cope with keys it cannot tell apart
+        common = names(0, 1)[0][:8]
+        same   = sorted( common + hashlib.sha256(str(i).encode('ascii')).digest()[:NAME_SIZE - 8] for i in range(100) )
+
+        index = ChunkIndex(self.indexFile)
+        for name in same[::2] + names(0, 100):
+            index.add(name)
+        index.save()
+
+        for i, name in enumerate(same):
+            if i % 2 == 0:
+                self.assertIn(name, index)
+            else:
+                self.assertNotIn(name, index)
+        index.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
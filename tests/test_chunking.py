@@ -0,0 +1,109 @@
+#!/usr/bin/python
+#
+# Tests splitting files into content-defined chunks. Where files are cut
+# must never change, or chunks stored earlier are no longer found again,
+# so the fast gear hash is compared with a plain one, and the cut points of
+# a fixed file are pinned.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os
+import paradux.chunkstore
+from paradux.chunkstore import AVG_CHUNK_SIZE, MAX_CHUNK_SIZE, MIN_CHUNK_SIZE
+import random
+import tempfile
+import unittest
+
+
+def referenceFirstMatch(buf, start, stop, mask):
+    """
+    Find the first position whose gear hash matches a mask, byte by byte.
+    """
+    h = 0
+    for b in buf[start - paradux.chunkstore._WINDOW + 1:start]:
+        h = (( h << 1 ) + paradux.chunkstore._GEAR[b] ) & 0xFFFFFFFF
+    for i in range(start, stop):
+        h = (( h << 1 ) + paradux.chunkstore._GEAR[buf[i]] ) & 0xFFFFFFFF
+        if not h & mask:
+            return i
+    return -1
+
+
+def referenceCutPoint(buf):
+    """
+    Determine the length of the next chunk, byte by byte.
+    """
+    size = len(buf)
+    if size <= MIN_CHUNK_SIZE:
+        return size
+
+    normal = min(AVG_CHUNK_SIZE, size)
+    end    = min(MAX_CHUNK_SIZE, size)
+    for first, last, mask in ( ( MIN_CHUNK_SIZE, normal, paradux.chunkstore._MASK_SMALL ), ( normal, end, paradux.chunkstore._MASK_LARGE )):
+        i = referenceFirstMatch(buf, first, last, mask)
+        if i >= 0:
+            return i + 1
+    return end
+
+
+def sampleData(seed, size):
+    """
+    Random bytes, with a run of zeros and a repeated pattern, so all ways
+    of cutting occur.
+    """
+    rnd  = random.Random(seed)
+    data = bytearray(rnd.randbytes(size))
+    data[size // 4 : size // 4 + size // 8]   = bytes(size // 8)
+    data[size // 2 : size // 2 + 1024 * 1024] = b'paradux-' * ( 1024 * 1024 // 8 )
+    return data
+
+
+class ChunkingTest(unittest.TestCase):
+
+    def test_first_match_is_the_gear_hash(self):
+        rnd = random.Random(1)
+        buf = bytearray(rnd.randbytes(200000))
+        buf[100000:120000] = bytes(20000)
+
+        # Masks with few bits match often, so many positions are compared
+        for mask in ( paradux.chunkstore._MASK_SMALL, paradux.chunkstore._MASK_LARGE, 0x80000000, 0x00000100, 0x0000C003, 0x0F0F0000, 0xFFFFFFFF ):
+            maskTables = paradux.chunkstore._maskTables(mask)
+            for i in range(50):
+                start = rnd.randrange(paradux.chunkstore._WINDOW - 1, len(buf) - 1)
+                stop  = min(len(buf), start + rnd.randrange(1, 2 * paradux.chunkstore._BLOCK_SIZE))
+                self.assertEqual(paradux.chunkstore._firstMatch(buf, start, stop, maskTables),
+                                 referenceFirstMatch(buf, start, stop, mask),
+                                 'mask {0:08x}, positions {1:d} to {2:d}'.format(mask, start, stop))
+
+
+    def test_cut_points_are_the_gear_hash(self):
+        buf = sampleData(2, 3 * MAX_CHUNK_SIZE)
+        while buf:
+            n = paradux.chunkstore._cutPoint(buf)
+            self.assertEqual(n, referenceCutPoint(buf))
+            del buf[:n]
+
+
+    def test_cut_points_are_pinned(self):
+        with tempfile.NamedTemporaryFile() as fd:
+            fd.write(sampleData(48, 12 * 1024 * 1024))
+            fd.flush()
+            lengths, sha256 = paradux.chunkstore.chunkLengthsOfFile(fd.name)
+
+        self.assertEqual(lengths, [ 1389357, 1179871, 2616441, 483320, 2062610, 1178430, 1082838, 1131985, 1239064, 218996 ])
+        self.assertEqual(sha256, '283def47f1c8cf65fec0ef500012f46575ebbdc97488f65c3666823a769cea37')
+
+
+    def test_small_files_are_one_chunk(self):
+        for size in ( 0, 1, MIN_CHUNK_SIZE ):
+            with tempfile.NamedTemporaryFile() as fd:
+                fd.write(os.urandom(size))
+                fd.flush()
+                lengths, sha256 = paradux.chunkstore.chunkLengthsOfFile(fd.name)
+            self.assertEqual(lengths, [ size ] if size else [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+#
+# Tests encrypting and decrypting streams.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import io
+import os
+import os.path
+import paradux.encryption
+from paradux.encryption import EncryptionInfo
+import tempfile
+import unittest
+
+
+CHUNK_SIZE = paradux.encryption.MIN_CHUNK_SIZE
+
+
+def encrypt(content, key, info):
+    return b''.join(paradux.encryption.encryptChunks(io.BytesIO(content), key, info))
+
+
+def decrypt(data, key):
+    return b''.join(paradux.encryption.decryptChunks(io.BytesIO(data), key))
+
+
+class EncryptionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.key  = paradux.encryption.generateKey()
+        self.info = EncryptionInfo(chunkSize=CHUNK_SIZE)
+
+
+    def test_round_trip(self):
+        for cipher in paradux.encryption.CIPHERS:
+            info = EncryptionInfo(cipher, CHUNK_SIZE)
+            for size in ( 0, 1, CHUNK_SIZE - 1, CHUNK_SIZE, CHUNK_SIZE + 1, 3 * CHUNK_SIZE ):
+                content   = os.urandom(size)
+                encrypted = encrypt(content, self.key, info)
+
+                self.assertEqual(len(encrypted), paradux.encryption.encryptedSize(size, info))
+                self.assertEqual(decrypt(encrypted, self.key), content)
+
+
+    def test_round_trip_through_reader(self):
+        content = os.urandom(2 * CHUNK_SIZE + 100)
+        reader  = paradux.encryption.EncryptingReader(io.BytesIO(content), self.key, self.info)
+
+        encrypted = b''
+        while True:
+            buf = reader.read(1000)
+            if not buf:
+                break
+            encrypted += buf
+
+        self.assertEqual(decrypt(encrypted, self.key), content)
+
+
+    def test_round_trip_of_files(self):
+        content = os.urandom(CHUNK_SIZE + 5)
+        with tempfile.TemporaryDirectory() as tmpDir:
+            plain     = os.path.join(tmpDir, 'plain')
+            encrypted = os.path.join(tmpDir, 'encrypted')
+            decrypted = os.path.join(tmpDir, 'decrypted')
+            with open(plain, 'wb') as fd:
+                fd.write(content)
+
+            bytesIn, bytesOut = paradux.encryption.encryptFile(plain, encrypted, self.key, self.info)
+            self.assertEqual(( bytesIn, bytesOut ), ( len(content), os.path.getsize(encrypted) ))
+            self.assertTrue(paradux.encryption.isEncrypted(encrypted))
+            self.assertFalse(paradux.encryption.isEncrypted(plain))
+
+            paradux.encryption.decryptFile(encrypted, decrypted, self.key)
+            with open(decrypted, 'rb') as fd:
+                self.assertEqual(fd.read(), content)
+
+
+    def test_same_content_encrypts_differently(self):
+        content = os.urandom(100)
+        self.assertNotEqual(encrypt(content, self.key, self.info), encrypt(content, self.key, self.info))
+
+
+    def test_truncation_is_detected(self):
+        encrypted = encrypt(os.urandom(3 * CHUNK_SIZE), self.key, self.info)
+        sealed    = CHUNK_SIZE + paradux.encryption.TAG_SIZE
+
+        # Cut at a chunk boundary, so what is left consists of complete chunks
+        for end in ( paradux.encryption.HEADER_SIZE + sealed, paradux.encryption.HEADER_SIZE + 2 * sealed, len(encrypted) - 1 ):
+            with self.assertRaises(ValueError):
+                decrypt(encrypted[:end], self.key)
+
+        with self.assertRaises(ValueError):
+            decrypt(encrypted[:paradux.encryption.HEADER_SIZE - 1], self.key)
+
+
+    def test_tampering_is_detected(self):
+        encrypted = encrypt(os.urandom(3 * CHUNK_SIZE), self.key, self.info)
+        sealed    = CHUNK_SIZE + paradux.encryption.TAG_SIZE
+        header    = encrypted[:paradux.encryption.HEADER_SIZE]
+        chunks    = [ encrypted[i:i+sealed] for i in range(len(header), len(encrypted), sealed) ]
+
+        flipped = bytearray(encrypted)
+        flipped[len(header) + 10] ^= 1
+        swapped = header + chunks[1] + chunks[0] + chunks[2]
+
+        for data in ( bytes(flipped), swapped ):
+            with self.assertRaises(ValueError):
+                decrypt(data, self.key)
+
+
+    def test_other_key_does_not_decrypt(self):
+        encrypted = encrypt(b'secret', self.key, self.info)
+        with self.assertRaises(ValueError):
+            decrypt(encrypted, paradux.encryption.generateKey())
+
+
+    def test_not_encrypted(self):
+        with self.assertRaises(ValueError):
+            decrypt(b'just some plain text, long enough for a header', self.key)
+
+
+    def test_other_versions_are_rejected(self):
+        encrypted = bytearray(encrypt(b'content', self.key, self.info))
+        for version in ( 0, 1, 3 ):
+            encrypted[len(paradux.encryption.MAGIC)] = version
+            with self.assertRaises(ValueError):
+                decrypt(bytes(encrypted), self.key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+#
+# Tests the S3 data transfer protocol against a local stand-in. The part
+# sizes are reduced, so multipart uploads need little data.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import hashlib
+import io
+import os
+import os.path
+from paradux.data.credential import AwsApiCredentials
+from paradux.data.datalocation import DestinationDataLocation
+import paradux.datatransfer.s3
+import paradux.httppool
+import tempfile
+from tests import httpstandin
+import unittest
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+
+PART_SIZE           = 64 * 1024
+MULTIPART_THRESHOLD = 2 * PART_SIZE
+
+
+@mock.patch.object(paradux.datatransfer.s3, 'PART_SIZE',           PART_SIZE)
+@mock.patch.object(paradux.datatransfer.s3, 'MULTIPART_THRESHOLD', MULTIPART_THRESHOLD)
+class S3Test(unittest.TestCase):
+
+    def setUp(self):
+        self.server    = httpstandin.s3Server()
+        self.transport = paradux.datatransfer.s3.TRANSPORT
+        self.tmpDir    = tempfile.TemporaryDirectory()
+
+
+    def tearDown(self):
+        paradux.httppool.closeDefaultPool()
+        self.server.stop()
+        self.tmpDir.cleanup()
+
+
+    def location(self, key):
+        credentials = AwsApiCredentials('AKIAEXAMPLE', 'secret', None, 'http://127.0.0.1:{0:d}'.format(self.server.port))
+        return DestinationDataLocation(None, None, 's3://bucket/' + key, credentials, None, None)
+
+
+    def localFile(self, name, content):
+        ret = os.path.join(self.tmpDir.name, name)
+        with open(ret, 'wb') as fd:
+            fd.write(content)
+        return ret
+
+
+    def test_upload_small_file(self):
+        content = os.urandom(1000)
+
+        self.assertTrue(self.transport.upload(self.localFile('a', content), self.location('dir/a')))
+
+        self.assertEqual(self.server.methods(), [ 'HEAD', 'PUT' ])
+        self.assertEqual(self.server.files['/bucket/dir/a'].content, content)
+        self.assertEqual(self.transport.remoteHash(self.location('dir/a')), hashlib.sha256(content).hexdigest())
+
+
+    def test_upload_unchanged_file_is_skipped(self):
+        for size in ( 1000, 5 * PART_SIZE + 3 ):
+            localFile = self.localFile('a', os.urandom(size))
+            self.assertTrue(self.transport.upload(localFile, self.location('a')))
+            del self.server.requests[:]
+
+            self.assertTrue(self.transport.upload(localFile, self.location('a')))
+            self.assertEqual(self.server.methods(), [ 'HEAD' ])
+
+
+    def test_upload_large_file_in_parts(self):
+        content = os.urandom(5 * PART_SIZE + 3)
+
+        self.assertTrue(self.transport.upload(self.localFile('a', content), self.location('a')))
+
+        self.assertEqual(self.server.methods().count('PUT'), 6)
+        self.assertEqual(self.server.files['/bucket/a'].content, content)
+        self.assertEqual(self.transport.remoteHash(self.location('a')), hashlib.sha256(content).hexdigest())
+        self.assertEqual(self.server.uploads, {})
+
+
+    def test_upload_stream_that_fits_into_one_part(self):
+        content = os.urandom(PART_SIZE - 1)
+
+        self.assertTrue(self.transport.uploadStream(io.BytesIO(content), self.location('s')))
+
+        self.assertEqual(self.server.methods(), [ 'PUT' ])
+        self.assertEqual(self.server.files['/bucket/s'].content, content)
+
+
+    def test_upload_long_stream_in_parts(self):
+        for size in ( PART_SIZE, 3 * PART_SIZE, 3 * PART_SIZE + 1 ):
+            content = os.urandom(size)
+
+            self.assertTrue(self.transport.uploadStream(io.BytesIO(content), self.location('s')))
+
+            self.assertEqual(self.server.files['/bucket/s'].content, content)
+            self.assertEqual(self.server.uploads, {})
+
+
+    @mock.patch.object(paradux.datatransfer.s3, 'STREAM_PARTS_PER_SIZE', 2)
+    def test_stream_parts_grow(self):
+        content = os.urandom(7 * PART_SIZE)
+
+        self.assertTrue(self.transport.uploadStream(io.BytesIO(content), self.location('s')))
+
+        # Parts are uploaded concurrently, so they may arrive in any order
+        parts = sorted( ( int(parse_qs(urlsplit(target).query)['partNumber'][0]), int(headers['Content-Length']) )
+                        for method, target, headers in self.server.requests if method == 'PUT' )
+        partSizes = [ size for partNumber, size in parts ]
+        self.assertEqual(partSizes, [ PART_SIZE, PART_SIZE, 2 * PART_SIZE, 2 * PART_SIZE, PART_SIZE ])
+        self.assertEqual(self.server.files['/bucket/s'].content, content)
+
+
+    def test_download_stat_and_list(self):
+        content = os.urandom(100000)
+        for key in ( 'dir/b', 'dir/a', 'dir/sub/c' ):
+            self.assertTrue(self.transport.upload(self.localFile('x', content), self.location(key)))
+
+        downloaded = os.path.join(self.tmpDir.name, 'downloaded')
+        self.assertTrue(self.transport.download(self.location('dir/a'), downloaded))
+        with open(downloaded, 'rb') as fd:
+            self.assertEqual(fd.read(), content)
+
+        self.assertEqual(self.transport.stat(self.location('dir/a')).size, len(content))
+        self.assertIsNone(self.transport.stat(self.location('dir/missing')))
+        self.assertFalse(self.transport.download(self.location('dir/missing'), downloaded))
+        self.assertEqual(self.transport.list(self.location('dir')), [ 'a', 'b' ])
+
+
+    def test_requests_are_signed(self):
+        self.assertTrue(self.transport.uploadStream(io.BytesIO(b'signed'), self.location('a')))
+
+        method, target, headers = self.server.requests[0]
+        self.assertTrue(headers['Authorization'].startswith('AWS4-HMAC-SHA256 Credential=AKIAEXAMPLE/'))
+        self.assertEqual(headers['x-amz-content-sha256'], hashlib.sha256(b'signed').hexdigest())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+#
+# Tests when backups are scheduled.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import os.path
+from paradux.data.datalocation import DestinationDataLocation
+from paradux.data.dataset import Dataset
+import paradux.scheduler
+from paradux.scheduler import CATCH_UP_WINDOW, MAX_JITTER, Scheduler, ScheduleEntry
+import paradux.utils
+import tempfile
+import unittest
+from unittest import mock
+
+
+HOUR = 60 * 60
+DAY  = 24 * HOUR
+NOW  = 1700000000
+
+
+def dataset(name, *frequencies):
+    destinations = tuple(
+            DestinationDataLocation(None, None, 'file:///backups/{0:s}/{1:d}'.format(name, i), None, frequency, None)
+            for i, frequency in enumerate(frequencies) )
+    return Dataset(name, None, None, destinations)
+
+
+class FailingSyncer:
+    def sync(self, datasets):
+        raise RuntimeError('Source is gone')
+
+
+class NextSlotTest(unittest.TestCase):
+
+    def test_parse_frequency(self):
+        self.assertEqual(paradux.scheduler.parseFrequencyJson(86400),   DAY)
+        self.assertEqual(paradux.scheduler.parseFrequencyJson('12h'),   12 * HOUR)
+        self.assertEqual(paradux.scheduler.parseFrequencyJson('daily'), DAY)
+        self.assertEqual(paradux.scheduler.parseFrequencyJson('1.5m'),  90)
+        for j in ( 0, -1, True, 'often', '1y' ):
+            with self.assertRaises(ValueError):
+                paradux.scheduler.parseFrequencyJson(j)
+
+
+    @mock.patch('random.uniform', return_value=0)
+    def test_slots_are_at_the_phase(self, uniform):
+        entry = ScheduleEntry(dataset('a', DAY), dataset('a', DAY).destinations[0], DAY)
+        phase = entry.phase()
+        self.assertTrue(0 <= phase < DAY)
+
+        for after in ( NOW, NOW + 1, NOW + DAY // 2, NOW + DAY - 1 ):
+            slot = entry.nextSlot(after)
+            self.assertTrue(after < slot <= after + DAY)
+            self.assertAlmostEqual(( slot - phase ) % DAY, 0, places=3)
+
+        # A backup right at its slot is next due one interval later
+        slot = entry.nextSlot(NOW)
+        self.assertAlmostEqual(entry.nextSlot(slot), slot + DAY, places=3)
+
+
+    def test_jitter_is_bounded(self):
+        entry = ScheduleEntry(dataset('a', DAY), dataset('a', DAY).destinations[0], DAY)
+        with mock.patch('random.uniform', return_value=0):
+            slot = entry.nextSlot(NOW)
+
+        for i in range(100):
+            self.assertTrue(slot <= entry.nextSlot(NOW) <= slot + MAX_JITTER)
+
+
+    def test_phases_are_spread(self):
+        ds     = dataset('a', *( [ DAY ] * 20 ))
+        phases = { ScheduleEntry(ds, destination, DAY).phase() for destination in ds.destinations }
+        self.assertEqual(len(phases), 20)
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir    = tempfile.TemporaryDirectory()
+        self.stateFile = os.path.join(self.tmpDir.name, 'schedule.json')
+
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+
+    def saveState(self, datasets, dues, interval=DAY):
+        j = { 'datasets' : {} }
+        for ds in datasets:
+            for destination in ds.destinations:
+                j['datasets'].setdefault(ds.name, {})[str(destination)] = {
+                    'interval'     : interval,
+                    'due'          : paradux.utils.time2string(dues[str(destination)]),
+                    'last-success' : paradux.utils.time2string(dues[str(destination)] - DAY),
+                    'failures'     : 0
+                }
+        paradux.utils.writeJsonToFile(self.stateFile, j, 0o600)
+
+
+    def test_never_run_is_due_now(self):
+        scheduler = Scheduler(None, None, self.stateFile)
+        self.assertEqual(scheduler.load([ dataset('a', DAY), dataset('b', None) ], NOW), 1)
+        self.assertEqual(scheduler.nextDue(), NOW)
+
+
+    def test_saved_schedule_is_continued(self):
+        ds        = dataset('a', DAY, DAY)
+        dues      = { str(ds.destinations[0]) : NOW + 100, str(ds.destinations[1]) : NOW + 200 }
+        self.saveState([ ds ], dues)
+
+        scheduler = Scheduler(None, None, self.stateFile)
+        scheduler.load([ ds ], NOW)
+        self.assertEqual(scheduler.nextDue(), NOW + 100)
+        self.assertEqual(scheduler.takeDue(NOW), []) # beyond the coalesce window
+        self.assertEqual([ str(entry.destination) for entry in scheduler.takeDue(NOW + 150) ],
+                         [ str(ds.destinations[0]), str(ds.destinations[1]) ])
+
+
+    def test_missed_backups_are_caught_up_once_and_spread(self):
+        ds   = dataset('a', DAY, DAY, DAY, DAY)
+        dues = { str(destination) : NOW - ( i + 1 ) * HOUR for i, destination in enumerate(ds.destinations) }
+        self.saveState([ ds ], dues)
+
+        scheduler = Scheduler(None, None, self.stateFile)
+        self.assertEqual(scheduler.load([ ds ], NOW), 4)
+
+        entries = sorted(scheduler.heap)
+        self.assertEqual([ due for due, sequence, entry in entries ],
+                         [ NOW + i * CATCH_UP_WINDOW / 4 for i in range(4) ])
+
+        # Most overdue first
+        self.assertEqual([ str(entry.destination) for due, sequence, entry in entries ],
+                         [ str(destination) for destination in reversed(ds.destinations) ])
+
+
+    def test_changed_interval_is_rescheduled(self):
+        ds = dataset('a', HOUR)
+        self.saveState([ ds ], { str(ds.destinations[0]) : NOW + 10 * DAY }, interval=DAY)
+
+        scheduler = Scheduler(None, None, self.stateFile)
+        scheduler.load([ ds ], NOW)
+        self.assertLessEqual(scheduler.nextDue(), NOW + 10 * DAY - DAY + HOUR + MAX_JITTER)
+
+
+    def test_failed_run_stays_scheduled(self):
+        scheduler = Scheduler(None, FailingSyncer(), self.stateFile)
+        scheduler.load([ dataset('a', DAY, DAY) ], NOW)
+
+        with self.assertRaises(RuntimeError):
+            scheduler.runDue(NOW + CATCH_UP_WINDOW) # all are due once caught up
+
+        self.assertEqual(len(scheduler.heap), 2)
+        for due, sequence, entry in scheduler.heap:
+            self.assertEqual(entry.failures, 1)
+            self.assertGreater(due, NOW)
+
+        reloaded = Scheduler(None, None, self.stateFile)
+        self.assertEqual(reloaded.load([ dataset('a', DAY, DAY) ], NOW), 2)
+        for due, sequence, entry in reloaded.heap:
+            self.assertEqual(entry.failures, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
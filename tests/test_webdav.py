@@ -0,0 +1,184 @@
+#!/usr/bin/python
+#
+# Tests the WebDAV data transfer protocol against a local stand-in.
+#
+# Copyright (C) 2019 and later, Paradux project.
+# All rights reserved. License: see package.
+#
+
+import hashlib
+import io
+import os
+import os.path
+from paradux.data.credential import PasswordCredentials
+from paradux.data.datalocation import DestinationDataLocation
+import paradux.datatransfer.webdav
+import paradux.httppool
+import tempfile
+from tests import httpstandin
+import unittest
+
+
+class WebdavTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server    = httpstandin.webdavServer()
+        self.transport = paradux.datatransfer.webdav.TRANSPORT
+        self.tmpDir    = tempfile.TemporaryDirectory()
+
+
+    def tearDown(self):
+        paradux.httppool.closeDefaultPool()
+        self.server.stop()
+        self.tmpDir.cleanup()
+
+
+    def location(self, path, credentials=None):
+        return DestinationDataLocation(None, None, 'webdav://127.0.0.1:{0:d}{1:s}'.format(self.server.port, path), credentials, None, None)
+
+
+    def localFile(self, name, content):
+        ret = os.path.join(self.tmpDir.name, name)
+        with open(ret, 'wb') as fd:
+            fd.write(content)
+        return ret
+
+
+    def test_upload_new_file(self):
+        content = os.urandom(3 * paradux.datatransfer.webdav.CHUNK_SIZE + 17)
+
+        self.assertTrue(self.transport.upload(self.localFile('a', content), self.location('/dir/a')))
+
+        self.assertEqual(self.server.files['/dir/a'].content, content)
+        self.assertEqual(self.server.methods(), [ 'PROPFIND', 'PUT', 'PROPPATCH' ])
+        self.assertEqual(self.server.requests[1][2].get('If-None-Match'), '*')
+        self.assertEqual(self.transport.remoteHash(self.location('/dir/a')), hashlib.sha256(content).hexdigest())
+
+
+    def test_upload_unchanged_file_is_skipped(self):
+        localFile = self.localFile('a', b'unchanged')
+        self.assertTrue(self.transport.upload(localFile, self.location('/a')))
+        del self.server.requests[:]
+
+        self.assertTrue(self.transport.upload(localFile, self.location('/a')))
+        self.assertEqual(self.server.methods(), [ 'PROPFIND' ])
+
+
+    def test_upload_changed_file_is_conditional(self):
+        self.assertTrue(self.transport.upload(self.localFile('a', b'before'), self.location('/a')))
+        etag = self.server.files['/a'].etag
+        del self.server.requests[:]
+
+        self.assertTrue(self.transport.upload(self.localFile('a', b'after'), self.location('/a')))
+        self.assertEqual(self.server.methods(), [ 'PROPFIND', 'PUT', 'PROPPATCH' ])
+        self.assertEqual(self.server.requests[1][2].get('If-Match'), etag)
+        self.assertEqual(self.server.files['/a'].content, b'after')
+
+
+    def test_concurrent_change_is_not_overwritten(self):
+        self.server.files['/a'] = httpstandin.StoredFile(b'theirs', '"theirs"')
+
+        client = paradux.datatransfer.webdav._WebdavClient(self.location('/a'))
+        with self.assertRaises(paradux.datatransfer.webdav.WebdavError) as cm:
+            client.put([ b'ours' ], { 'If-Match' : '"seen-before"' }, hashlib.sha256(b'ours').hexdigest())
+
+        self.assertEqual(cm.exception.status, 412)
+        self.assertEqual(self.server.files['/a'].content, b'theirs')
+
+
+    def test_upload_stream_is_chunked(self):
+        content = os.urandom(2 * paradux.datatransfer.webdav.CHUNK_SIZE + 5)
+
+        self.assertTrue(self.transport.uploadStream(io.BytesIO(content), self.location('/s')))
+
+        method, target, headers = self.server.requests[0]
+        self.assertEqual(method, 'PUT')
+        self.assertEqual(headers.get('Transfer-Encoding'), 'chunked')
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(self.server.files['/s'].content, content)
+        self.assertEqual(self.server.files['/s'].props.get('sha256'), hashlib.sha256(content).hexdigest())
+
+
+    def test_connections_are_kept_alive(self):
+        for i in range(5):
+            self.assertTrue(self.transport.upload(self.localFile('f', str(i).encode('ascii')), self.location('/f' + str(i))))
+
+        self.assertEqual(len(self.server.requests), 15)
+        self.assertEqual(self.server.connections, 1)
+
+
+    def test_download_and_stat(self):
+        content = os.urandom(100000)
+        self.assertTrue(self.transport.upload(self.localFile('a', content), self.location('/a')))
+
+        downloaded = os.path.join(self.tmpDir.name, 'downloaded')
+        self.assertTrue(self.transport.download(self.location('/a'), downloaded))
+        with open(downloaded, 'rb') as fd:
+            self.assertEqual(fd.read(), content)
+
+        self.assertEqual(self.transport.stat(self.location('/a')).size, len(content))
+        self.assertIsNone(self.transport.stat(self.location('/missing')))
+        self.assertFalse(self.transport.download(self.location('/missing'), downloaded))
+
+
+    def test_list_and_make_directories(self):
+        for name in ( 'b', 'a', 'c' ):
+            self.assertTrue(self.transport.upload(self.localFile(name, name.encode('ascii')), self.location('/dir/' + name)))
+        self.assertTrue(self.transport.upload(self.localFile('d', b'd'), self.location('/dir/sub/d')))
+
+        self.assertEqual(self.transport.list(self.location('/dir')), [ 'a', 'b', 'c' ])
+        self.assertIsNone(self.transport.list(self.location('/nothing')))
+        self.assertTrue(self.transport.makeDirectories(self.location('/x/y')))
+        self.assertIn('MKCOL', self.server.methods())
+
+
+    def test_credentials_are_sent(self):
+        location = self.location('/a', PasswordCredentials('user', 'secret'))
+        self.assertTrue(self.transport.upload(self.localFile('a', b'a'), location))
+
+        for method, target, headers in self.server.requests:
+            self.assertEqual(headers.get('Authorization'), 'Basic dXNlcjpzZWNyZXQ=')
+
+
+class PlainHttpTest(unittest.TestCase):
+    """
+    A web server that does not speak WebDAV still takes uploads.
+    """
+    def setUp(self):
+        self.server    = httpstandin.webdavServer(webdav=False)
+        self.transport = paradux.datatransfer.webdav.TRANSPORT
+
+
+    def tearDown(self):
+        paradux.httppool.closeDefaultPool()
+        self.server.stop()
+
+
+    def location(self, path):
+        return DestinationDataLocation(None, None, 'http://127.0.0.1:{0:d}{1:s}'.format(self.server.port, path), None, None, None)
+
+
+    def test_upload_without_webdav(self):
+        self.assertTrue(self.transport.uploadStream(io.BytesIO(b'first'), self.location('/a')))
+        self.assertEqual(self.server.files['/a'].content, b'first')
+        self.assertIsNone(self.transport.remoteHash(self.location('/a')))
+
+        etag = self.server.files['/a'].etag
+        del self.server.requests[:]
+        with tempfile.NamedTemporaryFile() as fd:
+            fd.write(b'second')
+            fd.flush()
+            self.assertTrue(self.transport.upload(fd.name, self.location('/a')))
+
+        self.assertEqual(self.server.methods(), [ 'PROPFIND', 'HEAD', 'PUT', 'PROPPATCH' ])
+        self.assertEqual(self.server.requests[2][2].get('If-Match'), etag)
+        self.assertEqual(self.server.files['/a'].content, b'second')
+
+
+    def test_list_needs_webdav(self):
+        with self.assertRaises(NotImplementedError):
+            self.transport.list(self.location('/'))
+
+
+if __name__ == '__main__':
+    unittest.main()